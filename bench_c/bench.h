@@ -0,0 +1,239 @@
+/* Shared helpers for the C microbenchmarks: a seeded synthetic star
+   field generator, a timer and the output format read by c_bench.py.
+
+   Every benchmark prints one line per case:
+
+       <benchmark> <TAB> <parameters> <TAB> <seconds per call> <TAB> <calls>
+
+   The time is the best of BENCH_REPEAT rounds, each of which runs the
+   case enough times to take at least BENCH_MIN_TIME seconds. */
+
+#ifndef _STIMAGE_BENCH_H_
+#define _STIMAGE_BENCH_H_
+
+#define _USE_MATH_DEFINES       /* needed for MS Windows to define M_PI */
+#include <math.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+#include "lib/error.h"
+#include "lib/util.h"
+
+#define BENCH_MIN_TIME 0.1
+#define BENCH_REPEAT 3
+#define BENCH_DEFAULT_MAX_SIZE 6
+
+/* The field is BENCH_WIDTH pixels on a side */
+#define BENCH_WIDTH 4096.0
+
+/***************************************************************************
+ Random numbers
+
+ A xorshift64* generator, so that the fields are the same on every
+ platform, unlike drand48 or rand.
+*/
+
+typedef struct {
+    uint64_t state;
+} bench_rng_t;
+
+static inline void
+bench_rng_init(bench_rng_t* const rng, const uint64_t seed) {
+    rng->state = seed * 2685821657736338717ULL + 0x9E3779B97F4A7C15ULL;
+    if (rng->state == 0) {
+        rng->state = 1;
+    }
+}
+
+static inline double
+bench_uniform(bench_rng_t* const rng) {
+    uint64_t x = rng->state;
+
+    x ^= x >> 12;
+    x ^= x << 25;
+    x ^= x >> 27;
+    rng->state = x;
+    return (double)((x * 2685821657736338717ULL) >> 11) / 9007199254740992.0;
+}
+
+static inline double
+bench_normal(bench_rng_t* const rng) {
+    double u = 0.0;
+
+    while (u == 0.0) {
+        u = bench_uniform(rng);
+    }
+    return sqrt(-2.0 * log(u)) * cos(2.0 * M_PI * bench_uniform(rng));
+}
+
+/***************************************************************************
+ Synthetic star fields
+*/
+
+typedef struct {
+    /** The number of stars */
+    size_t n;
+
+    /** The transformation from ref to input: input = scale * R(rotation)
+        * ref + shift */
+    coord_t shift;
+    double scale;
+    double rotation; /* degrees */
+
+    /** Gaussian noise added to each input coordinate, in pixels */
+    double noise;
+
+    /** The fraction of the input stars replaced by random positions */
+    double outlier_fraction;
+
+    /** The fraction of the stars put within a pixel of another star */
+    double crowding_fraction;
+} bench_field_t;
+
+static inline void
+bench_field_init(bench_field_t* const field, const size_t n) {
+    field->n = n;
+    field->shift.x = 12.5;
+    field->shift.y = -7.25;
+    field->scale = 1.0;
+    field->rotation = 0.0;
+    field->noise = 0.05;
+    field->outlier_fraction = 0.0;
+    field->crowding_fraction = 0.0;
+}
+
+/* Fill in ref and input (each of field->n coordinates) so that
+   input[i] is ref[i] under the field's transformation, apart from the
+   outliers */
+static inline void
+bench_field_make(
+        const bench_field_t* const field,
+        const uint64_t seed,
+        coord_t* const ref,
+        coord_t* const input) {
+
+    bench_rng_t rng;
+    double      c, s, dx, dy;
+    size_t      i, j;
+
+    bench_rng_init(&rng, seed);
+    c = field->scale * cos(field->rotation * M_PI / 180.0);
+    s = field->scale * sin(field->rotation * M_PI / 180.0);
+
+    for (i = 0; i < field->n; ++i) {
+        if (i > 0 && bench_uniform(&rng) < field->crowding_fraction) {
+            j = (size_t)(bench_uniform(&rng) * (double)i);
+            ref[i].x = ref[j].x + bench_uniform(&rng) - 0.5;
+            ref[i].y = ref[j].y + bench_uniform(&rng) - 0.5;
+        } else {
+            ref[i].x = bench_uniform(&rng) * BENCH_WIDTH;
+            ref[i].y = bench_uniform(&rng) * BENCH_WIDTH;
+        }
+    }
+
+    for (i = 0; i < field->n; ++i) {
+        if (bench_uniform(&rng) < field->outlier_fraction) {
+            input[i].x = bench_uniform(&rng) * BENCH_WIDTH;
+            input[i].y = bench_uniform(&rng) * BENCH_WIDTH;
+        } else {
+            dx = field->noise * bench_normal(&rng);
+            dy = field->noise * bench_normal(&rng);
+            input[i].x = c * ref[i].x - s * ref[i].y + field->shift.x + dx;
+            input[i].y = s * ref[i].x + c * ref[i].y + field->shift.y + dy;
+        }
+    }
+}
+
+/***************************************************************************
+ Timing
+*/
+
+static inline double
+bench_now(void) {
+#if defined(CLOCK_MONOTONIC)
+    struct timespec ts;
+
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (double)ts.tv_sec + (double)ts.tv_nsec * 1e-9;
+#else
+    return (double)clock() / (double)CLOCKS_PER_SEC;
+#endif
+}
+
+/* A benchmarked function.  It returns non-zero on error. */
+typedef int (bench_func_t)(void* data, stimage_error_t* error);
+
+/* Time func and print the result line.  Returns non-zero if func
+   failed, after printing the error message. */
+static inline int
+bench_run(
+        const char* const name,
+        const char* const params,
+        bench_func_t* func,
+        void* data) {
+
+    stimage_error_t error;
+    double          start, elapsed, best = -1.0;
+    size_t          ncalls = 1;
+    size_t          i, round;
+
+    stimage_error_init(&error);
+
+    for (round = 0; round < BENCH_REPEAT; ++round) {
+        for (;;) {
+            start = bench_now();
+            for (i = 0; i < ncalls; ++i) {
+                if (func(data, &error)) {
+                    printf("%s\t%s\tERROR: %s\n", name, params,
+                           stimage_error_get_message(&error));
+                    return 1;
+                }
+            }
+            elapsed = bench_now() - start;
+            if (elapsed >= BENCH_MIN_TIME || round > 0) {
+                break;
+            }
+            ncalls *= (elapsed > BENCH_MIN_TIME / 10.0) ? 2 : 10;
+        }
+
+        elapsed /= (double)ncalls;
+        if (best < 0.0 || elapsed < best) {
+            best = elapsed;
+        }
+    }
+
+    printf("%s\t%s\t%.6e\t%lu\n", name, params, best, (unsigned long)ncalls);
+    fflush(stdout);
+    return 0;
+}
+
+/* The largest size, as a power of 10, given as the first command line
+   argument */
+static inline int
+bench_max_size(const int argc, char** const argv) {
+    int max_size = BENCH_DEFAULT_MAX_SIZE;
+
+    if (argc > 1) {
+        max_size = atoi(argv[1]);
+        if (max_size < 2) {
+            max_size = 2;
+        }
+    }
+    return max_size;
+}
+
+static inline size_t
+bench_pow10(const int exponent) {
+    size_t n = 1;
+    int    i;
+
+    for (i = 0; i < exponent; ++i) {
+        n *= 10;
+    }
+    return n;
+}
+
+#endif /* _STIMAGE_BENCH_H_ */
@@ -0,0 +1,139 @@
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "bench.h"
+#include "immatch/geomap.h"
+
+/* Cases whose normal equations take more than this many
+   multiply-adds to accumulate are skipped */
+#define MAX_WORK 2e9
+
+typedef struct {
+    size_t           n;
+    coord_t*         ref;
+    coord_t*         input;
+    geomap_output_t* output;
+    geomap_fit_e     fit_geometry;
+    size_t           order;
+    size_t           maxiter;
+    double           reject;
+    workspace_t      workspace;
+} geomap_data_t;
+
+static int
+run_geomap(void* data, stimage_error_t* error) {
+    geomap_data_t*  d = (geomap_data_t*)data;
+    geomap_result_t result;
+    bbox_t          bbox;
+    size_t          noutput = d->n;
+    int             status;
+
+    bbox_init(&bbox);
+    geomap_result_init(&result);
+    status = geomap(
+            d->n, d->input, d->n, d->ref, &bbox,
+            geomap_proj_none, NULL,
+            d->fit_geometry, surface_type_polynomial,
+            d->order, d->order, d->order, d->order,
+            xterms_half, xterms_half,
+            d->maxiter, d->reject, NULL, &d->workspace,
+            &noutput, d->output, &result, error);
+    geomap_result_free(&result);
+    return status;
+}
+
+int main(int argc, char** argv) {
+    const int     max_size = bench_max_size(argc, argv);
+    const size_t  orders[] = {2, 3, 4, 6, 8, 10, 12};
+    const struct {
+        const char*  name;
+        geomap_fit_e fit_geometry;
+    } geometries[] = {
+        {"shift", geomap_fit_shift},
+        {"rscale", geomap_fit_rscale},
+        {"general", geomap_fit_general}
+    };
+    bench_field_t field;
+    geomap_data_t data;
+    char          params[96];
+    double        ncoeff;
+    int           exponent;
+    size_t        i;
+    int           status = 1;
+
+    data.ref = data.input = NULL;
+    data.output = NULL;
+    workspace_init(&data.workspace);
+
+    for (exponent = 2; exponent <= max_size; ++exponent) {
+        bench_field_init(&field, bench_pow10(exponent));
+        field.rotation = 0.5;
+        field.scale = 1.001;
+        data.n = field.n;
+        data.ref = malloc(field.n * sizeof(coord_t));
+        data.input = malloc(field.n * sizeof(coord_t));
+        data.output = malloc(field.n * sizeof(geomap_output_t));
+        if (data.ref == NULL || data.input == NULL || data.output == NULL) {
+            printf("Out of memory\n");
+            goto exit;
+        }
+
+        bench_field_make(&field, 0, data.ref, data.input);
+        data.maxiter = 0;
+        data.reject = 0.0;
+
+        for (i = 0; i < sizeof(geometries) / sizeof(geometries[0]); ++i) {
+            data.fit_geometry = geometries[i].fit_geometry;
+            data.order = 2;
+            sprintf(params, "n=%lu geometry=%s",
+                    (unsigned long)field.n, geometries[i].name);
+            if (bench_run("geomap", params, &run_geomap, &data)) {
+                goto exit;
+            }
+        }
+
+        data.fit_geometry = geomap_fit_general;
+        for (i = 1; i < sizeof(orders) / sizeof(size_t); ++i) {
+            /* With half cross terms */
+            data.order = orders[i];
+            ncoeff = (double)(orders[i] * (orders[i] + 1) / 2);
+            if ((double)field.n * ncoeff * ncoeff > MAX_WORK ||
+                (double)field.n <= ncoeff) {
+                continue;
+            }
+            sprintf(params, "n=%lu geometry=general order=%lu",
+                    (unsigned long)field.n, (unsigned long)orders[i]);
+            if (bench_run("geomap", params, &run_geomap, &data)) {
+                goto exit;
+            }
+        }
+
+        /* Sigma clipping on a list with false pairs */
+        field.outlier_fraction = 0.2;
+        bench_field_make(&field, 1, data.ref, data.input);
+        data.order = 2;
+        data.maxiter = 10;
+        data.reject = 3.0;
+        sprintf(params, "n=%lu geometry=general outliers=0.2 maxiter=10",
+                (unsigned long)field.n);
+        if (bench_run("geomap", params, &run_geomap, &data)) {
+            goto exit;
+        }
+
+        free(data.ref);
+        free(data.input);
+        free(data.output);
+        data.ref = data.input = NULL;
+        data.output = NULL;
+    }
+
+    status = 0;
+
+ exit:
+    free(data.ref);
+    free(data.input);
+    free(data.output);
+    workspace_free(&data.workspace);
+
+    return status;
+}
@@ -0,0 +1,109 @@
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "bench.h"
+#include "surface/fit.h"
+#include "surface/surface.h"
+
+/* Cases whose normal equations take more than this many
+   multiply-adds to accumulate are skipped */
+#define MAX_WORK 2e9
+
+typedef struct {
+    size_t    n;
+    surface_t surface;
+    coord_t*  coords;
+    double*   z;
+    double*   w;
+} surface_data_t;
+
+static int
+run_surface_fit(void* data, stimage_error_t* error) {
+    surface_data_t*     d = (surface_data_t*)data;
+    surface_fit_error_e fit_error;
+
+    return surface_fit(
+            &d->surface, d->n, d->coords, d->z, d->w,
+            surface_fit_weight_uniform, NULL, &fit_error, error);
+}
+
+int main(int argc, char** argv) {
+    const int       max_size = bench_max_size(argc, argv);
+    const int       orders[] = {2, 3, 4, 6, 8, 10, 12};
+    bench_field_t   field;
+    surface_data_t  data;
+    stimage_error_t error;
+    coord_t*        input = NULL;
+    bbox_t          bbox;
+    char            params[64];
+    int             exponent;
+    size_t          i, j;
+    int             status = 1;
+
+    stimage_error_init(&error);
+    surface_new(&data.surface);
+    data.coords = NULL;
+    data.z = data.w = NULL;
+
+    bbox.min.x = bbox.min.y = 0.0;
+    bbox.max.x = bbox.max.y = BENCH_WIDTH;
+
+    for (exponent = 2; exponent <= max_size; ++exponent) {
+        bench_field_init(&field, bench_pow10(exponent));
+        data.n = field.n;
+        data.coords = malloc(field.n * sizeof(coord_t));
+        data.z = malloc(field.n * sizeof(double));
+        data.w = malloc(field.n * sizeof(double));
+        input = malloc(field.n * sizeof(coord_t));
+        if (data.coords == NULL || data.z == NULL || data.w == NULL ||
+            input == NULL) {
+            printf("Out of memory\n");
+            goto exit;
+        }
+
+        bench_field_make(&field, 0, data.coords, input);
+        for (j = 0; j < field.n; ++j) {
+            data.z[j] = input[j].x;
+        }
+
+        for (i = 0; i < sizeof(orders) / sizeof(int); ++i) {
+            if (surface_init(
+                        &data.surface, surface_type_polynomial,
+                        orders[i], orders[i], xterms_half, &bbox, &error)) {
+                printf("%s\n", stimage_error_get_message(&error));
+                goto exit;
+            }
+
+            if ((double)field.n * (double)data.surface.ncoeff *
+                (double)data.surface.ncoeff <= MAX_WORK &&
+                field.n > data.surface.ncoeff) {
+                sprintf(params, "n=%lu order=%d",
+                        (unsigned long)field.n, orders[i]);
+                if (bench_run("surface_fit", params,
+                              &run_surface_fit, &data)) {
+                    goto exit;
+                }
+            }
+
+            surface_free(&data.surface);
+        }
+
+        free(data.coords);
+        free(data.z);
+        free(data.w);
+        free(input);
+        data.coords = input = NULL;
+        data.z = data.w = NULL;
+    }
+
+    status = 0;
+
+ exit:
+    surface_free(&data.surface);
+    free(data.coords);
+    free(data.z);
+    free(data.w);
+    free(input);
+
+    return status;
+}
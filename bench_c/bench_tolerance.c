@@ -0,0 +1,102 @@
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "bench.h"
+#include "immatch/lib/tolerance.h"
+#include "lib/xycoincide.h"
+#include "lib/xysort.h"
+
+typedef struct {
+    size_t          n;
+    coord_t*        ref;
+    coord_t*        input;
+    const coord_t** ref_sorted;
+    const coord_t** input_sorted;
+    size_t          nref_unique;
+    size_t          ninput_unique;
+    size_t          nmatches;
+} tolerance_data_t;
+
+static int
+count_match(void* data, size_t ref_index, size_t input_index,
+            stimage_error_t* error) {
+    ++((tolerance_data_t*)data)->nmatches;
+    return 0;
+}
+
+static int
+run_match_tolerance(void* data, stimage_error_t* error) {
+    tolerance_data_t* d = (tolerance_data_t*)data;
+
+    d->nmatches = 0;
+    return match_tolerance(
+            d->nref_unique, d->ref, d->ref_sorted,
+            d->ninput_unique, d->input, d->input_sorted,
+            1.0, &count_match, d, error);
+}
+
+int main(int argc, char** argv) {
+    const int        max_size = bench_max_size(argc, argv);
+    const double     outliers[] = {0.0, 0.3};
+    bench_field_t    field;
+    tolerance_data_t data;
+    char             params[64];
+    int              exponent;
+    size_t           j;
+    int              status = 1;
+
+    data.ref = data.input = NULL;
+    data.ref_sorted = data.input_sorted = NULL;
+
+    for (exponent = 2; exponent <= max_size; ++exponent) {
+        bench_field_init(&field, bench_pow10(exponent));
+        /* The matching works on input coordinates that have already
+           been transformed to the reference frame */
+        field.shift.x = field.shift.y = 0.0;
+        data.n = field.n;
+        data.ref = malloc(field.n * sizeof(coord_t));
+        data.input = malloc(field.n * sizeof(coord_t));
+        data.ref_sorted = malloc(field.n * sizeof(coord_t*));
+        data.input_sorted = malloc(field.n * sizeof(coord_t*));
+        if (data.ref == NULL || data.input == NULL ||
+            data.ref_sorted == NULL || data.input_sorted == NULL) {
+            printf("Out of memory\n");
+            goto exit;
+        }
+
+        for (j = 0; j < sizeof(outliers) / sizeof(double); ++j) {
+            field.outlier_fraction = outliers[j];
+            bench_field_make(&field, 0, data.ref, data.input);
+            xysort(field.n, data.ref, data.ref_sorted);
+            xysort(field.n, data.input, data.input_sorted);
+            data.nref_unique = xycoincide(
+                    field.n, data.ref_sorted, data.ref_sorted, 0.0);
+            data.ninput_unique = xycoincide(
+                    field.n, data.input_sorted, data.input_sorted, 0.0);
+            sprintf(params, "n=%lu outliers=%.1f",
+                    (unsigned long)field.n, outliers[j]);
+
+            if (bench_run("match_tolerance", params,
+                          &run_match_tolerance, &data)) {
+                goto exit;
+            }
+        }
+
+        free(data.ref);
+        free(data.input);
+        free(data.ref_sorted);
+        free(data.input_sorted);
+        data.ref = data.input = NULL;
+        data.ref_sorted = data.input_sorted = NULL;
+    }
+
+    status = 0;
+
+ exit:
+    free(data.ref);
+    free(data.input);
+    free(data.ref_sorted);
+    free(data.input_sorted);
+
+    return status;
+}
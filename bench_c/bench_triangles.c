@@ -0,0 +1,243 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "bench.h"
+#include "immatch/lib/triangles.h"
+#include "lib/xycoincide.h"
+#include "lib/xysort.h"
+
+#define TOLERANCE 1.0
+#define MAXRATIO 10.0
+#define NREJECT 10
+
+typedef struct {
+    size_t            n;
+    size_t            ntriangles_allocated;
+    coord_t*          ref;
+    coord_t*          input;
+    const coord_t**   ref_sorted;
+    const coord_t**   input_sorted;
+    size_t            nref_unique;
+    size_t            ninput_unique;
+    size_t            nref_triangles;
+    triangle_t*       ref_triangles;
+    size_t            ninput_triangles;
+    triangle_t*       input_triangles;
+    size_t            nmatches;
+    triangle_match_t* matches;
+    triangle_match_t* rejected;
+    size_t            nrejected;
+    const coord_t**   ref_matches;
+    const coord_t**   input_matches;
+    triangle_table_t  ref_table;
+    triangle_table_t  input_table;
+    triangle_table_match_t* table_matches;
+} triangles_data_t;
+
+static int
+run_find_triangles(void* data, stimage_error_t* error) {
+    triangles_data_t* d = (triangles_data_t*)data;
+    size_t            ntriangles = d->ntriangles_allocated;
+
+    return find_triangles(
+            d->nref_unique, d->ref_sorted, &ntriangles, d->ref_triangles,
+            d->n, TOLERANCE, MAXRATIO, error);
+}
+
+static int
+run_find_triangle_table(void* data, stimage_error_t* error) {
+    triangles_data_t* d = (triangles_data_t*)data;
+
+    return find_triangle_table(
+            d->nref_unique, d->ref_sorted, d->n, TOLERANCE, MAXRATIO, 1,
+            &d->ref_table, error);
+}
+
+static int
+run_merge_triangles(void* data, stimage_error_t* error) {
+    triangles_data_t* d = (triangles_data_t*)data;
+
+    d->nmatches = d->nref_triangles;
+    return merge_triangles(
+            d->nref_triangles, d->ref_triangles,
+            d->ninput_triangles, d->input_triangles,
+            &d->nmatches, d->matches, error);
+}
+
+static int
+run_merge_triangle_tables(void* data, stimage_error_t* error) {
+    triangles_data_t* d = (triangles_data_t*)data;
+    size_t            nmatches = d->ref_table.ntriangles;
+
+    return merge_triangle_tables(
+            &d->ref_table, &d->input_table, 1,
+            &nmatches, d->table_matches, error);
+}
+
+/* reject_triangles works in place, so this includes copying the
+   merged matches */
+static int
+run_reject_triangles(void* data, stimage_error_t* error) {
+    triangles_data_t* d = (triangles_data_t*)data;
+
+    memcpy(d->rejected, d->matches, d->nmatches * sizeof(triangle_match_t));
+    d->nrejected = d->nmatches;
+    return reject_triangles(
+            &d->nrejected, d->rejected, NREJECT, NULL, error);
+}
+
+static int
+run_vote_triangle_matches(void* data, stimage_error_t* error) {
+    triangles_data_t* d = (triangles_data_t*)data;
+    size_t            ncoord_matches = d->n;
+
+    return vote_triangle_matches(
+            d->n, d->input, d->n, d->ref,
+            d->nrejected, d->rejected,
+            &ncoord_matches, d->ref_matches, d->input_matches, error);
+}
+
+static void
+triangles_data_free(triangles_data_t* d) {
+    free(d->ref);
+    free(d->input);
+    free(d->ref_sorted);
+    free(d->input_sorted);
+    free(d->ref_triangles);
+    free(d->input_triangles);
+    free(d->matches);
+    free(d->rejected);
+    free(d->ref_matches);
+    free(d->input_matches);
+    free(d->table_matches);
+    triangle_table_free(&d->ref_table);
+    triangle_table_free(&d->input_table);
+    memset(d, 0, sizeof(triangles_data_t));
+    triangle_table_init(&d->ref_table);
+    triangle_table_init(&d->input_table);
+}
+
+int main(int argc, char** argv) {
+    const size_t     sizes[] = {10, 20, 40, 80};
+    bench_field_t    field;
+    triangles_data_t data;
+    stimage_error_t  error;
+    char             params[64];
+    size_t           i, n;
+    int              status = 1;
+
+    stimage_error_init(&error);
+    memset(&data, 0, sizeof(triangles_data_t));
+    triangle_table_init(&data.ref_table);
+    triangle_table_init(&data.input_table);
+
+    /* The number of triangles grows as the cube of the number of
+       coordinates, so these sizes are fixed rather than given by the
+       command line */
+    for (i = 0; i < sizeof(sizes) / sizeof(size_t); ++i) {
+        n = sizes[i];
+        bench_field_init(&field, n);
+        field.rotation = 30.0;
+        field.scale = 1.1;
+        data.n = n;
+        data.ref = malloc(n * sizeof(coord_t));
+        data.input = malloc(n * sizeof(coord_t));
+        data.ref_sorted = malloc(n * sizeof(coord_t*));
+        data.input_sorted = malloc(n * sizeof(coord_t*));
+        data.ref_matches = malloc(n * sizeof(coord_t*));
+        data.input_matches = malloc(n * sizeof(coord_t*));
+        if (data.ref == NULL || data.input == NULL ||
+            data.ref_sorted == NULL || data.input_sorted == NULL ||
+            data.ref_matches == NULL || data.input_matches == NULL) {
+            goto oom;
+        }
+
+        bench_field_make(&field, 0, data.ref, data.input);
+        xysort(n, data.ref, data.ref_sorted);
+        xysort(n, data.input, data.input_sorted);
+        data.nref_unique = xycoincide(
+                n, data.ref_sorted, data.ref_sorted, TOLERANCE);
+        data.ninput_unique = xycoincide(
+                n, data.input_sorted, data.input_sorted, TOLERANCE);
+
+        if (max_num_triangles(data.nref_unique, n,
+                              &data.nref_triangles, &error) ||
+            max_num_triangles(data.ninput_unique, n,
+                              &data.ninput_triangles, &error)) {
+            goto error;
+        }
+
+        data.ntriangles_allocated = data.nref_triangles;
+        data.ref_triangles = malloc(data.nref_triangles * sizeof(triangle_t));
+        data.input_triangles = malloc(
+                data.ninput_triangles * sizeof(triangle_t));
+        data.matches = malloc(data.nref_triangles * sizeof(triangle_match_t));
+        data.rejected = malloc(
+                data.nref_triangles * sizeof(triangle_match_t));
+        if (data.ref_triangles == NULL || data.input_triangles == NULL ||
+            data.matches == NULL || data.rejected == NULL) {
+            goto oom;
+        }
+
+        /* Build everything once, so that each stage can be timed on
+           its own */
+        if (find_triangles(
+                    data.nref_unique, data.ref_sorted,
+                    &data.nref_triangles, data.ref_triangles,
+                    n, TOLERANCE, MAXRATIO, &error) ||
+            find_triangles(
+                    data.ninput_unique, data.input_sorted,
+                    &data.ninput_triangles, data.input_triangles,
+                    n, TOLERANCE, MAXRATIO, &error) ||
+            find_triangle_table(
+                    data.nref_unique, data.ref_sorted, n,
+                    TOLERANCE, MAXRATIO, 1, &data.ref_table, &error) ||
+            find_triangle_table(
+                    data.ninput_unique, data.input_sorted, n,
+                    TOLERANCE, MAXRATIO, 1, &data.input_table, &error) ||
+            run_merge_triangles(&data, &error) ||
+            run_reject_triangles(&data, &error)) {
+            goto error;
+        }
+
+        data.table_matches = malloc(
+                data.ref_table.ntriangles * sizeof(triangle_table_match_t));
+        if (data.table_matches == NULL) {
+            goto oom;
+        }
+
+        sprintf(params, "n=%lu", (unsigned long)n);
+        if (bench_run("find_triangles", params,
+                      &run_find_triangles, &data) ||
+            bench_run("find_triangle_table", params,
+                      &run_find_triangle_table, &data) ||
+            bench_run("merge_triangles", params,
+                      &run_merge_triangles, &data) ||
+            bench_run("merge_triangle_tables", params,
+                      &run_merge_triangle_tables, &data) ||
+            bench_run("reject_triangles", params,
+                      &run_reject_triangles, &data) ||
+            bench_run("vote_triangle_matches", params,
+                      &run_vote_triangle_matches, &data)) {
+            goto exit;
+        }
+
+        triangles_data_free(&data);
+    }
+
+    status = 0;
+    goto exit;
+
+ oom:
+    printf("Out of memory\n");
+    goto exit;
+
+ error:
+    printf("%s\n", stimage_error_get_message(&error));
+
+ exit:
+    triangles_data_free(&data);
+
+    return status;
+}
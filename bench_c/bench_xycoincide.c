@@ -0,0 +1,91 @@
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "bench.h"
+#include "lib/xycoincide.h"
+#include "lib/xysort.h"
+
+typedef struct {
+    size_t          n;
+    const coord_t** sorted;
+    const coord_t** output;
+    double          tolerance;
+} xycoincide_data_t;
+
+static int
+run_xycoincide(void* data, stimage_error_t* error) {
+    xycoincide_data_t* d = (xycoincide_data_t*)data;
+
+    xycoincide(d->n, d->sorted, d->output, d->tolerance);
+    return 0;
+}
+
+static int
+run_xycoincide_grid(void* data, stimage_error_t* error) {
+    xycoincide_data_t* d = (xycoincide_data_t*)data;
+    size_t             nunique;
+
+    return xycoincide_grid(
+            d->n, d->sorted, d->output, d->tolerance, &nunique, error);
+}
+
+int main(int argc, char** argv) {
+    const int         max_size = bench_max_size(argc, argv);
+    const double      crowding[] = {0.0, 0.2};
+    bench_field_t     field;
+    xycoincide_data_t data;
+    coord_t*          ref = NULL;
+    coord_t*          input = NULL;
+    char              params[64];
+    int               exponent;
+    size_t            i;
+    int               status = 1;
+
+    data.sorted = data.output = NULL;
+
+    for (exponent = 2; exponent <= max_size; ++exponent) {
+        bench_field_init(&field, bench_pow10(exponent));
+        data.n = field.n;
+        data.tolerance = 1.0;
+        data.sorted = malloc(field.n * sizeof(coord_t*));
+        data.output = malloc(field.n * sizeof(coord_t*));
+        ref = malloc(field.n * sizeof(coord_t));
+        input = malloc(field.n * sizeof(coord_t));
+        if (data.sorted == NULL || data.output == NULL || ref == NULL ||
+            input == NULL) {
+            printf("Out of memory\n");
+            goto exit;
+        }
+
+        for (i = 0; i < sizeof(crowding) / sizeof(double); ++i) {
+            field.crowding_fraction = crowding[i];
+            bench_field_make(&field, 0, ref, input);
+            xysort(field.n, ref, data.sorted);
+            sprintf(params, "n=%lu crowding=%.1f",
+                    (unsigned long)field.n, crowding[i]);
+
+            if (bench_run("xycoincide", params, &run_xycoincide, &data) ||
+                bench_run("xycoincide_grid", params,
+                          &run_xycoincide_grid, &data)) {
+                goto exit;
+            }
+        }
+
+        free(data.sorted);
+        free(data.output);
+        free(ref);
+        free(input);
+        data.sorted = data.output = NULL;
+        ref = input = NULL;
+    }
+
+    status = 0;
+
+ exit:
+    free(data.sorted);
+    free(data.output);
+    free(ref);
+    free(input);
+
+    return status;
+}
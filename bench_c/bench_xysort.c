@@ -0,0 +1,77 @@
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "bench.h"
+#include "lib/xysort.h"
+
+typedef struct {
+    size_t          n;
+    coord_t*        coords;
+    const coord_t** ptr;
+    size_t*         index;
+} xysort_data_t;
+
+static int
+run_xysort(void* data, stimage_error_t* error) {
+    xysort_data_t* d = (xysort_data_t*)data;
+
+    xysort(d->n, d->coords, d->ptr);
+    return 0;
+}
+
+static int
+run_xysort_index(void* data, stimage_error_t* error) {
+    xysort_data_t* d = (xysort_data_t*)data;
+
+    return xysort_index(d->n, d->coords, d->index, 1, error);
+}
+
+int main(int argc, char** argv) {
+    const int     max_size = bench_max_size(argc, argv);
+    bench_field_t field;
+    xysort_data_t data;
+    coord_t*      input = NULL;
+    char          params[64];
+    int           exponent;
+    int           status = 1;
+
+    for (exponent = 2; exponent <= max_size; ++exponent) {
+        bench_field_init(&field, bench_pow10(exponent));
+        data.n = field.n;
+        data.coords = malloc(field.n * sizeof(coord_t));
+        data.ptr = malloc(field.n * sizeof(coord_t*));
+        data.index = malloc(field.n * sizeof(size_t));
+        input = malloc(field.n * sizeof(coord_t));
+        if (data.coords == NULL || data.ptr == NULL || data.index == NULL ||
+            input == NULL) {
+            printf("Out of memory\n");
+            goto exit;
+        }
+
+        bench_field_make(&field, 0, data.coords, input);
+        sprintf(params, "n=%lu", (unsigned long)field.n);
+
+        if (bench_run("xysort", params, &run_xysort, &data) ||
+            bench_run("xysort_index", params, &run_xysort_index, &data)) {
+            goto exit;
+        }
+
+        free(data.coords);
+        free(data.ptr);
+        free(data.index);
+        free(input);
+        data.coords = input = NULL;
+        data.ptr = NULL;
+        data.index = NULL;
+    }
+
+    status = 0;
+
+ exit:
+    free(data.coords);
+    free(data.ptr);
+    free(data.index);
+    free(input);
+
+    return status;
+}
@@ -0,0 +1,128 @@
+"""
+Run the C microbenchmarks and record or compare their results.
+
+The benchmarks are built by ``waf build`` into build/default/bench_c,
+and ``waf bench`` builds and runs them.  To keep a baseline and check a
+later build against it::
+
+    python bench_c/c_bench.py -o baseline.json
+    python bench_c/c_bench.py -c baseline.json
+
+Comparing exits with a non-zero status if any case got slower than the
+baseline by more than the threshold.  The largest coordinate list has
+10**max_size coordinates; the default of 6 runs in a few minutes, and
+7 covers the full 10**2 to 10**7 range.
+"""
+from __future__ import print_function
+
+from os.path import exists, join
+import json
+import optparse
+import platform
+import subprocess
+import sys
+import time
+
+BENCHMARKS = [
+    'geomap',
+    'surface',
+    'tolerance',
+    'triangles',
+    'xycoincide',
+    'xysort'
+    ]
+
+def run_benchmark(path, max_size):
+    """
+    Run one benchmark program, returning a dictionary from case names
+    of the form "name[params]" to seconds per call.
+    """
+    process = subprocess.Popen(
+        [path, str(max_size)], stdout=subprocess.PIPE,
+        universal_newlines=True)
+    results = {}
+    for line in process.stdout:
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) < 3:
+            print(line, end='')
+            continue
+        name = '%s[%s]' % (fields[0], fields[1])
+        if fields[2].startswith('ERROR'):
+            raise RuntimeError('%s: %s' % (name, fields[2]))
+        results[name] = float(fields[2])
+        print('%-60s %12.3f us' % (name, results[name] * 1e6))
+        sys.stdout.flush()
+    retcode = process.wait()
+    if retcode != 0:
+        raise RuntimeError('%s returned code %d' % (path, retcode))
+    return results
+
+def compare(results, baseline, threshold):
+    """
+    Print the ratio of each result to the baseline, returning the names
+    of the cases that are slower by more than threshold.
+    """
+    slower = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        ratio = results[name] / baseline[name]
+        flag = ''
+        if ratio > threshold:
+            flag = '  SLOWER'
+            slower.append(name)
+        elif ratio < 1.0 / threshold:
+            flag = '  faster'
+        print('%-60s %8.3f%s' % (name, ratio, flag))
+    return slower
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options] [benchmark ...]')
+    parser.add_option(
+        '-b', '--build-dir', default=join('build', 'default', 'bench_c'),
+        help='directory containing the benchmark programs')
+    parser.add_option(
+        '-m', '--max-size', type='int', default=6,
+        help='largest coordinate list size, as a power of 10')
+    parser.add_option(
+        '-o', '--output', help='write the results to this JSON file')
+    parser.add_option(
+        '-c', '--compare', help='compare the results to this JSON file')
+    parser.add_option(
+        '-t', '--threshold', type='float', default=1.25,
+        help='slowdown ratio reported as a regression')
+    options, names = parser.parse_args(argv)
+
+    results = {}
+    for name in names or BENCHMARKS:
+        path = join(options.build_dir, 'bench_%s' % name)
+        if not exists(path):
+            parser.error('%s has not been built' % path)
+        results.update(run_benchmark(path, options.max_size))
+
+    if options.output:
+        record = {
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'machine': platform.node(),
+            'platform': platform.platform(),
+            'max_size': options.max_size,
+            'results': results
+            }
+        fd = open(options.output, 'w')
+        json.dump(record, fd, indent=1, sort_keys=True)
+        fd.close()
+
+    if options.compare:
+        fd = open(options.compare, 'r')
+        baseline = json.load(fd)['results']
+        fd.close()
+        print()
+        slower = compare(results, baseline, options.threshold)
+        if slower:
+            print('\n%d case(s) slower than the baseline' % len(slower))
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,12 @@
+"""
+Benchmarks of the Python layer of `stsci.stimage`, in the format used
+by airspeed velocity (asv).  From the top of the source tree::
+
+    asv run                     # benchmark the current commit
+    asv continuous master HEAD  # report the cases that got slower
+
+The largest coordinate lists have ``10**STIMAGE_BENCH_MAX_SIZE``
+coordinates; the default of 6 keeps a run to a reasonable length, and
+7 covers the full range.  The kernels underneath are benchmarked on
+their own by the programs in ``bench_c``.
+"""
@@ -0,0 +1,106 @@
+"""
+Benchmarks of `stsci.stimage.geomap`.
+"""
+import numpy as np
+
+import stsci.stimage as stimage
+
+from .synthetic import sizes, star_field
+
+ORDERS = [2, 3, 4, 6, 8, 10, 12]
+
+# Cases whose normal equations take more than this many multiply-adds
+# to accumulate are skipped
+MAX_WORK = 2e9
+
+def ncoeff(order):
+    """
+    The number of coefficients of a surface of the given order with
+    half cross terms.
+    """
+    return order * (order + 1) // 2
+
+class TimeGeomap(object):
+    """
+    General fits of increasing order to a distorted field.
+    """
+    params = [sizes(), ORDERS]
+    param_names = ['n', 'order']
+    timeout = 600
+
+    def setup(self, n, order):
+        if n <= ncoeff(order) or n * ncoeff(order) ** 2 > MAX_WORK:
+            raise NotImplementedError()
+        self.field = star_field(
+            n, rotation=0.5, scale=1.001, distortion=2.0)
+
+    def fit(self, order):
+        return stimage.geomap(
+            self.field.input, self.field.ref, fit_geometry='general',
+            xxorder=order, xyorder=order, yxorder=order, yyorder=order)
+
+    def time_geomap(self, n, order):
+        self.fit(order)
+
+    def peakmem_geomap(self, n, order):
+        self.fit(order)
+
+    def track_rms(self, n, order):
+        fit, output = self.fit(order)
+        return float(np.hypot(*fit.rms))
+
+class TimeGeometry(object):
+    """
+    The restricted fit geometries.
+    """
+    params = [sizes(), ['shift', 'rscale', 'rxyscale', 'general']]
+    param_names = ['n', 'fit_geometry']
+    timeout = 600
+
+    def setup(self, n, fit_geometry):
+        self.field = star_field(n, rotation=0.5, scale=1.001)
+
+    def time_geomap(self, n, fit_geometry):
+        stimage.geomap(
+            self.field.input, self.field.ref, fit_geometry=fit_geometry)
+
+class TimeReject(object):
+    """
+    Sigma clipping of match lists that contain false pairs.
+    """
+    params = [sizes(limit=6), [0.0, 0.1, 0.3]]
+    param_names = ['n', 'outliers']
+    timeout = 600
+
+    def setup(self, n, outliers):
+        self.field = star_field(
+            n, rotation=0.5, scale=1.001, outlier_fraction=outliers)
+
+    def fit(self):
+        return stimage.geomap(
+            self.field.input, self.field.ref, fit_geometry='general',
+            maxiter=10, reject=3.0)
+
+    def time_reject(self, n, outliers):
+        self.fit()
+
+    def track_rms(self, n, outliers):
+        fit, output = self.fit()
+        return float(np.hypot(*fit.rms))
+
+class TimeFitter(object):
+    """
+    The per-call overhead of repeatedly fitting small lists.
+    """
+    params = [[10, 100, 1000]]
+    param_names = ['n']
+
+    def setup(self, n):
+        self.field = star_field(n, rotation=0.5, scale=1.001)
+        self.fitter = stimage.Fitter(fit_geometry='general')
+
+    def time_geomap(self, n):
+        stimage.geomap(self.field.input, self.field.ref)
+
+    def time_fitter(self, n):
+        self.fitter(self.field.input, self.field.ref)
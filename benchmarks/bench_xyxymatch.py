@@ -0,0 +1,96 @@
+"""
+Benchmarks of `stsci.stimage.xyxymatch`.
+"""
+import stsci.stimage as stimage
+
+from .synthetic import sizes, star_field
+
+class TimeTolerance(object):
+    """
+    Matching with known offsets, as when the lists have already been
+    aligned.
+    """
+    params = [sizes(), [0.0, 0.3]]
+    param_names = ['n', 'outliers']
+    timeout = 600
+
+    def setup(self, n, outliers):
+        self.field = star_field(n, shift=(0.0, 0.0), outlier_fraction=outliers)
+
+    def time_tolerance(self, n, outliers):
+        stimage.xyxymatch(
+            self.field.input, self.field.ref, algorithm='tolerance',
+            tolerance=1.0, separation=0.0)
+
+    def peakmem_tolerance(self, n, outliers):
+        stimage.xyxymatch(
+            self.field.input, self.field.ref, algorithm='tolerance',
+            tolerance=1.0, separation=0.0)
+
+    def track_nmatched(self, n, outliers):
+        return len(stimage.xyxymatch(
+            self.field.input, self.field.ref, algorithm='tolerance',
+            tolerance=1.0, separation=0.0))
+
+class TimeSeparation(object):
+    """
+    Removing close pairs from crowded lists before matching, which
+    sorts both lists and culls the coincident coordinates.
+    """
+    params = [sizes(), [0.0, 0.2]]
+    param_names = ['n', 'crowding']
+    timeout = 600
+
+    def setup(self, n, crowding):
+        self.field = star_field(
+            n, shift=(0.0, 0.0), crowding_fraction=crowding)
+
+    def time_separation(self, n, crowding):
+        stimage.xyxymatch(
+            self.field.input, self.field.ref, algorithm='tolerance',
+            tolerance=1.0, separation=3.0)
+
+class TimeTriangles(object):
+    """
+    Matching without tie points, using triangles built from at most
+    nmatch stars of each list.
+    """
+    params = [[100, 1000, 10000], [10, 20, 40], ['sample', 'brightest']]
+    param_names = ['n', 'nmatch', 'select']
+    timeout = 600
+
+    def setup(self, n, nmatch, select):
+        self.field = star_field(
+            n, rotation=30.0, scale=1.1, outlier_fraction=0.1)
+
+    def time_triangles(self, n, nmatch, select):
+        stimage.xyxymatch(
+            self.field.input, self.field.ref, algorithm='triangles',
+            tolerance=1.0, separation=3.0, nmatch=nmatch, select=select,
+            input_weights=self.field.flux, ref_weights=self.field.flux)
+
+    def track_nmatched(self, n, nmatch, select):
+        return len(stimage.xyxymatch(
+            self.field.input, self.field.ref, algorithm='triangles',
+            tolerance=1.0, separation=3.0, nmatch=nmatch, select=select,
+            input_weights=self.field.flux, ref_weights=self.field.flux))
+
+class TimeMatcher(object):
+    """
+    The per-call overhead of repeatedly matching small lists.
+    """
+    params = [[10, 100, 1000]]
+    param_names = ['n']
+
+    def setup(self, n):
+        self.field = star_field(n, shift=(0.0, 0.0))
+        self.matcher = stimage.Matcher(
+            algorithm='tolerance', tolerance=1.0, separation=0.0)
+
+    def time_xyxymatch(self, n):
+        stimage.xyxymatch(
+            self.field.input, self.field.ref, algorithm='tolerance',
+            tolerance=1.0, separation=0.0)
+
+    def time_matcher(self, n):
+        self.matcher(self.field.input, self.field.ref)
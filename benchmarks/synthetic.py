@@ -0,0 +1,119 @@
+"""
+Seeded synthetic star fields with a known transformation, false pairs
+and crowding, shared by the benchmarks.
+"""
+from __future__ import division
+
+import os
+
+import numpy as np
+
+#: The field is this many pixels on a side
+WIDTH = 4096.0
+
+def max_size():
+    """
+    The largest coordinate list size to benchmark, as a power of 10.
+    """
+    return int(os.environ.get('STIMAGE_BENCH_MAX_SIZE', 6))
+
+def sizes(min_size=2, limit=None):
+    """
+    The coordinate list sizes to benchmark, from ``10**min_size`` up to
+    ``10**max_size()`` (or ``10**limit``, if that is smaller).
+    """
+    top = max_size()
+    if limit is not None:
+        top = min(top, limit)
+    return [10 ** k for k in range(min_size, top + 1)]
+
+class StarField(object):
+    """
+    A reference star list and the same stars as seen in an input
+    image.
+
+    **Attributes:**
+
+    - *ref*: An Nx2 array of reference coordinates
+
+    - *input*: An Nx2 array of input coordinates.  Apart from the
+      outliers, ``input[i]`` is ``ref[i]`` under the field's
+      transformation.
+
+    - *flux*: The brightness of each star, for the weighted selection
+      of triangle vertices
+
+    - *outlier*: A boolean array, true for the input coordinates that
+      were replaced by random positions
+    """
+    def __init__(self, ref, input, flux, outlier):
+        self.ref = ref
+        self.input = input
+        self.flux = flux
+        self.outlier = outlier
+
+def star_field(n,
+               seed=0,
+               shift=(12.5, -7.25),
+               scale=1.0,
+               rotation=0.0,
+               distortion=0.0,
+               noise=0.05,
+               outlier_fraction=0.0,
+               crowding_fraction=0.0):
+    """
+    Make a random star field with a known transformation.
+
+    **Parameters:**
+
+    - *n*: The number of stars
+
+    - *seed*: The seed of the random number generator.  The same
+      arguments always give the same field.
+
+    - *shift*, *scale*, *rotation*: The linear transformation from ref
+      to input, ``input = scale * R(rotation) * ref + shift``, with
+      *rotation* in degrees
+
+    - *distortion*: The size, in pixels at the edge of the field, of a
+      cubic distortion added to the input coordinates, so that higher
+      order fits have something to fit
+
+    - *noise*: The standard deviation of the Gaussian noise added to
+      each input coordinate, in pixels
+
+    - *outlier_fraction*: The fraction of the input coordinates
+      replaced by random positions, i.e. false pairs
+
+    - *crowding_fraction*: The fraction of the stars put within a pixel
+      of another star
+
+    **Returns** a `StarField`
+    """
+    random = np.random.RandomState(seed)
+
+    ref = random.uniform(0.0, WIDTH, (n, 2))
+    ncrowded = int(crowding_fraction * n)
+    if ncrowded and n > 1:
+        crowded = random.choice(np.arange(1, n), ncrowded, replace=False)
+        neighbors = (random.uniform(0.0, 1.0, ncrowded) * crowded).astype(int)
+        ref[crowded] = ref[neighbors] + random.uniform(-0.5, 0.5, (ncrowded, 2))
+
+    theta = np.deg2rad(rotation)
+    c = scale * np.cos(theta)
+    s = scale * np.sin(theta)
+    input = np.empty_like(ref)
+    input[:, 0] = c * ref[:, 0] - s * ref[:, 1] + shift[0]
+    input[:, 1] = s * ref[:, 0] + c * ref[:, 1] + shift[1]
+    if distortion:
+        u = ref / WIDTH - 0.5
+        input[:, 0] += 8.0 * distortion * u[:, 0] ** 2 * u[:, 1]
+        input[:, 1] += 8.0 * distortion * u[:, 1] ** 3
+    input += random.normal(0.0, noise, (n, 2))
+
+    outlier = random.uniform(0.0, 1.0, n) < outlier_fraction
+    input[outlier] = random.uniform(0.0, WIDTH, (outlier.sum(), 2))
+
+    flux = random.lognormal(0.0, 1.0, n)
+
+    return StarField(ref, input, flux, outlier)
@@ -65,15 +65,22 @@ except AttributeError:
 ######################################################################
 # STIMAGE-SPECIFIC AND WRAPPER SOURCE FILES
 STIMAGE_SOURCES = [ # List of pure-C files to compile
+    'immatch/crossmatch.c',
     'immatch/geomap.c',
     'immatch/xyxymatch.c',
+    'immatch/lib/offsets.c',
+    'immatch/lib/quads.c',
     'immatch/lib/tolerance.c',
     'immatch/lib/triangles.c',
     'immatch/lib/triangles_vote.c',
+    'immatch/lib/verify.c',
     'lib/error.c',
     'lib/lintransform.c',
+    'lib/parallel.c',
     'lib/polynomial.c',
+    'lib/projection.c',
     'lib/util.c',
+    'lib/workspace.c',
     'lib/xybbox.c',
     'lib/xycoincide.c',
     'lib/xysort.c',
@@ -87,7 +94,9 @@ STIMAGE_WRAP_SOURCES = [
     'stimage_module.c',
     'wrap_util.c',
     'immatch/py_xyxymatch.c',
-    'immatch/py_geomap.c'
+    'immatch/py_geomap.c',
+    'lib/py_projection.c',
+    'immatch/py_crossmatch.c'
     ]
 STIMAGE_WRAP_SOURCES = [join('src_wrap', x) for x in STIMAGE_WRAP_SOURCES]
 
@@ -107,6 +116,9 @@ else:
     define_macros.append(('NDEBUG', None))
     undef_macros.append('DEBUG')
 
+if sys.platform != 'win32':
+    libraries.append('pthread')
+
 pkg = ["stsci.stimage", "stsci.stimage.test"]
 
 setupargs = {
@@ -0,0 +1,89 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#ifndef _STIMAGE_CROSSMATCH_H_
+#define _STIMAGE_CROSSMATCH_H_
+
+#include "lib/util.h"
+#include "lib/lintransform.h"
+
+/**
+Cross-matches the coordinate lists of several epochs of the same
+field at once, assigning a global source ID to every detection.
+
+Each epoch is first put into a common frame by applying its linear
+transformation.  All of the detections are then put into a single
+spatial index, and any two detections within tolerance of each other
+are linked (friends-of-friends).  Every connected group of detections
+is one source.  This takes O(n log n) time in the total number of
+detections, rather than the O(nepochs^2) calls of pairwise matching.
+
+Since the linking is transitive, detections in the same epoch closer
+together than tolerance are merged into a single source.  Crowded
+lists should be culled first, for example with xycoincide.
+
+@param nepochs The number of epochs
+
+@param ncoords The number of coordinates in each epoch [nepochs]
+
+@param coords The coordinates of each epoch [nepochs][ncoords[i]]
+
+@param transforms The transformation of each epoch into the common
+frame [nepochs], for example created by compute_lintransform.  If
+NULL, the coordinates are used as-is.
+
+@param tolerance The linking length, in the units of the common
+frame.  Must be > 0.
+
+@param ids Output array of the source ID of each detection, in epoch
+order, i.e. the ID of coords[i][j] is in ids[ncoords[0] + ... +
+ncoords[i-1] + j].  IDs are numbered from 0 in order of each source's
+first detection.  Detections with non-finite coordinates are each
+given an ID of their own.
+
+@param nsources Output: the number of distinct sources
+
+@param error
+
+@return Non-zero on error
+*/
+int
+crossmatch_epochs(
+    const size_t nepochs,
+    const size_t* const ncoords, /* [nepochs] */
+    const coord_t* const * const coords, /* [nepochs][ncoords[i]] */
+    const lintransform_t* const transforms, /* [nepochs] */
+    const double tolerance,
+    size_t* const ids, /* [sum(ncoords)] */
+    size_t* const nsources,
+    stimage_error_t* const error);
+
+#endif /* _STIMAGE_CROSSMATCH_H_ */
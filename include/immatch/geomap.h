@@ -38,6 +38,8 @@ DAMAGE.
 #define _STIMAGE_GEOMAP_H_
 
 #include "lib/util.h"
+#include "lib/projection.h"
+#include "lib/workspace.h"
 #include "lib/xybbox.h"
 #include "surface/surface.h"
 
@@ -52,37 +54,82 @@ typedef enum {
 } geomap_fit_e;
 
 typedef enum {
-    geomap_proj_none,
-    geomap_proj_lin,
-    geomap_proj_azp,
-    geomap_proj_tan,
-    geomap_proj_sin,
-    geomap_proj_stg,
-    geomap_proj_arc,
-    geomap_proj_zpn,
-    geomap_proj_zea,
-    geomap_proj_air,
-    geomap_proj_cyp,
-    geomap_proj_car,
-    geomap_proj_mer,
-    geomap_proj_cea,
-    geomap_proj_cop,
-    geomap_proj_cod,
-    geomap_proj_coe,
-    geomap_proj_coo,
-    geomap_proj_bon,
-    geomap_proj_pco,
-    geomap_proj_gls,
-    geomap_proj_par,
-    geomap_proj_ait,
-    geomap_proj_mol,
-    geomap_proj_csc,
-    geomap_proj_qsc,
-    geomap_proj_tsc,
-    geomap_proj_tnx,
-    geomap_proj_zpx,
-    geomap_proj_LAST
-} geomap_proj_e;
+    geomap_order_fixed,
+    geomap_order_aic,
+    geomap_order_bic,
+    geomap_order_cv,
+    geomap_order_LAST
+} geomap_order_e;
+
+typedef enum {
+    geomap_uncertainty_none,
+    geomap_uncertainty_analytic,
+    geomap_uncertainty_bootstrap,
+    geomap_uncertainty_jackknife,
+    geomap_uncertainty_LAST
+} geomap_uncertainty_e;
+
+typedef enum {
+    geomap_robust_none,
+    geomap_robust_huber,
+    geomap_robust_tukey,
+    geomap_robust_LAST
+} geomap_robust_e;
+
+/* Options of geomap beyond those of the original task */
+typedef struct {
+    /* How the orders of a general fit are chosen */
+    geomap_order_e order_select;
+    /* The largest order tried when the orders are chosen */
+    size_t max_order;
+    /* The number of folds of the cross-validation of geomap_order_cv */
+    size_t nfolds;
+    /* How the covariances of the coefficients are estimated */
+    geomap_uncertainty_e uncertainty;
+    /* The number of bootstrap resamples, or of jackknife groups (0
+       for one group per point) */
+    size_t nresamples;
+    /* The seed of the bootstrap resamples */
+    size_t seed;
+    /* The number of threads the resamples are fit on, 0 for one per
+       processor */
+    size_t nthreads;
+    /* The weight function of a robust fit, which replaces the
+       rejection of maxiter and reject */
+    geomap_robust_e robust;
+    /* The tuning constant of the weight function, in units of the
+       scatter of the residuals, 0 for the default of robust */
+    double robust_tuning;
+    /* The largest number of reweighting iterations */
+    size_t robust_maxiter;
+    /* The iterations stop when no fitted value changes by more than
+       robust_tol times the scatter of the residuals */
+    double robust_tol;
+} geomap_options_t;
+
+/**
+Initialize the options to their defaults, which fit the orders given
+to geomap.
+*/
+void
+geomap_options_init(
+        geomap_options_t* const options);
+
+/* The scores of one order tried when the orders are chosen.  The x
+   and y members are those of the x and y fits. */
+typedef struct {
+    size_t order;
+    size_t nxcoeff;
+    size_t nycoeff;
+    /* The weighted sum of the squared residuals */
+    coord_t chisq;
+    /* The Akaike and Bayesian information criteria */
+    coord_t aic;
+    coord_t bic;
+    /* The cross-validated sum of squared residuals, NaN if the order
+       was not cross-validated */
+    coord_t cv;
+} geomap_order_score_t;
 
 typedef struct {
     coord_t input;
@@ -91,9 +138,22 @@ typedef struct {
     coord_t residual;
 } geomap_output_t;
 
+/* The shape and normalization of one of the surfaces of a fit */
+typedef struct {
+    size_t xorder;
+    size_t yorder;
+    xterms_e xterms;
+    double xrange;
+    double xmaxmin;
+    double yrange;
+    double ymaxmin;
+} geomap_surface_t;
+
 typedef struct {
     geomap_fit_e fit_geometry;
     surface_type_e function;
+    geomap_proj_e projection;
+    coord_t refpt;
     coord_t rms;
     coord_t mean_ref;
     coord_t mean_input;
@@ -108,6 +168,35 @@ typedef struct {
     double* x2coeff;
     size_t ny2coeff;
     double* y2coeff;
+    geomap_surface_t xsurface;
+    geomap_surface_t ysurface;
+    geomap_surface_t x2surface;
+    geomap_surface_t y2surface;
+    size_t xxorder;
+    size_t xyorder;
+    size_t yxorder;
+    size_t yyorder;
+    size_t nscores;
+    geomap_order_score_t* scores;
+    /* The covariance matrices of xcoeff, ycoeff, x2coeff and y2coeff
+       [ncoeff * ncoeff], or NULL if they were not estimated.  For a
+       general fit with a distortion surface, x2cov and y2cov are those
+       of the combined surface (see geomap) */
+    geomap_uncertainty_e uncertainty;
+    double* xcov;
+    double* ycov;
+    double* x2cov;
+    double* y2cov;
+    /* The coefficients fit to each resample, one row of nxcoeff +
+       nycoeff + nx2coeff + ny2coeff values each, in that order */
+    size_t nresamples;
+    double* resamples;
+    /* The number of rejection or reweighting iterations */
+    size_t niter;
+    /* The weight of each point in the fit: 0 for points that were
+       rejected, or the weights of a robust fit */
+    size_t nweights;
+    double* weights;
 } geomap_result_t;
 
 /**
@@ -145,6 +234,19 @@ coordinate system to the input coordinate system.
        x 512 image. The minimum and maximum values in *ref* input are
        used if *bbox* is `None` or any of its members are NaN.
 
+@param projection The sky projection geometry.  If not
+       geomap_proj_none or geomap_proj_lin, the reference coordinates
+       are celestial coordinates (RA, Dec) in degrees, and they are
+       projected onto the plane of the sky about *refpt* before the fit
+       is computed.  The fit is then a mapping from the projection
+       plane coordinates (xi, eta), in degrees, to the input
+       coordinates.  See project_coords for the supported projections.
+
+@param refpt The reference point of the projection (RA, Dec) in
+       degrees.  If NULL or non-finite, the mean of the reference
+       coordinates on the sky is used.  Ignored if *projection* is
+       geomap_proj_none or geomap_proj_lin.
+
 @param fit_geometry The fitting geometry to be used.  The options
        are the following:
 
@@ -232,10 +334,96 @@ coordinate system to the input coordinate system.
 
 @param reject The rejection limit in units of sigma.
 
+@param options Further options, or NULL for the defaults of
+       geomap_options_init.
+
+       If *options->order_select* is not geomap_order_fixed and
+       *fit_geometry* is geomap_fit_general, the orders of the x and y
+       fits are chosen separately, among the orders from 2 to
+       *options->max_order* in both *x* and *y*, instead of taken from
+       *xxorder*, *xyorder*, *yxorder* and *yyorder*.  The cross
+       terms remain *xxterms* and *yxterms*.  Every order is fit to
+       the residuals of the linear fit from a single accumulation of
+       the normal equations at the largest order (see
+       surface_fit_nested), and the one with the smallest Akaike
+       (geomap_order_aic) or Bayesian (geomap_order_bic) information
+       criterion, or cross-validated residuals (geomap_order_cv), is
+       then used for the fit.  The orders are chosen before any
+       rejection.  The scores of every order are returned in
+       *result*.
+
+       If *options->uncertainty* is not geomap_uncertainty_none, the
+       covariance matrix of each array of coefficients is returned in
+       *result*, estimated from the points left after rejection:
+
+       - geomap_uncertainty_analytic: The inverse of the normal
+         matrix, from the Cholesky factorization of the fit, scaled
+         by the variance of the residuals.  The rotate, rscale and
+         rxyscale geometries are not linear least-squares fits, and
+         their covariances are NaN.
+
+       - geomap_uncertainty_bootstrap: The covariance of the
+         coefficients fit to *options->nresamples* resamples of the
+         points, drawn with replacement with the given *seed*.
+
+       - geomap_uncertainty_jackknife: The jackknife covariance of the
+         coefficients fit with each of *options->nresamples* groups
+         of points left out in turn.  Point k is in group k %
+         nresamples.
+
+       The distortion surface of a general fit is fit to the residuals
+       of the linear one, so their coefficients are not independent:
+       a resample of the linear fit follows the distortion in the
+       points drawn, and the distortion surface makes up for it.  The
+       covariance of the fit is that of the combined surface, which
+       has the coefficients of the distortion surface with those of
+       the linear surface added to its constant and linear terms, and
+       it is returned instead of that of the distortion surface alone
+       (x2cov and y2cov).  The covariance of the linear surface (xcov
+       and ycov) is propagated from it through the linear fit to the
+       combined surface, so it is that of a fit to the same points
+       with new errors, and not that of a fit to other points.  If the
+       distortion surface does not have the terms of the linear one,
+       both covariances are NaN.
+
+       The resamples are fit on *options->nthreads* threads, and the
+       results do not depend on their number.  For the xyscale and
+       general geometries, the basis functions of the surfaces are
+       evaluated once, and each resample only reweights their
+       weighted inner products: a bootstrap resample costs one
+       accumulation of the normal equations, and all of the
+       jackknife groups together cost one.  The coefficients of
+       each resample are returned as well.  A resample that cannot be
+       fit has NaN coefficients and is left out of the covariances.
+
+       If *options->robust* is not geomap_robust_none, no points are
+       rejected, and the fit is instead iteratively reweighted, with
+       the Huber (geomap_robust_huber) or Tukey biweight
+       (geomap_robust_tukey) weight function of the residuals of each
+       point.  The x and y residuals are scaled by their median
+       absolute deviations, and combined in quadrature.
+       *options->robust_tuning* is in the same units, and defaults to
+       1.345 for Huber and 4.685 for Tukey, the usual constants of
+       their one-dimensional forms.  The iterations start from the
+       least-squares fit, whose outliers do not bias the median
+       absolute deviations as much as its rms.  Each iteration solves
+       for the change of the coefficients from the last one and, for
+       the xyscale and general geometries, only accumulates the
+       reweighted inner products of basis functions that are
+       evaluated once.  The iterations stop after
+       *options->robust_maxiter*, or once no fitted value moves by
+       more than *options->robust_tol* times the scatter of the
+       residuals.  Points with a weight of zero are reported as
+       rejected.  The uncertainties are those of the final weights.
+
+@param workspace Optional workspace for the scratch memory of the
+       fit, so that repeated calls can reuse it.  May be NULL.
+
 @param noutput The number of output records returned
 
 @param output An array of output records matching input and reference
-       coordinates with their fit and residual values.
+       coordinates with their fit and residual values.  The reference
+       coordinates are always returned as given, i.e. unprojected.
 
 @param result A structure defining the fit that was found.
 
@@ -248,6 +436,8 @@ geomap(
         const size_t ninput, const coord_t* const input,
         const size_t nref, const coord_t* const ref,
         const bbox_t* const bbox,
+        const geomap_proj_e projection,
+        const coord_t* const refpt,
         const geomap_fit_e fit_geometry,
         const surface_type_e function,
         const size_t xxorder,
@@ -258,6 +448,8 @@ geomap(
         const xterms_e yxterms,
         const size_t maxiter,
         const double reject,
+        const geomap_options_t* const options,
+        workspace_t* const workspace,
         /* Input/output */
         size_t* const noutput,
         /* Output */
@@ -265,6 +457,33 @@ geomap(
         geomap_result_t* const result,
         stimage_error_t* const error);
 
+/**
+Evaluate a fit found by `geomap` at the given reference coordinates,
+without fitting it again.  The coefficients and surfaces of *result*
+are all that is used, so it may be one that was saved and read back.
+
+@param result The fit, as returned by `geomap`.
+
+@param ncoord The number of coordinates
+
+@param ref The reference coordinates, on the sky if the fit was made
+       with a celestial projection.
+
+@param fit Output array of the fitted input coordinates
+
+@param error
+
+@return Non-zero on error
+*/
+int
+geomap_result_eval(
+        const geomap_result_t* const result,
+        const size_t ncoord,
+        const coord_t* const ref, /* [ncoord] */
+        /* Output */
+        coord_t* const fit, /* [ncoord] */
+        stimage_error_t* const error);
+
 void
 geomap_result_print(
         const geomap_result_t* const result);
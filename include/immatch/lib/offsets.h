@@ -0,0 +1,123 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#ifndef _STIMAGE_OFFSETS_H_
+#define _STIMAGE_OFFSETS_H_
+
+#include "lib/util.h"
+#include "immatch/lib/match_util.h"
+
+/**
+Compute the intersection of two lists by voting in offset space (a
+Hough transform).  The displacement vectors between every input
+coordinate and every reference coordinate within search_radius of it
+are histogrammed, and the most common displacement is taken as the
+shift between the two lists.  The input coordinates are then shifted
+and matched to the reference coordinates with match_tolerance.
+
+Since the reference coordinates are put in a spatial index, the cost
+is O(n k), where k is the number of reference coordinates within
+search_radius of each input coordinate, and every coordinate is used,
+not a subsample as with match_triangles.
+
+If max_rotation or max_scale are non-zero, the input coordinates are
+also rotated and scaled about their center on a coarse grid, and the
+(rotation, scale, shift) with the strongest peak is used.  The grid
+steps are chosen so that the error at the edge of the field is about
+tolerance.  Each grid point costs as much as the pure shift search.
+
+@param nref The number of reference coordinates
+
+@param nref_unique The number of unique reference coordinates
+(specifically in ref_sorted)
+
+@param ref The raw array of reference coordinates, used for
+determining indices into the original set.
+
+@param ref_sorted An array of pointers reference coordinates in ref.
+It is assumed that this array has already been sorted with xysort and
+culled with xycoincide.
+
+@param ninput The number of input coordinates
+
+@param ninput_unique The number of unique input coordinates
+(specifically in input_sorted)
+
+@param input The raw array of input coordinates, used for
+determining indices into the original set.
+
+@param input_sorted An array of pointers input coordinates in input.
+It is assumed that this array has already been sorted with xysort and
+culled with xycoincide.
+
+@param tolerance The matching tolerance in pixels.  This is also the
+width of the histogram bins, unless search_radius is very large.  The
+bins are then made wider, and the peak is searched for again in
+histograms of shrinking radius about it, down to bins tolerance wide.
+
+@param search_radius The maximum shift between the lists, in pixels.
+If <= 0, shifts up to the extent of the lists are searched for, but
+no more than 511.5 * tolerance, the largest radius whose histogram
+bins are tolerance wide.
+
+@param max_rotation The maximum rotation between the lists, in
+degrees.  If 0, no rotation is searched for.
+
+@param max_scale The maximum fractional difference in scale between
+the lists, e.g. 0.01 for 1%.  If 0, no scale is searched for.
+
+@param callback A callback function that is called with each matching
+coordinate pair.  See match_triangles.
+
+@param callback_data A void* to private data required by the given
+callback.
+
+@param error Stores an error string, if an error occurred.
+ */
+int
+match_offsets(
+        const size_t nref,
+        const size_t nref_unique,
+        const coord_t* const ref,
+        const coord_t* const * const ref_sorted, /*[nref]*/
+        const size_t ninput,
+        const size_t ninput_unique,
+        const coord_t* const input, /*[ninput]*/
+        const coord_t* const * const input_sorted,
+        const double tolerance,
+        const double search_radius,
+        const double max_rotation,
+        const double max_scale,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error);
+
+#endif /* _STIMAGE_OFFSETS_H_ */
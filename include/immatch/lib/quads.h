@@ -0,0 +1,203 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#ifndef _STIMAGE_QUADS_H_
+#define _STIMAGE_QUADS_H_
+
+#include "lib/util.h"
+#include "immatch/lib/match_util.h"
+#include "immatch/lib/verify.h"
+
+/**
+Stores a quad: four stars and their geometric hash code
+*/
+typedef struct {
+    /** The stars A, B, C and D, as indices into the coordinate list.
+        A and B are the most widely separated pair. */
+    size_t stars[4];
+
+    /** The positions of C and D in the frame where A is at (0, 0)
+        and B is at (1, 1): (xc, yc, xd, yd).  This is invariant to
+        translation, rotation and scale. */
+    double code[4];
+
+    /** The code quantized to the index's code tolerance */
+    long   cell[4];
+} star_quad_t;
+
+/**
+A hash index of the quads in a coordinate list.  It can be built once
+for a reference list with quad_index_init and then used to match any
+number of input lists with match_quads_indexed.
+*/
+typedef struct {
+    /** The coordinates, sorted with xysort (not owned by the index) */
+    size_t                 ncoords;
+    const coord_t* const * coords;
+
+    /** Used to verify hypothetical transformations against the
+        coordinates */
+    verify_index_t         verify;
+
+    /** The maximum distance between two matching codes */
+    double                 code_tolerance;
+
+    /** The quads, sorted by cell */
+    size_t                 nquads;
+    star_quad_t*                quads;
+} quad_index_t;
+
+/**
+Build a quad index for a list of coordinates.  A quad is built from
+each coordinate and every choice of three of its nearest neighbors.
+
+@param index The index to initialize.  Must be freed with
+quad_index_free, even if an error occurs.
+
+@param ncoords The number of coordinates in coords
+
+@param coords An array of pointers to coordinates.  It is assumed that
+this array has already been sorted with xysort and culled with
+xycoincide.  It must remain valid for the life of the index.
+
+@param tolerance The matching tolerance in pixels.  Quads smaller than
+a few times the tolerance are not used, since their codes are too
+uncertain.
+
+@param error
+
+@return Non-zero on error
+*/
+int
+quad_index_init(
+        quad_index_t* const index,
+        const size_t ncoords,
+        const coord_t* const * const coords,
+        const double tolerance,
+        stimage_error_t* const error);
+
+/**
+Free the memory used by a quad index.
+*/
+void
+quad_index_free(
+        quad_index_t* const index);
+
+/**
+Compute the intersection of two lists using geometric hashing of
+quads of stars, in the style of astrometry.net (Lang et al. 2010,
+AJ 139, 1782).  Each group of four nearby stars is described by a
+code which does not change under translation, rotation and scale.
+Quads from the input list are looked up in a hash index of the
+reference quads, and each pair of quads with similar codes gives a
+hypothetical similarity transformation (possibly including a flip).
+Each hypothesis is verified by counting the input coordinates it maps
+onto a reference coordinate, first for a small sample and then for
+the whole list, and the first hypothesis with far more matches than
+expected by chance is accepted.  The transformation is then refined
+by a least-squares fit to those matches, and the lists are matched
+with match_tolerance.
+
+Since the input quads are built on demand and the search stops at
+the first verified hypothesis, usually only a small fraction of the
+candidates is examined.
+
+@param nref The number of reference coordinates
+
+@param nref_unique The number of unique reference coordinates
+(specifically in ref_sorted)
+
+@param ref The raw array of reference coordinates, used for
+determining indices into the original set.
+
+@param ref_sorted An array of pointers reference coordinates in ref.
+It is assumed that this array has already been sorted with xysort and
+culled with xycoincide.
+
+@param ninput The number of input coordinates
+
+@param ninput_unique The number of unique input coordinates
+(specifically in input_sorted)
+
+@param input The raw array of input coordinates, used for
+determining indices into the original set.
+
+@param input_sorted An array of pointers input coordinates in input.
+It is assumed that this array has already been sorted with xysort and
+culled with xycoincide.
+
+@param tolerance The matching tolerance in pixels.
+
+@param callback A callback function that is called with each matching
+coordinate pair.  See match_triangles.
+
+@param callback_data A void* to private data required by the given
+callback.
+
+@param error Stores an error string, if an error occurred.
+*/
+int
+match_quads(
+        const size_t nref,
+        const size_t nref_unique,
+        const coord_t* const ref,
+        const coord_t* const * const ref_sorted, /*[nref]*/
+        const size_t ninput,
+        const size_t ninput_unique,
+        const coord_t* const input, /*[ninput]*/
+        const coord_t* const * const input_sorted,
+        const double tolerance,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error);
+
+/**
+Like match_quads, but uses an index of the reference list built with
+quad_index_init.
+
+@param index The quad index of the reference coordinates.
+
+@param ref The raw array of reference coordinates the index was
+built from, used for determining indices into the original set.
+*/
+int
+match_quads_indexed(
+        const quad_index_t* const index,
+        const coord_t* const ref,
+        const size_t ninput_unique,
+        const coord_t* const input, /*[ninput]*/
+        const coord_t* const * const input_sorted,
+        const double tolerance,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error);
+
+#endif /* _STIMAGE_QUADS_H_ */
@@ -90,4 +90,113 @@ match_tolerance(
         void*                        callback_data,
         stimage_error_t* const       error);
 
+/**
+Like match_tolerance, but the input coordinates are first moved to new
+positions, for example by a transformation determined by a pattern
+matching algorithm.  The moved coordinates are sorted, but the
+callback is still given indices into input.
+
+@param nref The number of reference coordinates in ref_sorted.
+
+@param ref A list of reference coordinates
+
+@param ref_sorted A list of pointers to reference coordinates that have
+been sorted with xysort and culled with xycoincide.
+
+@param ninput The number of input coordinates in input_list
+
+@param input A list of input coordinates
+
+@param input_list A list of pointers into input of the coordinates to
+match, in any order.
+
+@param moved The new position of each coordinate in input_list
+[ninput]
+
+@param tolerance The maximum distance to be considered a match
+
+@param callback See match_tolerance.
+
+@param callback_data A void* to private data required by the given
+callback.
+
+@param error Set to a meaningful message if an error occurred.
+
+@return Non-zero in case of error.
+*/
+int
+match_tolerance_moved(
+        const size_t                 nref,
+        const coord_t* const         ref,
+        const coord_t* const * const ref_sorted,
+        const size_t                 ninput,
+        const coord_t* const         input,
+        const coord_t* const * const input_list,
+        const coord_t* const         moved,
+        const double                 tolerance,
+        coord_match_callback_t*      callback,
+        void*                        callback_data,
+        stimage_error_t* const       error);
+
+/**
+Like match_tolerance, but splits the reference coordinates into
+square spatial tiles and matches each tile separately, optionally in
+parallel.
+
+Each reference coordinate belongs to exactly one tile.  Each input
+coordinate is copied into every tile that lies within tolerance of
+it, so every pair is still found, and found only once.  Each tile is
+matched with match_tolerance.  The matches are identical to those of
+match_tolerance on the same lists, including how ties are broken.
+The callback is always called from the calling thread, in the order
+of the reference coordinates sorted by (y, x, index).
+
+Only the tile being matched is copied, so the coordinate arrays may
+be memory-mapped without being read into memory all at once.
+
+@param nref The number of reference coordinates in ref_list.
+
+@param ref A list of reference coordinates
+
+@param ref_list A list of pointers into ref of the coordinates to
+match, in any order, e.g. culled with xycoincide.  If NULL, all nref
+coordinates in ref are used.
+
+@param ninput The number of input coordinates in input_list
+
+@param input A list of input coordinates
+
+@param input_list A list of pointers into input, as ref_list.
+
+@param tolerance The maximum distance to be considered a match
+
+@param tile_size The width and height of each tile.  If <= 0, a size
+is chosen so each tile has on the order of 10^5 reference coordinates.
+
+@param nthreads The number of threads.  0 means one per processor.
+
+@param callback See match_tolerance.
+
+@param callback_data A void* to private data required by the given
+callback.
+
+@param error Set to a meaningful message if an error occurred.
+
+@return Non-zero in case of error.
+*/
+int
+match_tolerance_tiled(
+        const size_t                 nref,
+        const coord_t* const         ref,
+        const coord_t* const * const ref_list,
+        const size_t                 ninput,
+        const coord_t* const         input,
+        const coord_t* const * const input_list,
+        const double                 tolerance,
+        const double                 tile_size,
+        const size_t                 nthreads,
+        coord_match_callback_t*      callback,
+        void*                        callback_data,
+        stimage_error_t* const       error);
+
 #endif /* _STIMAGE_XYINTERSECT_H_ */
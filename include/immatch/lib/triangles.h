@@ -37,9 +37,96 @@ DAMAGE.
 #ifndef _STIMAGE_TRIANGLES_H_
 #define _STIMAGE_TRIANGLES_H_
 
+#include <stdint.h>
+
 #include "lib/util.h"
+#include "lib/workspace.h"
 #include "immatch/lib/match_util.h"
 
+/**
+How match_triangles turns the matched triangles into matched
+coordinates
+*/
+typedef enum {
+    /** Iteratively reject triangle matches whose log perimeter ratio
+        is discrepant, then let the remaining ones vote for coordinate
+        pairs (Groth 1986) */
+    triangles_verify_reject,
+
+    /** Draw triangle matches in random order, verify the similarity
+        transformation each one implies against the whole lists and
+        stop at the first that is accepted */
+    triangles_verify_ransac,
+
+    triangles_verify_LAST
+} triangles_verify_e;
+
+/**
+How match_triangles chooses the at most nmatch coordinates of each
+list that triangles are built from
+*/
+typedef enum {
+    /** Every n'th coordinate of the list sorted by y */
+    triangles_select_sample,
+
+    /** The coordinates with the largest weights, e.g. the brightest */
+    triangles_select_brightest,
+
+    /** The coordinates are spread evenly over a grid of cells
+        covering the list, taking those with the largest weights (or,
+        without weights, the first in sorted order) first within each
+        cell */
+    triangles_select_grid,
+
+    triangles_select_LAST
+} triangles_select_e;
+
+/**
+A list of triangles stored as a structure of arrays.
+
+An array of triangle_t takes 72 bytes per triangle, most of it in the
+three vertex pointers, and a merge that only compares ratios and
+cosines has to stride over all of it.  A triangle table stores the
+vertices as 16-bit indices into the coordinate list the triangles were
+built from (max_num_triangles limits that list to fewer than 2346
+coordinates), the tolerances in single precision and every quantity
+in an array of its own, which takes 39 bytes per triangle.
+*/
+typedef struct {
+    /** The number of triangles in the table */
+    size_t ntriangles;
+
+    /** The number of triangles the arrays have room for */
+    size_t nallocated;
+
+    /** The indices of the vertices, three per triangle */
+    uint16_t* vertices;
+
+    /** The log of the perimeter of each triangle */
+    double* log_perimeter;
+
+    /** The ratio of the longest to shortest side */
+    double* ratio;
+
+    /** Cosine of angle at vertex 1 */
+    double* cosine_v1;
+
+    /** Tolerance in the ratio */
+    float* ratio_tolerance;
+
+    /** Tolerance in the cosine */
+    float* cosine_tolerance;
+
+    /** Sense of the triangle (clockwise (non-zero) or anti-clockwise
+        (zero)) */
+    unsigned char* sense;
+
+    /** The workspace the arrays are allocated from, or NULL to use the
+        heap.  It may be set after triangle_table_init, while the table
+        is still empty. */
+    workspace_t* workspace;
+} triangle_table_t;
+
 /**
 Compute the intersection of two lists using a pattern matching
 algorithm. This algorithm is based on one developed by Edward Groth
@@ -86,6 +173,61 @@ the triangles used for matching.
 
 @param nreject The maximum number of rejection iteration cycles.
 
+@param verify How the matched triangles are turned into matched
+coordinates.  With triangles_verify_reject, the algorithm follows
+Groth.  With triangles_verify_ransac, triangle matches are drawn in a
+fixed pseudo-random order, the similarity transformation implied by
+each is checked against the full lists with the same test as
+match_quads, and the first accepted transformation is refined by a
+least-squares fit and used to match the lists with match_tolerance.
+Since the search stops at the first accepted transformation, and a
+true triangle match is usually found within a few draws, this is much
+faster than rejection when there are many false triangle matches, and
+it matches all of the coordinates rather than at most nmatch.  nreject
+is ignored.
+
+@param select How the at most nmatch coordinates used to build
+triangles are chosen from each list.  See select_triangle_points.
+
+@param ref_weights, input_weights Weights for the coordinates in ref
+and input, e.g. their fluxes, used by triangles_select_brightest and
+triangles_select_grid.  Either may be NULL.  Larger weights are
+preferred.
+
+@param adaptive If non-zero, nmatch is only an upper limit.  Matching
+starts with the first few coordinates of each list, in the order of
+preference given by select, and the number is doubled until a match
+is found that has kept all the pairs found with fewer coordinates over
+two steps in a row (or, with triangles_verify_ransac, until a
+transformation is accepted), or nmatch is reached.  The triangles
+already built are reused at each step, so a field that matches with
+few coordinates costs far less than the C(nmatch, 3) triangles of a
+fixed nmatch, and one that needs more costs little more.
+
+The two modes return different pairs with triangles_verify_reject.
+The adaptive mode fits a similarity transformation to the voted
+pairs of the accepted match, and returns the match of the whole
+lists within tolerance under that transformation.  It only returns
+the voted pairs if nmatch was reached first, or if the fitted
+transformation does not match all of them.  The fixed mode (adaptive
+zero) always returns only the voted pairs, which are among the at
+most nmatch coordinates of each list.  With triangles_verify_ransac,
+both modes match the whole lists.
+
+@param ref_table Optional reference triangles built beforehand by
+find_reference_triangle_table from the same ref_sorted, nmatch,
+tolerance and maxratio.  They are used instead of building the
+reference triangles again when select is triangles_select_sample and
+adaptive is zero, and ignored otherwise.  May be NULL.
+
+@param nthreads The number of threads used to build and merge the
+triangles.  0 means one per processor.  The results are the same in
+all cases.
+
+@param workspace Optional workspace for the triangle tables and the
+other scratch memory.  May be NULL.  The adaptive search always uses
+the heap, since it grows its tables in place many times.
+
 @param callback A callback function that is called with each matching
 coordinate pair.  Its arguments are (data, ref_index, input_index,
 error).  data is always whatever callback_data is.  ref_index is the
@@ -112,10 +254,98 @@ match_triangles(
         const double tolerance,
         const double maxratio,
         const size_t nreject,
+        const triangles_verify_e verify,
+        const triangles_select_e select,
+        const double* const ref_weights, /*[nref]*/
+        const double* const input_weights, /*[ninput]*/
+        const int adaptive,
+        const triangle_table_t* const ref_table,
+        const size_t nthreads,
+        workspace_t* const workspace,
         coord_match_callback_t* callback,
         void* callback_data,
         stimage_error_t* const error);
 
+/**
+The resources match_triangles is expected to need, as computed by
+estimate_triangles.
+*/
+typedef struct {
+    /** The number of reference and input coordinates triangles are
+        built from */
+    size_t nref_points;
+    size_t ninput_points;
+
+    /** The maximum number of reference and input triangles */
+    size_t nref_triangles;
+    size_t ninput_triangles;
+
+    /** An upper limit on the memory allocated at any one time, in
+        bytes, including the sorted copies of the coordinate lists
+        made by xyxymatch */
+    size_t peak_bytes;
+
+    /** The approximate number of elementary steps, mostly triangles
+        built, sorted and compared.  It is proportional to the run
+        time, to within a factor that depends on the machine and on
+        the data. */
+    double cost;
+} triangles_estimate_t;
+
+/**
+Estimate the memory and time match_triangles needs, without
+allocating anything.
+
+The number of triangles grows with the cube of nmatch, so a large
+nmatch can allocate many gigabytes.  The estimate is an upper limit:
+it assumes every triangle survives the maxratio cut and every
+triangle of the shorter list matches.
+
+@param nref The number of reference coordinates
+
+@param ninput The number of input coordinates
+
+@param nmatch The maximum number of coordinates of each list used,
+as passed to match_triangles
+
+@param maxratio As passed to match_triangles.  It is only checked,
+since the triangles are allocated before they are cut.
+
+@param estimate The estimate
+
+@param error
+*/
+int
+estimate_triangles(
+        const size_t nref,
+        const size_t ninput,
+        const size_t nmatch,
+        const double maxratio,
+        triangles_estimate_t* const estimate,
+        stimage_error_t* const error);
+
+/**
+Find the largest nmatch, no larger than the one given, whose
+estimate_triangles peak_bytes is within memory_limit.
+
+@param nref, ninput, nmatch, maxratio As for estimate_triangles
+
+@param memory_limit The memory budget, in bytes.  0 means no limit.
+
+@param nmatch_limited On output, the limited nmatch
+
+@param error Set if even triangles of 3 coordinates do not fit
+*/
+int
+limit_triangles_nmatch(
+        const size_t nref,
+        const size_t ninput,
+        const size_t nmatch,
+        const double maxratio,
+        const size_t memory_limit,
+        size_t* const nmatch_limited,
+        stimage_error_t* const error);
+
 /********************************************************************************
 BELOW IS THE SECONDARY API -- SUBJECT TO CHANGE
 ********************************************************************************/
@@ -155,6 +385,14 @@ typedef struct {
     const triangle_t* r;
 } triangle_match_t;
 
+/**
+Indices of a matching pair of triangles in two triangle tables.
+*/
+typedef struct {
+    size_t l;
+    size_t r;
+} triangle_table_match_t;
+
 /**
 Compute the number of possible triangles given the number of
 coordinates.
@@ -166,6 +404,54 @@ max_num_triangles(
         size_t* num_triangles,
         stimage_error_t* const error);
 
+/**
+Choose the coordinates that triangles are built from.
+
+Taking every n'th coordinate of the sorted list, as
+triangles_select_sample does, picks stars from a set of horizontal
+strips, and a small nmatch then often has few stars in common between
+the two lists.  Choosing the brightest stars, or spreading the choice
+over the whole field, makes it much more likely that they overlap.
+
+@param ncoords The number of coordinates in coords
+
+@param coords A list of pointers to coordinates, sorted with xysort.
+
+@param base The array the coordinates point into, used to look up
+their weights.
+
+@param weights The weights of the coordinates in base, or NULL.  NaN
+weights are taken last.
+
+@param select The selection strategy.  triangles_select_brightest
+requires weights.  With triangles_select_sample, all the coordinates
+are returned, and find_triangles does the subsampling.
+
+@param nselect The maximum number of coordinates to choose
+
+@param nselected On output, the number of coordinates chosen
+
+@param selected An array of ncoords pointers to store the chosen
+coordinates.  They are kept in the order of coords.
+
+@param workspace Optional workspace for the scratch memory.  May be
+NULL.
+
+@param error
+*/
+int
+select_triangle_points(
+        const size_t ncoords,
+        const coord_t* const * const coords,
+        const coord_t* const base,
+        const double* const weights,
+        const triangles_select_e select,
+        const size_t nselect,
+        size_t* const nselected,
+        const coord_t** const selected,
+        workspace_t* const workspace,
+        stimage_error_t* const error);
+
 /**
 Construct all possible triangles from an input coordinate list.
 
@@ -207,6 +493,154 @@ find_triangles(
         const double maxratio,
         stimage_error_t* const error);
 
+/**
+Initialize an empty triangle table.  It must be freed with
+triangle_table_free.
+*/
+void
+triangle_table_init(
+        triangle_table_t* const table);
+
+/**
+Free the arrays of a triangle table.  Arrays allocated from a
+workspace are left to it.
+*/
+void
+triangle_table_free(
+        triangle_table_t* const table);
+
+/**
+Make room for at least ntriangles triangles in a triangle table,
+keeping the ones it already has.
+*/
+int
+triangle_table_reserve(
+        triangle_table_t* const table,
+        const size_t ntriangles,
+        stimage_error_t* const error);
+
+/**
+Fill in a triangle_t from a row of a triangle table.
+
+@param table The triangle table
+
+@param i The index of the triangle in the table
+
+@param coords The coordinate list the table was built from
+
+@param tri The triangle to fill in
+*/
+void
+triangle_table_get(
+        const triangle_table_t* const table,
+        const size_t i,
+        const coord_t* const * const coords,
+        triangle_t* const tri);
+
+/**
+Construct all possible triangles from an input coordinate list into a
+triangle table.  This takes the same arguments and builds the same
+triangles as find_triangles, except that the table is allocated as
+needed.
+
+@param ncoords The number of coordinates in the coordinate list
+
+@param coords A list of pointers to coordinates.  It is assumed that
+these coordinates have already been sorted with xysort and culled with
+xycoincide.  The vertices in the table are indices into this list.
+
+@param maxnpoints The maximum number of points.
+
+@param tolerance Triangles with vertices closer than tolerance are
+rejected.
+
+@param maxratio Triangles with a ratio of longest side to shortest
+side greater than maxratio are rejected.
+
+@param nthreads The number of threads.  0 means one per processor.
+Each thread builds the triangles of some of the coordinates into its
+own part of the table, and the parts are put together in order before
+the table is sorted by ratio, so the table does not depend on the
+number of threads.
+
+@param table A triangle table initialized with triangle_table_init.
+Any triangles it contains are replaced.
+
+@param error
+*/
+int
+find_triangle_table(
+        const size_t ncoords,
+        const coord_t* const * const coords,
+        const size_t maxnpoints,
+        const double tolerance,
+        const double maxratio,
+        const size_t nthreads,
+        triangle_table_t* const table,
+        stimage_error_t* const error);
+
+/**
+Build the reference triangles that match_triangles builds with
+triangles_select_sample, so that they can be built once for a
+reference list that is matched many times and passed to
+match_triangles as ref_table.
+
+@param nref_unique The number of coordinates in ref_sorted
+
+@param ref_sorted Pointers to the reference coordinates, sorted with
+xysort and culled with xycoincide, as passed to match_triangles.
+
+@param nmatch, tolerance, maxratio As passed to match_triangles.
+
+@param nthreads The number of threads.  0 means one per processor.
+
+@param table A triangle table initialized with triangle_table_init.
+Its arrays come from table->workspace, and it must be freed with
+triangle_table_free.
+
+@param error
+*/
+int
+find_reference_triangle_table(
+        const size_t nref_unique,
+        const coord_t* const * const ref_sorted,
+        const size_t nmatch,
+        const double tolerance,
+        const double maxratio,
+        const size_t nthreads,
+        triangle_table_t* const table,
+        stimage_error_t* const error);
+
+/**
+Compute the intersection of two triangle tables sorted by ratio, in
+the same way as merge_triangles.
+
+@param r_table The table with the fewer triangles
+
+@param l_table The other table
+
+@param nthreads The number of threads.  0 means one per processor.
+The triangles of r_table are split into ranges of ratio that are
+merged in parallel, and the matches of the ranges are concatenated in
+order, so the result does not depend on the number of threads.
+
+@param nmatches On input: The number of matches allocated, which must
+be at least the number of triangles in r_table.  On output: The
+number of matches found.
+
+@param matches An array to store the indices of the match pairs.
+
+@param error
+*/
+int
+merge_triangle_tables(
+        const triangle_table_t* const r_table,
+        const triangle_table_t* const l_table,
+        const size_t nthreads,
+        size_t* nmatches,
+        triangle_table_match_t* const matches,
+        stimage_error_t* const error);
+
 /**
 Compute the intersection of the two sorted lists of triangles using
 the ratio tolerance parameter.
@@ -245,6 +679,9 @@ Remove false matches from the list of matched triangles.
 
 @param nreject The number of rejection iterations to perform
 
+@param workspace Optional workspace for the scratch memory.  May be
+NULL.
+
 @param error
 */
 int
@@ -252,6 +689,7 @@ reject_triangles(
         size_t* nmatches,
         triangle_match_t* const matches,
         const size_t nreject,
+        workspace_t* const workspace,
         stimage_error_t* error);
 
 /**
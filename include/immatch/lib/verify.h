@@ -0,0 +1,189 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#ifndef _STIMAGE_VERIFY_H_
+#define _STIMAGE_VERIFY_H_
+
+#include "lib/util.h"
+
+/**
+A similarity transformation, possibly with a flip: the point (x,
+parity * y) is rotated and scaled by the complex number (a, b) and
+shifted by (tx, ty).
+*/
+typedef struct {
+    double a;
+    double b;
+    double tx;
+    double ty;
+    double parity;
+} similarity_t;
+
+/**
+Apply a similarity transformation to a coordinate.
+*/
+static inline void
+similarity_apply(
+        const similarity_t* const t,
+        const coord_t* const in,
+        coord_t* const out) {
+
+    const double y = t->parity * in->y;
+
+    out->x = t->a * in->x - t->b * y + t->tx;
+    out->y = t->b * in->x + t->a * y + t->ty;
+}
+
+/**
+Compute the similarity transformation that maps two input coordinates
+onto two reference coordinates.
+
+@param input0, input1 The input coordinates
+
+@param ref0, ref1 The reference coordinates they map to
+
+@param parity 1.0, or -1.0 to flip the input y axis first
+
+@param t The output transformation
+
+@return Zero if the input coordinates coincide and there is no
+solution.
+*/
+int
+similarity_from_pairs(
+        const coord_t* const input0,
+        const coord_t* const input1,
+        const coord_t* const ref0,
+        const coord_t* const ref1,
+        const double parity,
+        similarity_t* const t);
+
+/**
+Least-squares fit of a similarity transformation to a set of matched
+coordinate pairs.  The parity of t is kept.  t is left unchanged if
+there are fewer than two pairs.
+
+@param npairs The number of pairs
+
+@param pairs The pairs: l is the reference coordinate and r the input
+coordinate.
+
+@param t On input, the parity to use.  On output, the transformation.
+*/
+void
+similarity_fit(
+        const size_t npairs,
+        const coord_match_t* const pairs,
+        similarity_t* const t);
+
+/**
+An index of reference coordinates for checking hypothetical
+transformations against.
+*/
+typedef struct {
+    /** The coordinates, sorted with xysort (not owned by the index) */
+    size_t                 ncoords;
+    const coord_t* const * coords;
+
+    /** The number of coordinates per unit area, used to estimate the
+        number of chance matches */
+    double                 density;
+} verify_index_t;
+
+/**
+Initialize a verification index.
+
+@param index The index to initialize.  It holds no memory of its own.
+
+@param ncoords The number of coordinates
+
+@param coords An array of pointers to coordinates, sorted with xysort.
+It must remain valid for the life of the index.
+
+@param tolerance The matching tolerance.
+*/
+void
+verify_index_init(
+        verify_index_t* const index,
+        const size_t ncoords,
+        const coord_t* const * const coords,
+        const double tolerance);
+
+/**
+Count the input coordinates that a transformation moves to within
+tolerance of a reference coordinate.
+
+@param index The reference coordinates
+
+@param ninput The number of input coordinates
+
+@param input An array of pointers to input coordinates
+
+@param stride Only every stride'th input coordinate is checked
+
+@param t The transformation
+
+@param tolerance The matching tolerance
+
+@param pairs If not NULL, the matched pairs are stored here: l is the
+nearest reference coordinate and r the input coordinate.  Must have
+room for ninput / stride + 1 pairs.
+
+@return The number of matches
+*/
+size_t
+verify_count_matches(
+        const verify_index_t* const index,
+        const size_t ninput,
+        const coord_t* const * const input,
+        const size_t stride,
+        const similarity_t* const t,
+        const double tolerance,
+        coord_match_t* const pairs);
+
+/**
+Determine whether a transformation is correct, i.e. whether it
+matches far more input coordinates to reference coordinates than
+would be expected by chance.  A small sample of the input coordinates
+is checked first, so that wrong transformations are rejected quickly,
+and only then the whole list.
+
+@return Non-zero if the transformation is accepted.
+*/
+int
+verify_similarity(
+        const verify_index_t* const index,
+        const size_t ninput,
+        const coord_t* const * const input,
+        const similarity_t* const t,
+        const double tolerance);
+
+#endif /* _STIMAGE_VERIFY_H_ */
@@ -33,6 +33,7 @@ DAMAGE.
 #define _STIMAGE_XYXYMATCH_H_
 
 #include "lib/util.h"
+#include "immatch/lib/triangles.h"
 
 typedef struct {
     coord_t coord;
@@ -44,9 +45,99 @@ typedef struct {
 typedef enum {
     xyxymatch_algo_tolerance,
     xyxymatch_algo_triangles,
+    xyxymatch_algo_offsets,
+    xyxymatch_algo_quads,
     xyxymatch_algo_LAST
 } xyxymatch_algo_e;
 
+/**
+A reference coordinate list prepared for xyxymatch by
+xyxymatch_prepare_ref, so that a list matched many times is sorted and
+culled only once.  It holds indices rather than pointers, so that it
+can be kept in memory shared between processes, where the coordinates
+may be mapped at a different address in each.
+*/
+typedef struct {
+    /** The separation the coordinates were culled with */
+    double separation;
+
+    /** The number of coordinates left after culling */
+    size_t nunique;
+
+    /** The indices into the reference coordinates of those left, in
+        the order given by xysort */
+    const size_t* index; /*[nunique]*/
+
+    /** Reference triangles built by xyxymatch_ref_triangles, or NULL.
+        They are used by xyxymatch_algo_triangles when nmatch,
+        tolerance and maxratio are the same as below, select is
+        triangles_select_sample and adaptive is zero. */
+    const triangle_table_t* triangles;
+
+    /** The parameters the triangles were built with */
+    size_t nmatch;
+    double tolerance;
+    double maxratio;
+} xyxymatch_ref_t;
+
+/**
+Sort a reference coordinate list and remove the coordinates closer
+together than separation, as xyxymatch does.
+
+@param nref The number of reference coordinates
+
+@param ref Array of reference coordinates
+
+@param separation As passed to xyxymatch
+
+@param nunique Output: The number of coordinates left
+
+@param index Output: The indices into ref of the coordinates left, in
+sorted order.  Must have room for nref indices.
+
+@param error
+
+@return Non-zero on error
+*/
+int
+xyxymatch_prepare_ref(
+    const size_t nref, const coord_t* const ref /*[nref]*/,
+    const double separation,
+    size_t* const nunique,
+    size_t* const index /*[nref]*/,
+    stimage_error_t* const error);
+
+/**
+Build the reference triangles of a prepared reference list, for the
+triangles member of xyxymatch_ref_t.
+
+@param nref The number of reference coordinates
+
+@param ref Array of reference coordinates
+
+@param prepared The list prepared by xyxymatch_prepare_ref.  Its
+triangles member is not used.
+
+@param nmatch, tolerance, maxratio, nthreads As passed to xyxymatch
+
+@param table A triangle table initialized with triangle_table_init,
+which must be freed with triangle_table_free.
+
+@param error
+
+@return Non-zero on error
+*/
+int
+xyxymatch_ref_triangles(
+    const size_t nref, const coord_t* const ref /*[nref]*/,
+    const xyxymatch_ref_t* const prepared,
+    const size_t nmatch,
+    const double tolerance,
+    const double maxratio,
+    const size_t nthreads,
+    triangle_table_t* const table,
+    stimage_error_t* const error);
+
 /**
 xyxymatch
 
@@ -114,6 +205,34 @@ xyxymatch
       the x and y axes, and higher order distortion terms in the
       coordinate transformation.
 
+    - xyxymatch_algo_offsets: A linear transformation is applied to
+      the input coordinate list, the transformed input list and the
+      reference list are sorted, points which are too close together
+      are removed, and the displacements between all input and
+      reference coordinates within search_radius of each other are
+      histogrammed.  The peak of the histogram gives the shift between
+      the two lists, which are then matched with the tolerance
+      algorithm.  If max_rotation or max_scale are given, a coarse
+      grid of rotations and scales is searched as well.  The offsets
+      algorithm does not require tie points, and uses all of the
+      coordinates rather than nmatch of them.  It works best when the
+      transformation, after the initial linear transformation, is
+      mostly a shift.
+
+    - xyxymatch_algo_quads: A linear transformation is applied to the
+      input coordinate list, the transformed input list and the
+      reference list are sorted, points which are too close together
+      are removed, and groups of four nearby stars in each list are
+      matched by their geometric hash codes, which do not depend on
+      shifts, rotations, magnification or axis flips.  Each pair of
+      matching quads gives a transformation, which is verified
+      against the whole lists, and the first one that matches far
+      more coordinates than expected by chance is used to match the
+      lists with the tolerance algorithm.  The quads algorithm does
+      not require prior knowledge of the linear transformation, and
+      works with lists of thousands of coordinates, which are too
+      large for the triangles algorithm.
+
 @param tolerance The matching tolerance in pixels.
 
 @param separation The minimum separation for objects in the input and
@@ -137,6 +256,62 @@ set higher than 10.0 but may be set as low as 5.0.
 @param nreject The maximum number of rejection iterations for the
 triangles pattern matching algorithm.
 
+@param tile_size The width and height of the spatial tiles used by
+the xyxymatch_algo_tolerance algorithm when matching in parallel.  If
+<= 0, a size is chosen automatically.  See match_tolerance_tiled.
+
+@param nthreads The number of threads used by the
+xyxymatch_algo_tolerance algorithm, and to build and merge the
+triangles of the xyxymatch_algo_triangles algorithm.  0 means one per
+processor.  When nthreads is 1 and tile_size <= 0, the lists are
+matched by xyxymatch_algo_tolerance in a single pass.  The results are
+the same in all cases.
+
+@param search_radius The maximum shift searched for by the
+xyxymatch_algo_offsets algorithm.  If <= 0, shifts up to the extent of
+the lists are searched for, but no more than 511.5 * tolerance, the
+largest radius whose histogram bins are tolerance wide.
+
+@param max_rotation The maximum rotation, in degrees, searched for by
+the xyxymatch_algo_offsets algorithm.
+
+@param max_scale The maximum fractional scale change searched for by
+the xyxymatch_algo_offsets algorithm.
+
+@param verify How the xyxymatch_algo_triangles algorithm turns matched
+triangles into matched coordinates: by iterative rejection
+(triangles_verify_reject) or by verifying the transformation given by
+each triangle match in turn against the whole lists
+(triangles_verify_ransac).  See match_triangles.
+
+@param select How the xyxymatch_algo_triangles algorithm chooses the
+at most nmatch coordinates of each list to build triangles from: every
+n'th coordinate in sorted order (triangles_select_sample), those with
+the largest weights (triangles_select_brightest), or spread evenly
+over the field (triangles_select_grid).  See select_triangle_points.
+
+@param input_weights, ref_weights Weights, such as fluxes, for the
+input and reference coordinates, used by the select strategies.
+Larger weights are preferred.  Either may be NULL.
+
+@param adaptive If non-zero, the xyxymatch_algo_triangles algorithm
+starts with a few coordinates and doubles the number until a stable
+match is found, using nmatch only as an upper limit.  See
+match_triangles.
+
+@param memory_limit If non-zero, the memory, in bytes, the
+xyxymatch_algo_triangles algorithm may use.  nmatch is lowered as far
+as needed to keep the estimate_triangles peak within it, and an error
+is returned if even the smallest nmatch does not fit.
+
+@param prepared Optional reference list prepared beforehand by
+xyxymatch_prepare_ref for the same ref and separation, which is used
+instead of sorting and culling ref again.  May be NULL.
+
+@param workspace Optional workspace for the scratch memory of the
+match.  Passing the same workspace to repeated calls lets them reuse
+the memory grown by the first one.  May be NULL.
+
 @return Non-zero on error
  */
 int
@@ -154,6 +329,19 @@ xyxymatch(
     const size_t nmatch,
     const double maxratio,
     const size_t nreject,
+    const double tile_size,
+    const size_t nthreads,
+    const double search_radius,
+    const double max_rotation,
+    const double max_scale,
+    const triangles_verify_e verify,
+    const triangles_select_e select,
+    const double* const input_weights, /*[ninput]*/
+    const double* const ref_weights, /*[nref]*/
+    const int adaptive,
+    const size_t memory_limit,
+    const xyxymatch_ref_t* const prepared,
+    workspace_t* const workspace,
     stimage_error_t* const error);
 
 #endif /* _STIMAGE_XYXYMATCH_H_ */
@@ -0,0 +1,89 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#ifndef _STIMAGE_PARALLEL_H_
+#define _STIMAGE_PARALLEL_H_
+
+#include "lib/util.h"
+
+/**
+A task run by parallel_for.
+
+@param data User data passed to parallel_for
+
+@param task The task number, in the range [0, ntasks)
+
+@param error Error object private to the thread running the task
+
+@return Non-zero on error
+*/
+typedef int (*parallel_task_t)(
+        void* data,
+        const size_t task,
+        stimage_error_t* const error);
+
+/**
+Returns the number of threads to use when the user asks for the
+default (nthreads == 0), which is the number of online processors.
+*/
+size_t
+parallel_default_nthreads(void);
+
+/**
+Run the tasks [0, ntasks) on up to nthreads threads.  Tasks are
+handed out dynamically, so they must not depend on each other or on
+the order in which they are run.  If threads are not available on the
+platform, or nthreads or ntasks is 1, the tasks are run serially in
+the calling thread.
+
+@param nthreads The maximum number of threads.  0 means use
+parallel_default_nthreads().
+
+@param ntasks The number of tasks
+
+@param task The function to run for each task
+
+@param data User data passed to each task
+
+@param error If any task fails, the message of the failed task with
+the lowest task number, so errors are reproducible.
+
+@return Non-zero if any task failed
+*/
+int
+parallel_for(
+        size_t nthreads,
+        const size_t ntasks,
+        parallel_task_t task,
+        void* data,
+        stimage_error_t* const error);
+
+#endif /* _STIMAGE_PARALLEL_H_ */
@@ -0,0 +1,168 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#ifndef _STIMAGE_PROJECTION_H_
+#define _STIMAGE_PROJECTION_H_
+
+#include "lib/util.h"
+
+typedef enum {
+    geomap_proj_none,
+    geomap_proj_lin,
+    geomap_proj_azp,
+    geomap_proj_tan,
+    geomap_proj_sin,
+    geomap_proj_stg,
+    geomap_proj_arc,
+    geomap_proj_zpn,
+    geomap_proj_zea,
+    geomap_proj_air,
+    geomap_proj_cyp,
+    geomap_proj_car,
+    geomap_proj_mer,
+    geomap_proj_cea,
+    geomap_proj_cop,
+    geomap_proj_cod,
+    geomap_proj_coe,
+    geomap_proj_coo,
+    geomap_proj_bon,
+    geomap_proj_pco,
+    geomap_proj_gls,
+    geomap_proj_par,
+    geomap_proj_ait,
+    geomap_proj_mol,
+    geomap_proj_csc,
+    geomap_proj_qsc,
+    geomap_proj_tsc,
+    geomap_proj_tnx,
+    geomap_proj_zpx,
+    geomap_proj_LAST
+} geomap_proj_e;
+
+/**
+Returns non-zero if the given projection is implemented by
+project_coords and deproject_coords.  geomap_proj_none and
+geomap_proj_lin are supported, and are the identity transformation.
+The zenithal projections geomap_proj_tan, geomap_proj_sin,
+geomap_proj_stg, geomap_proj_arc and geomap_proj_zea are supported.
+*/
+int
+projection_is_supported(
+        const geomap_proj_e projection);
+
+/**
+Returns non-zero if the projection actually transforms coordinates,
+i.e. it is not geomap_proj_none or geomap_proj_lin.
+*/
+int
+projection_is_celestial(
+        const geomap_proj_e projection);
+
+/**
+Compute a reference point for a projection from a list of celestial
+coordinates.  The mean is computed on the unit sphere, so lists
+straddling RA = 0 are handled correctly.
+
+@param ncoords The number of coordinates
+
+@param sky The celestial coordinates (RA, Dec) in degrees
+
+@param refpt The output reference point (RA, Dec) in degrees
+*/
+void
+compute_sky_refpt(
+        const size_t ncoords,
+        const coord_t* const sky, /* [ncoords] */
+        coord_t* const refpt);
+
+/**
+Project celestial coordinates onto the plane of the sky.
+
+The projection is a zenithal projection with the native pole at the
+reference point, following Calabretta & Greisen (2002), A&A 395,
+1077.  The projection plane coordinates (xi, eta) are in degrees,
+with xi increasing towards the east and eta towards the north.
+
+@param projection The projection to use
+
+@param refpt The tangent point (RA, Dec) in degrees
+
+@param ncoords The number of coordinates
+
+@param sky Celestial coordinates (RA, Dec) in degrees
+
+@param plane Output projection plane coordinates (xi, eta) in
+degrees.  May be the same pointer as sky.
+
+@param error
+
+@return Non-zero on error.  It is an error if a coordinate lies
+outside of the domain of the projection, for example more than 90
+degrees from the tangent point for geomap_proj_tan.
+*/
+int
+project_coords(
+        const geomap_proj_e projection,
+        const coord_t* const refpt,
+        const size_t ncoords,
+        const coord_t* const sky, /* [ncoords] */
+        coord_t* const plane, /* [ncoords] */
+        stimage_error_t* const error);
+
+/**
+Convert projection plane coordinates back to celestial coordinates.
+This is the inverse of project_coords.
+
+@param projection The projection to use
+
+@param refpt The tangent point (RA, Dec) in degrees
+
+@param ncoords The number of coordinates
+
+@param plane Projection plane coordinates (xi, eta) in degrees
+
+@param sky Output celestial coordinates (RA, Dec) in degrees, with
+RA in the range [0, 360).  May be the same pointer as plane.
+
+@param error
+
+@return Non-zero on error
+*/
+int
+deproject_coords(
+        const geomap_proj_e projection,
+        const coord_t* const refpt,
+        const size_t ncoords,
+        const coord_t* const plane, /* [ncoords] */
+        coord_t* const sky, /* [ncoords] */
+        stimage_error_t* const error);
+
+#endif /* _STIMAGE_PROJECTION_H_ */
@@ -0,0 +1,135 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#ifndef _STIMAGE_WORKSPACE_H_
+#define _STIMAGE_WORKSPACE_H_
+
+#include "lib/util.h"
+
+/**
+A workspace is an arena for the scratch memory of a single call.
+Allocations are carved out of large blocks and are never freed
+individually; instead the whole arena is rewound when the call
+returns.  Keeping a workspace around between calls means the blocks
+grown by the first call are reused by the next ones, so repeated
+calls on similarly-sized inputs do not touch the system allocator at
+all.
+
+A workspace is not thread-safe: it must only be used by one call at a
+time, and only from the calling thread.
+
+Every function that takes a workspace also accepts NULL, in which
+case workspace_alloc and workspace_release fall back to malloc and
+free.
+*/
+
+typedef struct workspace_block_t workspace_block_t;
+
+typedef struct {
+    workspace_block_t* first;
+    workspace_block_t* current;
+    size_t             used;
+    size_t             nsystem_allocs;
+} workspace_t;
+
+/**
+A position in a workspace, returned by workspace_mark.
+*/
+typedef struct {
+    workspace_block_t* block;
+    size_t             used;
+} workspace_mark_t;
+
+/**
+Initialize an empty workspace.  No memory is allocated until the
+first call to workspace_alloc.
+*/
+void
+workspace_init(
+        workspace_t* const workspace);
+
+/**
+Free all of the memory held by the workspace.  Any memory returned by
+workspace_alloc becomes invalid.
+*/
+void
+workspace_free(
+        workspace_t* const workspace);
+
+/**
+Allocate memory from the workspace.  The memory is suitably aligned
+for any of the types used by stimage.
+
+@param workspace The workspace.  If NULL, the memory is allocated with
+malloc and must be freed with workspace_release (or free).
+
+@param size The number of bytes to allocate
+
+@return A pointer to the memory, or NULL on error
+*/
+void*
+workspace_alloc(
+        workspace_t* const workspace,
+        const size_t size,
+        stimage_error_t* const error);
+
+/**
+Release memory obtained from workspace_alloc.  When workspace is NULL
+this frees the memory, otherwise it does nothing, since workspace
+memory is reclaimed by workspace_rewind.
+*/
+void
+workspace_release(
+        workspace_t* const workspace,
+        void* const p);
+
+/**
+Get the current position of the workspace, so the memory allocated
+after it can later be reclaimed with workspace_rewind.  If workspace
+is NULL, the returned mark is ignored by workspace_rewind.
+*/
+workspace_mark_t
+workspace_mark(
+        const workspace_t* const workspace);
+
+/**
+Reclaim all of the memory allocated since mark was taken.  The blocks
+are kept for later allocations.  When the workspace is rewound to its
+very beginning, and the previous call needed more than one block, the
+blocks are replaced by a single block large enough for the whole
+call, so that the next call of the same size needs no allocation.
+*/
+void
+workspace_rewind(
+        workspace_t* const workspace,
+        const workspace_mark_t mark);
+
+#endif /* _STIMAGE_WORKSPACE_H_ */
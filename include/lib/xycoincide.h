@@ -61,4 +61,57 @@ xycoincide(
     const coord_t** const  output, /*[ncoords]*/
     const double tolerance);
 
+/* The sliding window of xycoincide compares each coordinate with the
+   ones in the row of height tolerance above it, so its cost is the
+   number of coordinates times the number per row, while the hashing
+   of xycoincide_grid costs about the same for each coordinate.  The
+   number per row, n * tolerance / (ymax - ymin) for uniform
+   coordinates, is the measure that sets the crossover.  For uniform
+   coordinates in 1024 to 16384 pixel fields, with tolerances of 1 to
+   20 pixels, the grid is faster from 40 to 200 coordinates per row,
+   depending on how crowded the field is: with a tolerance of 9 in a
+   4096 pixel field it wins from 2e4 coordinates (1.7x faster at 9e4),
+   while with a tolerance of 1 it only wins from 8e5.  Switching at
+   160 keeps every run longer than 10 ms within 1.25x of the faster
+   of the two.  Sorted lists with fewer coordinates per row than this
+   should use xycoincide. */
+#define XYCOINCIDE_GRID_MIN_ROW 160.0
+
+/**
+Removes coordinates from the list that are too close together, as
+given by tolerance, using a hash grid with a cell size equal to the
+tolerance.  This runs in expected O(n) time and does not require the
+coordinates to be sorted.
+
+Coordinates are visited in the order given, and each coordinate is
+removed if it lies within tolerance of an earlier coordinate that was
+kept.  When the input has been sorted with xysort, the result is
+identical to xycoincide.  Coordinates that are not finite are always
+kept.
+
+@param coords The number of coordinates
+
+@param input A list of pointers to coordinates
+
+@param output A list of pointers to coordinates with all coordinates
+too close to other coordinates removed.  May be the same pointer as
+input, otherwise must be the same buffer size as input.
+
+@param tolerance The coincidence tolerance.
+
+@param nunique The number of coordinates remaining in output.
+
+@param error
+
+@return Non-zero on error
+ */
+int
+xycoincide_grid(
+    const size_t ncoords,
+    const coord_t* const * input, /*[ncoords]*/
+    const coord_t** const  output, /*[ncoords]*/
+    const double tolerance,
+    size_t* const nunique,
+    stimage_error_t* const error);
+
 #endif /* _STIMAGE_XYCOINCIDE_H_ */
@@ -56,4 +56,34 @@ xysort(
     const coord_t* const coords, /* [ncoords] */
     const coord_t** const coord_ptr /* [ncoords] */);
 
+/**
+Sorts coordinates by (y, x), returning the sorted order as indices
+into coords.  This is a radix sort, so it runs in O(n) time.  Ties
+are left in index order, so the result is fully deterministic.  The
+pointer array filled in by xysort can be built from the result as
+coords + index[i].
+
+xysort uses this internally for all but small arrays.
+
+@param ncoords The number of coordinates in the input array
+
+@param coords Input array
+
+@param index Output array of indices into coords, sorted
+
+@param nthreads The number of threads to use for large arrays.  0
+means use one thread per processor.
+
+@param error
+
+@return Non-zero on error
+ */
+int
+xysort_index(
+    const size_t ncoords,
+    const coord_t* const coords, /* [ncoords] */
+    size_t* const index, /* [ncoords] */
+    size_t nthreads,
+    stimage_error_t* const error);
+
 #endif /* _STIMAGE_XYSORT_H_ */
@@ -37,6 +37,7 @@ DAMAGE.
 #ifndef _STIMAGE_SURFACE_FIT_H_
 #define _STIMAGE_SURFACE_FIT_H_
 
+#include "lib/workspace.h"
 #include "surface/surface.h"
 
 typedef enum {
@@ -78,6 +79,9 @@ used to solve for the s->ncoeff-vector coeff.
 
 @param weight_type type of weights
 
+@param workspace Optional workspace for the temporary basis arrays.
+May be NULL.
+
 @param error_type
 
 @param error
@@ -90,8 +94,180 @@ surface_fit(
         const double* const z,
         double* const w,
         const surface_fit_weight_e weight_type,
+        workspace_t* const workspace,
         /* Output */
         surface_fit_error_e* const error_type,
         stimage_error_t* const error);
 
+/**
+Evaluate the basis function of each coefficient of a surface at the
+data points.  These are the functions whose inner products
+surface_fit accumulates into the normal equations, so a caller that
+fits the same points many times, with different weights, can compute
+them once.
+
+@param s Surface descriptor, initialized with surface_init
+
+@param ncoord Number of data points
+
+@param coord Data points
+
+@param workspace Optional workspace for the temporary basis arrays.
+May be NULL.
+
+@param basis The basis functions [s->ncoeff, ncoord].  The function
+of coefficient k at point i is basis[k * ncoord + i].
+
+@param error
+
+@return Non-zero on error
+*/
+int
+surface_fit_basis(
+        const surface_t* const s,
+        const size_t ncoord,
+        const coord_t* const coord,
+        workspace_t* const workspace,
+        /* Output */
+        double* const basis,
+        stimage_error_t* const error);
+
+/**
+Compute the inverse of the normal matrix of a fit from its Cholesky
+factorization.  This is the covariance matrix of the coefficients,
+for points whose weights are the inverses of their variances, and is
+otherwise to be scaled by the variance of the residuals.  The rows
+and columns of coefficients that could not be fit because the matrix
+is singular are zero.
+
+@param s Surface descriptor, fit with surface_fit
+
+@param covariance The covariance matrix [s->ncoeff, s->ncoeff]
+
+@param error
+
+@return Non-zero on error
+*/
+int
+surface_fit_covariance(
+        const surface_t* const s,
+        /* Output */
+        double* const covariance,
+        stimage_error_t* const error);
+
+/**
+Find the coefficients of a smaller surface among those of *s*.  The
+basis functions of *sub* are a subset of those of *s* if the surfaces
+have the same type and normalization, and each of the terms of *sub*
+is a term of *s*.  Coefficient k of *sub* then multiplies the same
+basis function as coefficient idx[k] of *s*.
+
+@param s The larger surface, initialized with surface_init
+
+@param sub The smaller surface, initialized with surface_init
+
+@param workspace Optional workspace for the scratch memory.  May be
+NULL.
+
+@param idx The index among the coefficients of *s* of each of the
+coefficients of *sub* [sub->ncoeff]
+
+@param nested Set to non-zero if *sub* is nested in *s*.  *idx* is
+only filled in if it is.
+
+@param error
+
+@return Non-zero on error
+*/
+int
+surface_fit_nested_index(
+        const surface_t* const s,
+        const surface_t* const sub,
+        workspace_t* const workspace,
+        /* Output */
+        size_t* const idx,
+        int* const nested,
+        stimage_error_t* const error);
+
+/**
+The score of one of the surfaces fit by surface_fit_nested.
+*/
+typedef struct {
+    size_t              ncoeff;
+    /* The weighted sum of the squared residuals of the fit */
+    double              chisq;
+    /* The weighted sum of the squared residuals of each point, from
+       the fit to the folds that leave it out.  NaN if there was no
+       cross-validation. */
+    double              cv;
+    surface_fit_error_e error_type;
+} surface_fit_score_t;
+
+/**
+Fit several surfaces of lower order than *s* from a single
+accumulation of the normal equations of *s*.
+
+The basis functions of a surface of lower order, with the same type,
+cross terms and normalization, are a subset of those of *s*, so its
+normal equations are a principal sub-block of those of *s*.  Each
+surface is solved from its sub-block, and its weighted sum of squared
+residuals is found from the normal equations as well, without
+evaluating the surface at the data points.
+
+If *nfolds* is 2 or more, point i is assigned to fold i % nfolds, the
+normal equations are accumulated separately for each fold, and each
+surface is also solved once for every fold, from the others, and
+scored on the points of that fold.  This k-fold cross-validation
+costs a single accumulation as well.
+
+On return, *s* holds the normal equations of all of the points, and
+its own fit.
+
+@param s The largest surface, initialized with surface_init
+
+@param ncoord Number of data points
+
+@param coord Data points
+
+@param z data array
+
+@param w weights array
+
+@param weight_type type of weights
+
+@param nsurfaces The number of surfaces to fit
+
+@param xorders
+@param yorders The orders of the surfaces to fit [nsurfaces].  None
+may be larger than the orders of *s*.
+
+@param nfolds The number of folds of the cross-validation, or 0 for
+none.
+
+@param workspace Optional workspace for the scratch memory.  May be
+NULL.
+
+@param scores The score of each surface [nsurfaces]
+
+@param error
+
+@return Non-zero on error
+*/
+int
+surface_fit_nested(
+        surface_t* const s,
+        const size_t ncoord,
+        const coord_t* const coord,
+        const double* const z,
+        double* const w,
+        const surface_fit_weight_e weight_type,
+        const size_t nsurfaces,
+        const size_t* const xorders,
+        const size_t* const yorders,
+        const size_t nfolds,
+        workspace_t* const workspace,
+        /* Output */
+        surface_fit_score_t* const scores,
+        stimage_error_t* const error);
+
 #endif
@@ -30,6 +30,8 @@
 from __future__ import absolute_import
 from .version import *
 from . import _stimage
+from ._stimage import Matcher, Fitter, GeomapResults
+from .prepared import PreparedReference
 
 def xyxymatch(input,
               ref,
@@ -42,7 +44,18 @@ def xyxymatch(input,
               separation = 9.0,
               nmatch = 30,
               maxratio = 10.0,
-              nreject = 10):
+              nreject = 10,
+              tile_size = 0.0,
+              nthreads = 1,
+              search_radius = 0.0,
+              max_rotation = 0.0,
+              max_scale = 0.0,
+              verify = 'reject',
+              select = 'sample',
+              input_weights = None,
+              ref_weights = None,
+              adaptive = False,
+              memory_limit = 0):
     """
     Match pixels coordinate lists using various methods.
 
@@ -67,8 +80,8 @@ def xyxymatch(input,
        with a minimum separation specified by the parameter separation
        from both lists
 
-    4. matching the two lists using either the "tolerance" or
-       "triangles" algorithm
+    4. matching the two lists using the "tolerance", "triangles",
+       "offsets" or "quads" algorithm
 
     5. storing the matched list to the output array
 
@@ -146,11 +159,106 @@ def xyxymatch(input,
       parameter will increase the ability to deal with distortions but
       will also produce more false matches.
 
+      If *verify* is "ransac", the rejection and voting steps are
+      replaced by a RANSAC-style search.  The matched triangles are
+      drawn one at a time in a fixed pseudo-random order, and the
+      transformation mapping each input triangle onto its reference
+      triangle is verified against the whole lists in the same way as
+      by the "quads" algorithm.  The search stops at the first
+      transformation that is accepted, which is refined by a
+      least-squares fit and used to match the entire lists with the
+      "tolerance" algorithm.  When most matched triangles are false,
+      as when the lists have few objects in common, this is much
+      faster and more reliable than rejection.
+
+      By default, if a list has more than *nmatch* objects, every
+      n'th object of the list sorted in *y* is used, which picks
+      objects from a set of horizontal strips.  A small *nmatch* then
+      often has few objects in common between the two lists.  If
+      *select* is "brightest", the *nmatch* objects with the largest
+      *input_weights* and *ref_weights*, such as fluxes, are used
+      instead.  If *select* is "grid", the objects are spread evenly
+      over a grid of cells covering the field, taking the ones with
+      the largest weights first within each cell if weights are
+      given.
+
+      If *adaptive* is True, *nmatch* does not need to be guessed in
+      advance: it is only an upper limit.  The "triangles" algorithm
+      starts with the first few objects of each list, in the order of
+      preference given by *select*, and doubles their number until it
+      finds a match that has kept all the pairs found with fewer
+      objects over two steps in a row (or, with *verify* "ransac",
+      until a transformation is accepted).  The triangles already
+      built are reused at each step, so easy fields are matched with
+      few triangles, and hard ones cost little more than a single
+      call with a large *nmatch*.
+
+      The result differs from that of a fixed *nmatch* with *verify*
+      "reject".  The adaptive search fits a similarity transformation
+      to the voted pairs, and returns the match of the whole lists
+      within *tolerance* under it (or only the voted pairs, if
+      *nmatch* was reached first).  A fixed *nmatch* returns only the
+      voted pairs, among at most *nmatch* objects of each list.
+
+    - If *algorithm* is "offsets", `xyxymatch` computes the
+      displacement between every transformed input coordinate and
+      every reference coordinate within *search_radius* of it, and
+      accumulates the displacements in a histogram of at most 1024
+      bins on a side.  The bins are *tolerance* wide unless
+      *search_radius* is more than about 511 times *tolerance*, when
+      they are made wider, and the peak is then searched for again in
+      histograms of shrinking extent about it, down to bins
+      *tolerance* wide.  The peak is the shift between the two
+      coordinate systems.  The shift is refined by averaging the
+      displacements near the peak, and the shifted input coordinates
+      are matched using the "tolerance" algorithm.
+      If *max_rotation* or *max_scale* are non-zero, the search is
+      repeated over a coarse grid of rotations and scale changes
+      about the center of the input list, and the strongest peak is
+      used.
+
+      Like the "triangles" algorithm, the "offsets" algorithm
+      requires no tie point information, but it uses every object
+      rather than *nmatch* of them, and its cost grows only with the
+      number of reference objects within *search_radius* of each
+      input object.  It is the best choice when the two coordinate
+      systems differ mostly by a shift, or by a shift plus a small
+      rotation or scale change.
+
+    - If *algorithm* is "quads", `xyxymatch` describes each group of
+      four nearby objects (a quad) in both lists by a geometric hash
+      code: the positions of the inner two objects in the frame where
+      the outer two are at (0, 0) and (1, 1).  These codes do not
+      change with shifts, rotations, magnification or axis flips.
+      The reference quads are put into a hash index, and the input
+      quads are looked up in it one at a time.  Each pair of quads
+      with similar codes gives a trial transformation, which is
+      verified by counting how many transformed input objects land
+      within *tolerance* of a reference object, first for a small
+      sample and then for the whole list.  The first transformation
+      that matches far more objects than expected by chance is
+      refined by a least-squares fit to its matches, and the
+      transformed input list is matched using the "tolerance"
+      algorithm.
+
+      Like the "triangles" algorithm, the "quads" algorithm requires
+      no tie point information, but the codes are much more
+      discriminating than triangle shapes, so the right
+      transformation is usually found after examining only a few
+      quads.  It works with all the objects of lists with thousands
+      of objects, where the "triangles" algorithm can only use
+      *nmatch* of them.  It is sensitive to *x* and *y* scale
+      differences and axis skew.  If no transformation is verified,
+      no matches are returned.
+
     **Parameters:**
 
     - *input*: Array of input coordinates. (Must be an Nx2 array).
 
     - *ref*: Array of reference coordinates. (Must be an Nx2 array).
+      Or a `PreparedReference`, which has already been sorted and
+      culled with the same *separation*, and may hold the reference
+      triangles of the ``'triangles'`` algorithm.
 
     - *origin*: The origin of the input coordinate system.  Default:
       (0.0, 0.0)
@@ -197,6 +305,22 @@ def xyxymatch(input,
         between the *x* and *y* axes, and higher order distortion
         terms in the coordinate transformation.
 
+      - ``'offsets'``: A linear transformation is applied to the
+        input coordinate list, the transformed input list and the
+        reference list are sorted, points which are too close together
+        are removed, and the shift between the two lists is found as
+        the peak of the histogram of displacements between input and
+        reference coordinates.  The shifted input coordinates are
+        then matched using the ``'tolerance'`` algorithm.
+
+      - ``'quads'``: A linear transformation is applied to the input
+        coordinate list, the transformed input list and the reference
+        list are sorted, points which are too close together are
+        removed, and the transformation between the two lists is found
+        by matching the geometric hash codes of quads of nearby
+        objects.  The transformed input coordinates are then matched
+        using the ``'tolerance'`` algorithm.
+
     - *tolerance*: The matching tolerance in pixels. Default: 1.0
 
     - *separation*: The minimum separation for objects in the input
@@ -222,6 +346,62 @@ def xyxymatch(input,
     - *nreject*: The maximum number of rejection iterations for the
       ``'triangles'`` pattern matching algorithm.  Default: 10
 
+    - *tile_size*: The width and height of the square spatial tiles
+      the reference coordinates are split into when matching with the
+      ``'tolerance'`` algorithm in parallel.  Each tile is matched
+      separately, together with the input coordinates within
+      *tolerance* of it.  If 0, a size is chosen automatically.
+      Default: 0.0
+
+    - *nthreads*: The number of threads used by the ``'tolerance'``
+      algorithm, and to build and merge the triangles of the
+      ``'triangles'`` algorithm.  If 0, one thread per processor is
+      used.  The results do not depend on *nthreads* or *tile_size*.
+      Default: 1
+
+    - *search_radius*: The maximum shift searched for by the
+      ``'offsets'`` algorithm, in pixels.  If 0, shifts up to the
+      extent of the lists are searched for, but no more than 511 times
+      *tolerance*, the largest radius whose histogram bins are
+      *tolerance* wide.  Default: 0.0
+
+    - *max_rotation*: The maximum rotation searched for by the
+      ``'offsets'`` algorithm, in degrees.  Default: 0.0
+
+    - *max_scale*: The maximum fractional scale change searched for
+      by the ``'offsets'`` algorithm, e.g. 0.01 for 1%.  Default: 0.0
+
+    - *verify*: How the ``'triangles'`` algorithm turns matched
+      triangles into matched coordinates: ``'reject'`` for iterative
+      rejection and voting, or ``'ransac'`` to verify the
+      transformation given by each matched triangle in turn and stop
+      at the first one accepted.  Default: ``'reject'``
+
+    - *select*: How the ``'triangles'`` algorithm chooses the at most
+      *nmatch* objects of each list to build triangles from:
+      ``'sample'`` for every n'th object in sorted order,
+      ``'brightest'`` for the objects with the largest weights, or
+      ``'grid'`` to spread them over the field.  Default:
+      ``'sample'``
+
+    - *input_weights*, *ref_weights*: Arrays with one weight per input
+      and reference coordinate, used by *select*.  Larger weights are
+      preferred, so pass fluxes, or negated magnitudes.  Required for
+      ``'brightest'``.  Default: None
+
+    - *adaptive*: If True, the ``'triangles'`` algorithm starts with a
+      few objects and doubles their number until the match is stable,
+      up to *nmatch*.  Default: False
+
+    - *memory_limit*: The memory, in bytes, the ``'triangles'``
+      algorithm may use.  If the *nmatch* given would need more,
+      according to `estimate_triangles`, it is lowered until it fits,
+      and an error is raised if even the smallest *nmatch* does not.
+      If 0, there is no limit.  Default: 0
+
+    C-contiguous ``float64`` arrays, including `numpy.memmap` arrays,
+    are used in place, without being copied.
+
     **Returns**: A structured array containing the output
     information.  It has the following columns:
 
@@ -232,6 +412,11 @@ def xyxymatch(input,
     - *ref_y*
     - *ref_idx*
     """
+    prepared = None
+    if isinstance(ref, PreparedReference):
+        prepared = ref._arguments()
+        ref = ref.ref
+
     return _stimage.xyxymatch(
         input,
         ref,
@@ -244,7 +429,119 @@ def xyxymatch(input,
         separation,
         nmatch,
         maxratio,
-        nreject)
+        nreject,
+        tile_size,
+        nthreads,
+        search_radius,
+        max_rotation,
+        max_scale,
+        verify,
+        select,
+        input_weights,
+        ref_weights,
+        adaptive,
+        memory_limit,
+        prepared)
+
+
+def estimate_triangles(ninput, nref, nmatch = 30, maxratio = 10.0):
+    """
+    Estimate the memory and time the ``'triangles'`` algorithm of
+    `xyxymatch` needs, without running it.
+
+    The number of triangles grows with the cube of *nmatch*, so a
+    large *nmatch* can need many gigabytes.  The estimate is an upper
+    limit, which assumes every triangle is kept and every triangle of
+    the shorter list is matched.
+
+    **Parameters:**
+
+    - *ninput*, *nref*: The number of input and reference
+      coordinates.
+
+    - *nmatch*: The maximum number of coordinates of each list used,
+      as passed to `xyxymatch`.  Default: 30
+
+    - *maxratio*: As passed to `xyxymatch`.  It is only checked,
+      since triangles are allocated before they are cut.  Default:
+      10.0
+
+    **Returns**: A dictionary with the following keys:
+
+    - *ninput_points*, *nref_points*: The number of coordinates of
+      each list triangles are built from.
+
+    - *ninput_triangles*, *nref_triangles*: The maximum number of
+      triangles of each list.
+
+    - *peak_bytes*: An upper limit on the memory in use at any one
+      time, in bytes.
+
+    - *cost*: The approximate number of elementary steps, mostly
+      triangles built, sorted and compared.  It is proportional to
+      the run time.
+    """
+    return _stimage.estimate_triangles(ninput, nref, nmatch, maxratio)
+
+
+def crossmatch_epochs(catalogs,
+                      tolerance = 1.0,
+                      origins = None,
+                      mags = None,
+                      rotations = None,
+                      ref_origins = None):
+    """
+    Cross-match several epochs of the same field at once, assigning a
+    global source ID to every detection.
+
+    Each catalog is first put into a common frame using the linear
+    transformation given by its *origins*, *mags*, *rotations* and
+    *ref_origins* entries, as in `xyxymatch`.  All of the detections
+    are then put in one spatial index, and any two detections within
+    *tolerance* of each other are linked (friends-of-friends).  Each
+    connected group of detections is one source.  This replaces the
+    N*(N-1)/2 pairwise `xyxymatch` calls otherwise needed to build
+    light curves with a single pass.
+
+    Since linking is transitive, detections in the same catalog
+    closer together than *tolerance* are merged into one source.
+
+    **Parameters:**
+
+    - *catalogs*: A sequence of Nx2 arrays of coordinates, one per
+      epoch.
+
+    - *tolerance*: The linking length, in pixels of the common frame.
+      Default: 1.0
+
+    - *origins*: A sequence of (x, y) origins of each catalog's
+      coordinate system, or None.  Default: (0.0, 0.0) for each
+      catalog.
+
+    - *mags*: A sequence of (x, y) scale factors, in common frame
+      pixels per catalog pixel, or None.  Default: (1.0, 1.0)
+
+    - *rotations*: A sequence of (x, y) rotations, in degrees, or
+      None.  Default: (0.0, 0.0)
+
+    - *ref_origins*: A sequence of (x, y) origins of the common frame
+      for each catalog, or None.  Default: (0.0, 0.0)
+
+    Individual entries of the transformation sequences may also be
+    None to use the default.
+
+    **Returns**: A list with one integer array per catalog, giving the
+    source ID of each detection.  Source IDs are numbered from 0 in
+    order of first detection.  Detections with non-finite coordinates
+    each get a source ID of their own.
+    """
+    return _stimage.crossmatch_epochs(
+        catalogs,
+        tolerance,
+        origins,
+        mags,
+        rotations,
+        ref_origins)
 
 
 def geomap(input,
@@ -259,7 +556,21 @@ def geomap(input,
            xxterms="half",
            yxterms="half",
            maxiter=0,
-           reject=0.0):
+           reject=0.0,
+           projection=None,
+           refpt=None,
+           order=None,
+           max_order=5,
+           criterion="bic",
+           nfolds=5,
+           uncertainty=None,
+           nresamples=100,
+           seed=0,
+           nthreads=1,
+           robust=None,
+           robust_tuning=0.0,
+           robust_maxiter=50,
+           robust_tol=1e-4):
     """
     `geomap` computes the transformation required to map the reference
     coordinate system to the input coordinate system.
@@ -525,6 +836,129 @@ def geomap(input,
 
     - *reject* = 3.0: The rejection limit in units of sigma.
 
+    - *projection*: The sky projection used to convert celestial
+      reference coordinates to the projection plane before fitting.
+      When given, *ref* contains (RA, Dec) pairs in degrees and the
+      transformation is computed from the projection plane
+      coordinates, in degrees, to the input coordinate system.  The
+      options are:
+
+      - `None` or "none" (default): *ref* is used as given.
+
+      - "lin": Same as "none".
+
+      - "tan": Gnomonic projection.
+
+      - "sin": Orthographic projection.
+
+      - "stg": Stereographic projection.
+
+      - "arc": Zenithal equidistant projection.
+
+      - "zea": Zenithal equal-area projection.
+
+      *bbox*, *shift*, *mean_ref* and the coefficients all refer to
+      the projection plane coordinates.  The *ref_x* and *ref_y*
+      columns of the output remain in celestial coordinates.
+
+    - *refpt*: The (RA, Dec) of the projection tangent point in
+      degrees.  If `None`, the mean position of the reference
+      coordinates is used.
+
+    - *order*: If "auto" and *fit_geometry* is "general", the orders
+      of the *x* and *y* fits are chosen separately, among the orders
+      from 2 to *max_order* in both *x* and *y*, and *xxorder*,
+      *xyorder*, *yxorder* and *yyorder* are ignored.  The cross
+      terms remain *xxterms* and *yxterms*.  All of the orders are
+      fit from a single accumulation of the normal equations at
+      *max_order*, so choosing costs about as much as one fit at
+      *max_order*.  The orders are chosen before any rejection.  If
+      `None` (default), the given orders are used.
+
+    - *max_order*: The largest order tried when *order* is "auto".
+      Default: 5
+
+    - *criterion*: How the order is chosen when *order* is "auto".
+      The options are:
+
+      - "bic" (default): The smallest Bayesian information
+        criterion.
+
+      - "aic": The smallest Akaike information criterion.
+
+      - "cv": The smallest sum of squared residuals of a *nfolds*-fold
+        cross-validation.
+
+    - *nfolds*: The number of folds of the cross-validation.  Point
+      *i* is held out of fold ``i % nfolds``.  Default: 5
+
+    - *uncertainty*: How the covariance matrices of the coefficients
+      are estimated, from the points left after rejection.  The
+      options are:
+
+      - `None` (default): They are not estimated.
+
+      - "analytic": From the inverse of the normal matrix of the fit,
+        scaled by the variance of the residuals.  The "rotate",
+        "rscale" and "rxyscale" geometries are not linear
+        least-squares fits, and their covariances are NaN.
+
+      - "bootstrap": From the coefficients fit to *nresamples*
+        resamples of the points, drawn with replacement.
+
+      - "jackknife": From the coefficients fit with each of
+        *nresamples* groups of points left out in turn.  Point *k*
+        is in group ``k % nresamples``.
+
+      For the "general" geometry with a distortion surface, which is
+      fit to the residuals of the linear fit, the covariance of the
+      fit is that of the combined surface, and is returned in
+      *x2cov* and *y2cov* (see below).
+
+      For the "xyscale" and "general" geometries, the basis functions
+      of the fit are evaluated once, and each resample only
+      reweights their inner products, so a bootstrap costs about one
+      fit per resample, and a jackknife about one fit in all.
+
+    - *nresamples*: The number of bootstrap resamples, or of
+      jackknife groups.  For a jackknife, 0 leaves out one point at a
+      time.  Default: 100
+
+    - *seed*: The seed of the bootstrap resamples.  Default: 0
+
+    - *nthreads*: The number of threads the resamples are fit on.  If
+      0, one thread per processor is used.  The results do not depend
+      on *nthreads*.  Default: 1
+
+    - *robust*: If not `None`, the fit is iteratively reweighted by a
+      robust weight function of the residuals, instead of rejecting
+      points with *maxiter* and *reject*.  The options are:
+
+      - "huber": Points with residuals larger than *robust_tuning* are
+        weighted down in inverse proportion to their residual.
+
+      - "tukey": The Tukey biweight, which is zero for residuals
+        larger than *robust_tuning*, so that false pairs are rejected
+        rather than only weighted down.
+
+      The x and y residuals of each point are scaled by their median
+      absolute deviations and combined in quadrature.  Each iteration
+      refines the coefficients of the last one and, for the "xyscale"
+      and "general" geometries, only reweights the inner products of
+      basis functions evaluated once, so it costs less than a fit.
+      Points whose weight falls to zero are reported as rejected.
+
+    - *robust_tuning*: The tuning constant of the weight function, in
+      units of the scatter of the residuals.  If 0, 1.345 for "huber"
+      and 4.685 for "tukey".  Default: 0
+
+    - *robust_maxiter*: The largest number of reweighting iterations.
+      Default: 50
+
+    - *robust_tol*: The iterations stop once no fitted value changes
+      by more than *robust_tol* times the scatter of the residuals.
+      Default: 1e-4
+
     **Returns:** A 2-tuple with the following parts:
 
     - `GeomapResults` object, with the following attributes:
@@ -534,6 +968,12 @@ def geomap(input,
 
       - *function* str: The same value as *function* passed to `geomap`.
 
+      - *projection* str: The projection used for the reference
+        coordinates.
+
+      - *refpt* (ra, dec) tuple: The projection tangent point.  NaN
+        if no projection was used.
+
       - *rms* (x, y) tuple: The root-mean-square of the residuals.
 
       - *mean_ref* (x, y) tuple: The mean value of the reference
@@ -560,6 +1000,61 @@ def geomap(input,
       - *y2coeff* double array: The second-order *y* coefficients of
         the fit.
 
+      - *surfaces* 4x7 double array: The surfaces the coefficients
+        belong to, one row each for *xcoeff*, *ycoeff*, *x2coeff*
+        and *y2coeff*, with the columns *xorder*, *yorder*, *xterms*
+        (0 for ``'none'``, 1 for ``'half'``, 2 for ``'full'``),
+        *xrange*, *xmaxmin*, *yrange* and *ymaxmin*.  The last four
+        normalize the coordinates before the surface is evaluated.
+        The row of a second-order surface that was not fit is all
+        zeros.
+
+      - *orders* int array: The orders of the fit, as (*xxorder*,
+        *xyorder*, *yxorder*, *yyorder*).
+
+      - *scores*: A structured array with a record for each order
+        tried when *order* is "auto", and none otherwise.  Its
+        columns are the *order*, the number of coefficients of the
+        *x* and *y* fits (*nxcoeff*, *nycoeff*), and for each fit,
+        with the suffixes ``_x`` and ``_y``, the weighted sum of
+        squared residuals (*chisq*), the information criteria (*aic*,
+        *bic*) and the cross-validated sum of squared residuals
+        (*cv*, NaN unless *criterion* is "cv").
+
+      - *xcov*, *ycov*, *x2cov*, *y2cov* double arrays: The
+        covariance matrices of *xcoeff*, *ycoeff*, *x2coeff* and
+        *y2coeff*, as estimated by *uncertainty*.  Empty if
+        *uncertainty* is `None`.  The standard errors of the
+        coefficients are the square roots of their diagonals.
+
+        For the "general" geometry with a distortion surface, *x2cov*
+        and *y2cov* are instead the covariances of the combined
+        surfaces: *x2coeff* with *xcoeff* added to its constant and
+        linear terms (and likewise for *y*), which are the
+        coefficients of a single fit of the higher order.  *xcov* and
+        *ycov* are then propagated from them through the linear fit,
+        so they are the covariances of refits of the same points with
+        new errors.  Both are NaN if the distortion surface does not
+        have the constant and linear terms.
+
+      - *resamples* double array: The coefficients fit to each
+        bootstrap or jackknife resample, one row each, with the
+        values of *xcoeff*, *ycoeff*, *x2coeff* and *y2coeff* in that
+        order.  A resample that could not be fit is NaN and is left
+        out of the covariances.  Empty unless *uncertainty* is
+        "bootstrap" or "jackknife".
+
+      - *niter* int: The number of rejection or reweighting
+        iterations.
+
+      - *weights* double array: The weight of each point in the fit:
+        1, or 0 if it was rejected, or its weight in a *robust* fit.
+
+      The ``evaluate(ref)`` method of the object evaluates the fit
+      at other reference coordinates, without fitting again.  The
+      object can be pickled, and saved in bulk with
+      `stsci.stimage.solutions.Solutions`.
+
     - A Numpy structured array with the following columns:
 
       - *input_x*
@@ -584,4 +1079,62 @@ def geomap(input,
         xxterms,
         yxterms,
         maxiter,
-        reject)
+        reject,
+        projection,
+        refpt,
+        order,
+        max_order,
+        criterion,
+        nfolds,
+        uncertainty,
+        nresamples,
+        seed,
+        nthreads,
+        robust,
+        robust_tuning,
+        robust_maxiter,
+        robust_tol)
+
+
+def project(coords, refpt, projection="tan"):
+    """
+    Project celestial coordinates onto the plane of the sky.
+
+    **Parameters:**
+
+    - *coords*: Array of (RA, Dec) coordinates in degrees.  (Must be
+      an Nx2 array).
+
+    - *refpt*: The (RA, Dec) of the projection tangent point in
+      degrees.
+
+    - *projection*: One of "tan", "sin", "stg", "arc", "zea", "lin"
+      or "none".  See `geomap`.  Default: "tan"
+
+    **Returns:** An Nx2 array of projection plane coordinates (xi,
+    eta) in degrees.  *xi* increases to the east and *eta* to the
+    north.
+    """
+    return _stimage.project(coords, refpt, projection)
+
+
+def deproject(coords, refpt, projection="tan"):
+    """
+    Convert projection plane coordinates back to celestial
+    coordinates.  This is the inverse of `project`.
+
+    **Parameters:**
+
+    - *coords*: Array of (xi, eta) projection plane coordinates in
+      degrees.  (Must be an Nx2 array).
+
+    - *refpt*: The (RA, Dec) of the projection tangent point in
+      degrees.
+
+    - *projection*: One of "tan", "sin", "stg", "arc", "zea", "lin"
+      or "none".  See `geomap`.  Default: "tan"
+
+    **Returns:** An Nx2 array of (RA, Dec) coordinates in degrees,
+    with RA in the range [0, 360).
+    """
+    return _stimage.deproject(coords, refpt, projection)
@@ -0,0 +1,216 @@
+# Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""
+asyncio front-end to `xyxymatch` and `geomap`.
+
+The matching and fitting run on a pool of threads without holding the
+GIL, so awaiting them leaves the event loop free to serve other
+requests.  At most *max_workers* calls run at once; further calls
+wait for a free worker, which is the backpressure, without being
+queued on the pool.  Cancelling a call that is still waiting removes
+it.  A call that is already running cannot be interrupted, so its
+worker stays busy until it finishes and the result is discarded.
+
+For example::
+
+    from stsci.stimage import aio
+
+    async def align(input, ref):
+        matches = await aio.xyxymatch_async(input, ref, tolerance=2.0)
+        ...
+"""
+
+from __future__ import absolute_import
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import os
+import threading
+import weakref
+
+from . import xyxymatch as _xyxymatch
+from . import geomap as _geomap
+
+class Executor(object):
+    """
+    A pool of worker threads for matching and fitting, with a bound on
+    the number of calls running at once.
+
+    An Executor may be used from several event loops, for example in
+    successive `asyncio.run` calls, and from several threads.  It can
+    be used as a context manager, which shuts it down on exit.
+
+    **Parameters:**
+
+    - *max_workers*: The maximum number of calls running at once.
+      Default: the number of processors
+    """
+    def __init__(self, max_workers=None):
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(
+            max_workers, thread_name_prefix='stimage')
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._running = 0
+        self._waiting = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    @property
+    def running(self):
+        """
+        The number of calls running on the workers, including
+        cancelled calls that have not finished yet.
+        """
+        return self._running
+
+    @property
+    def waiting(self):
+        """
+        The number of calls waiting for a free worker.
+        """
+        return self._waiting
+
+    def shutdown(self, wait=True):
+        """
+        Stop the workers.  If *wait* is True, this waits for the
+        running calls to finish.
+        """
+        self._pool.shutdown(wait=wait)
+
+    def _count(self, name, delta):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + delta)
+
+    def _semaphore(self, loop):
+        # asyncio primitives belong to one event loop, so each loop
+        # gets its own semaphore.  The calls of different loops are
+        # still bounded by the pool.
+        with self._lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(self.max_workers)
+                self._semaphores[loop] = semaphore
+            return semaphore
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Call ``func(*args, **kwargs)`` on a worker and return its
+        result.  *func* should release the GIL, as `xyxymatch`,
+        `geomap`, `Matcher` and `Fitter` do, or it will stall the
+        event loop all the same.
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphore(loop)
+
+        self._count('_waiting', 1)
+        try:
+            await semaphore.acquire()
+        finally:
+            self._count('_waiting', -1)
+
+        def done(future):
+            self._count('_running', -1)
+            try:
+                loop.call_soon_threadsafe(semaphore.release)
+            except RuntimeError:
+                # The loop has been closed
+                pass
+
+        self._count('_running', 1)
+        try:
+            future = self._pool.submit(functools.partial(func, *args, **kwargs))
+        except BaseException:
+            self._count('_running', -1)
+            semaphore.release()
+            raise
+        # The worker is only given back when the call has really
+        # finished, even if the awaiting task is cancelled first
+        future.add_done_callback(done)
+
+        return await asyncio.wrap_future(future)
+
+    async def xyxymatch(self, input, ref, **kwargs):
+        """
+        Run `xyxymatch` on a worker.
+        """
+        return await self.run(_xyxymatch, input, ref, **kwargs)
+
+    async def geomap(self, input, ref, **kwargs):
+        """
+        Run `geomap` on a worker.
+        """
+        return await self.run(_geomap, input, ref, **kwargs)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """
+    Get the `Executor` used by `xyxymatch_async` and `geomap_async`,
+    creating it with the default number of workers on first use.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = Executor()
+        return _executor
+
+def set_executor(executor):
+    """
+    Replace the `Executor` used by `xyxymatch_async` and
+    `geomap_async`.  The previous one is not shut down.
+    """
+    global _executor
+    with _executor_lock:
+        _executor = executor
+
+async def xyxymatch_async(input, ref, **kwargs):
+    """
+    Coroutine version of `xyxymatch`, taking the same arguments.  It
+    runs on the executor returned by `get_executor`.
+    """
+    return await get_executor().xyxymatch(input, ref, **kwargs)
+
+async def geomap_async(input, ref, **kwargs):
+    """
+    Coroutine version of `geomap`, taking the same arguments.  It runs
+    on the executor returned by `get_executor`.
+    """
+    return await get_executor().geomap(input, ref, **kwargs)
@@ -0,0 +1,318 @@
+# Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""
+Memoization of `xyxymatch` and `geomap` results.
+
+Pipelines that are rerun on unchanged data call `xyxymatch` and
+`geomap` again with byte-identical inputs.  A `ResultCache` keys each
+call on a hash of its input arrays and of all of its parameters, and
+returns the stored result when the same call is made again, so that
+only the fits whose inputs changed are recomputed.
+"""
+
+from __future__ import absolute_import
+
+from collections import OrderedDict
+import hashlib
+import inspect
+import os
+import threading
+
+import numpy as np
+
+from . import _stimage
+from ._fileio import atomic_write
+from . import version as _version
+from . import xyxymatch as _xyxymatch
+from . import geomap as _geomap
+from .prepared import PreparedReference
+
+# The attributes of a GeomapResults object, in the order they are
+# stored
+_GEOMAP_ATTRIBUTES = (
+    'fit_geometry', 'function', 'projection', 'refpt', 'rms', 'mean_ref',
+    'mean_input', 'shift', 'mag', 'rotation', 'xcoeff', 'ycoeff',
+    'x2coeff', 'y2coeff', 'surfaces', 'orders', 'scores', 'xcov', 'ycov',
+    'x2cov', 'y2cov', 'resamples', 'niter', 'weights')
+
+if hasattr(hashlib, 'blake2b'):
+    def _new_hash():
+        return hashlib.blake2b(digest_size=20)
+else:
+    _new_hash = hashlib.sha1
+
+def _update_hash(h, value):
+    """
+    Feed a parameter value into a hash.  Arrays and sequences of
+    numbers are hashed by their dtype, shape and contents, and a
+    `PreparedReference` by the contents of its buffer.  Raises
+    `TypeError` for values that can not be hashed by their contents.
+    """
+    if value is None or isinstance(value, (str, bytes, bool)):
+        h.update(repr(value).encode('utf-8'))
+        return
+
+    if isinstance(value, PreparedReference):
+        h.update(b'PreparedReference')
+        h.update(value._content_digest())
+        return
+
+    array = np.asarray(value)
+    if array.dtype == object:
+        if isinstance(value, (tuple, list)):
+            h.update(('%s%d' % (type(value).__name__, len(value))).encode(
+                'ascii'))
+            for item in value:
+                _update_hash(h, item)
+            return
+        raise TypeError(
+            "Can not compute a cache key for a %s" % type(value).__name__)
+
+    array = np.ascontiguousarray(array)
+    h.update(('%s%r' % (array.dtype.str, array.shape)).encode('ascii'))
+    h.update(array.view(np.uint8).ravel())
+
+def _copy_fit(fit):
+    """
+    Make a copy of a GeomapResults object that shares no arrays with
+    it.
+    """
+    copy = _stimage.GeomapResults()
+    for name in _GEOMAP_ATTRIBUTES:
+        value = getattr(fit, name)
+        if isinstance(value, np.ndarray):
+            value = value.copy()
+        setattr(copy, name, value)
+    return copy
+
+def _nbytes(value):
+    """
+    The approximate memory used by a cached result.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, tuple):
+        return sum(_nbytes(x) for x in value)
+    if isinstance(value, _stimage.GeomapResults):
+        return sum(_nbytes(getattr(value, name))
+                   for name in _GEOMAP_ATTRIBUTES)
+    return 64
+
+class ResultCache(object):
+    """
+    A cache of `xyxymatch` and `geomap` results.
+
+    The `xyxymatch` and `geomap` methods take the same arguments as
+    the functions of the same name.  Each call is keyed on a hash of
+    its input arrays and all of its parameters, including the ones
+    left at their defaults, so a call that only differs in spelling
+    out a default value hits the same entry.  Arrays are hashed by
+    their dtype as well as their values, so the same coordinates
+    passed once as float32 and once as float64 are different entries.
+
+    The most recently used results are kept in memory, up to
+    *maxsize* bytes.  If *directory* is given, every result is also
+    written there, one file per key, so that later runs of the
+    pipeline start with a warm cache.  The files are NumPy ``.npz``
+    archives, which are read without unpickling anything.
+
+    Results are returned as copies, so changing a returned array does
+    not change the cache.  Calls that raise an exception are not
+    cached.  The cache may be shared between threads.
+
+    **Parameters:**
+
+    - *maxsize*: The memory bound of the in-memory cache, in bytes.
+      Results larger than this are only stored on disk.  Default:
+      256 MB
+
+    - *directory*: A directory for the on-disk store, which is created
+      if necessary, or None to keep the results in memory only.
+      Default: None
+    """
+    def __init__(self, maxsize=256 * 1024 * 1024, directory=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        """
+        The approximate memory used by the in-memory cache, in bytes.
+        """
+        return self._nbytes
+
+    def clear(self, disk=False):
+        """
+        Empty the in-memory cache and reset the hit and miss counts.
+        If *disk* is True, the on-disk store is emptied too.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            self.hits = 0
+            self.misses = 0
+        if disk and self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith('.npz'):
+                    os.remove(os.path.join(self.directory, name))
+
+    def key(self, func, *args, **kwargs):
+        """
+        Compute the cache key of a call to *func*, which is either
+        `stsci.stimage.xyxymatch` or `stsci.stimage.geomap`.
+
+        **Returns:** The key as a hex string.
+        """
+        arguments = inspect.getcallargs(func, *args, **kwargs)
+        h = _new_hash()
+        h.update(func.__name__.encode('ascii'))
+        h.update(getattr(_version, '__version__', '').encode('ascii'))
+        for name in sorted(arguments):
+            h.update(name.encode('ascii'))
+            _update_hash(h, arguments[name])
+        return h.hexdigest()
+
+    def xyxymatch(self, input, ref, **kwargs):
+        """
+        `xyxymatch`, returning the cached match table if the same call
+        has been made before.
+        """
+        key = self.key(_xyxymatch, input, ref, **kwargs)
+        result = self._get(key)
+        if result is None:
+            result = _xyxymatch(input, ref, **kwargs)
+            self._put(key, result)
+            result = result.copy()
+        return result
+
+    def geomap(self, input, ref, **kwargs):
+        """
+        `geomap`, returning the cached fit and output table if the same
+        call has been made before.
+        """
+        key = self.key(_geomap, input, ref, **kwargs)
+        result = self._get(key)
+        if result is None:
+            result = _geomap(input, ref, **kwargs)
+            self._put(key, result)
+            result = (_copy_fit(result[0]), result[1].copy())
+        return result
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+                self.hits += 1
+                return self._copy(entry[0])
+
+        result = self._load(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._remember(key, result)
+        return self._copy(result)
+
+    def _put(self, key, result):
+        self._remember(key, result)
+        self._save(key, result)
+
+    def _remember(self, key, result):
+        nbytes = _nbytes(result)
+        if nbytes > self.maxsize:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._nbytes -= old[1]
+            self._entries[key] = (result, nbytes)
+            self._nbytes += nbytes
+            while self._nbytes > self.maxsize:
+                oldest = next(iter(self._entries))
+                self._nbytes -= self._entries.pop(oldest)[1]
+
+    def _copy(self, result):
+        if isinstance(result, tuple):
+            return (_copy_fit(result[0]), result[1].copy())
+        return result.copy()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def _save(self, key, result):
+        if self.directory is None:
+            return
+        if isinstance(result, tuple):
+            fit, output = result
+            arrays = dict(('fit_' + name, np.asarray(getattr(fit, name)))
+                          for name in _GEOMAP_ATTRIBUTES)
+        else:
+            output = result
+            arrays = {}
+        arrays['output'] = output
+
+        atomic_write(self._path(key), lambda f: np.savez(f, **arrays))
+
+    def _load(self, key):
+        if self.directory is None:
+            return None
+        try:
+            archive = np.load(self._path(key), allow_pickle=False)
+        except (IOError, OSError, ValueError):
+            return None
+        with archive:
+            output = archive['output']
+            if 'fit_xcoeff' not in archive:
+                return output
+            if any('fit_' + name not in archive
+                   for name in _GEOMAP_ATTRIBUTES):
+                # Stored before all of the attributes were saved
+                return None
+            fit = _stimage.GeomapResults()
+            for name in _GEOMAP_ATTRIBUTES:
+                value = archive['fit_' + name]
+                if value.dtype.kind == 'U':
+                    value = str(value)
+                elif value.dtype.kind == 'i' and value.ndim == 0:
+                    value = int(value)
+                setattr(fit, name, value)
+            return (fit, output)
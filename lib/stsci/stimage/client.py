@@ -0,0 +1,170 @@
+# Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""
+A client for the matching server of `stsci.stimage.server`.
+
+For example::
+
+    from stsci.stimage.client import Client
+
+    with Client('/tmp/stimage.sock') as client:
+        matches = client.xyxymatch(input, 'field1', algorithm='triangles')
+        fit, output = client.geomap(matches_input, matches_ref)
+"""
+
+from __future__ import absolute_import
+
+import socket
+import threading
+
+from .server import receive_message, send_message, _EXCEPTIONS
+
+class Client(object):
+    """
+    A connection to a matching server.
+
+    The methods take the same arguments as the functions of the same
+    names, and return the same results.  An exception raised by the
+    server is raised again by the client, as a `RuntimeError` unless
+    it is a `KeyError`, `TypeError` or `ValueError`.  A Client may be
+    shared between threads, whose requests are then made one at a
+    time.  It can be used as a context manager, which closes it on
+    exit.
+
+    **Parameters:**
+
+    - *path*: The path of the server's socket.
+
+    - *timeout*: The time, in seconds, to wait for the server to
+      answer before raising `socket.timeout`, or None to wait forever.
+      The connection is closed after a timeout, since the rest of the
+      answer would otherwise be taken for the answer to the next
+      request.  Default: None
+    """
+    def __init__(self, path, timeout=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._sock.settimeout(timeout)
+            self._sock.connect(path)
+        except:
+            self._sock.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Close the connection.
+        """
+        self._sock.close()
+
+    def request(self, op, *args):
+        """
+        Make a request of the server, returning its result.
+        """
+        with self._lock:
+            if self._sock.fileno() < 0:
+                raise ConnectionError("The connection is closed")
+            try:
+                send_message(self._sock, [op] + list(args))
+                response = receive_message(self._sock)
+            except BaseException:
+                # Part of a message may be left in the stream
+                self.close()
+                raise
+        if response is None:
+            raise ConnectionError("The server closed the connection")
+        if 'error' in response:
+            raise _EXCEPTIONS.get(response['error'], RuntimeError)(
+                response['message'])
+        return response['result']
+
+    def ping(self):
+        """
+        Check that the server is answering.
+        """
+        return self.request('ping') == 'pong'
+
+    def catalogs(self):
+        """
+        **Returns:** A dictionary of the number of coordinates in each
+        catalog the server holds, by name.
+        """
+        return self.request('catalogs')
+
+    def prepare(self, name, ref, **kwargs):
+        """
+        Send a reference catalog to the server, which prepares it with
+        `PreparedReference.create` and serves it under *name*.  The
+        keyword arguments are those of `PreparedReference.create`.
+
+        **Returns:** The number of coordinates left after culling.
+        """
+        return self.request('prepare', name, ref, kwargs)
+
+    def load(self, name, path):
+        """
+        Have the server open a catalog saved with
+        `PreparedReference.save`, and serve it under *name*.  *path*
+        is opened by the server, so it must be valid on the server's
+        side.
+
+        **Returns:** The number of coordinates left after culling.
+        """
+        return self.request('load', name, path)
+
+    def remove(self, name):
+        """
+        Have the server stop serving the catalog *name*.
+        """
+        self.request('remove', name)
+
+    def xyxymatch(self, input, ref, **kwargs):
+        """
+        Match coordinate lists on the server.  *ref* is either an
+        array of reference coordinates or the name of a catalog the
+        server holds.  See `stsci.stimage.xyxymatch`.
+        """
+        return self.request('xyxymatch', input, ref, kwargs)
+
+    def geomap(self, input, ref, **kwargs):
+        """
+        Fit a transformation on the server.  See
+        `stsci.stimage.geomap`.
+
+        **Returns:** The tuple (fit, output), as `geomap` does.
+        """
+        return tuple(self.request('geomap', input, ref, kwargs))
@@ -0,0 +1,359 @@
+# Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""
+Reference coordinate lists prepared once and shared between processes.
+
+Every call to `xyxymatch` sorts the reference coordinates and removes
+those closer together than *separation*, and the ``'triangles'``
+algorithm builds the reference triangles as well.  A
+`PreparedReference` keeps the coordinates, the result of that work
+and, optionally, the reference triangles together in one flat buffer,
+and `xyxymatch` uses them in place when it is passed as *ref*.
+
+The buffer can be saved to a file, which other processes open as a
+read-only memory map, or copied into any other shared buffer, such as
+a `multiprocessing.shared_memory.SharedMemory` block.  Either way,
+worker processes that match against the same catalog share one copy
+of it instead of each holding their own::
+
+    prepared = PreparedReference.create(ref, nmatch=30)
+    prepared.save('catalog.ref')
+
+    # In each worker
+    prepared = PreparedReference.open('catalog.ref')
+    matches = stimage.xyxymatch(input, prepared, algorithm='triangles')
+
+or, with shared memory::
+
+    block = SharedMemory(create=True, size=prepared.nbytes)
+    prepared.copy_to(block.buf)
+
+    # In each worker, given block.name
+    block = SharedMemory(name)
+    prepared = PreparedReference(block.buf)
+
+The arrays are stored in the byte order of the machine that made them,
+so the buffer is meant to be shared between processes on one machine.
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import mmap
+
+import numpy as np
+
+from . import _stimage
+from ._fileio import atomic_write
+
+_MAGIC = b'STIMREF\0'
+_VERSION = 1
+
+# Every array starts at a multiple of this many bytes from the start of
+# the buffer
+_ALIGNMENT = 64
+
+_HEADER = np.dtype([
+    ('magic', 'S8'),
+    ('version', np.uint32),
+    ('has_triangles', np.uint32),
+    ('nref', np.uint64),
+    ('nunique', np.uint64),
+    ('ntriangles', np.uint64),
+    ('separation', np.float64),
+    ('nmatch', np.uint64),
+    ('tolerance', np.float64),
+    ('maxratio', np.float64)])
+
+# The columns of the reference triangles, in the order
+# _stimage.reference_triangles returns them and _stimage.xyxymatch
+# takes them, with their types and number of entries per triangle
+_TRIANGLE_COLUMNS = (
+    ('vertices', np.uint16, 3),
+    ('log_perimeter', np.float64, 1),
+    ('ratio', np.float64, 1),
+    ('cosine_v1', np.float64, 1),
+    ('ratio_tolerance', np.float32, 1),
+    ('cosine_tolerance', np.float32, 1),
+    ('sense', np.uint8, 1))
+
+def _layout(nref, nunique, ntriangles, has_triangles):
+    """
+    The arrays of a prepared reference, as a list of (name, dtype,
+    shape, offset), and the total size of the buffer.
+    """
+    arrays = [('ref', np.float64, (nref, 2)), ('index', np.uintp, (nunique,))]
+    if has_triangles:
+        arrays.extend((name, dtype, (count * ntriangles,))
+                      for name, dtype, count in _TRIANGLE_COLUMNS)
+
+    layout = []
+    offset = _HEADER.itemsize
+    for name, dtype, shape in arrays:
+        offset = -(-offset // _ALIGNMENT) * _ALIGNMENT
+        layout.append((name, np.dtype(dtype), shape, offset))
+        offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+    return layout, offset
+
+class PreparedReference(object):
+    """
+    A reference coordinate list, sorted and culled for `xyxymatch`,
+    with its reference triangles if they were built.
+
+    ``PreparedReference(buffer)`` uses a prepared reference already
+    in *buffer*, which may be any object with the buffer protocol,
+    such as a `bytes` object, an `mmap.mmap` or the ``buf`` of a
+    `multiprocessing.shared_memory.SharedMemory`.  The arrays are
+    views of the buffer, not copies.  Use `create` to make a new one.
+
+    A PreparedReference is passed to `xyxymatch` in place of the
+    reference coordinates.  The *separation* given to `xyxymatch`
+    must be the one it was prepared with.  The reference triangles
+    are used by the ``'triangles'`` algorithm when *nmatch*,
+    *tolerance* and *maxratio* are the ones they were built with,
+    *select* is ``'sample'`` and *adaptive* is False, and are built
+    again otherwise.
+
+    Pickling one opened with `open` pickles only its path.  Pickling
+    any other copies the whole buffer, so to hand one in shared
+    memory to another process, send the name of the shared memory
+    block instead.
+
+    **Attributes:**
+
+    - *ref*: The Nx2 array of reference coordinates
+
+    - *index*: The indices into *ref* of the coordinates left after
+      culling, in sorted order
+
+    - *separation*: The separation the coordinates were culled with
+
+    - *nmatch*, *tolerance*, *maxratio*: The parameters the reference
+      triangles were built with, or None if there are none
+
+    - *path*: The file it was opened from, or None
+    """
+    def __init__(self, buffer):
+        data = np.frombuffer(buffer, np.uint8)
+        if data.size < _HEADER.itemsize:
+            raise ValueError("The buffer is too small for a prepared reference")
+        header = data[:_HEADER.itemsize].view(_HEADER)[0]
+        if header['magic'] != _MAGIC.rstrip(b'\0'):
+            raise ValueError("The buffer does not hold a prepared reference")
+        if header['version'] != _VERSION:
+            raise ValueError(
+                "Unsupported prepared reference version %d, or a different "
+                "byte order" % header['version'])
+
+        layout, size = _layout(
+            int(header['nref']), int(header['nunique']),
+            int(header['ntriangles']), bool(header['has_triangles']))
+        if data.size < size:
+            raise ValueError("The prepared reference is truncated")
+
+        arrays = {}
+        for name, dtype, shape, offset in layout:
+            count = int(np.prod(shape))
+            arrays[name] = data[offset:offset + count * dtype.itemsize].view(
+                dtype).reshape(shape)
+
+        self._buffer = buffer
+        self._data = data[:size]
+        self._digest = None
+        self.path = None
+        self.ref = arrays['ref']
+        self.index = arrays['index']
+        self.separation = float(header['separation'])
+        if header['has_triangles']:
+            self.nmatch = int(header['nmatch'])
+            self.tolerance = float(header['tolerance'])
+            self.maxratio = float(header['maxratio'])
+            self._triangles = (self.nmatch, self.tolerance, self.maxratio) + \
+                tuple(arrays[name] for name, dtype, count in _TRIANGLE_COLUMNS)
+        else:
+            self.nmatch = self.tolerance = self.maxratio = None
+            self._triangles = None
+
+    @classmethod
+    def create(cls, ref, separation=9.0, nmatch=None, tolerance=1.0,
+               maxratio=10.0, nthreads=1):
+        """
+        Prepare a reference coordinate list.
+
+        **Parameters:**
+
+        - *ref*: Array of reference coordinates. (Must be an Nx2
+          array).
+
+        - *separation*: The minimum separation, as for `xyxymatch`.
+          Default: 9.0
+
+        - *nmatch*: If given, the reference triangles for the
+          ``'triangles'`` algorithm are built as well, for this
+          *nmatch*.  Default: None
+
+        - *tolerance*, *maxratio*: The parameters of `xyxymatch` the
+          reference triangles are built for.  Defaults: 1.0, 10.0
+
+        - *nthreads*: The number of threads used to build the
+          triangles.  If 0, one per processor.  Default: 1
+
+        **Returns:** A new PreparedReference, in memory of its own.
+        """
+        ref = np.ascontiguousarray(ref, dtype=np.float64)
+        if ref.ndim != 2 or ref.shape[1] != 2:
+            raise TypeError("ref array must be an Nx2 array")
+
+        index = _stimage.prepare_reference(ref, separation)
+        triangles = None
+        if nmatch is not None:
+            triangles = _stimage.reference_triangles(
+                ref, index, nmatch, tolerance, maxratio, nthreads)
+
+        ntriangles = len(triangles[2]) if triangles is not None else 0
+        layout, size = _layout(
+            len(ref), len(index), ntriangles, triangles is not None)
+
+        data = np.zeros(size, np.uint8)
+        header = data[:_HEADER.itemsize].view(_HEADER)
+        header['magic'] = _MAGIC
+        header['version'] = _VERSION
+        header['has_triangles'] = triangles is not None
+        header['nref'] = len(ref)
+        header['nunique'] = len(index)
+        header['ntriangles'] = ntriangles
+        header['separation'] = separation
+        if triangles is not None:
+            header['nmatch'] = nmatch
+            header['tolerance'] = tolerance
+            header['maxratio'] = maxratio
+
+        values = [ref, index] + list(triangles or ())
+        for (name, dtype, shape, offset), value in zip(layout, values):
+            count = int(np.prod(shape))
+            data[offset:offset + count * dtype.itemsize].view(dtype)[:] = \
+                np.asarray(value, dtype).ravel()
+
+        return cls(data)
+
+    @classmethod
+    def open(cls, path):
+        """
+        Open a prepared reference saved with `save`, as a read-only
+        memory map.  The operating system keeps one copy of the file
+        in memory for all of the processes that open it.
+        """
+        with open(path, 'rb') as fd:
+            buffer = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            prepared = cls(buffer)
+        except:
+            buffer.close()
+            raise
+        prepared.path = path
+        return prepared
+
+    def __len__(self):
+        return len(self.ref)
+
+    def __reduce__(self):
+        if self.path is not None:
+            return (self.__class__.open, (self.path,))
+        return (self.__class__, (self._data.tobytes(),))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def nbytes(self):
+        """
+        The size of the buffer, in bytes.
+        """
+        return self._data.size
+
+    def _content_digest(self):
+        """
+        A digest of the buffer, computed on first use.  `ResultCache`
+        keys calls with a PreparedReference on it.
+        """
+        if self._digest is None:
+            self._digest = hashlib.sha1(self._data.data).digest()
+        return self._digest
+
+    def copy_to(self, buffer):
+        """
+        Copy the prepared reference into the start of *buffer*, which
+        must be writable and at least `nbytes` long.  A
+        PreparedReference using the copy is then made with
+        ``PreparedReference(buffer)``.
+        """
+        target = np.frombuffer(buffer, np.uint8)
+        if target.size < self.nbytes:
+            raise ValueError(
+                "The buffer is too small (%d bytes, %d needed)" %
+                (target.size, self.nbytes))
+        target[:self.nbytes] = self._data
+
+    def save(self, path):
+        """
+        Write the prepared reference to a file, to be opened with
+        `open`.  The file is replaced atomically, so processes that
+        already have it open keep the old one.
+        """
+        atomic_write(path, lambda f: f.write(self._data.data))
+
+    def close(self):
+        """
+        Release the buffer, closing the memory map of one opened with
+        `open`.  The arrays of the PreparedReference can no longer be
+        used afterward.
+        """
+        buffer = self._buffer
+        self.ref = self.index = self._data = self._triangles = None
+        self._buffer = None
+        if isinstance(buffer, mmap.mmap):
+            try:
+                buffer.close()
+            except BufferError:
+                # Arrays taken from it are still in use, so it is left
+                # to be closed when they are gone
+                pass
+
+    def _arguments(self):
+        """
+        The prepared reference in the form taken by the *prepared*
+        argument of ``_stimage.xyxymatch``.
+        """
+        if self._data is None:
+            raise ValueError("The prepared reference is closed")
+        return (self.separation, self.index, self._triangles)
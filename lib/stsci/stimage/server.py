@@ -0,0 +1,445 @@
+# Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""
+A matching and fitting daemon, serving prepared reference catalogs
+over a Unix domain socket.
+
+A short-lived pipeline task that matches a few hundred stars spends
+far longer starting Python, importing NumPy and preparing the
+reference catalog than matching.  A long-running server holds the
+catalogs, as `PreparedReference` objects, and a pool of worker
+threads, so each request only costs the match itself.  Start it
+with::
+
+    python -m stsci.stimage.server --socket /tmp/stimage.sock \\
+        --catalog field1=field1.ref
+
+and use it through `stsci.stimage.client.Client`.  The socket file is
+only accessible to the user that started the server.
+
+Each message, in either direction, is a header, a JSON description
+and the raw bytes of the arrays it refers to::
+
+    magic "STIM", uint32 description length, uint64 data length
+    description (UTF-8 JSON)
+    array data, each array starting at a multiple of 8 bytes
+
+Arrays are described by their dtype, in the form of
+`numpy.lib.format`, their shape and their offset in the data, so
+they are sent without any conversion, and nothing is ever unpickled.
+"""
+
+from __future__ import absolute_import
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import threading
+
+import numpy as np
+from numpy.lib import format as _format
+
+from . import _stimage
+from . import xyxymatch as _xyxymatch
+from . import geomap as _geomap
+from .prepared import PreparedReference
+
+_MAGIC = b'STIM'
+_HEADER = struct.Struct('<4sIQ')
+_ALIGNMENT = 8
+
+# The largest message accepted, in bytes
+MAX_MESSAGE = 1 << 30
+
+# The message data is received in pieces of at most this many bytes,
+# so that memory is only allocated for data that actually arrives
+_CHUNK = 1 << 24
+
+# The attributes of a GeomapResults object sent over the socket
+_GEOMAP_ATTRIBUTES = (
+    'fit_geometry', 'function', 'projection', 'refpt', 'rms', 'mean_ref',
+    'mean_input', 'shift', 'mag', 'rotation', 'xcoeff', 'ycoeff',
+    'x2coeff', 'y2coeff', 'surfaces', 'orders', 'scores', 'xcov', 'ycov',
+    'x2cov', 'y2cov', 'resamples', 'niter', 'weights')
+
+# The exceptions that are raised again by the client with the message
+# of the server, rather than as a RuntimeError
+_EXCEPTIONS = {
+    'KeyError': KeyError,
+    'RuntimeError': RuntimeError,
+    'TypeError': TypeError,
+    'ValueError': ValueError}
+
+class ProtocolError(Exception):
+    """
+    A malformed message was received.
+    """
+
+def _encode(value, arrays):
+    """
+    Convert a value to something JSON can encode, appending the arrays
+    in it to *arrays*.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        arrays.append(np.ascontiguousarray(value))
+        return {'$array': len(arrays) - 1}
+    if isinstance(value, (list, tuple)):
+        return [_encode(x, arrays) for x in value]
+    if isinstance(value, dict):
+        return {'$dict': dict(
+            (str(k), _encode(v, arrays)) for k, v in value.items())}
+    if isinstance(value, _stimage.GeomapResults):
+        return {'$geomap': dict(
+            (name, _encode(getattr(value, name), arrays))
+            for name in _GEOMAP_ATTRIBUTES)}
+    raise TypeError("Cannot send a value of type %s" % type(value).__name__)
+
+def _decode(value, arrays):
+    """
+    The inverse of `_encode`.
+    """
+    if isinstance(value, list):
+        return [_decode(x, arrays) for x in value]
+    if isinstance(value, dict):
+        if '$array' in value:
+            return arrays[value['$array']]
+        if '$dict' in value:
+            return dict((k, _decode(v, arrays))
+                        for k, v in value['$dict'].items())
+        if '$geomap' in value:
+            fit = _stimage.GeomapResults()
+            for name, x in value['$geomap'].items():
+                if name in _GEOMAP_ATTRIBUTES:
+                    setattr(fit, name, _decode(x, arrays))
+            return fit
+        raise ProtocolError("Unknown value %r" % value)
+    return value
+
+def _recv_exactly(sock, buffer):
+    """
+    Fill *buffer* from the socket.  Returns False if the connection
+    was closed before any of it was received.
+    """
+    view = memoryview(buffer)
+    received = 0
+    while received < len(view):
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            if received == 0:
+                return False
+            raise ProtocolError("The connection was closed mid-message")
+        received += n
+    return True
+
+def _recv_data(sock, length):
+    """
+    Receive *length* bytes, in chunks of at most `_CHUNK` bytes.
+    """
+    data = bytearray()
+    while len(data) < length:
+        chunk = bytearray(min(length - len(data), _CHUNK))
+        if not _recv_exactly(sock, chunk):
+            raise ProtocolError("The connection was closed mid-message")
+        if data:
+            data += chunk
+        else:
+            data = chunk
+    return data
+
+def send_message(sock, message):
+    """
+    Send *message*, which may contain arrays, `GeomapResults` objects
+    and anything JSON can encode.
+    """
+    arrays = []
+    description = {'value': _encode(message, arrays), 'arrays': []}
+    parts = []
+    offset = 0
+    for array in arrays:
+        padding = -offset % _ALIGNMENT
+        if padding:
+            parts.append(b'\0' * padding)
+            offset += padding
+        description['arrays'].append(
+            [_format.dtype_to_descr(array.dtype), array.shape, offset])
+        parts.append(memoryview(array.reshape(-1)).cast('B'))
+        offset += array.nbytes
+
+    head = json.dumps(description, separators=(',', ':')).encode('utf-8')
+    parts.insert(0, _HEADER.pack(_MAGIC, len(head), offset) + head)
+    if offset < 65536:
+        sock.sendall(b''.join(parts))
+    else:
+        for part in parts:
+            sock.sendall(part)
+
+def receive_message(sock, max_message=MAX_MESSAGE):
+    """
+    Receive a message sent by `send_message`.  The arrays in it are
+    views of a single buffer.  Returns None if the connection was
+    closed between messages.
+    """
+    header = bytearray(_HEADER.size)
+    if not _recv_exactly(sock, header):
+        return None
+    magic, head_length, data_length = _HEADER.unpack(header)
+    if magic != _MAGIC:
+        raise ProtocolError("Not a stimage message")
+    if head_length + data_length > max_message:
+        raise ProtocolError(
+            "The message is too long (%d bytes)" %
+            (head_length + data_length))
+
+    head = _recv_data(sock, head_length)
+    data = _recv_data(sock, data_length)
+
+    try:
+        description = json.loads(head.decode('utf-8'))
+        arrays = []
+        for descr, shape, offset in description['arrays']:
+            dtype = _format.descr_to_dtype(descr)
+            count = int(np.prod(shape))
+            if offset < 0 or offset + count * dtype.itemsize > data_length:
+                raise ProtocolError("An array is outside the message")
+            arrays.append(np.frombuffer(
+                data, dtype, count, offset).reshape(shape))
+        return _decode(description['value'], arrays)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ProtocolError("Malformed message: %s" % e)
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    A server for `xyxymatch` and `geomap` requests on a Unix domain
+    socket.
+
+    Each connection is served by a thread of its own, which may make
+    any number of requests, one at a time.  The matching and fitting
+    run on a pool of *max_workers* threads without holding the GIL, so
+    that at most that many run at once, however many clients are
+    connected.  Call `serve_forever` to run it, from another thread
+    if need be, and `shutdown` and `server_close` to stop it.
+
+    **Parameters:**
+
+    - *path*: The path of the socket.  A stale socket file left by a
+      server that is no longer running is replaced.
+
+    - *max_workers*: The number of worker threads.  Default: the
+      number of processors
+
+    - *catalogs*: A dictionary of `PreparedReference` objects to
+      serve, by name.  Clients may add more.  Default: None
+    """
+    daemon_threads = True
+    allow_reuse_address = False
+
+    def __init__(self, path, max_workers=None, catalogs=None):
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        self.path = path
+        self.catalogs = dict(catalogs or {})
+        self._catalogs_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers)
+        _remove_stale_socket(path)
+        # Create the socket file without access for other users, since
+        # they could connect before a chmod made afterward
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, _Handler)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        self._executor.shutdown(wait=True)
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def add_catalog(self, name, prepared):
+        """
+        Serve a `PreparedReference` under *name*, replacing any
+        catalog of that name.
+        """
+        with self._catalogs_lock:
+            self.catalogs[name] = prepared
+
+    def remove_catalog(self, name):
+        """
+        Stop serving the catalog *name*.
+        """
+        with self._catalogs_lock:
+            del self.catalogs[name]
+
+    def get_catalog(self, name):
+        with self._catalogs_lock:
+            try:
+                return self.catalogs[name]
+            except KeyError:
+                raise KeyError("No catalog named %r" % name)
+
+    def handle_request_message(self, request):
+        """
+        Carry out one request, a list of the operation name and its
+        arguments, returning the result.
+        """
+        op, args = request[0], request[1:]
+        handler = getattr(self, '_op_' + str(op), None)
+        if handler is None:
+            raise ValueError("Unknown operation %r" % op)
+        return handler(*args)
+
+    def _run(self, func, *args, **kwargs):
+        return self._executor.submit(func, *args, **kwargs).result()
+
+    def _op_ping(self):
+        return 'pong'
+
+    def _op_catalogs(self):
+        with self._catalogs_lock:
+            return dict(
+                (name, len(prepared))
+                for name, prepared in self.catalogs.items())
+
+    def _op_prepare(self, name, ref, kwargs):
+        prepared = self._run(PreparedReference.create, ref, **kwargs)
+        self.add_catalog(name, prepared)
+        return len(prepared.index)
+
+    def _op_load(self, name, path):
+        prepared = PreparedReference.open(path)
+        self.add_catalog(name, prepared)
+        return len(prepared.index)
+
+    def _op_remove(self, name):
+        self.remove_catalog(name)
+
+    def _op_xyxymatch(self, input, ref, kwargs):
+        if isinstance(ref, str):
+            ref = self.get_catalog(ref)
+        return self._run(_xyxymatch, input, ref, **kwargs)
+
+    def _op_geomap(self, input, ref, kwargs):
+        return self._run(_geomap, input, ref, **kwargs)
+
+class _Handler(socketserver.BaseRequestHandler):
+    """
+    Serves the requests of one connection until it is closed.
+    """
+    def handle(self):
+        while True:
+            try:
+                request = receive_message(self.request)
+            except (ProtocolError, OSError):
+                return
+            if request is None:
+                return
+            try:
+                response = {
+                    'result': self.server.handle_request_message(request)}
+            except Exception as e:
+                response = {'error': type(e).__name__, 'message': str(e)}
+            try:
+                send_message(self.request, response)
+            except TypeError as e:
+                send_message(self.request, {
+                    'error': 'TypeError', 'message': str(e)})
+            except OSError:
+                return
+
+def _remove_stale_socket(path):
+    """
+    Remove a socket file that no server is listening on.
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError("%s exists and is not a socket" % path)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (OSError, socket.error):
+        os.remove(path)
+    else:
+        raise OSError("A server is already listening on %s" % path)
+    finally:
+        probe.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m stsci.stimage.server',
+        description='Serve xyxymatch and geomap over a Unix domain socket.')
+    parser.add_argument(
+        '--socket', required=True, help='the path of the socket')
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help='the number of worker threads (default: one per processor)')
+    parser.add_argument(
+        '--catalog', action='append', default=[], metavar='NAME=PATH',
+        help='serve a reference catalog saved with PreparedReference.save')
+    options = parser.parse_args(argv)
+
+    catalogs = {}
+    for spec in options.catalog:
+        name, sep, path = spec.partition('=')
+        if not sep:
+            parser.error('--catalog must be of the form NAME=PATH')
+        catalogs[name] = PreparedReference.open(path)
+
+    server = Server(options.socket, options.workers, catalogs)
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown).start()
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,288 @@
+# Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""
+Compact storage of many `geomap` solutions.
+
+A `GeomapResults` object can be pickled, but a pipeline that keeps
+the solutions of thousands of chips spends most of the time of
+loading them in unpickling many small objects and arrays.
+`Solutions` stores any number of them in one flat buffer instead: a
+table of fixed-size records holding the fit geometry, function,
+projection and surfaces of each, followed by all of their
+coefficients.  Opening the file maps it into memory, and only the
+solutions that are looked at are turned into `GeomapResults`
+objects, which can be evaluated without fitting again::
+
+    solutions = Solutions.create(fits)
+    solutions.save('chips.fit')
+
+    solutions = Solutions.open('chips.fit')
+    fit = solutions[1234]
+    xy = fit.evaluate(ref)
+
+The whole table is also available as the structured array
+`Solutions.records`, for example to look at the *rms* of every
+solution at once.
+
+As with `stsci.stimage.prepared.PreparedReference`, the values are
+stored in the byte order of the machine that made them.
+"""
+
+from __future__ import absolute_import
+
+import mmap
+
+import numpy as np
+
+from . import _stimage
+from ._fileio import atomic_write
+
+_MAGIC = b'STIMFIT\0'
+_VERSION = 1
+
+# The records and the coefficients start at a multiple of this many
+# bytes from the start of the buffer
+_ALIGNMENT = 64
+
+_HEADER = np.dtype([
+    ('magic', 'S8'),
+    ('version', np.uint32),
+    ('record_size', np.uint32),
+    ('count', np.uint64),
+    ('ncoeff', np.uint64)])
+
+# The coefficient arrays of a GeomapResults object, in the order of
+# the rows of its surfaces
+_COEFFICIENTS = ('xcoeff', 'ycoeff', 'x2coeff', 'y2coeff')
+
+_RECORD = np.dtype([
+    ('fit_geometry', 'S16'),
+    ('function', 'S16'),
+    ('projection', 'S8'),
+    ('refpt', np.float64, (2,)),
+    ('rms', np.float64, (2,)),
+    ('mean_ref', np.float64, (2,)),
+    ('mean_input', np.float64, (2,)),
+    ('shift', np.float64, (2,)),
+    ('mag', np.float64, (2,)),
+    ('rotation', np.float64, (2,)),
+    ('surfaces', np.float64, (4, 7)),
+    ('offset', np.uint64),
+    ('ncoeff', np.uint64, (4,))])
+
+# The record fields that are copied to and from the attributes of the
+# same name
+_STRINGS = ('fit_geometry', 'function', 'projection')
+_ARRAYS = ('refpt', 'rms', 'mean_ref', 'mean_input', 'shift', 'mag',
+           'rotation', 'surfaces')
+
+def _align(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+def _layout(count, ncoeff):
+    """
+    The offsets of the records and the coefficients, and the total
+    size of the buffer.
+    """
+    records = _align(_HEADER.itemsize)
+    coefficients = _align(records + count * _RECORD.itemsize)
+    return records, coefficients, coefficients + ncoeff * 8
+
+class Solutions(object):
+    """
+    A collection of `geomap` solutions in one flat buffer.
+
+    ``Solutions(buffer)`` uses the solutions already in *buffer*,
+    which may be any object with the buffer protocol, such as a
+    `bytes` object or an `mmap.mmap`.  Use `create` to make a new
+    one.
+
+    A Solutions object is a sequence: ``solutions[i]`` is a new
+    `GeomapResults` object for the *i*-th solution, with its own
+    copies of the arrays.
+
+    **Attributes:**
+
+    - *records*: A structured array with one record per solution,
+      holding its attributes other than the coefficients, and the
+      *offset* and number (*ncoeff*) of its coefficients in
+      *coefficients*.
+
+    - *coefficients*: The coefficients of all of the solutions,
+      one after the other.
+
+    - *path*: The file it was opened from, or None
+    """
+    def __init__(self, buffer):
+        data = np.frombuffer(buffer, np.uint8)
+        if data.size < _HEADER.itemsize:
+            raise ValueError("The buffer is too small for geomap solutions")
+        header = data[:_HEADER.itemsize].view(_HEADER)[0]
+        if header['magic'] != _MAGIC.rstrip(b'\0'):
+            raise ValueError("The buffer does not hold geomap solutions")
+        if header['version'] != _VERSION or \
+                header['record_size'] != _RECORD.itemsize:
+            raise ValueError(
+                "Unsupported geomap solutions version %d, or a different "
+                "byte order" % header['version'])
+
+        count = int(header['count'])
+        ncoeff = int(header['ncoeff'])
+        records, coefficients, size = _layout(count, ncoeff)
+        if data.size < size:
+            raise ValueError("The geomap solutions are truncated")
+
+        self._buffer = buffer
+        self._data = data[:size]
+        self.path = None
+        self.records = data[records:records + count * _RECORD.itemsize].view(
+            _RECORD)
+        self.coefficients = data[coefficients:size].view(np.float64)
+
+    @classmethod
+    def create(cls, solutions):
+        """
+        Store `geomap` solutions.
+
+        **Parameters:**
+
+        - *solutions*: A sequence of `GeomapResults` objects.
+
+        **Returns:** A new Solutions object, in memory of its own.
+        """
+        solutions = list(solutions)
+        coefficients = []
+        for fit in solutions:
+            if not isinstance(fit, _stimage.GeomapResults):
+                raise TypeError(
+                    "Expected GeomapResults, got %s" % type(fit).__name__)
+            coefficients.append([
+                np.asarray(getattr(fit, name), np.float64).ravel()
+                for name in _COEFFICIENTS])
+
+        ncoeff = sum(len(c) for arrays in coefficients for c in arrays)
+        records, offset, size = _layout(len(solutions), ncoeff)
+
+        data = np.zeros(size, np.uint8)
+        header = data[:_HEADER.itemsize].view(_HEADER)
+        header['magic'] = _MAGIC
+        header['version'] = _VERSION
+        header['record_size'] = _RECORD.itemsize
+        header['count'] = len(solutions)
+        header['ncoeff'] = ncoeff
+
+        table = data[records:records + len(solutions) * _RECORD.itemsize].view(
+            _RECORD)
+        pool = data[offset:size].view(np.float64)
+        position = 0
+        for i, (fit, arrays) in enumerate(zip(solutions, coefficients)):
+            for name in _STRINGS:
+                table[name][i] = getattr(fit, name).encode('ascii')
+            for name in _ARRAYS:
+                table[name][i] = getattr(fit, name)
+            table['offset'][i] = position
+            table['ncoeff'][i] = [len(array) for array in arrays]
+            for array in arrays:
+                pool[position:position + len(array)] = array
+                position += len(array)
+
+        return cls(data)
+
+    @classmethod
+    def open(cls, path):
+        """
+        Open solutions saved with `save`, as a read-only memory map.
+        """
+        with open(path, 'rb') as fd:
+            buffer = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            solutions = cls(buffer)
+        except:
+            buffer.close()
+            raise
+        solutions.path = path
+        return solutions
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        if self.records is None:
+            raise ValueError("The geomap solutions are closed")
+        record = self.records[index]
+        fit = _stimage.GeomapResults()
+        for name in _STRINGS:
+            setattr(fit, name, record[name].decode('ascii'))
+        for name in _ARRAYS:
+            setattr(fit, name, np.array(record[name]))
+        position = int(record['offset'])
+        for name, count in zip(_COEFFICIENTS, record['ncoeff']):
+            count = int(count)
+            setattr(fit, name,
+                    self.coefficients[position:position + count].copy())
+            position += count
+        return fit
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def nbytes(self):
+        """
+        The size of the buffer, in bytes.
+        """
+        return self._data.size
+
+    def save(self, path):
+        """
+        Write the solutions to a file, to be opened with `open`.  The
+        file is replaced atomically.
+        """
+        atomic_write(path, lambda f: f.write(self._data.data))
+
+    def close(self):
+        """
+        Release the buffer, closing the memory map of one opened with
+        `open`.  `GeomapResults` objects already taken from it remain
+        usable.
+        """
+        buffer = self._buffer
+        self.records = self.coefficients = self._data = None
+        self._buffer = None
+        if isinstance(buffer, mmap.mmap):
+            try:
+                buffer.close()
+            except BufferError:
+                # Arrays taken from it are still in use, so it is left
+                # to be closed when they are gone
+                pass
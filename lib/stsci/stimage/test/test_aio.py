@@ -0,0 +1,146 @@
+# Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+import asyncio
+import threading
+import time
+
+import numpy as np
+import stsci.stimage as stimage
+from stsci.stimage import aio
+from stsci.stimage.test.util import make_lists
+
+def test_async_results():
+    input, ref = make_lists(500)
+
+    async def main():
+        matches = await aio.xyxymatch_async(
+            input, ref, origin=(3.0, -2.0), tolerance=2.0)
+        fit, output = await aio.geomap_async(input, ref, fit_geometry='rscale')
+        return matches, fit, output
+
+    matches, fit, output = asyncio.run(main())
+    assert np.all(matches == stimage.xyxymatch(
+        input, ref, origin=(3.0, -2.0), tolerance=2.0))
+    fit2, output2 = stimage.geomap(input, ref, fit_geometry='rscale')
+    assert np.all(output == output2)
+    assert np.all(fit.xcoeff == fit2.xcoeff)
+
+def test_bounded_concurrency():
+    lock = threading.Lock()
+    state = {'running': 0, 'max': 0}
+
+    def work(i):
+        with lock:
+            state['running'] += 1
+            state['max'] = max(state['max'], state['running'])
+        time.sleep(0.02)
+        with lock:
+            state['running'] -= 1
+        return i
+
+    with aio.Executor(max_workers=2) as executor:
+        async def main():
+            return await asyncio.gather(
+                *[executor.run(work, i) for i in range(6)])
+
+        assert asyncio.run(main()) == list(range(6))
+        # The executor can be used again from a new event loop
+        assert asyncio.run(main()) == list(range(6))
+        assert executor.running == 0 and executor.waiting == 0
+    assert state['max'] == 2
+
+def test_cancel():
+    started = []
+    finished = []
+
+    def work(name):
+        started.append((name, time.time()))
+        time.sleep(0.1)
+        finished.append((name, time.time()))
+        return name
+
+    with aio.Executor(max_workers=1) as executor:
+        async def main():
+            a = asyncio.ensure_future(executor.run(work, 'a'))
+            b = asyncio.ensure_future(executor.run(work, 'b'))
+            await asyncio.sleep(0.02)
+            assert executor.running == 1 and executor.waiting == 1
+
+            # b is still waiting for the worker, so it never runs
+            b.cancel()
+            # a is running, so it runs to the end, keeping the worker
+            a.cancel()
+            for task in (a, b):
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                else:
+                    assert False
+            assert executor.running == 1
+
+            return await executor.run(work, 'c')
+
+        assert asyncio.run(main()) == 'c'
+
+    assert [name for name, t in started] == ['a', 'c']
+    assert started[1][1] >= finished[0][1]
+
+def test_event_loop_not_blocked():
+    input, ref = make_lists(20000)
+
+    async def main():
+        ticks = 0
+        fit = asyncio.ensure_future(aio.geomap_async(
+            input, ref, xxorder=12, xyorder=12, yxorder=12, yyorder=12))
+        while not fit.done():
+            await asyncio.sleep(0.001)
+            ticks += 1
+        await fit
+        return ticks
+
+    assert asyncio.run(main()) > 1
+
+def test_shared_matcher():
+    input, ref = make_lists(500)
+    matcher = stimage.Matcher(origin=(3.0, -2.0), tolerance=2.0)
+    expected = matcher(input, ref)
+    results = []
+
+    def work():
+        for i in range(20):
+            results.append(np.all(matcher(input, ref) == expected))
+
+    threads = [threading.Thread(target=work) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 80 and all(results)
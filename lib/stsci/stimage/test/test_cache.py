@@ -0,0 +1,146 @@
+# Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+import shutil
+import tempfile
+
+import numpy as np
+import stsci.stimage as stimage
+from stsci.stimage.cache import ResultCache
+from stsci.stimage.test.util import make_lists
+
+def test_cache_xyxymatch():
+    input, ref = make_lists(200)
+    cache = ResultCache()
+
+    r = stimage.xyxymatch(input, ref, origin=(3.0, -2.0), tolerance=2.0)
+    r1 = cache.xyxymatch(input, ref, origin=(3.0, -2.0), tolerance=2.0)
+    assert cache.misses == 1 and cache.hits == 0
+    assert np.all(r1 == r)
+
+    # Spelling out a default is the same call
+    r2 = cache.xyxymatch(input, ref, origin=(3.0, -2.0), tolerance=2.0,
+                         algorithm='tolerance')
+    assert cache.misses == 1 and cache.hits == 1
+    assert np.all(r2 == r)
+
+    # The returned arrays are copies
+    r2['input_x'] = 0.0
+    r3 = cache.xyxymatch(input, ref, origin=(3.0, -2.0), tolerance=2.0)
+    assert np.all(r3 == r)
+
+    # Changing a parameter or a coordinate is a different call
+    cache.xyxymatch(input, ref, origin=(3.0, -2.0), tolerance=1.0)
+    input[0, 0] += 1e-9
+    cache.xyxymatch(input, ref, origin=(3.0, -2.0), tolerance=2.0)
+    assert cache.misses == 3 and cache.hits == 2
+    assert len(cache) == 3
+
+def test_cache_geomap():
+    input, ref = make_lists(200)
+    cache = ResultCache()
+
+    fit, output = stimage.geomap(input, ref, fit_geometry='rscale')
+    for i in range(2):
+        fit1, output1 = cache.geomap(input, ref, fit_geometry='rscale')
+        assert np.all(output1 == output)
+        assert np.all(fit1.xcoeff == fit.xcoeff)
+        assert np.all(fit1.rms == fit.rms)
+        assert fit1.fit_geometry == fit.fit_geometry
+        fit1.xcoeff[:] = 0.0
+    assert cache.misses == 1 and cache.hits == 1
+
+def test_cache_lru():
+    input, ref = make_lists(200)
+    nbytes = stimage.xyxymatch(input, ref, tolerance=5.0).nbytes
+    cache = ResultCache(maxsize=int(nbytes * 2.5))
+
+    for tolerance in (5.0, 6.0, 5.0, 7.0):
+        cache.xyxymatch(input, ref, tolerance=tolerance)
+    assert len(cache) == 2
+    assert cache.nbytes <= cache.maxsize
+
+    # 6.0 was the least recently used
+    cache.xyxymatch(input, ref, tolerance=5.0)
+    assert cache.hits == 2
+    cache.xyxymatch(input, ref, tolerance=6.0)
+    assert cache.hits == 2
+
+def test_cache_disk():
+    input, ref = make_lists(200)
+    directory = tempfile.mkdtemp()
+    try:
+        cache = ResultCache(directory=directory)
+        r = cache.xyxymatch(input, ref, origin=(3.0, -2.0), tolerance=2.0)
+        fit, output = cache.geomap(input, ref, fit_geometry='general')
+
+        # A new cache, as in a later run, finds the results on disk
+        cache = ResultCache(directory=directory)
+        r1 = cache.xyxymatch(input, ref, origin=(3.0, -2.0), tolerance=2.0)
+        fit1, output1 = cache.geomap(input, ref, fit_geometry='general')
+        assert cache.hits == 2 and cache.misses == 0
+        assert r1.dtype == r.dtype
+        assert np.all(r1 == r)
+        assert np.all(output1 == output)
+        for name in ('rms', 'shift', 'mag', 'rotation', 'xcoeff', 'ycoeff',
+                     'x2coeff', 'y2coeff'):
+            assert np.all(getattr(fit1, name) == getattr(fit, name))
+        assert fit1.fit_geometry == 'general'
+        assert isinstance(fit1, stimage.GeomapResults)
+
+        cache.clear(disk=True)
+        cache.geomap(input, ref, fit_geometry='general')
+        assert cache.misses == 1
+    finally:
+        shutil.rmtree(directory)
+
+def test_cache_prepared():
+    input, ref = make_lists(200)
+    other = make_lists(200, seed=1)[1]
+    cache = ResultCache()
+
+    # A PreparedReference is keyed on its contents, not its identity
+    key = cache.key(stimage.xyxymatch, input,
+                    stimage.PreparedReference.create(ref))
+    assert key == cache.key(stimage.xyxymatch, input,
+                            stimage.PreparedReference.create(ref))
+    assert key != cache.key(stimage.xyxymatch, input,
+                            stimage.PreparedReference.create(other))
+
+    r = cache.xyxymatch(input, stimage.PreparedReference.create(ref),
+                        origin=(3.0, -2.0), tolerance=2.0)
+    assert np.all(r == stimage.xyxymatch(input, ref, origin=(3.0, -2.0),
+                                         tolerance=2.0))
+
+    try:
+        cache.key(stimage.xyxymatch, input, ref, origin=object())
+    except TypeError:
+        pass
+    else:
+        assert False, "An object was keyed on its repr"
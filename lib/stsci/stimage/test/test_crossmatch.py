@@ -0,0 +1,57 @@
+# Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+from __future__ import print_function
+
+import numpy as np
+import stsci.stimage as stimage
+
+def test_crossmatch_epochs():
+    np.random.seed(0)
+    truth = np.random.random((500, 2)) * 1000.0
+    shifts = [(0.0, 0.0), (12.0, -4.0), (-7.5, 3.0)]
+    catalogs = []
+    for i, shift in enumerate(shifts):
+        if i == 0:
+            order = np.arange(len(truth))
+        else:
+            order = np.random.permutation(len(truth))
+        catalogs.append(
+            truth[order] - shift + np.random.normal(0.0, 0.01, truth.shape))
+
+    ids = stimage.crossmatch_epochs(
+        catalogs, tolerance=0.5, ref_origins=shifts)
+
+    assert len(ids) == 3
+    assert ids[0].tolist() == list(range(500))
+    for catalog, shift, catalog_ids in zip(catalogs, shifts, ids):
+        assert len(catalog_ids) == len(catalog)
+        # Each detection is linked to the star it was generated from
+        offset = catalog + shift - truth[catalog_ids]
+        assert np.all(np.hypot(offset[:, 0], offset[:, 1]) < 0.5)
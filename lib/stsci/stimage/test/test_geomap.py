@@ -30,6 +30,46 @@
 import numpy as np
 import stsci.stimage as stimage
 
+def test_general_surface():
+    # A quadratic distortion is reproduced exactly by every function
+    np.random.seed(0)
+    ref = np.random.random((200, 2)) * 1000.0
+    x, y = ref[:, 0], ref[:, 1]
+    input = np.column_stack((
+        3.0 + 1.001 * x - 0.002 * y + 1e-6 * x * y,
+        -2.0 + 0.002 * x + 0.999 * y + 2e-6 * x * x))
+
+    for function in ('polynomial', 'legendre', 'chebyshev'):
+        fit, output = stimage.geomap(
+            input, ref, fit_geometry='general', function=function,
+            xxorder=3, xyorder=3, yxorder=3, yyorder=3)
+        assert np.all(np.asarray(fit.rms) < 1e-9)
+        assert np.allclose(output['fit_x'], input[:, 0], rtol=0, atol=1e-9)
+        assert np.allclose(output['fit_y'], input[:, 1], rtol=0, atol=1e-9)
+        assert np.allclose(output['resid_x'], 0.0, rtol=0, atol=1e-9)
+
+def test_linear_geometries():
+    np.random.seed(1)
+    ref = np.random.random((200, 2)) * 1000.0
+    theta = np.radians(30.0)
+    rotation = np.array([[np.cos(theta), np.sin(theta)],
+                         [-np.sin(theta), np.cos(theta)]])
+    input = 1.2 * np.dot(ref, rotation) + (10.0, -5.0)
+
+    for fit_geometry in ('rscale', 'rxyscale', 'general'):
+        fit, output = stimage.geomap(input, ref, fit_geometry=fit_geometry)
+        assert np.allclose(fit.shift, (10.0, -5.0))
+        assert np.allclose(fit.mag, (1.2, 1.2))
+        assert np.allclose(fit.rotation, (330.0, 330.0))
+        assert np.all(np.asarray(fit.rms) < 1e-9)
+
+    # An outlier is rejected, and does not disturb the fit
+    input[7] += 50.0
+    fit, output = stimage.geomap(input, ref, fit_geometry='rscale',
+                                 maxiter=3, reject=3.0)
+    assert np.allclose(fit.mag, (1.2, 1.2))
+    assert np.all(np.asarray(fit.rms) < 1e-9)
+
 # def test_same():
 #     np.random.seed(0)
 #     x = np.random.random((512, 2))
@@ -42,5 +82,256 @@ import stsci.stimage as stimage
 
 #     assert False
 
+def test_fitter():
+    np.random.seed(0)
+    ref = np.random.random((100, 2)) * 1000.0
+    input = ref * 1.001 + (3.0, -2.0)
+
+    fitter = stimage.Fitter(fit_geometry='rscale', maxiter=3, reject=3.0)
+    fit, output = stimage.geomap(input, ref, fit_geometry='rscale',
+                                 maxiter=3, reject=3.0)
+    for i in range(3):
+        fit2, output2 = fitter(input, ref)
+        assert np.all(output2 == output)
+        assert np.all(fit2.xcoeff == fit.xcoeff)
+        assert fit2.fit_geometry == fit.fit_geometry
+
+def make_distorted(n=300, seed=0):
+    np.random.seed(seed)
+    ref = np.random.random((n, 2)) * 2048.0
+    x, y = ref[:, 0], ref[:, 1]
+    input = np.column_stack((
+        3.0 + 1.001 * x + 0.002 * y + 1e-9 * x ** 3 + 1e-9 * x * y * y,
+        -2.0 - 0.001 * x + 0.999 * y + 2e-6 * y * y))
+    input += np.random.normal(0.0, 0.01, input.shape)
+    return input, ref
+
+def test_order_auto():
+    input, ref = make_distorted()
+
+    for criterion in ('bic', 'aic', 'cv'):
+        fit, output = stimage.geomap(
+            input, ref, function='legendre', order='auto', max_order=6,
+            criterion=criterion)
+        assert list(fit.orders) == [4, 4, 3, 3]
+        assert list(fit.scores['order']) == [2, 3, 4, 5, 6]
+        assert np.all(np.diff(fit.scores['chisq_x']) <= 0.0)
+        assert np.all(np.diff(fit.scores['nxcoeff']) > 0)
+        assert np.all(np.isfinite(fit.scores['cv_x'])) == (criterion == 'cv')
+
+        # The same as fitting the chosen orders
+        fit2, output2 = stimage.geomap(
+            input, ref, function='legendre', xxorder=4, xyorder=4,
+            yxorder=3, yyorder=3)
+        assert np.allclose(fit.x2coeff, fit2.x2coeff)
+        assert np.allclose(output['fit_x'], output2['fit_x'])
+        assert np.allclose(output['fit_y'], output2['fit_y'])
+        assert len(fit2.scores) == 0
+        assert list(fit2.orders) == [4, 4, 3, 3]
+
+        # The sums of squares match the rms of the chosen fit
+        assert np.allclose(
+            fit.scores['chisq_x'][2], fit2.rms[0] ** 2 * (len(ref) - 1))
+
+    fitter = stimage.Fitter(order='auto', max_order=6)
+    fit, output = fitter(input, ref)
+    assert list(fit.orders) == [4, 4, 3, 3]
+
+def test_order_auto_invalid():
+    input, ref = make_distorted()
+    for kwargs, exception in [
+            ({'order': 'best'}, ValueError),
+            ({'order': 'auto', 'criterion': 'r2'}, ValueError),
+            ({'order': 'auto', 'max_order': 1}, ValueError),
+            ({'order': 'auto', 'criterion': 'cv', 'nfolds': 1},
+             ValueError)]:
+        try:
+            stimage.geomap(input, ref, **kwargs)
+        except exception:
+            pass
+        else:
+            assert False, "%r was accepted" % kwargs
+        try:
+            stimage.Fitter(**kwargs)
+        except exception:
+            pass
+        else:
+            assert False, "%r was accepted by Fitter" % kwargs
+
+def test_uncertainty():
+    input, ref = make_distorted()
+    orders = dict(function='legendre', xxorder=4, xyorder=4,
+                  yxorder=3, yyorder=3)
+
+    fit, output = stimage.geomap(input, ref, **orders)
+    assert fit.xcov.shape == (0, 0)
+    assert len(fit.resamples) == 0
+
+    # Each jackknife resample is the fit without its group.  Groups
+    # holding the extremes of the fit range are left out, as the range
+    # of the refit would differ.
+    jack, output2 = stimage.geomap(
+        input, ref, uncertainty='jackknife', nresamples=10, **orders)
+    assert np.all(output2 == output)
+    assert jack.resamples.shape == (10, 22)
+    extremes = set(np.concatenate(
+        (np.argmin(ref, axis=0), np.argmax(ref, axis=0))) % 10)
+    groups = [r for r in range(10) if r not in extremes]
+    assert len(groups) > 0
+    for r in groups:
+        mask = np.ones(len(ref), dtype=bool)
+        mask[r::10] = False
+        fit2, output2 = stimage.geomap(input[mask], ref[mask], **orders)
+        expected = np.concatenate(
+            (fit2.xcoeff, fit2.ycoeff, fit2.x2coeff, fit2.y2coeff))
+        assert np.allclose(jack.resamples[r], expected, rtol=0, atol=1e-9)
+
+    # The analytic and delete-one jackknife covariances agree
+    analytic, output2 = stimage.geomap(
+        input, ref, uncertainty='analytic', **orders)
+    jack, output2 = stimage.geomap(
+        input, ref, uncertainty='jackknife', nresamples=0, **orders)
+    for cov in ('xcov', 'ycov', 'x2cov', 'y2cov'):
+        a = getattr(analytic, cov)
+        j = getattr(jack, cov)
+        assert a.shape == j.shape
+        assert np.allclose(a, a.T)
+        assert np.all(np.diag(a) > 0.0)
+
+    for cov in ('xcov', 'ycov', 'x2cov', 'y2cov'):
+        ratio = np.sqrt(np.diag(getattr(jack, cov)) /
+                        np.diag(getattr(analytic, cov)))
+        assert np.all((ratio > 0.5) & (ratio < 2.0))
+
+    # The bootstrap does not depend on the number of threads
+    boot = [stimage.geomap(input, ref, uncertainty='bootstrap',
+                           nresamples=20, seed=1, nthreads=nthreads,
+                           **orders)[0]
+            for nthreads in (1, 3)]
+    assert np.all(boot[0].resamples == boot[1].resamples)
+    assert np.all(boot[0].x2cov == boot[1].x2cov)
+    assert np.all(np.isfinite(boot[0].x2cov))
+
+    # The analytic covariance of a rotation is not available
+    analytic, output2 = stimage.geomap(
+        input, ref, fit_geometry='rotate', uncertainty='analytic')
+    assert np.all(np.isnan(analytic.xcov))
+    boot, output2 = stimage.geomap(
+        input, ref, fit_geometry='rotate', uncertainty='bootstrap',
+        nresamples=20)
+    assert np.all(np.isfinite(boot.xcov))
+
+def test_uncertainty_general():
+    # The covariances of a general fit match the scatter of the fits
+    # to the same points with new errors
+    input, ref = make_distorted()
+    x, y = ref[:, 0], ref[:, 1]
+    exact = np.column_stack((
+        3.0 + 1.001 * x + 0.002 * y + 1e-9 * x ** 3 + 1e-9 * x * y * y,
+        -2.0 - 0.001 * x + 0.999 * y + 2e-6 * y * y))
+    orders = dict(function='legendre', xxorder=4, xyorder=4,
+                  yxorder=3, yyorder=3)
+
+    # The constant and linear terms of x2coeff are at 0, 1 and 4, and
+    # those of y2coeff at 0, 1 and 3
+    linear = {'x': [0, 1, 4], 'y': [0, 1, 3]}
+    coeffs = {'xcov': [], 'ycov': [], 'x2cov': [], 'y2cov': []}
+    np.random.seed(1)
+    for i in range(300):
+        noisy = exact + np.random.normal(0.0, 0.01, exact.shape)
+        fit, output = stimage.geomap(noisy, ref, **orders)
+        for axis in ('x', 'y'):
+            combined = getattr(fit, axis + '2coeff').copy()
+            combined[linear[axis]] += getattr(fit, axis + 'coeff')
+            coeffs[axis + 'cov'].append(getattr(fit, axis + 'coeff'))
+            coeffs[axis + '2cov'].append(combined)
+    expected = dict((cov, np.cov(np.array(c).T))
+                    for cov, c in coeffs.items())
+
+    for uncertainty in ('analytic', 'bootstrap', 'jackknife'):
+        fit, output = stimage.geomap(
+            input, ref, uncertainty=uncertainty, nresamples=200, **orders)
+        for cov in expected:
+            ratio = np.sqrt(np.diag(getattr(fit, cov)) /
+                            np.diag(expected[cov]))
+            assert np.all((ratio > 0.7) & (ratio < 1.4)), (uncertainty, cov)
+
+def test_uncertainty_invalid():
+    input, ref = make_distorted()
+    for kwargs, exception in [
+            ({'uncertainty': 'sandwich'}, ValueError),
+            ({'uncertainty': 'bootstrap', 'nresamples': 1}, ValueError),
+            ({'uncertainty': 'jackknife', 'nresamples': 1}, ValueError)]:
+        try:
+            stimage.geomap(input, ref, **kwargs)
+        except exception:
+            pass
+        else:
+            assert False, "%r was accepted" % kwargs
+        try:
+            stimage.Fitter(**kwargs)
+        except exception:
+            pass
+        else:
+            assert False, "%r was accepted by Fitter" % kwargs
+
+def test_robust():
+    input, ref = make_distorted(1000)
+    orders = dict(function='legendre', xxorder=4, xyorder=4,
+                  yxorder=3, yyorder=3)
+    fit, output = stimage.geomap(input, ref, **orders)
+
+    # Replace a quarter of the pairs with false ones
+    bad = np.random.random(len(ref)) < 0.25
+    contaminated = input.copy()
+    contaminated[bad] = np.random.random((bad.sum(), 2)) * 2048.0
+
+    tukey, output2 = stimage.geomap(
+        contaminated, ref, robust='tukey', **orders)
+    assert 0 < tukey.niter < 50
+    assert tukey.weights.shape == (len(ref),)
+    assert np.all(tukey.weights[bad] == 0.0)
+    assert np.all(tukey.weights[~bad] > 0.0)
+    assert np.all(np.isnan(output2['fit_x'][bad]))
+    assert np.allclose(
+        output2['fit_x'][~bad], output['fit_x'][~bad], rtol=0, atol=0.01)
+    assert np.allclose(
+        output2['fit_y'][~bad], output['fit_y'][~bad], rtol=0, atol=0.01)
+    assert np.all(tukey.rms < 0.015)
+
+    # The Huber weights of the false pairs are small, but not zero
+    huber, output2 = stimage.geomap(
+        contaminated, ref, robust='huber', **orders)
+    assert np.all(huber.weights > 0.0)
+    assert np.all(huber.weights[bad] < 0.1)
+    assert np.all(huber.weights[~bad] <= 1.0)
+
+    # Every geometry can be fit robustly
+    for fit_geometry in ('shift', 'xyscale', 'rotate', 'rscale',
+                         'rxyscale'):
+        tukey, output2 = stimage.geomap(
+            contaminated, ref, fit_geometry=fit_geometry, robust='tukey')
+        clip, output3 = stimage.geomap(
+            contaminated, ref, fit_geometry=fit_geometry, maxiter=50,
+            reject=3.0)
+        assert np.all(tukey.weights[bad] == 0.0)
+        assert np.all(tukey.rms < 2.0 * clip.rms)
+
+    # The weights of a rejection fit
+    clip, output2 = stimage.geomap(
+        contaminated, ref, maxiter=50, reject=3.0, **orders)
+    assert clip.niter > 0
+    assert np.all(np.isnan(output2['fit_x'][clip.weights == 0.0]))
+    assert np.all(clip.weights[bad] == 0.0)
+    assert fit.niter == 0
+    assert np.all(fit.weights == 1.0)
+
+    try:
+        stimage.geomap(input, ref, robust='cauchy')
+    except ValueError:
+        pass
+    else:
+        assert False, "robust='cauchy' was accepted"
+
 if __name__ == '__main__':
     test_same()
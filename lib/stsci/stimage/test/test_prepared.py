@@ -0,0 +1,170 @@
+# Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+import stsci.stimage as stimage
+from stsci.stimage import PreparedReference
+from stsci.stimage.test.util import make_lists
+
+def match_file(args):
+    path, input = args
+    with PreparedReference.open(path) as prepared:
+        return stimage.xyxymatch(
+            input, prepared, algorithm='triangles', tolerance=0.01)
+
+def match_shared(args):
+    from multiprocessing.shared_memory import SharedMemory
+    name, input = args
+    block = SharedMemory(name)
+    try:
+        prepared = PreparedReference(block.buf)
+        result = stimage.xyxymatch(input, prepared, tolerance=0.01,
+                                   algorithm='triangles', verify='ransac')
+        prepared.close()
+    finally:
+        block.close()
+    return result
+
+def test_prepared_matches():
+    input, ref = make_lists(500)
+    prepared = PreparedReference.create(ref, nmatch=30, tolerance=0.01)
+    assert len(prepared) == len(ref)
+    assert len(prepared.index) < len(ref)
+    assert prepared.nmatch == 30
+
+    r = stimage.xyxymatch(ref + 0.001, ref, tolerance=0.01)
+    r1 = stimage.xyxymatch(ref + 0.001, prepared, tolerance=0.01)
+    assert len(r) == len(prepared.index)
+    assert np.all(r1 == r)
+
+    for verify in ('reject', 'ransac'):
+        r = stimage.xyxymatch(input, ref, algorithm='triangles',
+                              tolerance=0.01, verify=verify)
+        r1 = stimage.xyxymatch(input, prepared, algorithm='triangles',
+                               tolerance=0.01, verify=verify)
+        assert len(r) > 0
+        assert np.all(r1 == r)
+
+    # Triangles built for other parameters are built again
+    r = stimage.xyxymatch(input, ref, algorithm='triangles', nmatch=20,
+                          tolerance=0.01)
+    r1 = stimage.xyxymatch(input, prepared, algorithm='triangles',
+                           nmatch=20, tolerance=0.01)
+    assert np.all(r1 == r)
+
+    try:
+        stimage.xyxymatch(input, prepared, separation=5.0)
+    except RuntimeError:
+        pass
+    else:
+        assert False, "A different separation was accepted"
+
+def test_prepared_buffers():
+    ref = make_lists(500)[1]
+    prepared = PreparedReference.create(ref, separation=5.0)
+    assert prepared.nmatch is None
+    expected = stimage.xyxymatch(ref + 0.001, ref, separation=5.0,
+                                 tolerance=0.01)
+    assert len(expected) > 0
+
+    buffer = bytearray(prepared.nbytes + 100)
+    prepared.copy_to(buffer)
+    copy = PreparedReference(buffer)
+    assert np.all(copy.ref == ref)
+    assert np.all(copy.index == prepared.index)
+    assert np.all(
+        stimage.xyxymatch(ref + 0.001, copy, separation=5.0,
+                          tolerance=0.01) == expected)
+
+    copy = pickle.loads(pickle.dumps(prepared))
+    assert np.all(copy.index == prepared.index)
+
+    try:
+        PreparedReference(bytes(100))
+    except ValueError:
+        pass
+    else:
+        assert False, "A buffer without a prepared reference was accepted"
+
+def test_prepared_file():
+    input, ref = make_lists(500)
+    prepared = PreparedReference.create(ref, nmatch=30, tolerance=0.01)
+    expected = stimage.xyxymatch(input, ref, algorithm='triangles',
+                                 tolerance=0.01)
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'catalog.ref')
+        prepared.save(path)
+        with PreparedReference.open(path) as opened:
+            assert opened.path == path
+            assert not opened.ref.flags.writeable
+            # Pickling one opened from a file only sends its path
+            assert len(pickle.dumps(opened)) < 1000
+            assert pickle.loads(pickle.dumps(opened)).path == path
+
+        pool = multiprocessing.Pool(2)
+        try:
+            for result in pool.map(match_file, [(path, input)] * 2):
+                assert np.all(result == expected)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        shutil.rmtree(directory)
+
+def test_prepared_shared_memory():
+    try:
+        from multiprocessing.shared_memory import SharedMemory
+    except ImportError:
+        return
+    input, ref = make_lists(500)
+    prepared = PreparedReference.create(ref, nmatch=30, tolerance=0.01)
+    expected = stimage.xyxymatch(input, ref, algorithm='triangles',
+                                 tolerance=0.01, verify='ransac')
+    # The block is made before the workers, so that they share the
+    # resource tracker that unlinks it
+    block = SharedMemory(create=True, size=prepared.nbytes)
+    try:
+        prepared.copy_to(block.buf)
+        pool = multiprocessing.Pool(2)
+        try:
+            for result in pool.map(match_shared, [(block.name, input)] * 2):
+                assert np.all(result == expected)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        block.close()
+        block.unlink()
@@ -0,0 +1,92 @@
+# Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+from __future__ import print_function
+
+import numpy as np
+import stsci.stimage as stimage
+
+def _make_sky(n=200, refpt=(150.0, 30.0), size=0.2):
+    np.random.seed(0)
+    return np.asarray(refpt) + (np.random.random((n, 2)) - 0.5) * size
+
+def test_project_roundtrip():
+    refpt = (150.0, 30.0)
+    sky = _make_sky(refpt=refpt)
+
+    for projection in ('tan', 'sin', 'stg', 'arc', 'zea'):
+        plane = stimage.project(sky, refpt, projection)
+        assert plane.shape == sky.shape
+        back = stimage.deproject(plane, refpt, projection)
+        assert np.allclose(back, sky, rtol=0.0, atol=1e-10)
+
+def test_project_tan():
+    refpt = (10.0, 0.0)
+    plane = stimage.project([[11.0, 0.0], [10.0, 1.0]], refpt, 'tan')
+    expected = np.degrees(np.tan(np.radians(1.0)))
+    assert np.allclose(plane, [[expected, 0.0], [0.0, expected]])
+
+def test_project_out_of_domain():
+    try:
+        stimage.project([[330.0, -30.0]], (150.0, 30.0), 'tan')
+    except RuntimeError:
+        pass
+    else:
+        assert False
+
+def test_geomap_projection():
+    refpt = (150.0, 30.0)
+    sky = _make_sky(refpt=refpt)
+    plane = stimage.project(sky, refpt, 'tan')
+
+    theta = np.radians(30.0)
+    scale = 3600.0 / 0.05
+    matrix = np.array([[np.cos(theta), -np.sin(theta)],
+                       [np.sin(theta), np.cos(theta)]]) * scale
+    pixels = np.dot(plane, matrix.T) + [2048.0, 1024.0]
+
+    fit, output = stimage.geomap(pixels, sky, projection='tan', refpt=refpt)
+
+    assert fit.projection == 'tan'
+    assert np.allclose(fit.refpt, refpt)
+    assert np.all(fit.rms < 1e-6)
+    assert np.allclose(fit.shift, [2048.0, 1024.0])
+    assert np.allclose(fit.mag, [scale, scale])
+    assert np.allclose(output['ref_x'], sky[:, 0])
+    assert np.allclose(output['fit_x'], pixels[:, 0])
+    assert np.allclose(output['fit_y'], pixels[:, 1])
+
+    # Without an explicit tangent point, the mean position is used
+    fit, output = stimage.geomap(pixels, sky, projection='tan')
+    assert np.allclose(fit.refpt, np.mean(sky, axis=0), atol=1e-3)
+    assert fit.rms[0] < 0.01 and fit.rms[1] < 0.01
+
+    fit, output = stimage.geomap(pixels, sky)
+    assert fit.projection == 'none'
+    assert np.all(np.isnan(fit.refpt))
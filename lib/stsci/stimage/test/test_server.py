@@ -0,0 +1,228 @@
+# Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+import os
+import shutil
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import stsci.stimage as stimage
+from stsci.stimage import PreparedReference
+from stsci.stimage.client import Client
+from stsci.stimage import server
+from stsci.stimage.server import Server, receive_message, send_message
+from stsci.stimage.test.util import make_lists
+
+class running_server(object):
+    """
+    A Server running on a thread, on a socket in a temporary directory
+    """
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'stimage.sock')
+        self.server = Server(self.path, max_workers=2)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.directory)
+
+def test_server_requests():
+    input, ref = make_lists()
+    with running_server() as running:
+        assert stat.S_IMODE(os.stat(running.path).st_mode) == 0o600
+        with Client(running.path) as client:
+            assert client.ping()
+            nunique = client.prepare('field', ref, nmatch=30, tolerance=0.01)
+            assert nunique == len(PreparedReference.create(ref).index)
+            assert client.catalogs() == {'field': len(ref)}
+
+            expected = stimage.xyxymatch(input, ref, algorithm='triangles',
+                                         tolerance=0.01)
+            for catalog in ('field', ref):
+                r = client.xyxymatch(input, catalog, algorithm='triangles',
+                                     tolerance=0.01)
+                assert r.dtype == expected.dtype
+                assert np.all(r == expected)
+
+            fit, output = stimage.geomap(input, ref, fit_geometry='rscale')
+            fit1, output1 = client.geomap(input, ref, fit_geometry='rscale')
+            assert isinstance(fit1, stimage.GeomapResults)
+            assert fit1.fit_geometry == fit.fit_geometry
+            assert np.all(fit1.xcoeff == fit.xcoeff)
+            assert np.all(output1 == output)
+
+            # Errors are raised again by the client, which can go on
+            # making requests
+            for call, error in (
+                    (lambda: client.xyxymatch(input, 'missing'), KeyError),
+                    (lambda: client.xyxymatch(input, ref, bogus=1),
+                     TypeError),
+                    (lambda: client.xyxymatch(input[:, :1], ref),
+                     TypeError)):
+                try:
+                    call()
+                except error:
+                    pass
+                else:
+                    assert False, "No %s was raised" % error.__name__
+
+            client.remove('field')
+            assert client.catalogs() == {}
+            assert client.ping()
+
+def test_server_clients():
+    input, ref = make_lists()
+    expected = stimage.xyxymatch(input, ref, algorithm='triangles',
+                                 tolerance=0.01)
+    results = []
+    with running_server() as running:
+        with Client(running.path) as client:
+            client.prepare('field', ref, nmatch=30, tolerance=0.01)
+
+        def match():
+            with Client(running.path) as client:
+                for i in range(5):
+                    results.append(client.xyxymatch(
+                        input, 'field', algorithm='triangles',
+                        tolerance=0.01))
+
+        threads = [threading.Thread(target=match) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert len(results) == 20
+    for r in results:
+        assert np.all(r == expected)
+
+def test_server_main():
+    input, ref = make_lists()
+    directory = tempfile.mkdtemp()
+    process = None
+    try:
+        catalog = os.path.join(directory, 'field.ref')
+        PreparedReference.create(ref).save(catalog)
+        path = os.path.join(directory, 'stimage.sock')
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'stsci.stimage.server', '--socket', path,
+             '--catalog', 'field=' + catalog])
+        for i in range(300):
+            if os.path.exists(path):
+                break
+            time.sleep(0.1)
+        with Client(path, timeout=60) as client:
+            assert client.catalogs() == {'field': len(ref)}
+            r = client.xyxymatch(ref + 0.001, 'field', tolerance=0.01)
+            assert np.all(r == stimage.xyxymatch(ref + 0.001, ref,
+                                                 tolerance=0.01))
+        process.terminate()
+        assert process.wait() == 0
+        assert not os.path.exists(path)
+    finally:
+        if process is not None and process.poll() is None:
+            process.kill()
+        shutil.rmtree(directory)
+
+def test_server_chunks():
+    a, b = socket.socketpair()
+    chunk = server._CHUNK
+    server._CHUNK = 7
+    try:
+        input, ref = make_lists(50)
+        send_message(a, ['xyxymatch', input, ref, {'tolerance': 0.01}])
+        message = receive_message(b)
+        assert message[0] == 'xyxymatch'
+        assert np.all(message[1] == input)
+        assert np.all(message[2] == ref)
+
+        # The length in the header is not allocated up front
+        a.sendall(server._HEADER.pack(b'STIM', 2, server.MAX_MESSAGE - 2))
+        a.close()
+        try:
+            receive_message(b)
+        except server.ProtocolError:
+            pass
+        else:
+            assert False, "A truncated message was accepted"
+    finally:
+        server._CHUNK = chunk
+        a.close()
+        b.close()
+
+def test_client_timeout():
+    directory = tempfile.mkdtemp()
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connections = []
+    try:
+        path = os.path.join(directory, 'stimage.sock')
+        listener.bind(path)
+        listener.listen(1)
+
+        def answer_slowly():
+            connection, address = listener.accept()
+            connections.append(connection)
+            receive_message(connection)
+            connection.sendall(server._HEADER.pack(b'STIM', 2, 0))
+
+        thread = threading.Thread(target=answer_slowly)
+        thread.start()
+        client = Client(path, timeout=0.5)
+        try:
+            client.ping()
+        except socket.timeout:
+            pass
+        else:
+            assert False, "No timeout was raised"
+        thread.join()
+
+        # The rest of the answer must not be taken for the next one
+        try:
+            client.ping()
+        except ConnectionError:
+            pass
+        else:
+            assert False, "The connection was reused after a timeout"
+        client.close()
+    finally:
+        for connection in connections:
+            connection.close()
+        listener.close()
+        shutil.rmtree(directory)
@@ -0,0 +1,145 @@
+# Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+import stsci.stimage as stimage
+from stsci.stimage.solutions import Solutions
+from stsci.stimage.test.util import make_lists
+
+def make_fits():
+    input, ref = make_lists(200, distortion=1e-7)
+    fits = []
+    for fit_geometry, function, order in [
+            ('general', 'legendre', 4),
+            ('general', 'polynomial', 3),
+            ('shift', 'chebyshev', 2),
+            ('rxyscale', 'legendre', 2)]:
+        fit, output = stimage.geomap(
+            input, ref, fit_geometry=fit_geometry, function=function,
+            xxorder=order, xyorder=order, yxorder=order, yyorder=order)
+        fits.append((fit, output))
+    return fits
+
+def assert_same_fit(fit1, fit):
+    for name in ('fit_geometry', 'function', 'projection'):
+        assert getattr(fit1, name) == getattr(fit, name)
+    for name in ('refpt', 'rms', 'mean_ref', 'mean_input', 'shift', 'mag',
+                 'rotation', 'xcoeff', 'ycoeff', 'x2coeff', 'y2coeff',
+                 'surfaces'):
+        assert np.array_equal(getattr(fit1, name), getattr(fit, name),
+                              equal_nan=True)
+
+def test_evaluate():
+    for fit, output in make_fits():
+        ref = np.column_stack((output['ref_x'], output['ref_y']))
+        xy = fit.evaluate(ref)
+        assert xy.shape == (len(ref), 2)
+        assert np.allclose(xy[:, 0], output['fit_x'], rtol=0, atol=1e-9)
+        assert np.allclose(xy[:, 1], output['fit_y'], rtol=0, atol=1e-9)
+
+    # A second-order surface was fit, and described
+    fit = make_fits()[0][0]
+    assert fit.surfaces.shape == (4, 7)
+    assert np.all(fit.surfaces[:, 0] == [2, 2, 4, 4])
+
+def test_evaluate_projection():
+    np.random.seed(1)
+    sky = np.column_stack((
+        150.0 + np.random.random(100) * 0.1,
+        2.0 + np.random.random(100) * 0.1))
+    input = (sky - (150.05, 2.05)) * 3600.0 + 1024.0
+    fit, output = stimage.geomap(input, sky, projection='tan')
+    xy = fit.evaluate(sky)
+    assert np.allclose(xy[:, 0], output['fit_x'], rtol=0, atol=1e-9)
+    assert np.allclose(xy[:, 1], output['fit_y'], rtol=0, atol=1e-9)
+
+def test_evaluate_invalid():
+    fit = stimage.GeomapResults()
+    try:
+        fit.evaluate(np.zeros((1, 2)))
+    except ValueError:
+        pass
+    else:
+        assert False, "An empty result was evaluated"
+
+    fit = make_fits()[0][0]
+    fit.xcoeff = fit.xcoeff[:-1]
+    try:
+        fit.evaluate(np.zeros((1, 2)))
+    except RuntimeError:
+        pass
+    else:
+        assert False, "Coefficients of the wrong surface were evaluated"
+
+def test_pickle():
+    for fit, output in make_fits():
+        for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+            fit1 = pickle.loads(pickle.dumps(fit, protocol))
+            assert type(fit1) is stimage.GeomapResults
+            assert_same_fit(fit1, fit)
+
+        if pickle.HIGHEST_PROTOCOL >= 5:
+            # The arrays are passed out-of-band
+            buffers = []
+            data = pickle.dumps(fit, 5, buffer_callback=buffers.append)
+            assert len(buffers) > 0
+            fit1 = pickle.loads(data, buffers=buffers)
+            assert_same_fit(fit1, fit)
+
+def test_solutions():
+    fits = make_fits()
+    solutions = Solutions.create([fit for fit, output in fits])
+    assert len(solutions) == len(fits)
+    assert np.all(solutions.records['rms'][0] == fits[0][0].rms)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'chips.fit')
+        solutions.save(path)
+        with Solutions.open(path) as solutions1:
+            for i, (fit, output) in enumerate(fits):
+                fit1 = solutions1[i]
+                assert_same_fit(fit1, fit)
+                ref = np.column_stack((output['ref_x'], output['ref_y']))
+                assert np.all(fit1.evaluate(ref) == fit.evaluate(ref))
+            assert_same_fit(solutions1[-1], fits[-1][0])
+
+        try:
+            Solutions(b'not geomap solutions at all' * 4)
+        except ValueError:
+            pass
+        else:
+            assert False, "A buffer of other data was accepted"
+    finally:
+        shutil.rmtree(tmpdir)
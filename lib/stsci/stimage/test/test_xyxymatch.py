@@ -73,3 +73,207 @@ def test_different():
         assert r['ref_idx'][i] < 512
 
 
+
+def test_tiled():
+    np.random.seed(0)
+    x = np.random.random((2048, 2)) * 100.0
+    y = x + np.random.normal(0.0, 0.1, (2048, 2))
+
+    r = stimage.xyxymatch(x, y, algorithm='tolerance', tolerance=0.5,
+                          separation=0.0)
+
+    for tile_size, nthreads in [(0.0, 0), (7.0, 1), (3.0, 4)]:
+        t = stimage.xyxymatch(x, y, algorithm='tolerance', tolerance=0.5,
+                              separation=0.0, tile_size=tile_size,
+                              nthreads=nthreads)
+        assert np.all(t == r)
+
+def test_offsets():
+    np.random.seed(0)
+    y = np.random.random((1000, 2)) * 1000.0
+    x = y - (25.0, -40.0) + np.random.normal(0.0, 0.05, (1000, 2))
+
+    r = stimage.xyxymatch(x, y, algorithm='offsets', tolerance=0.5,
+                          separation=0.0,
+                          search_radius=100.0)
+
+    assert len(r) > 950
+    assert np.all(r['input_idx'] == r['ref_idx'])
+
+def test_offsets_wide():
+    # A search radius too large for bins of width tolerance, and the
+    # default radius
+    np.random.seed(0)
+    y = np.random.random((4000, 2)) * 4096.0
+    x = y - (312.0, -209.0) + np.random.normal(0.0, 0.05, (4000, 2))
+
+    for search_radius in (6000.0, 0.0):
+        r = stimage.xyxymatch(x, y, algorithm='offsets', tolerance=1.0,
+                              separation=0.0, search_radius=search_radius)
+
+        assert len(r) == 4000
+        assert np.all(r['input_idx'] == r['ref_idx'])
+
+def test_quads():
+    np.random.seed(0)
+    y = np.random.random((2000, 2)) * 2048.0
+    theta = np.radians(-71.0)
+    rotation = np.array([[np.cos(theta), np.sin(theta)],
+                         [-np.sin(theta), np.cos(theta)]])
+    x = 1.7 * np.dot(y, rotation) + (50.0, 20.0)
+    x += np.random.normal(0.0, 0.05, x.shape)
+
+    r = stimage.xyxymatch(x, y, algorithm='quads', tolerance=1.0,
+                          separation=0.0)
+
+    assert len(r) > 1900
+    assert np.mean(r['input_idx'] == r['ref_idx']) > 0.99
+
+
+def test_triangles_ransac():
+    np.random.seed(0)
+    y = np.random.random((30, 2)) * 2048.0
+    theta = np.radians(33.0)
+    rotation = np.array([[np.cos(theta), np.sin(theta)],
+                         [-np.sin(theta), np.cos(theta)]])
+    x = 0.8 * np.dot(y, rotation) + (50.0, 20.0)
+    x[:, 1] *= -1.0
+    x[::5] = np.random.random((6, 2)) * 2048.0
+
+    r = stimage.xyxymatch(x, y, algorithm='triangles', tolerance=1.0,
+                          separation=0.0, verify='ransac')
+
+    assert len(r) == 24
+    assert np.all(r['input_idx'] == r['ref_idx'])
+
+
+def test_triangles_select():
+    np.random.seed(1)
+    y = np.random.random((2000, 2)) * 2048.0
+    flux = np.random.random(2000)
+    theta = np.radians(33.0)
+    rotation = np.array([[np.cos(theta), np.sin(theta)],
+                         [-np.sin(theta), np.cos(theta)]])
+    x = 0.8 * np.dot(y, rotation) + (50.0, 20.0)
+
+    r = stimage.xyxymatch(x, y, algorithm='triangles', tolerance=0.1,
+                          separation=0.0, verify='ransac',
+                          select='brightest', input_weights=flux,
+                          ref_weights=flux)
+
+    assert len(r) == 2000
+    assert np.all(r['input_idx'] == r['ref_idx'])
+
+    try:
+        stimage.xyxymatch(x, y, algorithm='triangles', select='brightest')
+    except RuntimeError:
+        pass
+    else:
+        assert False, "select='brightest' without weights should fail"
+
+
+def test_triangles_adaptive():
+    np.random.seed(2)
+    y = np.random.random((500, 2)) * 2048.0
+    flux = np.random.random(500)
+    theta = np.radians(-12.0)
+    rotation = np.array([[np.cos(theta), np.sin(theta)],
+                         [-np.sin(theta), np.cos(theta)]])
+    x = 1.1 * np.dot(y, rotation) + (50.0, 20.0)
+
+    r = stimage.xyxymatch(x, y, algorithm='triangles', tolerance=0.1,
+                          separation=0.0, nmatch=100, select='brightest',
+                          input_weights=flux, ref_weights=flux,
+                          adaptive=True)
+    fixed = stimage.xyxymatch(x, y, algorithm='triangles', tolerance=0.1,
+                              separation=0.0, nmatch=100,
+                              select='brightest', input_weights=flux,
+                              ref_weights=flux)
+
+    assert len(fixed) == 100
+    assert len(r) >= len(fixed)
+    assert np.all(r['input_idx'] == r['ref_idx'])
+
+    r = stimage.xyxymatch(x, y, algorithm='triangles', tolerance=0.1,
+                          separation=0.0, nmatch=100, select='brightest',
+                          input_weights=flux, ref_weights=flux,
+                          verify='ransac', adaptive=True)
+
+    assert len(r) == 500
+    assert np.all(r['input_idx'] == r['ref_idx'])
+
+def test_triangles_threads():
+    np.random.seed(3)
+    y = np.random.random((200, 2)) * 2048.0
+    theta = np.radians(5.0)
+    rotation = np.array([[np.cos(theta), np.sin(theta)],
+                         [-np.sin(theta), np.cos(theta)]])
+    x = 0.9 * np.dot(y, rotation) + (-30.0, 12.0)
+
+    r1 = stimage.xyxymatch(x, y, algorithm='triangles', tolerance=0.1,
+                           separation=0.0, nmatch=40)
+    r4 = stimage.xyxymatch(x, y, algorithm='triangles', tolerance=0.1,
+                           separation=0.0, nmatch=40, nthreads=4)
+
+    assert len(r1) > 0
+    assert np.all(r1 == r4)
+    assert np.all(r1['input_idx'] == r1['ref_idx'])
+
+def test_triangles_memory_limit():
+    estimate = stimage.estimate_triangles(1000, 1000, nmatch=40)
+    assert estimate['nref_triangles'] == 9880
+    assert estimate['peak_bytes'] > 0
+    assert stimage.estimate_triangles(
+        1000, 1000, nmatch=80)['peak_bytes'] > estimate['peak_bytes']
+
+    np.random.seed(4)
+    y = np.random.random((1000, 2)) * 2048.0
+    flux = np.random.random(1000)
+    x = y + (10.0, -4.0)
+
+    small = stimage.estimate_triangles(1000, 1000, nmatch=20)['peak_bytes']
+    r = stimage.xyxymatch(x, y, algorithm='triangles', tolerance=0.1,
+                          separation=0.0, nmatch=40, select='brightest',
+                          input_weights=flux, ref_weights=flux,
+                          memory_limit=small)
+    assert len(r) == 20
+    assert np.all(r['input_idx'] == r['ref_idx'])
+
+    try:
+        stimage.xyxymatch(x, y, algorithm='triangles', nmatch=40,
+                          memory_limit=100)
+    except RuntimeError:
+        pass
+    else:
+        assert False
+
+def test_matcher():
+    np.random.seed(5)
+    y = np.random.random((150, 2)) * 2048.0
+    flux = np.random.random(150)
+    x = y + (10.0, -4.0)
+
+    params = dict(algorithm='triangles', tolerance=0.1, separation=0.0,
+                  nmatch=30, select='brightest')
+    matcher = stimage.Matcher(**params)
+    expected = stimage.xyxymatch(x, y, input_weights=flux, ref_weights=flux,
+                                 **params)
+    for i in range(3):
+        r = matcher(x, y, flux, ref_weights=flux)
+        assert np.all(r == expected)
+    assert len(r) > 0
+
+    try:
+        stimage.Matcher(algorithm='nonsense')
+    except ValueError:
+        pass
+    else:
+        assert False
+
+    try:
+        matcher(x)
+    except TypeError:
+        pass
+    else:
+        assert False
+
@@ -0,0 +1,312 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <assert.h>
+#include <math.h>
+
+#include "immatch/crossmatch.h"
+#include "lib/xysort.h"
+
+/* The detections are binned into square cells the size of the
+   linking length, so every friend of a detection is in its own cell
+   or one of the 8 surrounding ones.  The cells are found by sorting
+   the detections by cell with xysort_index, which leaves each cell as
+   a contiguous run ordered by (row, column). */
+
+typedef struct {
+    size_t* parent;
+    size_t* size;
+} union_find_t;
+
+static size_t
+union_find_root(
+        union_find_t* const uf,
+        size_t i) {
+
+    /* Path halving */
+    while (uf->parent[i] != i) {
+        uf->parent[i] = uf->parent[uf->parent[i]];
+        i = uf->parent[i];
+    }
+
+    return i;
+}
+
+static void
+union_find_union(
+        union_find_t* const uf,
+        const size_t i,
+        const size_t j) {
+
+    size_t a = union_find_root(uf, i);
+    size_t b = union_find_root(uf, j);
+    size_t tmp;
+
+    if (a == b) {
+        return;
+    }
+
+    /* Union by size */
+    if (uf->size[a] < uf->size[b]) {
+        tmp = a;
+        a = b;
+        b = tmp;
+    }
+    uf->parent[b] = a;
+    uf->size[a] += uf->size[b];
+}
+
+/* Find the start of the first cell >= (col, row) in the sorted cell
+   list, or ncells if there is none */
+static size_t
+crossmatch_find_cell(
+        const size_t ncells,
+        const coord_t* const cells,
+        const size_t* const order,
+        const double col,
+        const double row) {
+
+    size_t lo = 0;
+    size_t hi = ncells;
+    size_t mid;
+    const coord_t* c;
+
+    while (lo < hi) {
+        mid = lo + (hi - lo) / 2;
+        c = &cells[order[mid]];
+        if (c->y < row || (c->y == row && c->x < col)) {
+            lo = mid + 1;
+        } else {
+            hi = mid;
+        }
+    }
+
+    return lo;
+}
+
+int
+crossmatch_epochs(
+        const size_t nepochs,
+        const size_t* const ncoords,
+        const coord_t* const * const coords,
+        const lintransform_t* const transforms,
+        const double tolerance,
+        size_t* const ids,
+        size_t* const nsources,
+        stimage_error_t* const error) {
+
+    const double tolerance2 = tolerance * tolerance;
+    /* Pad the cells a little so rounding can't put friends two cells
+       apart */
+    const double cell_size  = tolerance * (1.0 + 1e-6);
+    size_t       ntotal     = 0;
+    size_t       nfinite    = 0;
+    coord_t*     frame      = NULL;
+    coord_t*     cells      = NULL;
+    size_t*      finite     = NULL;
+    size_t*      order      = NULL;
+    size_t*      label      = NULL;
+    union_find_t uf         = {NULL, NULL};
+    size_t       i, j, k, e, start, end, nstart, root;
+    const coord_t* a;
+    const coord_t* b;
+    const coord_t* c;
+    double       col, row, dx, dy;
+    int          dcol;
+    int          status     = 1;
+
+    assert(ncoords || nepochs == 0);
+    assert(coords || nepochs == 0);
+    assert(ids);
+    assert(nsources);
+    assert(error);
+
+    *nsources = 0;
+
+    if (!(tolerance > 0.0) || !isfinite(tolerance)) {
+        stimage_error_set_message(error, "tolerance must be > 0");
+        goto exit;
+    }
+
+    for (e = 0; e < nepochs; ++e) {
+        ntotal += ncoords[e];
+    }
+
+    if (ntotal == 0) {
+        status = 0;
+        goto exit;
+    }
+
+    /****************************************
+     PUT ALL EPOCHS IN THE COMMON FRAME
+    */
+    frame = malloc_with_error(ntotal * sizeof(coord_t), error);
+    if (frame == NULL) goto exit;
+
+    for (e = 0, i = 0; e < nepochs; i += ncoords[e], ++e) {
+        for (j = 0; j < ncoords[e]; ++j) {
+            if (transforms != NULL && coord_is_finite(&coords[e][j])) {
+                apply_lintransform(&transforms[e], 1, &coords[e][j], &frame[i + j]);
+            } else {
+                frame[i + j] = coords[e][j];
+            }
+        }
+    }
+
+    /****************************************
+     BUILD THE SPATIAL INDEX
+    */
+    cells = malloc_with_error(ntotal * sizeof(coord_t), error);
+    if (cells == NULL) goto exit;
+    finite = malloc_with_error(ntotal * sizeof(size_t), error);
+    if (finite == NULL) goto exit;
+    order = malloc_with_error(ntotal * sizeof(size_t), error);
+    if (order == NULL) goto exit;
+
+    for (i = 0; i < ntotal; ++i) {
+        if (coord_is_finite(&frame[i])) {
+            cells[nfinite].x = floor(frame[i].x / cell_size);
+            cells[nfinite].y = floor(frame[i].y / cell_size);
+            finite[nfinite] = i;
+            ++nfinite;
+        }
+    }
+
+    if (xysort_index(nfinite, cells, order, 1, error)) goto exit;
+
+    /****************************************
+     LINK FRIENDS
+    */
+    uf.parent = malloc_with_error(ntotal * sizeof(size_t), error);
+    if (uf.parent == NULL) goto exit;
+    uf.size = malloc_with_error(ntotal * sizeof(size_t), error);
+    if (uf.size == NULL) goto exit;
+
+    for (i = 0; i < ntotal; ++i) {
+        uf.parent[i] = i;
+        uf.size[i] = 1;
+    }
+
+    for (start = 0; start < nfinite; start = end) {
+        c = &cells[order[start]];
+        col = c->x;
+        row = c->y;
+        for (end = start + 1; end < nfinite; ++end) {
+            if (cells[order[end]].x != col || cells[order[end]].y != row) {
+                break;
+            }
+        }
+
+        /* Pairs within this cell */
+        for (i = start; i < end; ++i) {
+            a = &frame[finite[order[i]]];
+            for (j = i + 1; j < end; ++j) {
+                b = &frame[finite[order[j]]];
+                dx = a->x - b->x;
+                dy = a->y - b->y;
+                if (dx*dx + dy*dy <= tolerance2) {
+                    union_find_union(&uf, finite[order[i]], finite[order[j]]);
+                }
+            }
+        }
+
+        /* Pairs with the following neighbors: the next cell in this
+           row and the three cells in the next row.  The preceding
+           neighbors were already handled by their own cells. */
+        for (k = end; k < nfinite; ++k) {
+            c = &cells[order[k]];
+            if (c->y != row || c->x != col + 1.0) {
+                break;
+            }
+            b = &frame[finite[order[k]]];
+            for (i = start; i < end; ++i) {
+                a = &frame[finite[order[i]]];
+                dx = a->x - b->x;
+                dy = a->y - b->y;
+                if (dx*dx + dy*dy <= tolerance2) {
+                    union_find_union(&uf, finite[order[i]], finite[order[k]]);
+                }
+            }
+        }
+
+        for (dcol = -1; dcol <= 1; ++dcol) {
+            nstart = crossmatch_find_cell(
+                    nfinite, cells, order, col + (double)dcol, row + 1.0);
+            for (k = nstart; k < nfinite; ++k) {
+                c = &cells[order[k]];
+                if (c->y != row + 1.0 || c->x != col + (double)dcol) {
+                    break;
+                }
+                b = &frame[finite[order[k]]];
+                for (i = start; i < end; ++i) {
+                    a = &frame[finite[order[i]]];
+                    dx = a->x - b->x;
+                    dy = a->y - b->y;
+                    if (dx*dx + dy*dy <= tolerance2) {
+                        union_find_union(&uf, finite[order[i]], finite[order[k]]);
+                    }
+                }
+            }
+        }
+    }
+
+    /****************************************
+     NUMBER THE SOURCES
+    */
+    label = malloc_with_error(ntotal * sizeof(size_t), error);
+    if (label == NULL) goto exit;
+
+    for (i = 0; i < ntotal; ++i) {
+        label[i] = (size_t)-1;
+    }
+
+    for (i = 0; i < ntotal; ++i) {
+        root = union_find_root(&uf, i);
+        if (label[root] == (size_t)-1) {
+            label[root] = (*nsources)++;
+        }
+        ids[i] = label[root];
+    }
+
+    status = 0;
+
+ exit:
+
+    free(frame);
+    free(cells);
+    free(finite);
+    free(order);
+    free(label);
+    free(uf.parent);
+    free(uf.size);
+
+    return status;
+}
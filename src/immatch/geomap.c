@@ -38,10 +38,14 @@ DAMAGE.
 
 #define _USE_MATH_DEFINES       /* needed for MS Windows to define M_PI */ 
 #include <math.h>
+#include <stdint.h>
 #include <stdio.h>
+#include <string.h>
 
 #include "immatch/geomap.h"
+#include "lib/parallel.h"
 #include "lib/xybbox.h"
+#include "surface/cholesky.h"
 #include "surface/fit.h"
 #include "surface/vector.h"
 
@@ -72,6 +76,21 @@ typedef struct {
     double reject;
     size_t nreject;
     int*   rej;
+    size_t niter;
+
+    /* Robust fitting parameters, and the weights of the robust fit */
+    geomap_robust_e robust;
+    double          robust_tuning;
+    size_t          robust_maxiter;
+    double          robust_tol;
+    double*         rweights;
+
+    /* The scores of the orders tried, when the orders are chosen */
+    size_t                nscores;
+    geomap_order_score_t* scores;
+
+    /* Scratch memory, may be NULL */
+    workspace_t* workspace;
 
     coord_t oref;
     coord_t oin;
@@ -95,7 +114,8 @@ geomap_fit_init(
         const size_t yyorder,
         const xterms_e yxterms,
         const size_t maxiter,
-        const double reject) {
+        const double reject,
+        workspace_t* const workspace) {
 
     assert(fit);
     assert(fit_geometry < geomap_fit_LAST);
@@ -119,6 +139,15 @@ geomap_fit_init(
     fit->reject  = reject;
     fit->nreject = 0;
     fit->rej     = NULL;
+    fit->niter   = 0;
+
+    fit->robust         = geomap_robust_none;
+    fit->robust_tuning  = 0.0;
+    fit->robust_maxiter = 0;
+    fit->robust_tol     = 0.0;
+    fit->rweights       = NULL;
+
+    fit->workspace = workspace;
 
     fit->initialized = 1;
 }
@@ -129,13 +158,19 @@ geomap_fit_new(
 
     fit->initialized = 0;
     fit->rej = NULL;
+    fit->rweights = NULL;
+    fit->nscores = 0;
+    fit->scores = NULL;
+    fit->workspace = NULL;
 }
 
 static void
 geomap_fit_free(
         geomap_fit_t* fit) {
 
-    free(fit->rej); fit->rej = NULL;
+    workspace_release(fit->workspace, fit->rej); fit->rej = NULL;
+    workspace_release(fit->workspace, fit->rweights); fit->rweights = NULL;
+    free(fit->scores); fit->scores = NULL;
     fit->initialized = 0;
 }
 
@@ -232,7 +267,7 @@ compute_surface_coefficients(
 
  exit:
 
-    return 0;
+    return status;
 }
 
 static int
@@ -395,7 +430,7 @@ geo_fit_theta(
     for (i = 0; i < ncoord; ++i) {
         syrxi += weights[i] * (ref[i].y - r0.y) * (input[i].x - i0.x);
         sxryi += weights[i] * (ref[i].x - r0.x) * (input[i].y - i0.y);
-        sxryi += weights[i] * (ref[i].x - r0.x) * (input[i].x - i0.x);
+        sxrxi += weights[i] * (ref[i].x - r0.x) * (input[i].x - i0.x);
         syryi += weights[i] * (ref[i].y - r0.y) * (input[i].y - i0.y);
     }
 
@@ -738,7 +773,7 @@ geo_fit_linear(
     cthetac.x = xmag * ctheta;
     sthetac.x = ymag * stheta;
     sthetac.y = xmag * stheta;
-    cthetac.x = ymag * ctheta;
+    cthetac.y = ymag * ctheta;
 
     /* Compute the X and Y fit coefficients */
     if (compute_surface_coefficients(
@@ -821,7 +856,7 @@ geo_fit_xy(
 
     bbox_t              bbox;
     double*             zfit      = NULL;
-    const double* const z = (double*)input + (xfit ? 0 : 1);
+    double*             z         = NULL;
     surface_t           savefit;
     surface_fit_error_e fit_error = surface_fit_error_ok;
     size_t              i         = 0;
@@ -843,9 +878,16 @@ geo_fit_xy(
 
     *has_secondary = 1;
 
-    zfit = malloc_with_error(ncoord * sizeof(double), error);
+    zfit = workspace_alloc(fit->workspace, ncoord * sizeof(double), error);
     if (zfit == NULL) goto exit;
 
+    z = workspace_alloc(fit->workspace, ncoord * sizeof(double), error);
+    if (z == NULL) goto exit;
+
+    for (i = 0; i < ncoord; ++i) {
+        z[i] = xfit ? input[i].x : input[i].y;
+    }
+
     bbox_copy(&fit->bbox, &bbox);
     bbox_make_nonsingular(&bbox);
 
@@ -860,12 +902,13 @@ geo_fit_xy(
                         sf1, fit->function, 1, 1, xterms_none, &bbox,
                         error)) goto exit;
             for (i = 0; i < ncoord; ++i) {
-                zfit[i] = z[i<<1] - ref[i].x;
+                zfit[i] = z[i] - ref[i].x;
             }
 
             if (surface_fit(
                         sf1, ncoord, ref, zfit, weights,
-                        surface_fit_weight_user, &fit_error, error)) goto exit;
+                        surface_fit_weight_user, fit->workspace, &fit_error,
+                        error)) goto exit;
 
             if (fit->function == surface_type_polynomial) {
                 savefit.coeff[0] = sf1->coeff[0];
@@ -887,7 +930,8 @@ geo_fit_xy(
                         error)) goto exit;
             if (surface_fit(
                         sf1, ncoord, ref, z, weights,
-                        surface_fit_weight_user, &fit_error, error)) goto exit;
+                        surface_fit_weight_user, fit->workspace, &fit_error,
+                        error)) goto exit;
             *has_secondary = 0;
             break;
 
@@ -897,7 +941,8 @@ geo_fit_xy(
                         error)) goto exit;
             if (surface_fit(
                         sf1, ncoord, ref, z, weights,
-                        surface_fit_weight_user, &fit_error, error)) goto exit;
+                        surface_fit_weight_user, fit->workspace, &fit_error,
+                        error)) goto exit;
 
             if (fit->xxorder > 2 || fit->xyorder > 2 ||
                 fit->xxterms == xterms_full) {
@@ -923,11 +968,12 @@ geo_fit_xy(
                         sf1, fit->function, 1, 1, xterms_none, &bbox,
                         error)) goto exit;
             for (i = 0; i < ncoord; ++i) {
-                zfit[i] = z[i<<1] - ref[i].y;
+                zfit[i] = z[i] - ref[i].y;
             }
             if (surface_fit(
                         sf1, ncoord, ref, zfit, weights,
-                        surface_fit_weight_user, &fit_error, error)) goto exit;
+                        surface_fit_weight_user, fit->workspace, &fit_error,
+                        error)) goto exit;
             if (fit->function == surface_type_polynomial) {
                 savefit.coeff[0] = sf1->coeff[0];
                 savefit.coeff[1] = 0.0;
@@ -949,7 +995,8 @@ geo_fit_xy(
                         error)) goto exit;
             if (surface_fit(
                         sf1, ncoord, ref, z, weights,
-                        surface_fit_weight_user, &fit_error, error)) goto exit;
+                        surface_fit_weight_user, fit->workspace, &fit_error,
+                        error)) goto exit;
             *has_secondary = 0;
             break;
 
@@ -959,7 +1006,8 @@ geo_fit_xy(
                         error)) goto exit;
             if (surface_fit(
                         sf1, ncoord, ref, z, weights,
-                        surface_fit_weight_user, &fit_error, error)) goto exit;
+                        surface_fit_weight_user, fit->workspace, &fit_error,
+                        error)) goto exit;
             if (fit->yxorder > 2 || fit->yyorder > 2 ||
                 fit->yxterms == xterms_full) {
                 if (surface_init(
@@ -978,20 +1026,21 @@ geo_fit_xy(
 
     if (surface_vector(sf1, ncoord, ref, residual, error)) goto exit;
     for (i = 0; i < ncoord; ++i) {
-        residual[i] = z[i<<1] - residual[i];
+        residual[i] = z[i] - residual[i];
     }
 
     /* Calculate the higher-order fit */
     if (*has_secondary) {
         if (surface_fit(
                     sf2, ncoord, ref, residual, weights,
-                    surface_fit_weight_user, &fit_error, error)) goto exit;
+                    surface_fit_weight_user, fit->workspace, &fit_error,
+                    error)) goto exit;
         if (_geo_fit_xy_validate_fit_error(
                     fit_error, xfit, fit->projection, error)) goto exit;
 
         if (surface_vector(sf2, ncoord, ref, zfit, error)) goto exit;
         for (i = 0; i < ncoord; ++i) {
-            residual[i] = zfit[i] - residual[i];
+            residual[i] -= zfit[i];
         }
     }
 
@@ -1018,11 +1067,55 @@ geo_fit_xy(
  exit:
 
     surface_free(&savefit);
-    free(zfit);
+    workspace_release(fit->workspace, zfit);
+    workspace_release(fit->workspace, z);
 
     return status;
 }
 
+/* Fit the x and y surfaces of the fitting geometry once, with the
+   given weights */
+static int
+geo_fit_geometry(
+        geomap_fit_t* const fit,
+        surface_t* const sx1,
+        surface_t* const sy1,
+        surface_t* const sx2,
+        surface_t* const sy2,
+        int* const has_sx2,
+        int* const has_sy2,
+        const size_t ncoord,
+        const coord_t* const input,
+        const coord_t* const ref,
+        double* const weights,
+        /* Output */
+        double* const residual_x,
+        double* const residual_y,
+        stimage_error_t* error) {
+
+    switch (fit->fit_geometry) {
+    case geomap_fit_rotate:
+        return geo_fit_theta(
+                fit, sx1, sy1, ncoord, input, ref, weights,
+                residual_x, residual_y, error);
+    case geomap_fit_rscale:
+        return geo_fit_magnify(
+                fit, sx1, sy1, ncoord, input, ref, weights,
+                residual_x, residual_y, error);
+    case geomap_fit_rxyscale:
+        return geo_fit_linear(
+                fit, sx1, sy1, ncoord, input, ref, weights,
+                residual_x, residual_y, error);
+    default:
+        return geo_fit_xy(
+                fit, sx1, sx2, ncoord, 1, input, ref, has_sx2, weights,
+                residual_x, error) ||
+            geo_fit_xy(
+                fit, sy1, sy2, ncoord, 0, input, ref, has_sy2, weights,
+                residual_y, error);
+    }
+}
+
 /* DIFF: was geo_mrejectd */
 static int
 geo_fit_reject(
@@ -1061,13 +1154,14 @@ geo_fit_reject(
     assert(residual_y);
     assert(error);
 
-    tweights = malloc_with_error(ncoord * sizeof(double), error);
+    tweights = workspace_alloc(
+            fit->workspace, ncoord * sizeof(double), error);
     if (tweights == NULL) goto exit;
 
     if (fit->rej != NULL) {
-        free(fit->rej);
+        workspace_release(fit->workspace, fit->rej);
     }
-    fit->rej = malloc_with_error(ncoord * sizeof(int), error);
+    fit->rej = workspace_alloc(fit->workspace, ncoord * sizeof(int), error);
     if (fit->rej == NULL) goto exit;
 
     fit->nreject = 0;
@@ -1093,11 +1187,11 @@ geo_fit_reject(
         /* Reject points from the fit */
         for (i = 0; i < ncoord; ++i) {
             if (tweights[i] > 0.0 &&
-                ((abs(residual_x[i]) > cutx) || abs(residual_y[i]) > cuty)) {
+                (fabs(residual_x[i]) > cutx || fabs(residual_y[i]) > cuty)) {
                 tweights[i] = 0.0;
-                ++nreject;
                 assert(nreject < ncoord);
                 fit->rej[nreject] = i;
+                ++nreject;
             }
         }
 
@@ -1107,34 +1201,12 @@ geo_fit_reject(
         fit->nreject = nreject;
 
         /* Compute the number of deleted points */
-        fit->n_zero_weighted = count_zero_weighted(ncoord, weights);
+        fit->n_zero_weighted = count_zero_weighted(ncoord, tweights);
 
         /* Recompute the X and Y fit */
-        switch (fit->fit_geometry) {
-        case geomap_fit_rotate:
-            if (geo_fit_theta(
-                        fit, sx1, sy1, ncoord, input, ref, tweights,
-                        residual_x, residual_y, error)) goto exit;
-            break;
-        case geomap_fit_rscale:
-            if (geo_fit_magnify(
-                        fit, sx1, sy1, ncoord, input, ref, tweights,
-                        residual_x, residual_y, error)) goto exit;
-            break;
-        case geomap_fit_rxyscale:
-            if (geo_fit_linear(
-                        fit, sx1, sy1, ncoord, input, ref, tweights,
-                        residual_x, residual_y, error)) goto exit;
-            break;
-        default:
-            if (geo_fit_xy(
-                        fit, sx1, sx2, ncoord, 1, input, ref, has_sx2, tweights,
-                        residual_x, error) ||
-                geo_fit_xy(
-                        fit, sy1, sy2, ncoord, 0, input, ref, has_sy2, tweights,
-                        residual_y, error)) goto exit;
-            break;
-        }
+        if (geo_fit_geometry(
+                    fit, sx1, sy1, sx2, sy2, has_sx2, has_sy2, ncoord, input,
+                    ref, tweights, residual_x, residual_y, error)) goto exit;
 
         /* Compute the X and Y fit rms */
         compute_rms(
@@ -1144,359 +1216,1950 @@ geo_fit_reject(
         ++niter;
     } while (niter < fit->maxiter);
 
+    fit->niter = niter;
+
     status = 0;
 
  exit:
 
-    free(tweights);
+    workspace_release(fit->workspace, tweights);
 
     return status;
 }
 
-/* DIFF: was geo_fitd */
-static int
-geofit(
-        geomap_fit_t* const fit,
-        surface_t* const sx1,
-        surface_t* const sy1,
-        surface_t* const sx2,
-        surface_t* const sy2,
-        int* const has_sx2,
-        int* const has_sy2,
-        const size_t ncoord,
-        const coord_t* const input,
-        const coord_t* const ref,
-        double* const weights,
-        stimage_error_t* error) {
-
-    double* residual_x = NULL;
-    double* residual_y = NULL;
-    int status = 1;
-
-    assert(fit);
-    assert(sx1);
-    assert(sy1);
-    assert(sx2);
-    assert(sy2);
-    assert(input);
-    assert(ref);
-    assert(weights);
-    assert(has_sx2);
-    assert(has_sy2);
-    assert(error);
-
-    *has_sx2 = 0;
-    *has_sy2 = 0;
-
-    residual_x = malloc_with_error(ncoord * sizeof(double), error);
-    if (residual_x == NULL) goto exit;
-
-    residual_y = malloc_with_error(ncoord * sizeof(double), error);
-    if (residual_y == NULL) goto exit;
+/* The design of one axis of a fit by geo_fit_xy, for resampling and
+   reweighting.  Its
+   columns are the basis functions of the linear and the distortion
+   surfaces and the data, so their weighted inner products are the
+   normal equations of both fits, and of the fit of the distortion
+   surface to the residuals of the linear one. */
+typedef struct {
+    size_t  ncoord;
+    size_t  n1;       /* The coefficients of the linear surface */
+    size_t  n2;       /* The coefficients of the distortion surface */
+    size_t  ncolumns; /* n1 + n2 + 1 */
+    double* columns;  /* [ncolumns * ncoord] */
+    double* gram;     /* [ncolumns * ncolumns], of all of the points */
+} geo_design_t;
+
+/* Compute the upper triangle of the Gram matrix of the design with the
+   weights w, a column at a time, as surface_fit accumulates the normal
+   equations */
+static void
+geo_design_gram(
+        const geo_design_t* const design,
+        const double* const w,
+        double* const bw, /* [ncoord] */
+        /* Output */
+        double* const gram) {
 
-    switch(fit->fit_geometry) {
-    case geomap_fit_rotate:
-        if (geo_fit_theta(
-                    fit, sx1, sy1, ncoord, input, ref, weights,
-                    residual_x, residual_y, error)) goto exit;
-        break;
-    case geomap_fit_rscale:
-        if (geo_fit_magnify(
-                    fit, sx1, sy1, ncoord, input, ref, weights,
-                    residual_x, residual_y, error)) goto exit;
-        break;
-    case geomap_fit_rxyscale:
-        if (geo_fit_linear(
-                    fit, sx1, sy1, ncoord, input, ref, weights,
-                    residual_x, residual_y, error)) goto exit;
-        break;
-    default:
-        if (geo_fit_xy(
-                    fit, sx1, sx2, ncoord, 0, input, ref, has_sx2, weights,
-                    residual_x, error)
-            ||
-            geo_fit_xy(
-                    fit, sy1, sy2, ncoord, 1, input, ref, has_sy2, weights,
-                    residual_y, error)) goto exit;
-        break;
-    }
+    const size_t  nc      = design->ncolumns;
+    const size_t  ncoord  = design->ncoord;
+    const double* columns = design->columns;
+    double        sum;
+    size_t        i, p, q;
 
-    if (fit->maxiter <= 0 || !isfinite64(fit->reject)) {
-        fit->nreject = 0;
-    } else {
-        if (geo_fit_reject(
-                    fit, sx1, sy1, sx2, sy2, has_sx2, has_sy2, ncoord, input,
-                    ref, weights, residual_x, residual_y, error)) goto exit;
+    for (p = 0; p < nc; ++p) {
+        for (i = 0; i < ncoord; ++i) {
+            bw[i] = w[i] * columns[p * ncoord + i];
+        }
+        for (q = p; q < nc; ++q) {
+            sum = 0.0;
+            for (i = 0; i < ncoord; ++i) {
+                sum += bw[i] * columns[q * ncoord + i];
+            }
+            gram[p * nc + q] = sum;
+        }
     }
+}
 
-    status = 0;
+static void
+geo_design_free(
+        geo_design_t* const design) {
 
- exit:
-    free(residual_x);
-    free(residual_y);
-    return status;
+    free(design->columns); design->columns = NULL;
+    free(design->gram); design->gram = NULL;
 }
 
-/* DIFF: was geo_evald */
+/* Evaluate the basis functions of the surfaces of one axis once, and
+   accumulate the normal equations of all of the points, unless
+   weights is NULL */
 static int
-geoeval(
-        const surface_t* const sx1,
-        const surface_t* const sy1,
-        const surface_t* const sx2,
-        const surface_t* const sy2,
-        const int has_sx2,
-        const int has_sy2,
+geo_design_init(
+        const surface_t* const s1,
+        const surface_t* const s2,
         const size_t ncoord,
         const coord_t* const ref,
-        double* const xfit,
-        double* const yfit,
-        stimage_error_t* const error) {
+        const double* const z,
+        const double* const weights,
+        workspace_t* const workspace,
+        /* Output */
+        geo_design_t* const design,
+        stimage_error_t* error) {
 
-    double* tmp    = NULL;
-    size_t  i      = 0;
+    double* bw     = NULL;
+    size_t  nc, i;
     int     status = 1;
 
-    assert(sx1);
-    assert(sy1);
-    assert(sx2);
-    assert(sy2);
-    assert(ref);
-    assert(xfit);
-    assert(yfit);
-    assert(error);
-
-    if (has_sx2 || has_sy2) {
-        tmp = malloc_with_error(ncoord * sizeof(double), error);
-        if (tmp == NULL) goto exit;
-    }
-
-    if (surface_vector(sx1, ncoord, ref, xfit, error)) goto exit;
-    if (has_sx2) {
-        if (surface_vector(sx2, ncoord, ref, tmp, error)) goto exit;
-        for (i = 0; i < ncoord; ++i) {
-            xfit[i] += tmp[i];
-        }
+    assert(s1);
+    assert(design);
+
+    design->ncoord = ncoord;
+    design->n1 = s1->ncoeff;
+    design->n2 = (s2 != NULL) ? s2->ncoeff : 0;
+    design->ncolumns = nc = design->n1 + design->n2 + 1;
+
+    design->columns = malloc_with_error(
+            nc * MAX(1, ncoord) * sizeof(double), error);
+    if (design->columns == NULL) goto exit;
+    design->gram = malloc_with_error(nc * nc * sizeof(double), error);
+    if (design->gram == NULL) goto exit;
+
+    if (surface_fit_basis(
+                s1, ncoord, ref, workspace, design->columns, error)) goto exit;
+    if (s2 != NULL && surface_fit_basis(
+                s2, ncoord, ref, workspace,
+                design->columns + design->n1 * ncoord, error)) goto exit;
+    for (i = 0; i < ncoord; ++i) {
+        design->columns[(nc - 1) * ncoord + i] = z[i];
     }
 
-    if (surface_vector(sy1, ncoord, ref, yfit, error)) goto exit;
-    if (has_sy2) {
-        if (surface_vector(sy2, ncoord, ref, tmp, error)) goto exit;
-        for (i = 0; i < ncoord; ++i) {
-            yfit[i] += tmp[i];
-        }
+    if (weights != NULL) {
+        bw = workspace_alloc(
+                workspace, MAX(1, ncoord) * sizeof(double), error);
+        if (bw == NULL) goto exit;
+        geo_design_gram(design, weights, bw, design->gram);
     }
 
     status = 0;
 
  exit:
 
-    free(tmp);
+    workspace_release(workspace, bw);
 
     return status;
 }
 
+/* Solve the normal equations of the n columns of a Gram matrix from
+   start, with the right side rhs */
 static int
-geo_get_coeff(
-        const surface_t* const sx,
-        const surface_t* const sy,
+geo_gram_solve(
+        const size_t nc,
+        const double* const gram,
+        const size_t start,
+        const size_t n,
+        const double* const rhs,
+        double* const block, /* [n * n] */
+        double* const fact,  /* [n * n] */
         /* Output */
-        coord_t* const shift,
-        coord_t* const scale,
-        coord_t* const rot,
+        double* const coeff,
+        surface_fit_error_e* const error_type,
         stimage_error_t* const error) {
 
-    size_t nxxcoeff, nxycoeff, nyxcoeff, nyycoeff;
-    double xxrange  = 1.0;
-    double xyrange  = 1.0;
-    double xxmaxmin = 1.0;
-    double xymaxmin = 1.0;
-    double yxrange  = 1.0;
-    double yyrange  = 1.0;
-    double yxmaxmin = 1.0;
-    double yymaxmin = 1.0;
-    double a, b, c, d;
+    size_t a, b;
 
-    assert(sx);
-    assert(sy);
-    assert(shift);
-    assert(scale);
-    assert(rot);
-    assert(sx->coeff);
-    assert(sy->coeff);
-    assert(sx->ncoeff >= 3);
-    assert(sy->ncoeff >= 3);
+    /* The banded form of cholesky_factorization, as surface_fit
+       accumulates it */
+    for (a = 0; a < n; ++a) {
+        for (b = a; b < n; ++b) {
+            block[a * n + (b - a)] = gram[(start + a) * nc + start + b];
+        }
+        for (b = n - a; b < n; ++b) {
+            block[a * n + b] = 0.0;
+        }
+    }
 
-    nxxcoeff = nyxcoeff = sx->nxcoeff;
-    nxycoeff = nyycoeff = sy->nycoeff;
+    return cholesky_factorization(n, n, block, fact, error_type, error) ||
+        cholesky_solve(n, n, fact, rhs, coeff, error);
+}
 
-    /* Get the data range */
-    if (sx->type != surface_type_polynomial) {
-        xxrange = (sx->bbox.max.x - sx->bbox.min.x) / 2.0;
-        xxmaxmin = -(sx->bbox.max.x - sx->bbox.min.x) / 2.0;
-        xyrange = (sx->bbox.max.y - sx->bbox.min.y) / 2.0;
-        xymaxmin = (sx->bbox.max.y - sx->bbox.min.y) / 2.0;
-    }
+/* Fit the linear and distortion surfaces of one axis from the normal
+   equations in gram.  Returns non-zero in *fitted if they could be
+   fit. */
+static int
+geo_design_solve(
+        const geo_design_t* const design,
+        const double* const gram,
+        double* const scratch, /* [3 * ncolumns * ncolumns] */
+        /* Output */
+        double* const coeff1,
+        double* const coeff2,
+        int* const fitted,
+        stimage_error_t* error) {
 
-    if (sy->type != surface_type_polynomial) {
-        yxrange = (sy->bbox.max.x - sy->bbox.min.x) / 2.0;
-        yxmaxmin = (sy->bbox.max.x - sy->bbox.min.x) / 2.0;
-        yyrange = (sy->bbox.max.y - sy->bbox.min.y) / 2.0;
-        yymaxmin = (sy->bbox.max.y - sy->bbox.min.y) / 2.0;
+    const size_t        nc    = design->ncolumns;
+    const size_t        n1    = design->n1;
+    const size_t        n2    = design->n2;
+    const size_t        zc    = nc - 1;
+    double* const       block = scratch;
+    double* const       fact  = scratch + nc * nc;
+    double* const       rhs   = scratch + 2 * nc * nc;
+    surface_fit_error_e error_type = surface_fit_error_ok;
+    size_t              a, b;
+
+    *fitted = 0;
+
+    for (a = 0; a < n1; ++a) {
+        rhs[a] = gram[a * nc + zc];
+    }
+    if (geo_gram_solve(
+                nc, gram, 0, n1, rhs, block, fact, coeff1, &error_type,
+                error)) return 1;
+    if (error_type != surface_fit_error_ok) {
+        return 0;
+    }
+
+    /* The right side of the fit to the residuals of the linear fit */
+    if (n2 > 0) {
+        for (b = 0; b < n2; ++b) {
+            rhs[b] = gram[(n1 + b) * nc + zc];
+            for (a = 0; a < n1; ++a) {
+                rhs[b] -= gram[a * nc + n1 + b] * coeff1[a];
+            }
+        }
+        if (geo_gram_solve(
+                    nc, gram, n1, n2, rhs, block, fact, coeff2, &error_type,
+                    error)) return 1;
+        if (error_type != surface_fit_error_ok) {
+            return 0;
+        }
     }
 
-    /* Get the shifts */
-    shift->x = sx->coeff[0] + \
-        sx->coeff[1] * xxmaxmin / xxrange + \
-        sx->coeff[2] * xymaxmin / xyrange;
-    shift->y = sy->coeff[0] + \
-        sy->coeff[1] * yxmaxmin / yxrange +
-        sx->coeff[2] * yymaxmin / yyrange;
-
-    /* Get the rotation and scaling parameters */
-    if (nxxcoeff > 1) {
-        a = sx->coeff[1] / xxrange;
-    } else {
-        a = 0.0;
-    }
+    *fitted = 1;
 
-    if (nxycoeff > 1) {
-        b = sx->coeff[nxxcoeff] / xyrange;
-    } else {
-        b = 0.0;
+    return 0;
+}
+
+/* Refine the coefficients of n columns of the design from start, with
+   the weights w, given the residuals of the data from them.  The
+   correction of the coefficients is fit to the residuals, which are
+   updated to match.  Returns non-zero in *fitted if it could be
+   fit. */
+static int
+geo_design_refine(
+        const geo_design_t* const design,
+        const double* const w,
+        const size_t start,
+        const size_t n,
+        double* const bw,      /* [ncoord] */
+        double* const scratch, /* [3 * n * n + 2 * n] */
+        /* Input/output */
+        double* const coeff,
+        double* const residual,
+        /* Output */
+        int* const fitted,
+        stimage_error_t* error) {
+
+    const size_t        ncoord  = design->ncoord;
+    const double* const columns = design->columns + start * ncoord;
+    double* const       gram    = scratch;
+    double* const       block   = scratch + n * n;
+    double* const       fact    = scratch + 2 * n * n;
+    double* const       rhs     = scratch + 3 * n * n;
+    double* const       delta   = scratch + 3 * n * n + n;
+    surface_fit_error_e error_type = surface_fit_error_ok;
+    const double*       column;
+    double              sum;
+    size_t              i, a, b;
+
+    *fitted = 0;
+
+    /* The normal equations of the correction, a column at a time */
+    for (a = 0; a < n; ++a) {
+        column = columns + a * ncoord;
+        for (i = 0; i < ncoord; ++i) {
+            bw[i] = w[i] * column[i];
+        }
+        for (b = a; b < n; ++b) {
+            column = columns + b * ncoord;
+            sum = 0.0;
+            for (i = 0; i < ncoord; ++i) {
+                sum += bw[i] * column[i];
+            }
+            gram[a * n + b] = sum;
+        }
+        sum = 0.0;
+        for (i = 0; i < ncoord; ++i) {
+            sum += bw[i] * residual[i];
+        }
+        rhs[a] = sum;
     }
 
-    if (nyxcoeff > 1) {
-        c = sx->coeff[1] / yxrange;
-    } else {
-        c = 0.0;
+    if (geo_gram_solve(
+                n, gram, 0, n, rhs, block, fact, delta, &error_type,
+                error)) return 1;
+    if (error_type != surface_fit_error_ok) {
+        return 0;
     }
 
-    if (nyycoeff > 1) {
-        d = sy->coeff[nyxcoeff] / yyrange;
-    } else {
-        d = 0.0;
+    for (a = 0; a < n; ++a) {
+        coeff[a] += delta[a];
+        column = columns + a * ncoord;
+        for (i = 0; i < ncoord; ++i) {
+            residual[i] -= delta[a] * column[i];
+        }
     }
 
-    scale->x = sqrt(a*a + c*c);
-    scale->y = sqrt(b*b + d*d);
+    *fitted = 1;
 
-    if (double_approx_equal(a, 0.0) && double_approx_equal(c, 0.0)) {
-        rot->x = 0.0;
-    } else {
-        rot->x = RADTODEG(atan2(-c, a));
-    }
-    if (rot->x < 0.0) {
-        rot->x += 360.0;
-    }
+    return 0;
+}
 
-    if (double_approx_equal(b, 0.0) && double_approx_equal(d, 0.0)) {
-        rot->y = 0.0;
-    } else {
-        rot->y = RADTODEG(atan2(b, d));
-    }
-    if (rot->y < 0.0) {
-        rot->y += 360.0;
+/* Subtract the surface of n columns of the design from start, with
+   the given coefficients, from residual */
+static void
+geo_design_subtract(
+        const geo_design_t* const design,
+        const size_t start,
+        const size_t n,
+        const double* const coeff,
+        /* Input/output */
+        double* const residual) {
+
+    const size_t  ncoord = design->ncoord;
+    const double* column;
+    size_t        i, p;
+
+    for (p = 0; p < n; ++p) {
+        column = design->columns + (start + p) * ncoord;
+        for (i = 0; i < ncoord; ++i) {
+            residual[i] -= coeff[p] * column[i];
+        }
     }
+}
 
-    return 0;
+/* Partially order a so that a[k] is its k-th smallest value, with
+   the smaller values before it and the larger ones after it */
+static void
+geo_select(
+        const size_t n,
+        double* const a,
+        const size_t k) {
+
+    size_t lo = 0;
+    size_t hi = n - 1;
+    size_t i, j;
+    double pivot, t;
+
+    assert(k < n);
+
+    while (lo < hi) {
+        pivot = a[lo + (hi - lo) / 2];
+        i = lo;
+        j = hi;
+        while (i <= j) {
+            while (a[i] < pivot) ++i;
+            while (a[j] > pivot) --j;
+            if (i <= j) {
+                t = a[i]; a[i] = a[j]; a[j] = t;
+                ++i;
+                if (j == 0) break;
+                --j;
+            }
+        }
+        if (k <= j) {
+            hi = j;
+        } else if (k >= i) {
+            lo = i;
+        } else {
+            break;
+        }
+    }
+}
+
+/* The scatter of the residuals of the points with weights > 0, from
+   their median absolute value, scaled to the standard deviation of
+   Gaussian residuals */
+static double
+geo_robust_scale(
+        const size_t ncoord,
+        const double* const residual,
+        const double* const weights,
+        double* const scratch /* [ncoord] */) {
+
+    size_t n = 0;
+    size_t i;
+    double median, below;
+
+    for (i = 0; i < ncoord; ++i) {
+        if (weights[i] > 0.0) {
+            scratch[n++] = fabs(residual[i]);
+        }
+    }
+
+    if (n == 0) {
+        return 0.0;
+    }
+
+    geo_select(n, scratch, n / 2);
+    median = scratch[n / 2];
+    if (n % 2 == 0) {
+        below = scratch[0];
+        for (i = 1; i < n / 2; ++i) {
+            below = MAX(below, scratch[i]);
+        }
+        median = 0.5 * (median + below);
+    }
+
+    return 1.4826 * median;
+}
+
+/* The weight of a residual of u times the scatter */
+static double
+geo_robust_weight(
+        const geomap_robust_e robust,
+        const double u,
+        const double tuning) {
+
+    double t;
+
+    switch (robust) {
+    case geomap_robust_huber:
+        return u <= tuning ? 1.0 : tuning / u;
+    case geomap_robust_tukey:
+        if (u >= tuning) {
+            return 0.0;
+        }
+        t = u / tuning;
+        t = 1.0 - t * t;
+        return t * t;
+    default:
+        return 1.0;
+    }
+}
+
+/* Fit the x and y surfaces by iteratively reweighted least squares,
+   starting from the fit to weights, whose residuals are in residual_x
+   and residual_y.  The weights of the final fit are left in
+   fit->rweights, and the points whose weight fell to zero in
+   fit->rej. */
+static int
+geo_fit_robust(
+        geomap_fit_t* const fit,
+        surface_t* const sx1,
+        surface_t* const sy1,
+        surface_t* const sx2,
+        surface_t* const sy2,
+        int* const has_sx2,
+        int* const has_sy2,
+        const size_t ncoord,
+        const coord_t* const input,
+        const coord_t* const ref,
+        const double* const weights,
+        double* const residual_x,
+        double* const residual_y,
+        stimage_error_t* error) {
+
+    geo_design_t    design[2];
+    surface_t*      s1[2];
+    surface_t*      s2[2];
+    double*         residual[2];
+    double*         last[2]    = {NULL, NULL};
+    double*         linear[2]  = {NULL, NULL};
+    double*         scratch    = NULL;
+    double*         sorted     = NULL;
+    double*         bw         = NULL;
+    double          scale[2];
+    double          tuning     = 0.0;
+    double          u, d, change;
+    int             has_design;
+    int             fitted;
+    size_t          nc         = 0;
+    size_t          nreject    = 0;
+    size_t          i, k;
+    int             status     = 1;
+
+    assert(fit);
+    assert(sx1);
+    assert(sy1);
+    assert(sx2);
+    assert(sy2);
+    assert(input);
+    assert(ref);
+    assert(weights);
+    assert(residual_x);
+    assert(residual_y);
+    assert(error);
+
+    design[0].columns = design[0].gram = NULL;
+    design[1].columns = design[1].gram = NULL;
+    s1[0] = sx1;
+    s1[1] = sy1;
+    s2[0] = *has_sx2 ? sx2 : NULL;
+    s2[1] = *has_sy2 ? sy2 : NULL;
+    residual[0] = residual_x;
+    residual[1] = residual_y;
+
+    has_design = (fit->fit_geometry == geomap_fit_xyscale ||
+                  fit->fit_geometry == geomap_fit_general);
+
+    workspace_release(fit->workspace, fit->rweights);
+    fit->rweights = workspace_alloc(
+            fit->workspace, MAX(1, ncoord) * sizeof(double), error);
+    if (fit->rweights == NULL) goto exit;
+    for (k = 0; k < 2; ++k) {
+        last[k] = workspace_alloc(
+                fit->workspace, MAX(1, ncoord) * sizeof(double), error);
+        if (last[k] == NULL) goto exit;
+    }
+    sorted = workspace_alloc(
+            fit->workspace, MAX(1, ncoord) * sizeof(double), error);
+    if (sorted == NULL) goto exit;
+
+    /* The basis functions are evaluated once, and each iteration only
+       accumulates their reweighted inner products.  The residuals of
+       the linear surface are kept, as the distortion surface is fit
+       to them. */
+    if (has_design) {
+        for (k = 0; k < 2; ++k) {
+            for (i = 0; i < ncoord; ++i) {
+                last[k][i] = k == 0 ? input[i].x : input[i].y;
+            }
+            if (geo_design_init(
+                        s1[k], s2[k], ncoord, ref, last[k], NULL,
+                        fit->workspace, &design[k], error)) goto exit;
+            nc = MAX(nc, design[k].ncolumns);
+
+            linear[k] = workspace_alloc(
+                    fit->workspace, MAX(1, ncoord) * sizeof(double), error);
+            if (linear[k] == NULL) goto exit;
+            for (i = 0; i < ncoord; ++i) {
+                linear[k][i] = last[k][i];
+            }
+            geo_design_subtract(
+                    &design[k], 0, design[k].n1, s1[k]->coeff, linear[k]);
+        }
+
+        scratch = workspace_alloc(
+                fit->workspace, (3 * nc * nc + 2 * nc) * sizeof(double),
+                error);
+        if (scratch == NULL) goto exit;
+        bw = workspace_alloc(
+                fit->workspace, MAX(1, ncoord) * sizeof(double), error);
+        if (bw == NULL) goto exit;
+    }
+
+    if (fit->robust_tuning > 0.0) {
+        tuning = fit->robust_tuning;
+    } else {
+        tuning = (fit->robust == geomap_robust_tukey) ? 4.685 : 1.345;
+    }
+
+    fit->niter = 0;
+    while (fit->niter < fit->robust_maxiter) {
+        for (k = 0; k < 2; ++k) {
+            scale[k] = geo_robust_scale(
+                    ncoord, residual[k], weights, sorted);
+        }
+        if (!(scale[0] > 0.0) && !(scale[1] > 0.0)) {
+            break;
+        }
+
+        for (i = 0; i < ncoord; ++i) {
+            if (weights[i] > 0.0) {
+                u = 0.0;
+                for (k = 0; k < 2; ++k) {
+                    if (scale[k] > 0.0) {
+                        d = residual[k][i] / scale[k];
+                        u += d * d;
+                    }
+                }
+                fit->rweights[i] = weights[i] * geo_robust_weight(
+                        fit->robust, sqrt(0.5 * u), tuning);
+            } else {
+                fit->rweights[i] = 0.0;
+            }
+            last[0][i] = residual_x[i];
+            last[1][i] = residual_y[i];
+        }
+
+        /* Refine the fit with the new weights, from the last one */
+        if (has_design) {
+            for (k = 0; k < 2; ++k) {
+                if (geo_design_refine(
+                            &design[k], fit->rweights, 0, design[k].n1, bw,
+                            scratch, s1[k]->coeff, linear[k], &fitted,
+                            error)) goto exit;
+                for (i = 0; i < ncoord; ++i) {
+                    residual[k][i] = linear[k][i];
+                }
+                if (fitted && s2[k] != NULL) {
+                    geo_design_subtract(
+                            &design[k], design[k].n1, design[k].n2,
+                            s2[k]->coeff, residual[k]);
+                    if (geo_design_refine(
+                                &design[k], fit->rweights, design[k].n1,
+                                design[k].n2, bw, scratch, s2[k]->coeff,
+                                residual[k], &fitted, error)) goto exit;
+                }
+                if (!fitted) {
+                    stimage_error_set_message(
+                            error,
+                            "Too few points have non-zero robust weights "
+                            "to fit");
+                    goto exit;
+                }
+            }
+        } else {
+            if (geo_fit_geometry(
+                        fit, sx1, sy1, sx2, sy2, has_sx2, has_sy2, ncoord,
+                        input, ref, fit->rweights, residual_x, residual_y,
+                        error)) goto exit;
+        }
+
+        ++fit->niter;
+
+        /* The largest change of a fitted value */
+        change = 0.0;
+        for (k = 0; k < 2; ++k) {
+            if (!(scale[k] > 0.0)) {
+                continue;
+            }
+            for (i = 0; i < ncoord; ++i) {
+                if (weights[i] > 0.0) {
+                    change = MAX(
+                            change,
+                            fabs(residual[k][i] - last[k][i]) / scale[k]);
+                }
+            }
+        }
+
+        if (change <= fit->robust_tol) {
+            break;
+        }
+    }
+
+    if (fit->niter == 0) {
+        for (i = 0; i < ncoord; ++i) {
+            fit->rweights[i] = weights[i];
+        }
+    }
+
+    /* The points whose weight fell to zero are rejected */
+    if (fit->rej != NULL) {
+        workspace_release(fit->workspace, fit->rej);
+    }
+    fit->rej = workspace_alloc(
+            fit->workspace, MAX(1, ncoord) * sizeof(int), error);
+    if (fit->rej == NULL) goto exit;
+    for (i = 0; i < ncoord; ++i) {
+        if (weights[i] > 0.0 && fit->rweights[i] <= 0.0) {
+            fit->rej[nreject++] = i;
+        }
+    }
+    fit->nreject = nreject;
+
+    fit->n_zero_weighted = count_zero_weighted(ncoord, fit->rweights);
+    compute_rms(
+            ncoord, fit->rweights, residual_x, residual_y,
+            &fit->xrms, &fit->yrms);
+
+    status = 0;
+
+ exit:
+
+    geo_design_free(&design[0]);
+    geo_design_free(&design[1]);
+    workspace_release(fit->workspace, last[0]);
+    workspace_release(fit->workspace, last[1]);
+    workspace_release(fit->workspace, linear[0]);
+    workspace_release(fit->workspace, linear[1]);
+    workspace_release(fit->workspace, sorted);
+    workspace_release(fit->workspace, scratch);
+    workspace_release(fit->workspace, bw);
+
+    return status;
+}
+
+/* Choose the orders of the x and y fits of a general fit.  Every
+   order from 2 to options->max_order is fit to the residuals of the
+   linear fit, as geo_fit_xy fits the higher-order surface, from one
+   accumulation of the normal equations at the largest order. */
+static int
+geo_select_order(
+        geomap_fit_t* const fit,
+        const geomap_options_t* const options,
+        const size_t ncoord,
+        const coord_t* const input,
+        const coord_t* const ref,
+        double* const weights,
+        stimage_error_t* error) {
+
+    size_t               norders  = 0;
+    size_t*              orders   = NULL;
+    surface_fit_score_t* scores   = NULL;
+    double*              z        = NULL;
+    double*              residual = NULL;
+    surface_t            sf1, sf2;
+    surface_fit_error_e  fit_error;
+    bbox_t               bbox;
+    geomap_order_score_t* score;
+    double               best_score;
+    size_t               best[2]  = {0, 0};
+    double               n        = 0.0;
+    double               value    = 0.0;
+    double               chisq, aic, bic, cv;
+    double               my_nan   = fmod(1.0, 0.0);
+    size_t               i, j;
+    int                  xfit;
+    int                  status   = 1;
+
+    assert(fit);
+    assert(options);
+    assert(input);
+    assert(ref);
+    assert(weights);
+    assert(error);
+
+    surface_new(&sf1);
+    surface_new(&sf2);
+
+    if (options->max_order < 2) {
+        stimage_error_set_message(error, "max_order must be at least 2");
+        goto exit;
+    }
+    if (options->order_select == geomap_order_cv && options->nfolds < 2) {
+        stimage_error_set_message(error, "nfolds must be at least 2");
+        goto exit;
+    }
+
+    norders = options->max_order - 1;
+
+    free(fit->scores);
+    fit->nscores = 0;
+    fit->scores = malloc_with_error(
+            norders * sizeof(geomap_order_score_t), error);
+    if (fit->scores == NULL) goto exit;
+    fit->nscores = norders;
+
+    orders = workspace_alloc(
+            fit->workspace, norders * sizeof(size_t), error);
+    if (orders == NULL) goto exit;
+    scores = workspace_alloc(
+            fit->workspace, norders * sizeof(surface_fit_score_t), error);
+    if (scores == NULL) goto exit;
+    z = workspace_alloc(fit->workspace, ncoord * sizeof(double), error);
+    if (z == NULL) goto exit;
+    residual = workspace_alloc(
+            fit->workspace, ncoord * sizeof(double), error);
+    if (residual == NULL) goto exit;
+
+    for (j = 0; j < norders; ++j) {
+        orders[j] = j + 2;
+        fit->scores[j].order = j + 2;
+    }
+
+    bbox_copy(&fit->bbox, &bbox);
+    bbox_make_nonsingular(&bbox);
+
+    n = (double)(ncoord - count_zero_weighted(ncoord, weights));
+
+    for (xfit = 1; xfit >= 0; --xfit) {
+        for (i = 0; i < ncoord; ++i) {
+            z[i] = xfit ? input[i].x : input[i].y;
+        }
+
+        /* The residuals of the linear fit */
+        fit_error = surface_fit_error_ok;
+        surface_free(&sf1);
+        if (surface_init(
+                    &sf1, fit->function, 2, 2, xterms_none, &bbox,
+                    error) ||
+            surface_fit(
+                    &sf1, ncoord, ref, z, weights, surface_fit_weight_user,
+                    fit->workspace, &fit_error, error)) goto exit;
+        if (_geo_fit_xy_validate_fit_error(
+                    fit_error, xfit, fit->projection, error)) goto exit;
+        if (surface_vector(&sf1, ncoord, ref, residual, error)) goto exit;
+        for (i = 0; i < ncoord; ++i) {
+            residual[i] = z[i] - residual[i];
+        }
+
+        surface_free(&sf2);
+        if (surface_init(
+                    &sf2, fit->function, options->max_order,
+                    options->max_order,
+                    xfit ? fit->xxterms : fit->yxterms, &bbox, error) ||
+            surface_fit_nested(
+                    &sf2, ncoord, ref, residual, weights,
+                    surface_fit_weight_user, norders, orders, orders,
+                    options->order_select == geomap_order_cv ?
+                    options->nfolds : 0,
+                    fit->workspace, scores, error)) goto exit;
+
+        best_score = MAX_DOUBLE;
+        for (j = 0; j < norders; ++j) {
+            chisq = aic = bic = cv = my_nan;
+            if (scores[j].error_type == surface_fit_error_ok &&
+                (double)scores[j].ncoeff < n) {
+                /* A perfect fit has the lowest possible likelihood
+                   term, so that the fewest coefficients win */
+                value = scores[j].chisq > 0.0 ?
+                    n * log(scores[j].chisq / n) : -MAX_DOUBLE / 2.0;
+                chisq = scores[j].chisq;
+                aic = value + 2.0 * (double)scores[j].ncoeff;
+                bic = value + log(n) * (double)scores[j].ncoeff;
+                cv = scores[j].cv;
+            }
+
+            score = &fit->scores[j];
+            if (xfit) {
+                score->nxcoeff = scores[j].ncoeff;
+                score->chisq.x = chisq;
+                score->aic.x = aic;
+                score->bic.x = bic;
+                score->cv.x = cv;
+            } else {
+                score->nycoeff = scores[j].ncoeff;
+                score->chisq.y = chisq;
+                score->aic.y = aic;
+                score->bic.y = bic;
+                score->cv.y = cv;
+            }
+
+            switch (options->order_select) {
+            case geomap_order_aic:
+                value = aic;
+                break;
+            case geomap_order_cv:
+                value = cv;
+                break;
+            default:
+                value = bic;
+                break;
+            }
+
+            /* The lowest order wins a tie */
+            if ((isfinite64(value)) && value < best_score) {
+                best_score = value;
+                best[xfit] = orders[j];
+            }
+        }
+
+        if (best[xfit] == 0) {
+            stimage_error_set_message(
+                    error, "None of the orders could be fit");
+            goto exit;
+        }
+    }
+
+    fit->xxorder = fit->xyorder = best[1];
+    fit->yxorder = fit->yyorder = best[0];
+
+    status = 0;
+
+ exit:
+
+    surface_free(&sf1);
+    surface_free(&sf2);
+    workspace_release(fit->workspace, orders);
+    workspace_release(fit->workspace, scores);
+    workspace_release(fit->workspace, z);
+    workspace_release(fit->workspace, residual);
+
+    return status;
+}
+
+/* DIFF: was geo_fitd */
+static int
+geofit(
+        geomap_fit_t* const fit,
+        surface_t* const sx1,
+        surface_t* const sy1,
+        surface_t* const sx2,
+        surface_t* const sy2,
+        int* const has_sx2,
+        int* const has_sy2,
+        const size_t ncoord,
+        const coord_t* const input,
+        const coord_t* const ref,
+        double* const weights,
+        stimage_error_t* error) {
+
+    double* residual_x = NULL;
+    double* residual_y = NULL;
+    int status = 1;
+
+    assert(fit);
+    assert(sx1);
+    assert(sy1);
+    assert(sx2);
+    assert(sy2);
+    assert(input);
+    assert(ref);
+    assert(weights);
+    assert(has_sx2);
+    assert(has_sy2);
+    assert(error);
+
+    *has_sx2 = 0;
+    *has_sy2 = 0;
+
+    residual_x = workspace_alloc(
+            fit->workspace, ncoord * sizeof(double), error);
+    if (residual_x == NULL) goto exit;
+
+    residual_y = workspace_alloc(
+            fit->workspace, ncoord * sizeof(double), error);
+    if (residual_y == NULL) goto exit;
+
+    if (geo_fit_geometry(
+                fit, sx1, sy1, sx2, sy2, has_sx2, has_sy2, ncoord, input,
+                ref, weights, residual_x, residual_y, error)) goto exit;
+
+    fit->niter = 0;
+    if (fit->robust != geomap_robust_none) {
+        if (geo_fit_robust(
+                    fit, sx1, sy1, sx2, sy2, has_sx2, has_sy2, ncoord, input,
+                    ref, weights, residual_x, residual_y, error)) goto exit;
+    } else if (fit->maxiter <= 0 || !isfinite64(fit->reject)) {
+        fit->nreject = 0;
+    } else {
+        if (geo_fit_reject(
+                    fit, sx1, sy1, sx2, sy2, has_sx2, has_sy2, ncoord, input,
+                    ref, weights, residual_x, residual_y, error)) goto exit;
+    }
+
+    status = 0;
+
+ exit:
+    workspace_release(fit->workspace, residual_x);
+    workspace_release(fit->workspace, residual_y);
+    return status;
+}
+
+/* DIFF: was geo_evald */
+static int
+geoeval(
+        const surface_t* const sx1,
+        const surface_t* const sy1,
+        const surface_t* const sx2,
+        const surface_t* const sy2,
+        const int has_sx2,
+        const int has_sy2,
+        const size_t ncoord,
+        const coord_t* const ref,
+        double* const xfit,
+        double* const yfit,
+        workspace_t* const workspace,
+        stimage_error_t* const error) {
+
+    double* tmp    = NULL;
+    size_t  i      = 0;
+    int     status = 1;
+
+    assert(sx1);
+    assert(sy1);
+    assert(sx2);
+    assert(sy2);
+    assert(ref);
+    assert(xfit);
+    assert(yfit);
+    assert(error);
+
+    if (has_sx2 || has_sy2) {
+        tmp = workspace_alloc(workspace, ncoord * sizeof(double), error);
+        if (tmp == NULL) goto exit;
+    }
+
+    if (surface_vector(sx1, ncoord, ref, xfit, error)) goto exit;
+    if (has_sx2) {
+        if (surface_vector(sx2, ncoord, ref, tmp, error)) goto exit;
+        for (i = 0; i < ncoord; ++i) {
+            xfit[i] += tmp[i];
+        }
+    }
+
+    if (surface_vector(sy1, ncoord, ref, yfit, error)) goto exit;
+    if (has_sy2) {
+        if (surface_vector(sy2, ncoord, ref, tmp, error)) goto exit;
+        for (i = 0; i < ncoord; ++i) {
+            yfit[i] += tmp[i];
+        }
+    }
+
+    status = 0;
+
+ exit:
+
+    workspace_release(workspace, tmp);
+
+    return status;
+}
+
+static int
+geo_get_coeff(
+        const surface_t* const sx,
+        const surface_t* const sy,
+        /* Output */
+        coord_t* const shift,
+        coord_t* const scale,
+        coord_t* const rot,
+        stimage_error_t* const error) {
+
+    size_t nxxcoeff, nxycoeff, nyxcoeff, nyycoeff;
+    double xxrange  = 1.0;
+    double xyrange  = 1.0;
+    double xxmaxmin = 0.0;
+    double xymaxmin = 0.0;
+    double yxrange  = 1.0;
+    double yyrange  = 1.0;
+    double yxmaxmin = 0.0;
+    double yymaxmin = 0.0;
+    double a, b, c, d;
+
+    assert(sx);
+    assert(sy);
+    assert(shift);
+    assert(scale);
+    assert(rot);
+    assert(sx->coeff);
+    assert(sy->coeff);
+
+    nxxcoeff = sx->nxcoeff;
+    nxycoeff = sx->nycoeff;
+    nyxcoeff = sy->nxcoeff;
+    nyycoeff = sy->nycoeff;
+
+    /* Get the data range */
+    if (sx->type != surface_type_polynomial) {
+        xxrange = (sx->bbox.max.x - sx->bbox.min.x) / 2.0;
+        xxmaxmin = -(sx->bbox.max.x + sx->bbox.min.x) / 2.0;
+        xyrange = (sx->bbox.max.y - sx->bbox.min.y) / 2.0;
+        xymaxmin = -(sx->bbox.max.y + sx->bbox.min.y) / 2.0;
+    }
+
+    if (sy->type != surface_type_polynomial) {
+        yxrange = (sy->bbox.max.x - sy->bbox.min.x) / 2.0;
+        yxmaxmin = -(sy->bbox.max.x + sy->bbox.min.x) / 2.0;
+        yyrange = (sy->bbox.max.y - sy->bbox.min.y) / 2.0;
+        yymaxmin = -(sy->bbox.max.y + sy->bbox.min.y) / 2.0;
+    }
+
+    /* Get the rotation and scaling parameters.  The linear y term
+       follows the nxcoeff x terms in the coefficient array. */
+    a = (nxxcoeff > 1) ? sx->coeff[1] : 0.0;
+    b = (nxycoeff > 1) ? sx->coeff[nxxcoeff] : 0.0;
+    c = (nyxcoeff > 1) ? sy->coeff[1] : 0.0;
+    d = (nyycoeff > 1) ? sy->coeff[nyxcoeff] : 0.0;
+
+    /* Get the shifts */
+    shift->x = sx->coeff[0] + a * xxmaxmin / xxrange + b * xymaxmin / xyrange;
+    shift->y = sy->coeff[0] + c * yxmaxmin / yxrange + d * yymaxmin / yyrange;
+
+    /* Correct for the normalization */
+    a /= xxrange;
+    b /= xyrange;
+    c /= yxrange;
+    d /= yyrange;
+
+    scale->x = sqrt(a*a + c*c);
+    scale->y = sqrt(b*b + d*d);
+
+    if (double_approx_equal(a, 0.0) && double_approx_equal(c, 0.0)) {
+        rot->x = 0.0;
+    } else {
+        rot->x = RADTODEG(atan2(-c, a));
+    }
+    if (rot->x < 0.0) {
+        rot->x += 360.0;
+    }
+
+    if (double_approx_equal(b, 0.0) && double_approx_equal(d, 0.0)) {
+        rot->y = 0.0;
+    } else {
+        rot->y = RADTODEG(atan2(b, d));
+    }
+    if (rot->y < 0.0) {
+        rot->y += 360.0;
+    }
+
+    return 0;
+}
+
+/* Store the shape and normalization of a surface, so that it can be
+   built again by geo_set_surface */
+static void
+geo_get_surface(
+        const surface_t* const s,
+        /* Output */
+        geomap_surface_t* const surface) {
+
+    assert(s);
+    assert(surface);
+
+    surface->xorder = s->xorder;
+    surface->yorder = s->yorder;
+    surface->xterms = s->xterms;
+    surface->xrange = s->xrange;
+    surface->xmaxmin = s->xmaxmin;
+    surface->yrange = s->yrange;
+    surface->ymaxmin = s->ymaxmin;
+}
+
+/* Build a surface from its stored shape, normalization and
+   coefficients */
+static int
+geo_set_surface(
+        const surface_type_e function,
+        const geomap_surface_t* const surface,
+        const size_t ncoeff,
+        const double* const coeff,
+        /* Output */
+        surface_t* const s,
+        stimage_error_t* const error) {
+
+    bbox_t bbox;
+    size_t i;
+
+    assert(surface);
+    assert(s);
+    assert(error);
+
+    if (!(surface->xrange > 0.0) || !(surface->yrange > 0.0) ||
+        !(isfinite64(surface->xmaxmin)) || !(isfinite64(surface->ymaxmin))) {
+        stimage_error_set_message(error, "Invalid surface normalization");
+        return 1;
+    }
+
+    /* The bbox the normalization was computed from.  The stored
+       normalization is then restored exactly, rather than computed
+       again from the bbox with a possible rounding difference. */
+    bbox.min.x = -surface->xmaxmin - 1.0 / surface->xrange;
+    bbox.max.x = -surface->xmaxmin + 1.0 / surface->xrange;
+    bbox.min.y = -surface->ymaxmin - 1.0 / surface->yrange;
+    bbox.max.y = -surface->ymaxmin + 1.0 / surface->yrange;
+
+    if (surface_init(
+                s, function, (int)surface->xorder, (int)surface->yorder,
+                surface->xterms, &bbox, error)) return 1;
+
+    if (s->ncoeff != ncoeff || coeff == NULL) {
+        stimage_error_set_message(
+                error, "The coefficients do not match the surface");
+        return 1;
+    }
+
+    s->xrange = surface->xrange;
+    s->xmaxmin = surface->xmaxmin;
+    s->yrange = surface->yrange;
+    s->ymaxmin = surface->ymaxmin;
+    for (i = 0; i < ncoeff; ++i) {
+        s->coeff[i] = coeff[i];
+    }
+
+    return 0;
 }
 
 /* Store the results of the coordinate mapping in the result structure */
 static int
-geo_get_results(
+geo_get_results(
+        geomap_fit_t* const fit,
+        const surface_t* const sx1,
+        const surface_t* const sy1,
+        const surface_t* const sx2,
+        const surface_t* const sy2,
+        const int has_sx2,
+        const int has_sy2,
+        /* Output */
+        geomap_result_t* const result,
+        stimage_error_t* const error) {
+
+    long   ngood  = 0;
+    size_t i      = 0;
+    int    status = 1;
+
+    assert(fit);
+    assert(result);
+    assert(error);
+
+    geomap_result_init(result);
+
+    result->fit_geometry = fit->fit_geometry;
+    result->function = fit->function;
+    result->projection = fit->projection;
+    result->refpt.x = fit->refpt.x;
+    result->refpt.y = fit->refpt.y;
+
+    ngood = MAX(0, fit->ncoord - fit->n_zero_weighted);
+
+    if (ngood <= 1) {
+        result->rms.x = 0.0;
+        result->rms.y = 0.0;
+    } else {
+        result->rms.x = sqrt(fit->xrms / (double)(ngood - 1));
+        result->rms.y = sqrt(fit->yrms / (double)(ngood - 1));
+    }
+
+    if (geo_get_coeff(
+                sx1, sy1, &result->shift, &result->mag, &result->rotation,
+                error)) goto exit;
+
+    geo_get_surface(sx1, &result->xsurface);
+    geo_get_surface(sy1, &result->ysurface);
+    if (has_sx2) {
+        geo_get_surface(sx2, &result->x2surface);
+    }
+    if (has_sy2) {
+        geo_get_surface(sy2, &result->y2surface);
+    }
+
+    result->xxorder = fit->xxorder;
+    result->xyorder = fit->xyorder;
+    result->yxorder = fit->yxorder;
+    result->yyorder = fit->yyorder;
+
+    /* The scores are handed over to the result */
+    result->nscores = fit->nscores;
+    result->scores = fit->scores;
+    fit->nscores = 0;
+    fit->scores = NULL;
+
+    result->mean_ref.x   = fit->oref.x;
+    result->mean_ref.y   = fit->oref.y;
+    result->mean_input.x = fit->oin.x;
+    result->mean_input.y = fit->oin.y;
+
+    result->nxcoeff = sx1->ncoeff;
+    result->xcoeff = malloc_with_error(result->nxcoeff * sizeof(double), error);
+    if (result->xcoeff == NULL) goto exit;
+    for (i = 0; i < result->nxcoeff; ++i) {
+        result->xcoeff[i] = sx1->coeff[i];
+    }
+
+    result->nycoeff = sy1->ncoeff;
+    result->ycoeff = malloc_with_error(result->nycoeff * sizeof(double), error);
+    if (result->ycoeff == NULL) goto exit;
+    for (i = 0; i < result->nycoeff; ++i) {
+        result->ycoeff[i] = sy1->coeff[i];
+    }
+
+    if (has_sx2) {
+        result->nx2coeff = sx2->ncoeff;
+        result->x2coeff = malloc_with_error(
+                result->nx2coeff * sizeof(double), error);
+        if (result->x2coeff == NULL) goto exit;
+        for (i = 0; i < result->nx2coeff; ++i) {
+            result->x2coeff[i] = sx2->coeff[i];
+        }
+
+    } else {
+        result->nx2coeff = 0;
+        result->x2coeff = NULL;
+    }
+
+    if (has_sy2) {
+        result->ny2coeff = sy2->ncoeff;
+        result->y2coeff = malloc_with_error(
+                result->ny2coeff * sizeof(double), error);
+        if (result->y2coeff == NULL) goto exit;
+        for (i = 0; i < result->ny2coeff; ++i) {
+            result->y2coeff[i] = sy2->coeff[i];
+        }
+    } else {
+        result->ny2coeff = 0;
+        result->y2coeff = NULL;
+    }
+
+    status = 0;
+
+ exit:
+    if (status != 0) {
+        free(result->xcoeff);
+        free(result->ycoeff);
+        free(result->x2coeff);
+        free(result->y2coeff);
+        free(result->scores);
+        result->nscores = 0;
+        result->scores = NULL;
+    }
+
+    return status;
+}
+
+/* The state shared by the resampling tasks */
+typedef struct {
+    const geomap_fit_t*  fit;
+    geomap_uncertainty_e method;
+    size_t               ncoord;
+    const coord_t*       input;
+    const coord_t*       ref;
+    const double*        weights;
+    size_t               ngood;
+    const size_t*        good;       /* The points with weights > 0 */
+    size_t               nresamples;
+    uint64_t             seed;
+    int                  has_design;
+    geo_design_t         design[2];  /* x and y */
+    size_t               ncoeff[4];  /* x, y, x2 and y2 */
+    size_t               nvalues;
+    double*              values;     /* [nresamples * nvalues] */
+} geo_resample_t;
+
+/* The splitmix64 generator, so that the resamples only depend on the
+   seed and their number, and not on the thread they run on */
+static uint64_t
+geo_random(
+        uint64_t* const state) {
+
+    uint64_t z = (*state += 0x9E3779B97F4A7C15ULL);
+
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL;
+    return z ^ (z >> 31);
+}
+
+/* Add the weighted outer product of the design at point i to the
+   upper triangle of gram */
+static void
+geo_design_add(
+        const geo_design_t* const design,
+        const size_t i,
+        const double w,
+        double* const gram) {
+
+    const size_t  nc      = design->ncolumns;
+    const size_t  ncoord  = design->ncoord;
+    const double* columns = design->columns;
+    double        wp;
+    size_t        p, q;
+
+    for (p = 0; p < nc; ++p) {
+        wp = w * columns[p * ncoord + i];
+        for (q = p; q < nc; ++q) {
+            gram[p * nc + q] += wp * columns[q * ncoord + i];
+        }
+    }
+}
+
+/* Fit the resample r.  A bootstrap resample draws ngood of the points
+   with replacement, which weights each by the number of times it was
+   drawn.  A jackknife resample leaves out every nresamples-th point,
+   starting from the r-th. */
+static int
+geo_resample_task(
+        void* data,
+        const size_t r,
+        stimage_error_t* const error) {
+
+    geo_resample_t* state      = (geo_resample_t*)data;
+    double*         values     = state->values + r * state->nvalues;
+    double*         w          = NULL;
+    double*         gram       = NULL;
+    double*         scratch    = NULL;
+    double*         bw         = NULL;
+    double*         residual_x = NULL;
+    double*         residual_y = NULL;
+    const surface_t* surfaces[4];
+    const geo_design_t* design;
+    geomap_fit_t    fit;
+    surface_t       sx1, sy1, sx2, sy2;
+    int             has_sx2    = 0;
+    int             has_sy2    = 0;
+    int             fitted     = 1;
+    uint64_t        rng        = 0;
+    size_t          nc         = 0;
+    size_t          i, j, k, offset, axis;
+    double          my_nan     = fmod(1.0, 0.0);
+    int             status     = 1;
+
+    surface_new(&sx1);
+    surface_new(&sy1);
+    surface_new(&sx2);
+    surface_new(&sy2);
+
+    /* The weights of the resample.  A jackknife resample with a
+       design only needs its group, which is taken out of the normal
+       equations of all of the points below. */
+    if (state->method == geomap_uncertainty_bootstrap) {
+        w = malloc_with_error(MAX(1, state->ncoord) * sizeof(double), error);
+        if (w == NULL) goto exit;
+        for (i = 0; i < state->ncoord; ++i) {
+            w[i] = 0.0;
+        }
+        rng = state->seed + (uint64_t)r * 0xD1B54A32D192ED03ULL;
+        for (k = 0; k < state->ngood; ++k) {
+            i = state->good[geo_random(&rng) % state->ngood];
+            w[i] += state->weights[i];
+        }
+    } else if (!state->has_design) {
+        w = malloc_with_error(MAX(1, state->ncoord) * sizeof(double), error);
+        if (w == NULL) goto exit;
+        for (i = 0; i < state->ncoord; ++i) {
+            w[i] = state->weights[i];
+        }
+        for (k = r; k < state->ngood; k += state->nresamples) {
+            w[state->good[k]] = 0.0;
+        }
+    }
+
+    if (state->has_design) {
+        nc = MAX(state->design[0].ncolumns, state->design[1].ncolumns);
+        gram = malloc_with_error(nc * nc * sizeof(double), error);
+        if (gram == NULL) goto exit;
+        scratch = malloc_with_error(3 * nc * nc * sizeof(double), error);
+        if (scratch == NULL) goto exit;
+        if (state->method == geomap_uncertainty_bootstrap) {
+            bw = malloc_with_error(
+                    MAX(1, state->ncoord) * sizeof(double), error);
+            if (bw == NULL) goto exit;
+        }
+
+        for (axis = 0; axis < 2 && fitted; ++axis) {
+            design = &state->design[axis];
+            nc = design->ncolumns;
+
+            if (state->method == geomap_uncertainty_bootstrap) {
+                geo_design_gram(design, w, bw, gram);
+            } else {
+                for (i = 0; i < nc * nc; ++i) {
+                    gram[i] = design->gram[i];
+                }
+                for (k = r; k < state->ngood; k += state->nresamples) {
+                    i = state->good[k];
+                    geo_design_add(design, i, -state->weights[i], gram);
+                }
+            }
+
+            /* The coefficients are stored in the order x, y, x2, y2 */
+            offset = (axis == 0) ? 0 : state->ncoeff[0];
+            j = state->ncoeff[0] + state->ncoeff[1];
+            if (axis == 1) {
+                j += state->ncoeff[2];
+            }
+            if (geo_design_solve(
+                        design, gram, scratch, values + offset, values + j,
+                        &fitted, error)) goto exit;
+        }
+    } else {
+        /* The fitting geometries without a design are fit again, on
+           private copies of the fit and the surfaces */
+        fit = *state->fit;
+        fit.workspace = NULL;
+        fit.rej = NULL;
+        fit.nscores = 0;
+        fit.scores = NULL;
+
+        residual_x = malloc_with_error(
+                MAX(1, state->ncoord) * sizeof(double), error);
+        if (residual_x == NULL) goto exit;
+        residual_y = malloc_with_error(
+                MAX(1, state->ncoord) * sizeof(double), error);
+        if (residual_y == NULL) goto exit;
+
+        if (geo_fit_geometry(
+                    &fit, &sx1, &sy1, &sx2, &sy2, &has_sx2, &has_sy2,
+                    state->ncoord, state->input, state->ref, w,
+                    residual_x, residual_y, error)) {
+            /* Too few points were drawn */
+            fitted = 0;
+        } else {
+            surfaces[0] = &sx1;
+            surfaces[1] = &sy1;
+            surfaces[2] = has_sx2 ? &sx2 : NULL;
+            surfaces[3] = has_sy2 ? &sy2 : NULL;
+            offset = 0;
+            for (j = 0; j < 4; ++j) {
+                if (state->ncoeff[j] == 0) {
+                    continue;
+                }
+                if (surfaces[j] == NULL ||
+                    surfaces[j]->ncoeff != state->ncoeff[j]) {
+                    fitted = 0;
+                    break;
+                }
+                for (k = 0; k < state->ncoeff[j]; ++k) {
+                    values[offset + k] = surfaces[j]->coeff[k];
+                }
+                offset += state->ncoeff[j];
+            }
+        }
+    }
+
+    if (!fitted) {
+        for (k = 0; k < state->nvalues; ++k) {
+            values[k] = my_nan;
+        }
+    }
+
+    status = 0;
+
+ exit:
+
+    free(w);
+    free(gram);
+    free(scratch);
+    free(bw);
+    free(residual_x);
+    free(residual_y);
+    surface_free(&sx1);
+    surface_free(&sy1);
+    surface_free(&sx2);
+    surface_free(&sy2);
+
+    return status;
+}
+
+/* The covariance of n of the values of the resamples, from offset.
+   Resamples that could not be fit are left out. */
+static void
+geo_resample_covariance(
+        const size_t nresamples,
+        const size_t nvalues,
+        const double* const values,
+        const int jackknife,
+        const size_t offset,
+        const size_t n,
+        /* Output */
+        double* const mean, /* [n] */
+        double* const covariance) {
+
+    const double* row;
+    size_t        nvalid = 0;
+    double        factor;
+    double        my_nan = fmod(1.0, 0.0);
+    size_t        r, a, b;
+
+    for (a = 0; a < n; ++a) {
+        mean[a] = 0.0;
+        for (b = 0; b < n; ++b) {
+            covariance[a * n + b] = 0.0;
+        }
+    }
+
+    for (r = 0; r < nresamples; ++r) {
+        row = values + r * nvalues + offset;
+        if (isfinite64(row[0])) {
+            for (a = 0; a < n; ++a) {
+                mean[a] += row[a];
+            }
+            ++nvalid;
+        }
+    }
+
+    if (nvalid < 2) {
+        for (a = 0; a < n * n; ++a) {
+            covariance[a] = my_nan;
+        }
+        return;
+    }
+
+    for (a = 0; a < n; ++a) {
+        mean[a] /= (double)nvalid;
+    }
+
+    for (r = 0; r < nresamples; ++r) {
+        row = values + r * nvalues + offset;
+        if (isfinite64(row[0])) {
+            for (a = 0; a < n; ++a) {
+                for (b = a; b < n; ++b) {
+                    covariance[a * n + b] +=
+                        (row[a] - mean[a]) * (row[b] - mean[b]);
+                }
+            }
+        }
+    }
+
+    if (jackknife) {
+        factor = (double)(nvalid - 1) / (double)nvalid;
+    } else {
+        factor = 1.0 / (double)(nvalid - 1);
+    }
+    for (a = 0; a < n; ++a) {
+        for (b = a; b < n; ++b) {
+            covariance[a * n + b] *= factor;
+            covariance[b * n + a] = covariance[a * n + b];
+        }
+    }
+}
+
+/* Fill an n x n covariance matrix with NaN */
+static void
+geo_nan_covariance(
+        const size_t n,
+        double* const covariance) {
+
+    double my_nan = fmod(1.0, 0.0);
+    size_t i;
+
+    for (i = 0; i < n * n; ++i) {
+        covariance[i] = my_nan;
+    }
+}
+
+/* The covariances of the linear and distortion surfaces of one axis
+   of a general fit, from the resamples.  The distortion surface is fit
+   to the residuals of the linear one, so each resample of the linear
+   fit scatters with the sample of the distortion it is fit to, and
+   is compensated by the distortion surface.  The covariance of the
+   fit is that of the combined surface: the distortion surface with
+   the linear coefficients added to its terms at idx.  The linear
+   coefficients are the fit of the linear surface to the combined one,
+   M = G11^-1 G12 in the Gram matrix of the design, so their
+   covariance is propagated from it as M cov2 M^T. */
+static int
+geo_resample_general_covariance(
+        const geo_design_t* const design,
+        const size_t* const idx,
+        const size_t nresamples,
+        const size_t nvalues,
+        const double* const values,
+        const int jackknife,
+        const size_t offset1,
+        const size_t offset2,
+        /* Output */
+        double* const cov1,
+        double* const cov2,
+        stimage_error_t* error) {
+
+    const size_t        nc         = design->ncolumns;
+    const size_t        n1         = design->n1;
+    const size_t        n2         = design->n2;
+    double*             combined   = NULL;
+    double*             m          = NULL;
+    double*             scratch    = NULL;
+    double*             mean       = NULL;
+    double*             rhs;
+    double*             column;
+    const double*       row;
+    surface_fit_error_e error_type = surface_fit_error_ok;
+    double              sum;
+    size_t              r, a, b, k, l;
+    int                 status     = 1;
+
+    combined = malloc_with_error(
+            MAX(1, nresamples * n2) * sizeof(double), error);
+    if (combined == NULL) goto exit;
+    m = malloc_with_error(n1 * n2 * sizeof(double), error);
+    if (m == NULL) goto exit;
+    scratch = malloc_with_error(2 * n1 * (n1 + 1) * sizeof(double), error);
+    if (scratch == NULL) goto exit;
+    mean = malloc_with_error(n2 * sizeof(double), error);
+    if (mean == NULL) goto exit;
+    rhs = scratch + 2 * n1 * n1;
+    column = rhs + n1;
+
+    for (r = 0; r < nresamples; ++r) {
+        row = values + r * nvalues;
+        for (k = 0; k < n2; ++k) {
+            combined[r * n2 + k] = row[offset2 + k];
+        }
+        for (a = 0; a < n1; ++a) {
+            combined[r * n2 + idx[a]] += row[offset1 + a];
+        }
+    }
+    geo_resample_covariance(
+            nresamples, n2, combined, jackknife, 0, n2, mean, cov2);
+
+    /* Column k of M, from column k of G12 */
+    for (k = 0; k < n2; ++k) {
+        for (a = 0; a < n1; ++a) {
+            rhs[a] = design->gram[a * nc + n1 + k];
+        }
+        if (geo_gram_solve(
+                    nc, design->gram, 0, n1, rhs, scratch,
+                    scratch + n1 * n1, column, &error_type,
+                    error)) goto exit;
+        if (error_type != surface_fit_error_ok) {
+            geo_nan_covariance(n1, cov1);
+            status = 0;
+            goto exit;
+        }
+        for (a = 0; a < n1; ++a) {
+            m[a * n2 + k] = column[a];
+        }
+    }
+
+    for (a = 0; a < n1; ++a) {
+        for (b = a; b < n1; ++b) {
+            sum = 0.0;
+            for (k = 0; k < n2; ++k) {
+                for (l = 0; l < n2; ++l) {
+                    sum += m[a * n2 + k] * cov2[k * n2 + l] * m[b * n2 + l];
+                }
+            }
+            cov1[a * n1 + b] = cov1[b * n1 + a] = sum;
+        }
+    }
+
+    status = 0;
+
+ exit:
+
+    free(combined);
+    free(m);
+    free(scratch);
+    free(mean);
+
+    return status;
+}
+
+/* The analytic covariance of the coefficients of one axis, from the
+   Cholesky factorization of its fit */
+static int
+geo_analytic_covariance(
+        const geomap_fit_t* const fit,
+        const surface_t* const s1,
+        const surface_t* const s2,
+        const int has_s2,
+        const double chisq,
+        const size_t ncoord,
+        const double* const weights,
+        /* Output */
+        double* const cov1,
+        double* const cov2,
+        stimage_error_t* error) {
+
+    const size_t n1     = s1->ncoeff;
+    const size_t ngood  = ncoord - count_zero_weighted(ncoord, weights);
+    size_t       nparam = 0;
+    double       sigma2 = 0.0;
+    double       sw     = 0.0;
+    double       my_nan = fmod(1.0, 0.0);
+    size_t       i;
+
+    switch (fit->fit_geometry) {
+    case geomap_fit_shift:
+        nparam = 1;
+        break;
+    case geomap_fit_xyscale:
+    case geomap_fit_general:
+        nparam = has_s2 ? s2->ncoeff : n1;
+        break;
+    default:
+        for (i = 0; i < n1 * n1; ++i) {
+            cov1[i] = my_nan;
+        }
+        return 0;
+    }
+
+    /* The variance of the residuals */
+    sigma2 = (ngood > nparam) ? chisq / (double)(ngood - nparam) : my_nan;
+
+    if (fit->fit_geometry == geomap_fit_shift) {
+        /* The shift is the weighted mean of the offsets, and the rest
+           of the coefficients are fixed */
+        for (i = 0; i < ncoord; ++i) {
+            sw += MAX(0.0, weights[i]);
+        }
+        for (i = 0; i < n1 * n1; ++i) {
+            cov1[i] = 0.0;
+        }
+        cov1[0] = (sw > 0.0) ? sigma2 / sw : my_nan;
+        return 0;
+    }
+
+    if (surface_fit_covariance(s1, cov1, error)) return 1;
+    for (i = 0; i < n1 * n1; ++i) {
+        cov1[i] *= sigma2;
+    }
+
+    if (has_s2) {
+        if (surface_fit_covariance(s2, cov2, error)) return 1;
+        for (i = 0; i < s2->ncoeff * s2->ncoeff; ++i) {
+            cov2[i] *= sigma2;
+        }
+    }
+
+    return 0;
+}
+
+/* Estimate the covariances of the coefficients, as asked for by
+   options->uncertainty, from the points with weights > 0 */
+static int
+geo_get_uncertainty(
         const geomap_fit_t* const fit,
+        const geomap_options_t* const options,
         const surface_t* const sx1,
         const surface_t* const sy1,
         const surface_t* const sx2,
         const surface_t* const sy2,
         const int has_sx2,
         const int has_sy2,
+        const size_t ncoord,
+        const coord_t* const input,
+        const coord_t* const ref,
+        const double* const weights,
         /* Output */
         geomap_result_t* const result,
-        stimage_error_t* const error) {
+        stimage_error_t* error) {
 
-    long   ngood  = 0;
-    size_t i      = 0;
-    int    status = 1;
+    geo_resample_t   state;
+    double**         covs[4];
+    size_t           offsets[4];
+    const surface_t* linear[2];
+    const surface_t* distortion[2];
+    int              nested[2];
+    size_t*          idx    = NULL;
+    size_t*          good   = NULL;
+    double*          z      = NULL;
+    double*          mean   = NULL;
+    size_t           nmax   = 0;
+    size_t           i, j, axis;
+    int              status = 1;
 
     assert(fit);
+    assert(options);
     assert(result);
-    assert(error);
-
-    geomap_result_init(result);
 
-    result->fit_geometry = fit->fit_geometry;
-    result->function = fit->function;
+    result->uncertainty = options->uncertainty;
+    if (options->uncertainty == geomap_uncertainty_none) {
+        return 0;
+    }
+
+    covs[0] = &result->xcov;
+    covs[1] = &result->ycov;
+    covs[2] = &result->x2cov;
+    covs[3] = &result->y2cov;
+
+    memset(&state, 0, sizeof(geo_resample_t));
+    state.ncoeff[0] = result->nxcoeff;
+    state.ncoeff[1] = result->nycoeff;
+    state.ncoeff[2] = result->nx2coeff;
+    state.ncoeff[3] = result->ny2coeff;
+
+    for (j = 0; j < 4; ++j) {
+        offsets[j] = state.nvalues;
+        state.nvalues += state.ncoeff[j];
+        nmax = MAX(nmax, state.ncoeff[j]);
+        if (state.ncoeff[j] > 0) {
+            *covs[j] = malloc_with_error(
+                    state.ncoeff[j] * state.ncoeff[j] * sizeof(double),
+                    error);
+            if (*covs[j] == NULL) goto exit;
+        }
+    }
 
-    ngood = MAX(0, fit->ncoord - fit->n_zero_weighted);
+    /* The covariances of a general fit with a distortion surface are
+       those of the combined surface, which needs the linear terms
+       among those of the distortion surface */
+    linear[0] = sx1;
+    linear[1] = sy1;
+    distortion[0] = (fit->fit_geometry == geomap_fit_general && has_sx2) ?
+        sx2 : NULL;
+    distortion[1] = (fit->fit_geometry == geomap_fit_general && has_sy2) ?
+        sy2 : NULL;
+    idx = malloc_with_error(2 * MAX(1, nmax) * sizeof(size_t), error);
+    if (idx == NULL) goto exit;
+    for (axis = 0; axis < 2; ++axis) {
+        nested[axis] = 0;
+        if (distortion[axis] != NULL &&
+            surface_fit_nested_index(
+                    distortion[axis], linear[axis], fit->workspace,
+                    idx + axis * nmax, &nested[axis], error)) goto exit;
+    }
+
+    if (options->uncertainty == geomap_uncertainty_analytic) {
+        if (geo_analytic_covariance(
+                    fit, sx1, sx2, has_sx2, fit->xrms, ncoord, weights,
+                    result->xcov, result->x2cov, error) ||
+            geo_analytic_covariance(
+                    fit, sy1, sy2, has_sy2, fit->yrms, ncoord, weights,
+                    result->ycov, result->y2cov, error)) goto exit;
+        for (axis = 0; axis < 2; ++axis) {
+            if (distortion[axis] != NULL && !nested[axis]) {
+                geo_nan_covariance(state.ncoeff[axis], *covs[axis]);
+                geo_nan_covariance(
+                        state.ncoeff[axis + 2], *covs[axis + 2]);
+            }
+        }
+        status = 0;
+        goto exit;
+    }
 
-    if (ngood <= 1) {
-        result->rms.x = 0.0;
-        result->rms.y = 0.0;
-    } else {
-        result->rms.x = sqrt(fit->xrms / (double)(ngood - 1));
-        result->rms.y = sqrt(fit->yrms / (double)(ngood - 1));
+    good = malloc_with_error(MAX(1, ncoord) * sizeof(size_t), error);
+    if (good == NULL) goto exit;
+    for (i = 0; i < ncoord; ++i) {
+        if (weights[i] > 0.0) {
+            good[state.ngood++] = i;
+        }
     }
 
-    if (geo_get_coeff(
-                sx1, sy1, &result->shift, &result->mag, &result->rotation,
-                error)) goto exit;
+    state.nresamples = options->nresamples;
+    if (options->uncertainty == geomap_uncertainty_jackknife &&
+        (state.nresamples == 0 || state.nresamples > state.ngood)) {
+        state.nresamples = state.ngood;
+    }
+    if (state.nresamples < 2) {
+        stimage_error_set_message(
+                error, "At least 2 resamples are needed for the covariances");
+        goto exit;
+    }
 
-    result->mean_ref.x   = fit->oref.x;
-    result->mean_ref.y   = fit->oref.y;
-    result->mean_input.x = fit->oin.x;
-    result->mean_input.y = fit->oin.y;
+    state.fit = fit;
+    state.method = options->uncertainty;
+    state.ncoord = ncoord;
+    state.input = input;
+    state.ref = ref;
+    state.weights = weights;
+    state.good = good;
+    state.seed = (uint64_t)options->seed;
+    state.has_design = (fit->fit_geometry == geomap_fit_xyscale ||
+                        fit->fit_geometry == geomap_fit_general);
 
-    result->nxcoeff = sx1->ncoeff;
-    result->xcoeff = malloc_with_error(result->nxcoeff * sizeof(double), error);
-    if (result->xcoeff == NULL) goto exit;
-    for (i = 0; i < result->nxcoeff; ++i) {
-        result->xcoeff[i] = sx1->coeff[i];
-    }
+    if (state.has_design) {
+        z = workspace_alloc(
+                fit->workspace, MAX(1, ncoord) * sizeof(double), error);
+        if (z == NULL) goto exit;
 
-    result->nycoeff = sy1->ncoeff;
-    result->ycoeff = malloc_with_error(result->nycoeff * sizeof(double), error);
-    if (result->ycoeff == NULL) goto exit;
-    for (i = 0; i < result->nycoeff; ++i) {
-        result->ycoeff[i] = sy1->coeff[i];
+        for (axis = 0; axis < 2; ++axis) {
+            for (i = 0; i < ncoord; ++i) {
+                z[i] = (axis == 0) ? input[i].x : input[i].y;
+            }
+            if (geo_design_init(
+                        (axis == 0) ? sx1 : sy1,
+                        (axis == 0) ? (has_sx2 ? sx2 : NULL) :
+                                      (has_sy2 ? sy2 : NULL),
+                        ncoord, ref, z, weights, fit->workspace,
+                        &state.design[axis], error)) goto exit;
+        }
     }
 
-    if (has_sx2) {
-        result->nx2coeff = sx2->ncoeff;
-        result->x2coeff = malloc_with_error(
-                result->nx2coeff * sizeof(double), error);
-        if (result->x2coeff == NULL) goto exit;
-        for (i = 0; i < result->nx2coeff; ++i) {
-            result->x2coeff[i] = sx2->coeff[i];
-        }
+    result->resamples = malloc_with_error(
+            state.nresamples * MAX(1, state.nvalues) * sizeof(double), error);
+    if (result->resamples == NULL) goto exit;
+    result->nresamples = state.nresamples;
+    state.values = result->resamples;
 
-    } else {
-        result->nx2coeff = 0;
-        result->x2coeff = NULL;
-    }
+    if (parallel_for(
+                options->nthreads, state.nresamples, &geo_resample_task,
+                &state, error)) goto exit;
 
-    if (has_sy2) {
-        result->ny2coeff = sy2->ncoeff;
-        result->y2coeff = malloc_with_error(
-                result->ny2coeff * sizeof(double), error);
-        if (result->y2coeff == NULL) goto exit;
-        for (i = 0; i < result->ny2coeff; ++i) {
-            result->y2coeff[i] = sy2->coeff[i];
+    mean = malloc_with_error(MAX(1, nmax) * sizeof(double), error);
+    if (mean == NULL) goto exit;
+    for (j = 0; j < 4; ++j) {
+        if (state.ncoeff[j] == 0 || (j >= 2 && distortion[j - 2] != NULL)) {
+            continue;
         }
-    } else {
-        result->ny2coeff = 0;
-        result->y2coeff = NULL;
+        if (j < 2 && distortion[j] != NULL) {
+            if (!nested[j]) {
+                geo_nan_covariance(state.ncoeff[j], *covs[j]);
+                geo_nan_covariance(state.ncoeff[j + 2], *covs[j + 2]);
+            } else if (geo_resample_general_covariance(
+                               &state.design[j], idx + j * nmax,
+                               state.nresamples, state.nvalues, state.values,
+                               options->uncertainty ==
+                               geomap_uncertainty_jackknife,
+                               offsets[j], offsets[j + 2], *covs[j],
+                               *covs[j + 2], error)) goto exit;
+            continue;
+        }
+        geo_resample_covariance(
+                state.nresamples, state.nvalues, state.values,
+                options->uncertainty == geomap_uncertainty_jackknife,
+                offsets[j], state.ncoeff[j], mean, *covs[j]);
     }
 
     status = 0;
 
  exit:
-    if (status != 0) {
-        free(result->xcoeff);
-        free(result->ycoeff);
-        free(result->x2coeff);
-        free(result->y2coeff);
-    }
+
+    free(idx);
+    free(good);
+    free(mean);
+    workspace_release(fit->workspace, z);
+    geo_design_free(&state.design[0]);
+    geo_design_free(&state.design[1]);
 
     return status;
 }
@@ -1506,6 +3169,8 @@ geomap(
         const size_t ninput, const coord_t* const input,
         const size_t nref, const coord_t* const ref,
         const bbox_t* const bbox,
+        const geomap_proj_e projection,
+        const coord_t* const refpt,
         const geomap_fit_e fit_geometry,
         const surface_type_e function,
         const size_t xxorder,
@@ -1516,6 +3181,8 @@ geomap(
         const xterms_e yxterms,
         const size_t maxiter,
         const double reject,
+        const geomap_options_t* const options,
+        workspace_t* const workspace,
         /* Input/Output */
         size_t* const noutput,
         /* Output */
@@ -1524,11 +3191,15 @@ geomap(
         stimage_error_t* const error) {
 
     geomap_fit_t     fit;
+    geomap_options_t default_options;
+    const geomap_options_t* opts    = options;
+    workspace_mark_t mark           = workspace_mark(workspace);
     bbox_t           tbbox;
     size_t           ninput_in_bbox = ninput;
     size_t           nref_in_bbox   = nref;
     coord_t*         input_in_bbox  = NULL;
     coord_t*         ref_in_bbox    = NULL;
+    coord_t*         ref_fit        = NULL;
     double*          xfit           = NULL;
     double*          yfit           = NULL;
     double*          weights        = NULL;
@@ -1545,21 +3216,55 @@ geomap(
     assert(ref);
     assert(error);
 
+    geomap_fit_new(&fit);
+
     if (ninput != nref) {
         stimage_error_set_message(
             error, "Must have the same number of input and reference coordinates.");
         goto exit;
     }
 
+    if (projection >= geomap_proj_LAST || projection < 0 ||
+        !projection_is_supported(projection)) {
+        stimage_error_set_message(error, "Unsupported projection");
+        goto exit;
+    }
+
     surface_new(&sx1);
     surface_new(&sy1);
     surface_new(&sx2);
     surface_new(&sy2);
 
+    if (opts == NULL) {
+        geomap_options_init(&default_options);
+        opts = &default_options;
+    }
+
+    if (opts->order_select >= geomap_order_LAST ||
+        opts->order_select < 0) {
+        stimage_error_set_message(error, "Invalid order selection");
+        goto exit;
+    }
+
+    if (opts->uncertainty >= geomap_uncertainty_LAST ||
+        opts->uncertainty < 0) {
+        stimage_error_set_message(error, "Invalid uncertainty estimate");
+        goto exit;
+    }
+
+    if (opts->robust >= geomap_robust_LAST || opts->robust < 0) {
+        stimage_error_set_message(error, "Invalid robust weight function");
+        goto exit;
+    }
+
     geomap_fit_init(
-            &fit, geomap_proj_none, fit_geometry, function,
+            &fit, projection, fit_geometry, function,
             xxorder, xyorder, xxterms, yxorder, yyorder, yxterms,
-            maxiter, reject);
+            maxiter, reject, workspace);
+    fit.robust = opts->robust;
+    fit.robust_tuning = opts->robust_tuning;
+    fit.robust_maxiter = opts->robust_maxiter;
+    fit.robust_tol = opts->robust_tol;
 
     /* If bbox is NULL, provide a dummy one full of NaNs */
     if (bbox == NULL) {
@@ -1579,12 +3284,12 @@ geomap(
         ninput_in_bbox = ninput;
         nref_in_bbox = nref;
     } else {
-        input_in_bbox = malloc_with_error(
-                ninput * sizeof(coord_t), error);
+        input_in_bbox = workspace_alloc(
+                workspace, ninput * sizeof(coord_t), error);
         if (input_in_bbox == NULL) goto exit;
 
-        ref_in_bbox = malloc_with_error(
-                nref * sizeof(coord_t), error);
+        ref_in_bbox = workspace_alloc(
+                workspace, nref * sizeof(coord_t), error);
         if (ref_in_bbox == NULL) goto exit;
 
         /* Reduce data to only those in the bbox */
@@ -1592,23 +3297,52 @@ geomap(
                 ninput, input, ref, &tbbox, input_in_bbox, ref_in_bbox);
     }
 
+    /* Project the reference coordinates onto the plane of the sky.
+       From here on, the fit only sees the projected coordinates, but
+       the output still reports the reference coordinates as given. */
+    if (projection_is_celestial(projection)) {
+        if (refpt != NULL && coord_is_finite(refpt)) {
+            fit.refpt.x = refpt->x;
+            fit.refpt.y = refpt->y;
+        } else {
+            compute_sky_refpt(nref_in_bbox, ref_in_bbox, &fit.refpt);
+        }
+
+        ref_fit = workspace_alloc(
+                workspace, nref_in_bbox * sizeof(coord_t), error);
+        if (ref_fit == NULL) goto exit;
+
+        if (project_coords(
+                    projection, &fit.refpt, nref_in_bbox, ref_in_bbox,
+                    ref_fit, error)) goto exit;
+
+        /* The bbox given by the user is on the sky, so the bbox of
+           the fit must be found from the projected coordinates */
+        bbox_init(&tbbox);
+    } else {
+        /* Set the reference point for the projections to undefined */
+        fit.refpt.x = my_nan;
+        fit.refpt.y = my_nan;
+
+        ref_fit = ref_in_bbox;
+    }
+
     /* Compute the mean of the reference and input coordinates */
-    compute_mean_coord(nref_in_bbox, ref_in_bbox, &fit.oref);
+    compute_mean_coord(nref_in_bbox, ref_fit, &fit.oref);
     compute_mean_coord(ninput_in_bbox, input_in_bbox, &fit.oin);
 
-    /* Set the reference point for the projections to undefined */
-    fit.refpt.x = my_nan;
-    fit.refpt.y = my_nan;
-
     /* Allocate some memory */
-    xfit = malloc_with_error(ninput_in_bbox * sizeof(double), error);
+    xfit = workspace_alloc(
+            workspace, ninput_in_bbox * sizeof(double), error);
     if (xfit == NULL) goto exit;
 
-    yfit = malloc_with_error(ninput_in_bbox * sizeof(double), error);
+    yfit = workspace_alloc(
+            workspace, ninput_in_bbox * sizeof(double), error);
     if (yfit == NULL) goto exit;
 
     /* Compute the weights */
-    weights = malloc_with_error(ninput_in_bbox * sizeof(double), error);
+    weights = workspace_alloc(
+            workspace, ninput_in_bbox * sizeof(double), error);
     if (weights == NULL) goto exit;
 
     for (i = 0; i < ninput_in_bbox; ++i) {
@@ -1616,18 +3350,25 @@ geomap(
     }
 
     /* Determine the actual max and min of the coordinates */
-    determine_bbox(nref_in_bbox, ref_in_bbox, &tbbox);
+    determine_bbox(nref_in_bbox, ref_fit, &tbbox);
     bbox_copy(&tbbox, &fit.bbox);
 
+    if (opts->order_select != geomap_order_fixed &&
+        fit_geometry == geomap_fit_general) {
+        if (geo_select_order(
+                    &fit, opts, ninput_in_bbox, input_in_bbox, ref_fit,
+                    weights, error)) goto exit;
+    }
+
     if (geofit(
                 &fit, &sx1, &sy1, &sx2, &sy2, &has_sx2, &has_sy2,
-                ninput_in_bbox, input_in_bbox, ref_in_bbox, weights,
+                ninput_in_bbox, input_in_bbox, ref_fit, weights,
                 error)) goto exit;
 
     /* Compute the fitted x and y values */
     if (geoeval(
                 &sx1, &sy1, &sx2, &sy2, has_sx2, has_sy2, ninput_in_bbox,
-                ref_in_bbox, xfit, yfit, error)) goto exit;
+                ref_fit, xfit, yfit, workspace, error)) goto exit;
 
     if (geo_get_results(
                 &fit, &sx1, &sy1, &sx2, &sy2, has_sx2, has_sy2, result,
@@ -1636,11 +3377,12 @@ geomap(
     /* DIFF: This section is from geo_plistd */
 
     /* Copy the results to the output buffer */
-    tweights = malloc_with_error(ninput_in_bbox * sizeof(double), error);
+    tweights = workspace_alloc(
+            workspace, ninput_in_bbox * sizeof(double), error);
     if (tweights == NULL) goto exit;
 
     for (i = 0; i < ninput_in_bbox; ++i) {
-        tweights[i] = weights[i];
+        tweights[i] = (fit.rweights != NULL) ? fit.rweights[i] : weights[i];
     }
 
     for (i = 0; i < fit.nreject; ++i) {
@@ -1651,6 +3393,26 @@ geomap(
         }
     }
 
+    result->niter = fit.niter;
+    result->nweights = ninput_in_bbox;
+    result->weights = malloc_with_error(
+            MAX(1, ninput_in_bbox) * sizeof(double), error);
+    if (result->weights == NULL) {
+        geomap_result_free(result);
+        goto exit;
+    }
+    for (i = 0; i < ninput_in_bbox; ++i) {
+        result->weights[i] = tweights[i];
+    }
+
+    if (geo_get_uncertainty(
+                &fit, opts, &sx1, &sy1, &sx2, &sy2, has_sx2, has_sy2,
+                ninput_in_bbox, input_in_bbox, ref_fit, tweights, result,
+                error)) {
+        geomap_result_free(result);
+        goto exit;
+    }
+
     outi = output;
     for (i = 0; i < ninput_in_bbox; ++i, ++outi) {
         outi->ref.x = ref_in_bbox[i].x;
@@ -1676,19 +3438,24 @@ geomap(
  exit:
 
     if (input_in_bbox != input) {
-        free(input_in_bbox);
+        workspace_release(workspace, input_in_bbox);
+    }
+    if (ref_fit != ref_in_bbox) {
+        workspace_release(workspace, ref_fit);
     }
     if (ref_in_bbox != ref) {
-        free(ref_in_bbox);
+        workspace_release(workspace, ref_in_bbox);
     }
-    free(weights);
-    free(xfit);
-    free(yfit);
-    free(tweights);
+    workspace_release(workspace, weights);
+    workspace_release(workspace, xfit);
+    workspace_release(workspace, yfit);
+    workspace_release(workspace, tweights);
+    geomap_fit_free(&fit);
     surface_free(&sx1);
     surface_free(&sy1);
     surface_free(&sx2);
     surface_free(&sy2);
+    workspace_rewind(workspace, mark);
 
     return status;
 }
@@ -1697,10 +3464,35 @@ void
 geomap_result_init(
         geomap_result_t* const r) {
 
+    r->projection = geomap_proj_none;
+    r->nxcoeff = 0;
     r->xcoeff = NULL;
+    r->nycoeff = 0;
     r->ycoeff = NULL;
+    r->nx2coeff = 0;
     r->x2coeff = NULL;
+    r->ny2coeff = 0;
     r->y2coeff = NULL;
+    memset(&r->xsurface, 0, sizeof(geomap_surface_t));
+    memset(&r->ysurface, 0, sizeof(geomap_surface_t));
+    memset(&r->x2surface, 0, sizeof(geomap_surface_t));
+    memset(&r->y2surface, 0, sizeof(geomap_surface_t));
+    r->xxorder = 0;
+    r->xyorder = 0;
+    r->yxorder = 0;
+    r->yyorder = 0;
+    r->nscores = 0;
+    r->scores = NULL;
+    r->uncertainty = geomap_uncertainty_none;
+    r->xcov = NULL;
+    r->ycov = NULL;
+    r->x2cov = NULL;
+    r->y2cov = NULL;
+    r->nresamples = 0;
+    r->resamples = NULL;
+    r->niter = 0;
+    r->nweights = 0;
+    r->weights = NULL;
 }
 
 void
@@ -1711,6 +3503,123 @@ geomap_result_free(
     free(r->ycoeff); r->ycoeff = NULL;
     free(r->x2coeff); r->x2coeff = NULL;
     free(r->y2coeff); r->y2coeff = NULL;
+    free(r->scores); r->scores = NULL;
+    r->nscores = 0;
+    free(r->xcov); r->xcov = NULL;
+    free(r->ycov); r->ycov = NULL;
+    free(r->x2cov); r->x2cov = NULL;
+    free(r->y2cov); r->y2cov = NULL;
+    free(r->resamples); r->resamples = NULL;
+    r->nresamples = 0;
+    free(r->weights); r->weights = NULL;
+    r->nweights = 0;
+}
+
+void
+geomap_options_init(
+        geomap_options_t* const options) {
+
+    options->order_select = geomap_order_fixed;
+    options->max_order = 5;
+    options->nfolds = 5;
+    options->uncertainty = geomap_uncertainty_none;
+    options->nresamples = 100;
+    options->seed = 0;
+    options->nthreads = 1;
+    options->robust = geomap_robust_none;
+    options->robust_tuning = 0.0;
+    options->robust_maxiter = 50;
+    options->robust_tol = 1e-4;
+}
+
+int
+geomap_result_eval(
+        const geomap_result_t* const result,
+        const size_t ncoord,
+        const coord_t* const ref,
+        /* Output */
+        coord_t* const fit,
+        stimage_error_t* const error) {
+
+    surface_t      sx1, sy1, sx2, sy2;
+    const int      has_sx2 = result->nx2coeff > 0;
+    const int      has_sy2 = result->ny2coeff > 0;
+    coord_t*       projected = NULL;
+    const coord_t* ref_fit   = ref;
+    double*        xfit      = NULL;
+    double*        yfit      = NULL;
+    size_t         i         = 0;
+    int            status    = 1;
+
+    assert(result);
+    assert(ref);
+    assert(fit);
+    assert(error);
+
+    surface_new(&sx1);
+    surface_new(&sy1);
+    surface_new(&sx2);
+    surface_new(&sy2);
+
+    if (result->function >= surface_type_LAST || result->function < 0) {
+        stimage_error_set_message(error, "Unknown surface type");
+        goto exit;
+    }
+
+    if (geo_set_surface(
+                result->function, &result->xsurface, result->nxcoeff,
+                result->xcoeff, &sx1, error) ||
+        geo_set_surface(
+                result->function, &result->ysurface, result->nycoeff,
+                result->ycoeff, &sy1, error)) goto exit;
+    if (has_sx2 && geo_set_surface(
+                result->function, &result->x2surface, result->nx2coeff,
+                result->x2coeff, &sx2, error)) goto exit;
+    if (has_sy2 && geo_set_surface(
+                result->function, &result->y2surface, result->ny2coeff,
+                result->y2coeff, &sy2, error)) goto exit;
+
+    if (ncoord == 0) {
+        status = 0;
+        goto exit;
+    }
+
+    if (projection_is_celestial(result->projection)) {
+        projected = malloc_with_error(ncoord * sizeof(coord_t), error);
+        if (projected == NULL) goto exit;
+        if (project_coords(
+                    result->projection, &result->refpt, ncoord, ref,
+                    projected, error)) goto exit;
+        ref_fit = projected;
+    }
+
+    xfit = malloc_with_error(ncoord * sizeof(double), error);
+    if (xfit == NULL) goto exit;
+    yfit = malloc_with_error(ncoord * sizeof(double), error);
+    if (yfit == NULL) goto exit;
+
+    if (geoeval(
+                &sx1, &sy1, &sx2, &sy2, has_sx2, has_sy2, ncoord, ref_fit,
+                xfit, yfit, NULL, error)) goto exit;
+
+    for (i = 0; i < ncoord; ++i) {
+        fit[i].x = xfit[i];
+        fit[i].y = yfit[i];
+    }
+
+    status = 0;
+
+ exit:
+
+    surface_free(&sx1);
+    surface_free(&sy1);
+    surface_free(&sx2);
+    surface_free(&sy2);
+    free(projected);
+    free(xfit);
+    free(yfit);
+
+    return status;
 }
 
 void
@@ -1774,6 +3683,9 @@ geomap_result_print(
     printf("FIT RESULTS:\n");
     printf("  fit_geometry: %s\n", fit_geometry);
     printf("  function:     %s\n", function);
+    if (projection_is_celestial(r->projection)) {
+        printf("  refpt:        (%f, %f)\n", r->refpt.x, r->refpt.y);
+    }
     printf("  rms:          (%f, %f)\n", r->rms.x, r->rms.y);
     printf("  mean_ref:     (%f, %f)\n", r->mean_ref.x, r->mean_ref.y);
     printf("  mean_input:   (%f, %f)\n", r->mean_input.x, r->mean_input.y);
@@ -0,0 +1,554 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <assert.h>
+#define _USE_MATH_DEFINES       /* needed for MS Windows to define M_PI */
+#include <math.h>
+#include <string.h>
+
+#include "immatch/lib/offsets.h"
+#include "immatch/lib/tolerance.h"
+#include "lib/xysort.h"
+
+/* The maximum number of histogram bins along each axis.  If the
+   search radius is too large for bins of width tolerance, the bins
+   are made wider, and the peak is then refined by histograms of
+   shrinking radius about it.  The default search radius is the
+   largest for which the bins are tolerance wide. */
+#define OFFSETS_MAX_BINS 1024
+
+/* The maximum number of grid steps on either side of zero for the
+   rotation and scale searches */
+#define OFFSETS_MAX_ROTATION_STEPS 45
+#define OFFSETS_MAX_SCALE_STEPS 10
+
+/* The maximum number of input coordinates that vote at each point of
+   the rotation and scale grid.  The peak only needs to stand out from
+   the background, so a spatially uniform subsample is enough. */
+#define OFFSETS_MAX_GRID_VOTERS 10000
+
+/* A spatial index of the reference coordinates: each coordinate is
+   binned into a square cell of width search_radius, and the cells are
+   sorted by (row, column), so that the cells of each row within
+   search_radius of a point are contiguous. */
+typedef struct {
+    double                       size;
+    size_t                       n;
+    const coord_t* const *       refs;
+    coord_t*                     cells;
+    size_t*                      order;
+} ref_index_t;
+
+/* A histogram of the displacements within radius of center */
+typedef struct {
+    coord_t       center;
+    double        radius;
+    double        width;
+    size_t        nbins;
+    size_t        capacity; /* The number of counts allocated */
+    unsigned int* counts;
+} histogram_t;
+
+static int
+ref_index_init(
+        ref_index_t* const index,
+        const size_t n,
+        const coord_t* const * const refs,
+        const double size,
+        stimage_error_t* const error) {
+
+    size_t i;
+
+    index->size = size;
+    index->n = n;
+    index->refs = refs;
+    index->cells = malloc_with_error(n * sizeof(coord_t), error);
+    if (index->cells == NULL) return 1;
+    index->order = malloc_with_error(n * sizeof(size_t), error);
+    if (index->order == NULL) return 1;
+
+    for (i = 0; i < n; ++i) {
+        index->cells[i].x = floor(refs[i]->x / size);
+        index->cells[i].y = floor(refs[i]->y / size);
+    }
+
+    return xysort_index(n, index->cells, index->order, 1, error);
+}
+
+static void
+ref_index_free(
+        ref_index_t* const index) {
+
+    free(index->cells);
+    free(index->order);
+}
+
+/* Find the first entry in the index >= (col, row) */
+static size_t
+ref_index_find(
+        const ref_index_t* const index,
+        const double col,
+        const double row) {
+
+    size_t lo = 0;
+    size_t hi = index->n;
+    size_t mid;
+    const coord_t* c;
+
+    while (lo < hi) {
+        mid = lo + (hi - lo) / 2;
+        c = &index->cells[index->order[mid]];
+        if (c->y < row || (c->y == row && c->x < col)) {
+            lo = mid + 1;
+        } else {
+            hi = mid;
+        }
+    }
+
+    return lo;
+}
+
+/* Set the geometry of the histogram, and clear its counts */
+static int
+histogram_reset(
+        histogram_t* const histogram,
+        const coord_t* const center,
+        const double radius,
+        const double width,
+        stimage_error_t* const error) {
+
+    unsigned int* counts;
+
+    histogram->center = *center;
+    histogram->radius = radius;
+    histogram->width = width;
+    histogram->nbins = (size_t)ceil(2.0 * radius / width) + 1;
+
+    if (histogram->nbins * histogram->nbins > histogram->capacity) {
+        counts = malloc_with_error(
+                histogram->nbins * histogram->nbins * sizeof(unsigned int),
+                error);
+        if (counts == NULL) return 1;
+        free(histogram->counts);
+        histogram->counts = counts;
+        histogram->capacity = histogram->nbins * histogram->nbins;
+    }
+
+    memset(histogram->counts, 0,
+           histogram->nbins * histogram->nbins * sizeof(unsigned int));
+
+    return 0;
+}
+
+/* Go through every (input, reference) pair whose displacement is
+   within the radius of the histogram of its center.  If sum is NULL,
+   the displacements are voted into the histogram.  Otherwise, they
+   are summed, to refine the location of the peak. */
+static void
+offsets_accumulate(
+        const ref_index_t* const index,
+        const size_t npoints,
+        const coord_t* const points,
+        histogram_t* const histogram,
+        coord_t* const sum,
+        size_t* const nsum) {
+
+    const double radius2 = histogram->radius * histogram->radius;
+    const coord_t* r;
+    const coord_t* cell;
+    double col, row, dx, dy;
+    size_t i, k, bx, by;
+    int drow;
+
+    for (i = 0; i < npoints; ++i) {
+        col = floor(points[i].x / index->size);
+        row = floor(points[i].y / index->size);
+
+        for (drow = -1; drow <= 1; ++drow) {
+            for (k = ref_index_find(index, col - 1.0, row + (double)drow);
+                 k < index->n;
+                 ++k) {
+                cell = &index->cells[index->order[k]];
+                if (cell->y != row + (double)drow || cell->x > col + 1.0) {
+                    break;
+                }
+
+                r = index->refs[index->order[k]];
+                dx = r->x - points[i].x - histogram->center.x;
+                dy = r->y - points[i].y - histogram->center.y;
+                if (dx*dx + dy*dy > radius2) {
+                    continue;
+                }
+
+                if (sum == NULL) {
+                    bx = (size_t)MIN(
+                            (dx + histogram->radius) / histogram->width,
+                            (double)(histogram->nbins - 1));
+                    by = (size_t)MIN(
+                            (dy + histogram->radius) / histogram->width,
+                            (double)(histogram->nbins - 1));
+                    ++histogram->counts[by * histogram->nbins + bx];
+                } else {
+                    sum->x += dx + histogram->center.x;
+                    sum->y += dy + histogram->center.y;
+                    ++(*nsum);
+                }
+            }
+        }
+    }
+}
+
+/* Find the histogram bin with the most votes.  It is scored by the
+   votes in its 3x3 neighborhood, so that peaks split across bins are
+   not penalized when comparing histograms. */
+static size_t
+histogram_peak(
+        const histogram_t* const histogram,
+        coord_t* const peak) {
+
+    const size_t n = histogram->nbins;
+    size_t best = 0;
+    size_t score = 0;
+    size_t bx, by, x, y;
+
+    for (by = 0; by < n * n; ++by) {
+        if (histogram->counts[by] > histogram->counts[best]) {
+            best = by;
+        }
+    }
+
+    bx = best % n;
+    by = best / n;
+    for (y = (by ? by - 1 : 0); y <= MIN(by + 1, n - 1); ++y) {
+        for (x = (bx ? bx - 1 : 0); x <= MIN(bx + 1, n - 1); ++x) {
+            score += histogram->counts[y * n + x];
+        }
+    }
+
+    peak->x = histogram->center.x +
+        ((double)bx + 0.5) * histogram->width - histogram->radius;
+    peak->y = histogram->center.y +
+        ((double)by + 0.5) * histogram->width - histogram->radius;
+
+    return score;
+}
+
+/* Rotate and scale the points about center */
+static void
+offsets_transform(
+        const size_t npoints,
+        const coord_t* const * const points,
+        const coord_t* const center,
+        const double rotation,
+        const double scale,
+        const coord_t* const shift,
+        coord_t* const output) {
+
+    const double c = scale * cos(DEGTORAD(rotation));
+    const double s = scale * sin(DEGTORAD(rotation));
+    double x, y;
+    size_t i;
+
+    for (i = 0; i < npoints; ++i) {
+        x = points[i]->x - center->x;
+        y = points[i]->y - center->y;
+        output[i].x = center->x + c * x - s * y + shift->x;
+        output[i].y = center->y + s * x + c * y + shift->y;
+    }
+}
+
+/* Map the grid index 0, 1, 2, 3, 4... to 0, 1, -1, 2, -2... so the
+   smallest rotations and scale changes win ties */
+static inline double
+zigzag(
+        const size_t i) {
+
+    return (i & 1) ? (double)((i + 1) / 2) : -(double)(i / 2);
+}
+
+int
+match_offsets(
+        const size_t nref,
+        const size_t nref_unique,
+        const coord_t* const ref,
+        const coord_t* const * const ref_sorted,
+        const size_t ninput,
+        const size_t ninput_unique,
+        const coord_t* const input,
+        const coord_t* const * const input_sorted,
+        const double tolerance,
+        const double search_radius,
+        const double max_rotation,
+        const double max_scale,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error) {
+
+    static const coord_t     ZERO         = {0.0, 0.0};
+    ref_index_t              index;
+    histogram_t              histogram;
+    coord_t*                 moved        = NULL;
+    const coord_t**          voters       = NULL;
+    coord_t                  center       = {0.0, 0.0};
+    coord_t                  peak, best_peak, sum;
+    coord_t                  lo, hi;
+    double                   field_radius = 0.0;
+    double                   radius, base_width;
+    double                   width          = 0.0;
+    double                   fine_rotation  = 0.0;
+    double                   fine_scale     = 0.0;
+    double                   range_rotation = 0.0;
+    double                   range_scale    = 0.0;
+    double                   step_rotation, step_scale;
+    double                   rotation, scale;
+    double                   best_rotation  = 0.0;
+    double                   best_scale     = 1.0;
+    double                   level_rotation = 0.0;
+    double                   level_scale    = 1.0;
+    size_t                   best_score   = 0;
+    size_t                   nrotation    = 0;
+    size_t                   nscale       = 0;
+    size_t                   nvoters, score, nsum, i, j;
+    int                      status       = 1;
+
+    assert(ref);
+    assert(ref_sorted);
+    assert(input);
+    assert(input_sorted);
+    assert(callback);
+    assert(error);
+
+    memset(&index, 0, sizeof(ref_index_t));
+    histogram.capacity = 0;
+    histogram.counts = NULL;
+
+    if (!(tolerance > 0.0)) {
+        stimage_error_set_message(
+                error, "tolerance must be > 0 for the offsets algorithm");
+        goto exit;
+    }
+
+    if (nref_unique == 0 || ninput_unique == 0) {
+        status = 0;
+        goto exit;
+    }
+
+    /****************************************
+     DETERMINE THE SEARCH GEOMETRY
+    */
+    lo.x = lo.y = MAX_DOUBLE;
+    hi.x = hi.y = -MAX_DOUBLE;
+    for (i = 0; i < ninput_unique; ++i) {
+        center.x += input_sorted[i]->x;
+        center.y += input_sorted[i]->y;
+        lo.x = MIN(lo.x, input_sorted[i]->x);
+        lo.y = MIN(lo.y, input_sorted[i]->y);
+        hi.x = MAX(hi.x, input_sorted[i]->x);
+        hi.y = MAX(hi.y, input_sorted[i]->y);
+    }
+    center.x /= (double)ninput_unique;
+    center.y /= (double)ninput_unique;
+    for (i = 0; i < ninput_unique; ++i) {
+        field_radius = MAX(
+                field_radius,
+                hypot(input_sorted[i]->x - center.x,
+                      input_sorted[i]->y - center.y));
+    }
+
+    radius = search_radius;
+    if (!(radius > 0.0)) {
+        for (i = 0; i < nref_unique; ++i) {
+            lo.x = MIN(lo.x, ref_sorted[i]->x);
+            lo.y = MIN(lo.y, ref_sorted[i]->y);
+            hi.x = MAX(hi.x, ref_sorted[i]->x);
+            hi.y = MAX(hi.y, ref_sorted[i]->y);
+        }
+        /* Leave room for rotation and scale about the center, but
+           no more than the histogram holds in bins of tolerance */
+        radius = MIN(
+                hypot(hi.x - lo.x, hi.y - lo.y) * (1.0 + max_scale) +
+                tolerance,
+                0.5 * (double)(OFFSETS_MAX_BINS - 1) * tolerance);
+    }
+
+    if (field_radius > 0.0) {
+        fine_rotation = RADTODEG((tolerance / field_radius));
+        fine_scale = tolerance / field_radius;
+        range_rotation = MAX(max_rotation, 0.0);
+        range_scale = MAX(max_scale, 0.0);
+    }
+
+    base_width = MAX(tolerance, 2.0 * radius / (OFFSETS_MAX_BINS - 1));
+
+    if (ref_index_init(&index, nref_unique, ref_sorted, radius, error)) goto exit;
+
+    moved = malloc_with_error(ninput_unique * sizeof(coord_t), error);
+    if (moved == NULL) goto exit;
+    voters = malloc_with_error(ninput_unique * sizeof(coord_t*), error);
+    if (voters == NULL) goto exit;
+
+    /****************************************
+     VOTE
+    */
+    /* The grid is searched coarse-to-fine.  If the grid would need too
+       many steps to keep the error at the edge of the field within
+       tolerance, the histogram bins are widened to match the steps,
+       and the grid is searched again around the best point with
+       finer steps. */
+    do {
+        nrotation = 0;
+        step_rotation = 0.0;
+        if (range_rotation > 0.0) {
+            nrotation = (size_t)MIN(
+                    ceil(range_rotation / fine_rotation),
+                    OFFSETS_MAX_ROTATION_STEPS);
+            step_rotation = range_rotation / (double)nrotation;
+        }
+
+        nscale = 0;
+        step_scale = 0.0;
+        if (range_scale > 0.0) {
+            nscale = (size_t)MIN(
+                    ceil(range_scale / fine_scale),
+                    OFFSETS_MAX_SCALE_STEPS);
+            step_scale = range_scale / (double)nscale;
+        }
+
+        width = MAX(
+                base_width,
+                MAX(DEGTORAD(step_rotation), step_scale) * field_radius);
+
+        nvoters = ninput_unique;
+        if (nrotation > 0 || nscale > 0) {
+            nvoters = MIN(ninput_unique, OFFSETS_MAX_GRID_VOTERS);
+        }
+        /* input_sorted is sorted in y, so every nth one is spread
+           evenly over the field */
+        for (i = 0; i < nvoters; ++i) {
+            voters[i] = input_sorted[(i * ninput_unique) / nvoters];
+        }
+
+        best_score = 0;
+        for (i = 0; i < 2 * nrotation + 1; ++i) {
+            rotation = best_rotation + zigzag(i) * step_rotation;
+            for (j = 0; j < 2 * nscale + 1; ++j) {
+                scale = best_scale + zigzag(j) * step_scale;
+
+                offsets_transform(
+                        nvoters, voters, &center, rotation, scale,
+                        &ZERO, moved);
+                if (histogram_reset(
+                            &histogram, &ZERO, radius, width,
+                            error)) goto exit;
+                offsets_accumulate(
+                        &index, nvoters, moved, &histogram, NULL, NULL);
+
+                score = histogram_peak(&histogram, &peak);
+                if (score > best_score) {
+                    best_score = score;
+                    level_rotation = rotation;
+                    level_scale = scale;
+                    best_peak = peak;
+                }
+            }
+        }
+
+        best_rotation = level_rotation;
+        best_scale = level_scale;
+        range_rotation = (step_rotation > fine_rotation) ? step_rotation : 0.0;
+        range_scale = (step_scale > fine_scale) ? step_scale : 0.0;
+    } while (best_score > 0 && (range_rotation > 0.0 || range_scale > 0.0));
+
+    if (best_score == 0) {
+        /* No pairs at all within the search radius */
+        status = 0;
+        goto exit;
+    }
+
+    /****************************************
+     REFINE THE PEAK
+    */
+    /* If the bins were wider than tolerance, the peak is searched for
+       again in histograms of shrinking radius about it, until the
+       bins are tolerance wide.  Averaging the displacements over a
+       wide bin would pull the peak towards the background. */
+    offsets_transform(
+            ninput_unique, input_sorted, &center, best_rotation, best_scale,
+            &ZERO, moved);
+    while (width > tolerance) {
+        radius = 2.0 * width;
+        width = MAX(tolerance, 2.0 * radius / (OFFSETS_MAX_BINS - 1));
+        if (histogram_reset(
+                    &histogram, &best_peak, radius, width, error)) goto exit;
+        offsets_accumulate(
+                &index, ninput_unique, moved, &histogram, NULL, NULL);
+        if (histogram_peak(&histogram, &peak) == 0) {
+            break;
+        }
+        best_peak = peak;
+    }
+
+    sum.x = sum.y = 0.0;
+    nsum = 0;
+    if (histogram_reset(
+                &histogram, &best_peak, 1.5 * width, width, error)) goto exit;
+    offsets_accumulate(
+            &index, ninput_unique, moved, &histogram, &sum, &nsum);
+    if (nsum > 0) {
+        best_peak.x = sum.x / (double)nsum;
+        best_peak.y = sum.y / (double)nsum;
+    }
+
+    /****************************************
+     MATCH
+    */
+    offsets_transform(
+            ninput_unique, input_sorted, &center, best_rotation, best_scale,
+            &best_peak, moved);
+
+    if (match_tolerance_moved(
+                nref_unique, ref, ref_sorted,
+                ninput_unique, input, input_sorted, moved,
+                tolerance,
+                callback, callback_data,
+                error)) goto exit;
+
+    status = 0;
+
+ exit:
+
+    ref_index_free(&index);
+    free(histogram.counts);
+    free(moved);
+    free(voters);
+
+    return status;
+}
@@ -0,0 +1,647 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <assert.h>
+#define _USE_MATH_DEFINES       /* needed for MS Windows to define M_PI */
+#include <math.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "immatch/lib/quads.h"
+#include "immatch/lib/tolerance.h"
+
+/* The number of nearest neighbors each quad is built from.  Every
+   choice of three of them, together with the star itself, is a quad. */
+#define QUADS_NNEIGHBORS 6
+
+/* Quads whose longest side is shorter than this many tolerances are
+   not used */
+#define QUADS_MIN_SIZE 5.0
+
+/* The limits on the code tolerance */
+#define QUADS_MIN_CODE_TOLERANCE 0.002
+#define QUADS_MAX_CODE_TOLERANCE 0.05
+
+/* The maximum number of hypotheses tested before giving up */
+#define QUADS_MAX_HYPOTHESES 20000
+
+/* Find the k nearest neighbors of coords[i].  coords is sorted in y,
+   so the search works outwards from i until the y distance alone is
+   larger than the kth nearest neighbor found so far. */
+static size_t
+quads_neighbors(
+        const size_t ncoords,
+        const coord_t* const * const coords,
+        const size_t i,
+        size_t* const neighbors /*[QUADS_NNEIGHBORS]*/) {
+
+    double dist2[QUADS_NNEIGHBORS];
+    size_t nfound  = 0;
+    size_t lo      = i;
+    size_t hi      = i + 1;
+    int    lo_done = (i == 0);
+    int    hi_done = (hi >= ncoords);
+    int    side;
+    size_t j, k;
+    double d2, dy;
+
+    while (!lo_done || !hi_done) {
+        for (side = 0; side < 2; ++side) {
+            if (side == 0) {
+                if (lo_done) continue;
+                j = --lo;
+                lo_done = (lo == 0);
+            } else {
+                if (hi_done) continue;
+                j = hi++;
+                hi_done = (hi >= ncoords);
+            }
+
+            dy = coords[j]->y - coords[i]->y;
+            if (nfound == QUADS_NNEIGHBORS && dy * dy > dist2[nfound - 1]) {
+                /* Nothing further in this direction can be closer */
+                if (side == 0) {
+                    lo_done = 1;
+                } else {
+                    hi_done = 1;
+                }
+                continue;
+            }
+
+            d2 = euclid_distance2(coords[i], coords[j]);
+            if (nfound == QUADS_NNEIGHBORS && d2 >= dist2[nfound - 1]) {
+                continue;
+            }
+
+            /* Insertion sort into the list of nearest neighbors */
+            if (nfound < QUADS_NNEIGHBORS) {
+                ++nfound;
+            }
+            for (k = nfound - 1; k > 0 && dist2[k - 1] > d2; --k) {
+                dist2[k] = dist2[k - 1];
+                neighbors[k] = neighbors[k - 1];
+            }
+            dist2[k] = d2;
+            neighbors[k] = j;
+        }
+    }
+
+    return nfound;
+}
+
+/* Compute the code of the quad formed by four stars.  Returns 0 if the
+   quad is too small to be used. */
+static int
+quads_make(
+        const coord_t* const * const coords,
+        const size_t stars[4],
+        const double parity,
+        const double min_size,
+        star_quad_t* const quad,
+        double* const size) {
+
+    coord_t p[4];
+    size_t  order[4];
+    size_t  i, j, tmp;
+    double  d2, best = -1.0;
+    double  ux, uy, norm, u, v;
+
+    for (i = 0; i < 4; ++i) {
+        p[i].x = coords[stars[i]]->x;
+        p[i].y = parity * coords[stars[i]]->y;
+    }
+
+    /* A and B are the most widely separated pair */
+    for (i = 0; i < 4; ++i) {
+        for (j = i + 1; j < 4; ++j) {
+            d2 = euclid_distance2(&p[i], &p[j]);
+            if (d2 > best) {
+                best = d2;
+                order[0] = i;
+                order[1] = j;
+            }
+        }
+    }
+
+    *size = sqrt(best);
+    if (!(*size >= min_size)) {
+        return 0;
+    }
+
+    for (i = 0, j = 2; i < 4; ++i) {
+        if (i != order[0] && i != order[1]) {
+            order[j++] = i;
+        }
+    }
+
+    /* Put C and D in the frame where A is (0, 0) and B is (1, 1) */
+    ux = p[order[1]].x - p[order[0]].x;
+    uy = p[order[1]].y - p[order[0]].y;
+    norm = ux * ux + uy * uy;
+    for (i = 0; i < 2; ++i) {
+        u = ((p[order[i+2]].x - p[order[0]].x) * ux +
+             (p[order[i+2]].y - p[order[0]].y) * uy) / norm;
+        v = ((p[order[i+2]].y - p[order[0]].y) * ux -
+             (p[order[i+2]].x - p[order[0]].x) * uy) / norm;
+        quad->code[2*i] = u - v;
+        quad->code[2*i+1] = u + v;
+    }
+
+    /* Break the symmetries: swapping A and B maps (x, y) to
+       (1 - x, 1 - y), and C and D can be swapped freely */
+    if (quad->code[0] + quad->code[2] > 1.0) {
+        tmp = order[0];
+        order[0] = order[1];
+        order[1] = tmp;
+        for (i = 0; i < 4; ++i) {
+            quad->code[i] = 1.0 - quad->code[i];
+        }
+    }
+
+    if (quad->code[0] > quad->code[2]) {
+        tmp = order[2];
+        order[2] = order[3];
+        order[3] = tmp;
+        u = quad->code[0];
+        v = quad->code[1];
+        quad->code[0] = quad->code[2];
+        quad->code[1] = quad->code[3];
+        quad->code[2] = u;
+        quad->code[3] = v;
+    }
+
+    for (i = 0; i < 4; ++i) {
+        quad->stars[i] = stars[order[i]];
+    }
+
+    return 1;
+}
+
+static void
+quads_quantize(
+        star_quad_t* const quad,
+        const double code_tolerance) {
+
+    size_t i;
+
+    for (i = 0; i < 4; ++i) {
+        quad->cell[i] = (long)floor(quad->code[i] / code_tolerance);
+    }
+}
+
+static int
+quads_compare_cells(
+        const long* const a,
+        const long* const b) {
+
+    size_t i;
+
+    for (i = 0; i < 4; ++i) {
+        if (a[i] < b[i]) {
+            return -1;
+        } else if (a[i] > b[i]) {
+            return 1;
+        }
+    }
+
+    return 0;
+}
+
+static int
+quads_compare(
+        const void* a,
+        const void* b) {
+
+    const star_quad_t* qa = (const star_quad_t*)a;
+    const star_quad_t* qb = (const star_quad_t*)b;
+    int result = quads_compare_cells(qa->cell, qb->cell);
+    size_t i;
+
+    /* Break ties by the stars, so the order is deterministic */
+    for (i = 0; result == 0 && i < 4; ++i) {
+        if (qa->stars[i] != qb->stars[i]) {
+            result = (qa->stars[i] < qb->stars[i]) ? -1 : 1;
+        }
+    }
+
+    return result;
+}
+
+/* Call fn for each quad built from star i and its nearest neighbors.
+   Stops and returns non-zero if fn does. */
+typedef int (quads_visit_t)(void*, const star_quad_t*, double);
+
+static int
+quads_visit_star(
+        const size_t ncoords,
+        const coord_t* const * const coords,
+        const size_t i,
+        const double parity,
+        const double min_size,
+        quads_visit_t* fn,
+        void* data) {
+
+    size_t neighbors[QUADS_NNEIGHBORS];
+    size_t nneighbors;
+    size_t stars[4];
+    size_t a, b, c;
+    star_quad_t quad;
+    double size;
+    int    result;
+
+    nneighbors = quads_neighbors(ncoords, coords, i, neighbors);
+    stars[0] = i;
+
+    for (a = 0; a < nneighbors; ++a) {
+        stars[1] = neighbors[a];
+        for (b = a + 1; b < nneighbors; ++b) {
+            stars[2] = neighbors[b];
+            for (c = b + 1; c < nneighbors; ++c) {
+                stars[3] = neighbors[c];
+                if (quads_make(coords, stars, parity, min_size, &quad, &size)) {
+                    result = fn(data, &quad, size);
+                    if (result) {
+                        return result;
+                    }
+                }
+            }
+        }
+    }
+
+    return 0;
+}
+
+typedef struct {
+    quad_index_t* index;
+    double*       sizes;
+} quads_collect_t;
+
+static int
+quads_collect(
+        void* data,
+        const star_quad_t* quad,
+        double size) {
+
+    quads_collect_t* state = (quads_collect_t*)data;
+
+    state->sizes[state->index->nquads] = size;
+    state->index->quads[state->index->nquads++] = *quad;
+
+    return 0;
+}
+
+int
+quad_index_init(
+        quad_index_t* const index,
+        const size_t ncoords,
+        const coord_t* const * const coords,
+        const double tolerance,
+        stimage_error_t* const error) {
+
+    quads_collect_t state;
+    double*         sizes    = NULL;
+    size_t          maxquads = 0;
+    size_t          i;
+    int             status   = 1;
+
+    assert(index);
+    assert(coords || ncoords == 0);
+    assert(error);
+
+    memset(index, 0, sizeof(quad_index_t));
+    index->ncoords = ncoords;
+    index->coords = coords;
+    index->code_tolerance = QUADS_MAX_CODE_TOLERANCE;
+
+    if (!(tolerance > 0.0)) {
+        stimage_error_set_message(
+                error, "tolerance must be > 0 for the quads algorithm");
+        goto exit;
+    }
+
+    if (ncoords == 0) {
+        status = 0;
+        goto exit;
+    }
+
+    verify_index_init(&index->verify, ncoords, coords, tolerance);
+
+    maxquads = ncoords * combinatorial(QUADS_NNEIGHBORS, 3);
+    index->quads = malloc_with_error(maxquads * sizeof(star_quad_t), error);
+    if (index->quads == NULL) goto exit;
+    sizes = malloc_with_error(maxquads * sizeof(double), error);
+    if (sizes == NULL) goto exit;
+
+    state.index = index;
+    state.sizes = sizes;
+    for (i = 0; i < ncoords; ++i) {
+        quads_visit_star(
+                ncoords, coords, i, 1.0, QUADS_MIN_SIZE * tolerance,
+                &quads_collect, &state);
+    }
+
+    /* Set the code tolerance from the typical quad size, so that it
+       corresponds to moving each star by about the matching
+       tolerance */
+    if (index->nquads > 0) {
+        sort_doubles(index->nquads, sizes);
+        index->code_tolerance = MIN(
+                QUADS_MAX_CODE_TOLERANCE,
+                MAX(QUADS_MIN_CODE_TOLERANCE,
+                    2.0 * M_SQRT2 * tolerance / sizes[index->nquads / 2]));
+    }
+
+    for (i = 0; i < index->nquads; ++i) {
+        quads_quantize(&index->quads[i], index->code_tolerance);
+    }
+    qsort(index->quads, index->nquads, sizeof(star_quad_t), &quads_compare);
+
+    status = 0;
+
+ exit:
+
+    free(sizes);
+
+    return status;
+}
+
+void
+quad_index_free(
+        quad_index_t* const index) {
+
+    assert(index);
+
+    free(index->quads);
+    index->quads = NULL;
+    index->nquads = 0;
+}
+
+/* Find the first quad in the index with a cell >= cell */
+static size_t
+quads_find(
+        const quad_index_t* const index,
+        const long* const cell) {
+
+    size_t lo = 0;
+    size_t hi = index->nquads;
+    size_t mid;
+
+    while (lo < hi) {
+        mid = lo + (hi - lo) / 2;
+        if (quads_compare_cells(index->quads[mid].cell, cell) < 0) {
+            lo = mid + 1;
+        } else {
+            hi = mid;
+        }
+    }
+
+    return lo;
+}
+
+typedef struct {
+    const quad_index_t*    index;
+    size_t                 ninput;
+    const coord_t* const * input;
+    double                 parity;
+    double                 tolerance;
+    size_t                 nhypotheses;
+    int                    found;
+    similarity_t           solution;
+} quads_search_t;
+
+/* Test the hypotheses given by one input quad.  Returns non-zero to
+   stop the search. */
+static int
+quads_search(
+        void* data,
+        const star_quad_t* quad,
+        double size) {
+
+    quads_search_t*     state  = (quads_search_t*)data;
+    const quad_index_t* index  = state->index;
+    const double        ctol2  = index->code_tolerance * index->code_tolerance;
+    star_quad_t              query  = *quad;
+    long                cell[4];
+    size_t              i, k;
+    int                 d;
+    double              d2;
+    const star_quad_t*       match;
+    similarity_t        t;
+
+    quads_quantize(&query, index->code_tolerance);
+
+    /* Look in the cell of the code and all of its neighbors */
+    for (d = 0; d < 81; ++d) {
+        cell[0] = query.cell[0] + (d % 3) - 1;
+        cell[1] = query.cell[1] + ((d / 3) % 3) - 1;
+        cell[2] = query.cell[2] + ((d / 9) % 3) - 1;
+        cell[3] = query.cell[3] + ((d / 27) % 3) - 1;
+
+        for (k = quads_find(index, cell);
+             k < index->nquads &&
+                 quads_compare_cells(index->quads[k].cell, cell) == 0;
+             ++k) {
+            match = &index->quads[k];
+            d2 = 0.0;
+            for (i = 0; i < 4; ++i) {
+                d2 += (match->code[i] - query.code[i]) *
+                    (match->code[i] - query.code[i]);
+            }
+            if (d2 > ctol2) {
+                continue;
+            }
+
+            if (++state->nhypotheses > QUADS_MAX_HYPOTHESES) {
+                return 1;
+            }
+
+            /* The similarity transformation mapping input A and B onto
+               reference A and B */
+            if (!similarity_from_pairs(
+                        state->input[query.stars[0]],
+                        state->input[query.stars[1]],
+                        index->coords[match->stars[0]],
+                        index->coords[match->stars[1]],
+                        state->parity, &t) ||
+                !verify_similarity(
+                        &index->verify, state->ninput, state->input, &t,
+                        state->tolerance)) {
+                continue;
+            }
+
+            state->found = 1;
+            state->solution = t;
+            return 1;
+        }
+    }
+
+    return 0;
+}
+
+int
+match_quads_indexed(
+        const quad_index_t* const index,
+        const coord_t* const ref,
+        const size_t ninput_unique,
+        const coord_t* const input,
+        const coord_t* const * const input_sorted,
+        const double tolerance,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error) {
+
+    quads_search_t  state;
+    coord_match_t*  pairs  = NULL;
+    coord_t*        moved  = NULL;
+    size_t          npairs, i, p;
+    int             status = 1;
+
+    assert(index);
+    assert(ref);
+    assert(input);
+    assert(input_sorted);
+    assert(callback);
+    assert(error);
+
+    if (!(tolerance > 0.0)) {
+        stimage_error_set_message(
+                error, "tolerance must be > 0 for the quads algorithm");
+        goto exit;
+    }
+
+    if (index->nquads == 0 || ninput_unique < 4) {
+        status = 0;
+        goto exit;
+    }
+
+    /****************************************
+     SEARCH
+    */
+    memset(&state, 0, sizeof(quads_search_t));
+    state.index = index;
+    state.ninput = ninput_unique;
+    state.input = input_sorted;
+    state.tolerance = tolerance;
+
+    /* Try the unflipped and flipped input quads of each star in turn,
+       so that a solution near the start of the list is found early
+       whatever the parity */
+    for (i = 0; i < ninput_unique && !state.found &&
+             state.nhypotheses <= QUADS_MAX_HYPOTHESES; ++i) {
+        for (p = 0; p < 2 && !state.found; ++p) {
+            state.parity = p ? -1.0 : 1.0;
+            /* The scale of the input is unknown, so any size of quad
+               is allowed */
+            quads_visit_star(
+                    ninput_unique, input_sorted, i, state.parity, 0.0,
+                    &quads_search, &state);
+        }
+    }
+
+    if (!state.found) {
+        status = 0;
+        goto exit;
+    }
+
+    /****************************************
+     REFINE
+    */
+    pairs = malloc_with_error(ninput_unique * sizeof(coord_match_t), error);
+    if (pairs == NULL) goto exit;
+
+    for (i = 0; i < 2; ++i) {
+        npairs = verify_count_matches(
+                &index->verify, ninput_unique, input_sorted, 1, &state.solution,
+                tolerance, pairs);
+        similarity_fit(npairs, pairs, &state.solution);
+    }
+
+    /****************************************
+     MATCH
+    */
+    moved = malloc_with_error(ninput_unique * sizeof(coord_t), error);
+    if (moved == NULL) goto exit;
+
+    for (i = 0; i < ninput_unique; ++i) {
+        similarity_apply(&state.solution, input_sorted[i], &moved[i]);
+    }
+
+    if (match_tolerance_moved(
+                index->ncoords, ref, index->coords,
+                ninput_unique, input, input_sorted, moved,
+                tolerance,
+                callback, callback_data,
+                error)) goto exit;
+
+    status = 0;
+
+ exit:
+
+    free(pairs);
+    free(moved);
+
+    return status;
+}
+
+int
+match_quads(
+        const size_t nref,
+        const size_t nref_unique,
+        const coord_t* const ref,
+        const coord_t* const * const ref_sorted,
+        const size_t ninput,
+        const size_t ninput_unique,
+        const coord_t* const input,
+        const coord_t* const * const input_sorted,
+        const double tolerance,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error) {
+
+    quad_index_t index;
+    int          status = 1;
+
+    if (quad_index_init(&index, nref_unique, ref_sorted, tolerance, error)) {
+        goto exit;
+    }
+
+    if (match_quads_indexed(
+                &index, ref, ninput_unique, input, input_sorted, tolerance,
+                callback, callback_data, error)) goto exit;
+
+    status = 0;
+
+ exit:
+
+    quad_index_free(&index);
+
+    return status;
+}
@@ -35,8 +35,12 @@ DAMAGE.
 */
 
 #include <assert.h>
+#include <string.h>
 
 #include "immatch/lib/tolerance.h"
+#include "lib/parallel.h"
+#include "lib/xybbox.h"
+#include "lib/xysort.h"
 
 int
 match_tolerance(
@@ -122,3 +126,503 @@ match_tolerance(
 
     return 0;
 }
+
+typedef struct {
+    const coord_t* const *  input_list;
+    const coord_t*          input;
+    coord_match_callback_t* callback;
+    void*                   callback_data;
+} moved_callback_data_t;
+
+static int
+moved_callback(
+        void* data,
+        size_t ref_index,
+        size_t input_index,
+        stimage_error_t* error) {
+
+    moved_callback_data_t* state = (moved_callback_data_t*)data;
+
+    return state->callback(
+            state->callback_data, ref_index,
+            state->input_list[input_index] - state->input, error);
+}
+
+int
+match_tolerance_moved(
+        const size_t nref,
+        const coord_t* const ref,
+        const coord_t* const * const ref_sorted,
+        const size_t ninput,
+        const coord_t* const input,
+        const coord_t* const * const input_list,
+        const coord_t* const moved,
+        const double tolerance,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error) {
+
+    const coord_t**       moved_sorted = NULL;
+    size_t*               perm         = NULL;
+    moved_callback_data_t state;
+    size_t                i;
+    int                   status       = 1;
+
+    assert(ref);
+    assert(ref_sorted);
+    assert(input);
+    assert(input_list);
+    assert(moved);
+    assert(callback);
+    assert(error);
+
+    if (ninput == 0) {
+        return 0;
+    }
+
+    moved_sorted = malloc_with_error(ninput * sizeof(coord_t*), error);
+    if (moved_sorted == NULL) goto exit;
+    perm = malloc_with_error(ninput * sizeof(size_t), error);
+    if (perm == NULL) goto exit;
+
+    if (xysort_index(ninput, moved, perm, 1, error)) goto exit;
+    for (i = 0; i < ninput; ++i) {
+        moved_sorted[i] = moved + perm[i];
+    }
+
+    state.input_list = input_list;
+    state.input = input;
+    state.callback = callback;
+    state.callback_data = callback_data;
+
+    if (match_tolerance(
+                nref, ref, ref_sorted,
+                ninput, moved, moved_sorted,
+                tolerance,
+                &moved_callback, &state,
+                error)) goto exit;
+
+    status = 0;
+
+ exit:
+
+    free(moved_sorted);
+    free(perm);
+
+    return status;
+}
+
+/* The approximate number of reference coordinates per tile when the
+   tile size is chosen automatically */
+#define TILE_TARGET_NREF 100000
+
+typedef struct {
+    size_t ref_idx;
+    size_t input_idx;
+} tile_match_t;
+
+typedef struct {
+    size_t        nmatches;
+    size_t        nalloc;
+    tile_match_t* matches;
+} tile_result_t;
+
+typedef struct {
+    const coord_t* ref;
+    const coord_t* input;
+    double         tolerance;
+    size_t         ntiles;
+    size_t*        ref_start;   /* [ntiles + 1] */
+    size_t*        ref_items;   /* ref indices, grouped by tile */
+    size_t*        input_start; /* [ntiles + 1] */
+    size_t*        input_items; /* input indices, grouped by tile */
+    tile_result_t* results;     /* [ntiles] */
+} tiled_state_t;
+
+typedef struct {
+    double x0;
+    double y0;
+    double size;
+    size_t nx;
+    size_t ny;
+} tile_grid_t;
+
+static inline size_t
+tile_column(
+        const tile_grid_t* const grid,
+        const double x) {
+
+    double t = floor((x - grid->x0) / grid->size);
+
+    if (!(t >= 0.0)) {
+        return 0;
+    } else if (t >= (double)grid->nx) {
+        return grid->nx - 1;
+    }
+    return (size_t)t;
+}
+
+static inline size_t
+tile_row(
+        const tile_grid_t* const grid,
+        const double y) {
+
+    double t = floor((y - grid->y0) / grid->size);
+
+    if (!(t >= 0.0)) {
+        return 0;
+    } else if (t >= (double)grid->ny) {
+        return grid->ny - 1;
+    }
+    return (size_t)t;
+}
+
+/* Determine the range of tiles an input coordinate must be copied to.
+   Returns 0 if it is not near any tile. */
+static inline int
+tile_input_range(
+        const tile_grid_t* const grid,
+        const coord_t* const c,
+        const double tolerance,
+        size_t* const tx0,
+        size_t* const tx1,
+        size_t* const ty0,
+        size_t* const ty1) {
+
+    /* Pad the margin so rounding can't exclude a pair that
+       match_tolerance would accept */
+    const double mx = tolerance * (1.0 + 1e-6) + 4.0 * EPS_DOUBLE * fabs(c->x);
+    const double my = tolerance * (1.0 + 1e-6) + 4.0 * EPS_DOUBLE * fabs(c->y);
+
+    if (!coord_is_finite(c) ||
+        c->x + mx < grid->x0 ||
+        c->y + my < grid->y0 ||
+        c->x - mx > grid->x0 + grid->size * (double)grid->nx ||
+        c->y - my > grid->y0 + grid->size * (double)grid->ny) {
+        return 0;
+    }
+
+    *tx0 = tile_column(grid, c->x - mx);
+    *tx1 = tile_column(grid, c->x + mx);
+    *ty0 = tile_row(grid, c->y - my);
+    *ty1 = tile_row(grid, c->y + my);
+
+    return 1;
+}
+
+static int
+tile_collect_callback(
+        void* data,
+        size_t ref_index,
+        size_t input_index,
+        stimage_error_t* error) {
+
+    tile_result_t* result = (tile_result_t*)data;
+    tile_match_t*  tmp;
+
+    if (result->nmatches == result->nalloc) {
+        result->nalloc = result->nalloc ? result->nalloc * 2 : 64;
+        tmp = realloc(result->matches, result->nalloc * sizeof(tile_match_t));
+        if (tmp == NULL) {
+            stimage_error_set_message(error, "Out of memory");
+            return 1;
+        }
+        result->matches = tmp;
+    }
+
+    result->matches[result->nmatches].ref_idx = ref_index;
+    result->matches[result->nmatches].input_idx = input_index;
+    ++result->nmatches;
+
+    return 0;
+}
+
+/* Build a sorted list of pointers into base from a list of indices */
+static int
+tile_sort(
+        const coord_t* const base,
+        const size_t n,
+        const size_t* const items,
+        const coord_t** const sorted,
+        stimage_error_t* const error) {
+
+    coord_t* local = NULL;
+    size_t*  perm  = NULL;
+    size_t   i;
+    int      status = 1;
+
+    local = malloc_with_error(n * sizeof(coord_t), error);
+    if (local == NULL) goto exit;
+    perm = malloc_with_error(n * sizeof(size_t), error);
+    if (perm == NULL) goto exit;
+
+    for (i = 0; i < n; ++i) {
+        local[i] = base[items[i]];
+    }
+
+    if (xysort_index(n, local, perm, 1, error)) goto exit;
+
+    for (i = 0; i < n; ++i) {
+        sorted[i] = base + items[perm[i]];
+    }
+
+    status = 0;
+
+ exit:
+
+    free(local);
+    free(perm);
+
+    return status;
+}
+
+static int
+tile_match_task(
+        void* data,
+        const size_t tile,
+        stimage_error_t* const error) {
+
+    tiled_state_t*  state        = (tiled_state_t*)data;
+    const size_t    nref         = state->ref_start[tile+1] - state->ref_start[tile];
+    const size_t    ninput       = state->input_start[tile+1] - state->input_start[tile];
+    const coord_t** ref_sorted   = NULL;
+    const coord_t** input_sorted = NULL;
+    int             status       = 1;
+
+    if (nref == 0 || ninput == 0) {
+        return 0;
+    }
+
+    ref_sorted = malloc_with_error(nref * sizeof(coord_t*), error);
+    if (ref_sorted == NULL) goto exit;
+    input_sorted = malloc_with_error(ninput * sizeof(coord_t*), error);
+    if (input_sorted == NULL) goto exit;
+
+    if (tile_sort(
+                state->ref, nref, state->ref_items + state->ref_start[tile],
+                ref_sorted, error) ||
+        tile_sort(
+                state->input, ninput,
+                state->input_items + state->input_start[tile],
+                input_sorted, error)) goto exit;
+
+    if (match_tolerance(
+                nref, state->ref, ref_sorted,
+                ninput, state->input, input_sorted,
+                state->tolerance,
+                &tile_collect_callback, &state->results[tile],
+                error)) goto exit;
+
+    status = 0;
+
+ exit:
+
+    free(ref_sorted);
+    free(input_sorted);
+
+    return status;
+}
+
+int
+match_tolerance_tiled(
+        const size_t nref,
+        const coord_t* const ref,
+        const coord_t* const * const ref_list,
+        const size_t ninput,
+        const coord_t* const input,
+        const coord_t* const * const input_list,
+        const double tolerance,
+        const double tile_size,
+        const size_t nthreads,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error) {
+
+    tiled_state_t  state;
+    tile_grid_t    grid;
+    bbox_t         bbox;
+    const coord_t* c;
+    coord_t*       match_ref = NULL;
+    size_t*        perm      = NULL;
+    tile_match_t** order     = NULL;
+    size_t         nmatches  = 0;
+    size_t         i, j, t, tx, ty, tx0, tx1, ty0, ty1;
+    double         width, height;
+    int            status    = 1;
+
+    assert(ref);
+    assert(input);
+    assert(callback);
+    assert(error);
+
+    memset(&state, 0, sizeof(tiled_state_t));
+    state.ref = ref;
+    state.input = input;
+    state.tolerance = tolerance;
+
+    /* Lay out the tiles over the finite reference coordinates */
+    bbox.min.x = bbox.min.y = MAX_DOUBLE;
+    bbox.max.x = bbox.max.y = -MAX_DOUBLE;
+    for (i = 0; i < nref; ++i) {
+        c = ref_list ? ref_list[i] : ref + i;
+        if (coord_is_finite(c)) {
+            bbox.min.x = MIN(bbox.min.x, c->x);
+            bbox.min.y = MIN(bbox.min.y, c->y);
+            bbox.max.x = MAX(bbox.max.x, c->x);
+            bbox.max.y = MAX(bbox.max.y, c->y);
+        }
+    }
+
+    if (bbox.min.x > bbox.max.x || ninput == 0) {
+        /* No finite reference coordinates: nothing can match */
+        return 0;
+    }
+
+    width = bbox.max.x - bbox.min.x;
+    height = bbox.max.y - bbox.min.y;
+    grid.x0 = bbox.min.x;
+    grid.y0 = bbox.min.y;
+    if (tile_size > 0.0) {
+        grid.size = tile_size;
+    } else {
+        grid.size = sqrt(MAX(width * height, 1e-300) /
+                         MAX(1.0, (double)nref / TILE_TARGET_NREF));
+        /* Keep the duplicated margins small compared to the tile */
+        grid.size = MAX(grid.size, 8.0 * tolerance);
+    }
+    if (!(grid.size > 0.0) || !isfinite(grid.size)) {
+        grid.size = MAX(MAX(width, height), 1.0);
+    }
+    grid.nx = (size_t)MIN(floor(width / grid.size) + 1.0, 65536.0);
+    grid.ny = (size_t)MIN(floor(height / grid.size) + 1.0, 65536.0);
+    /* The last tiles absorb anything past the clamp */
+    state.ntiles = grid.nx * grid.ny;
+
+    state.ref_start = malloc_with_error((state.ntiles + 1) * sizeof(size_t), error);
+    if (state.ref_start == NULL) goto exit;
+    state.input_start = malloc_with_error((state.ntiles + 1) * sizeof(size_t), error);
+    if (state.input_start == NULL) goto exit;
+    state.results = malloc_with_error(state.ntiles * sizeof(tile_result_t), error);
+    if (state.results == NULL) goto exit;
+    memset(state.ref_start, 0, (state.ntiles + 1) * sizeof(size_t));
+    memset(state.input_start, 0, (state.ntiles + 1) * sizeof(size_t));
+    memset(state.results, 0, state.ntiles * sizeof(tile_result_t));
+
+    /* Count the coordinates in each tile (a counting sort) */
+    for (i = 0; i < nref; ++i) {
+        c = ref_list ? ref_list[i] : ref + i;
+        if (coord_is_finite(c)) {
+            t = tile_row(&grid, c->y) * grid.nx + tile_column(&grid, c->x);
+            ++state.ref_start[t+1];
+        }
+    }
+
+    for (i = 0; i < ninput; ++i) {
+        c = input_list ? input_list[i] : input + i;
+        if (tile_input_range(&grid, c, tolerance, &tx0, &tx1, &ty0, &ty1)) {
+            for (ty = ty0; ty <= ty1; ++ty) {
+                for (tx = tx0; tx <= tx1; ++tx) {
+                    ++state.input_start[ty * grid.nx + tx + 1];
+                }
+            }
+        }
+    }
+
+    for (t = 0; t < state.ntiles; ++t) {
+        state.ref_start[t+1] += state.ref_start[t];
+        state.input_start[t+1] += state.input_start[t];
+    }
+
+    state.ref_items = malloc_with_error(
+            MAX(1, state.ref_start[state.ntiles]) * sizeof(size_t), error);
+    if (state.ref_items == NULL) goto exit;
+    state.input_items = malloc_with_error(
+            MAX(1, state.input_start[state.ntiles]) * sizeof(size_t), error);
+    if (state.input_items == NULL) goto exit;
+
+    /* Fill the tiles, using the start of the next tile as the fill
+       pointer, then shift the starts back */
+    for (i = 0; i < nref; ++i) {
+        c = ref_list ? ref_list[i] : ref + i;
+        if (coord_is_finite(c)) {
+            t = tile_row(&grid, c->y) * grid.nx + tile_column(&grid, c->x);
+            state.ref_items[state.ref_start[t]++] = c - ref;
+        }
+    }
+
+    for (i = 0; i < ninput; ++i) {
+        c = input_list ? input_list[i] : input + i;
+        if (tile_input_range(&grid, c, tolerance, &tx0, &tx1, &ty0, &ty1)) {
+            for (ty = ty0; ty <= ty1; ++ty) {
+                for (tx = tx0; tx <= tx1; ++tx) {
+                    t = ty * grid.nx + tx;
+                    state.input_items[state.input_start[t]++] = c - input;
+                }
+            }
+        }
+    }
+
+    for (t = state.ntiles; t > 0; --t) {
+        state.ref_start[t] = state.ref_start[t-1];
+        state.input_start[t] = state.input_start[t-1];
+    }
+    state.ref_start[0] = 0;
+    state.input_start[0] = 0;
+
+    /* Match the tiles */
+    if (parallel_for(
+                nthreads, state.ntiles, &tile_match_task, &state,
+                error)) goto exit;
+
+    /* Merge the results.  Each reference coordinate belongs to one
+       tile, so there are no duplicates, but the results are put back
+       into the order of the reference coordinates so they don't
+       depend on the tiling. */
+    for (t = 0; t < state.ntiles; ++t) {
+        nmatches += state.results[t].nmatches;
+    }
+
+    match_ref = malloc_with_error(MAX(1, nmatches) * sizeof(coord_t), error);
+    if (match_ref == NULL) goto exit;
+    order = malloc_with_error(MAX(1, nmatches) * sizeof(tile_match_t*), error);
+    if (order == NULL) goto exit;
+    perm = malloc_with_error(MAX(1, nmatches) * sizeof(size_t), error);
+    if (perm == NULL) goto exit;
+
+    j = 0;
+    for (t = 0; t < state.ntiles; ++t) {
+        for (i = 0; i < state.results[t].nmatches; ++i) {
+            order[j] = &state.results[t].matches[i];
+            match_ref[j] = ref[order[j]->ref_idx];
+            ++j;
+        }
+    }
+
+    if (xysort_index(nmatches, match_ref, perm, nthreads, error)) goto exit;
+
+    for (i = 0; i < nmatches; ++i) {
+        if (callback(
+                    callback_data, order[perm[i]]->ref_idx,
+                    order[perm[i]]->input_idx, error)) goto exit;
+    }
+
+    status = 0;
+
+ exit:
+
+    if (state.results != NULL) {
+        for (t = 0; t < state.ntiles; ++t) {
+            free(state.results[t].matches);
+        }
+    }
+    free(state.results);
+    free(state.ref_start);
+    free(state.ref_items);
+    free(state.input_start);
+    free(state.input_items);
+    free(match_ref);
+    free(order);
+    free(perm);
+
+    return status;
+}
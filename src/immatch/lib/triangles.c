@@ -36,8 +36,33 @@ DAMAGE.
 
 #include <assert.h>
 #include <math.h>
+#include <stdlib.h>
+#include <string.h>
 
 #include "immatch/lib/triangles.h"
+#include "immatch/lib/tolerance.h"
+#include "immatch/lib/verify.h"
+#include "lib/parallel.h"
+
+/* The maximum number of triangle matches tried by the RANSAC
+   verification before giving up */
+#define TRIANGLES_MAX_HYPOTHESES 10000
+
+/* The number of ranges of ratio merge_triangle_tables splits the
+   triangles into when it runs on more than one thread */
+#define TRIANGLES_MERGE_TASKS 64
+
+/* The number of coordinates of each list the adaptive mode starts
+   with */
+#define TRIANGLES_ADAPTIVE_START 8
+
+/* The minimum number of coordinate pairs the adaptive mode accepts
+   before reaching nmatch coordinates */
+#define TRIANGLES_ADAPTIVE_MIN_MATCHES 5
+
+/* The number of consecutive steps over which the adaptive mode must
+   keep all the pairs it found before, before it accepts a match */
+#define TRIANGLES_ADAPTIVE_STABLE_STEPS 2
 
 int
 max_num_triangles(
@@ -84,6 +109,368 @@ triangle_ratio_compare(
     }
 }
 
+typedef struct {
+    size_t cell;
+    size_t rank;
+    double weight;
+    size_t index;
+} triangle_point_t;
+
+/* Orders by decreasing weight, with NaN last, and then by position in
+   the sorted list */
+static int
+triangle_point_weight_compare(
+        const triangle_point_t* const a,
+        const triangle_point_t* const b) {
+
+    if (a->weight > b->weight || (isnan(b->weight) && !isnan(a->weight))) {
+        return -1;
+    } else if (a->weight < b->weight ||
+               (isnan(a->weight) && !isnan(b->weight))) {
+        return 1;
+    } else if (a->index < b->index) {
+        return -1;
+    } else if (a->index > b->index) {
+        return 1;
+    } else {
+        return 0;
+    }
+}
+
+/* Uses as a qsort functor */
+static int
+triangle_point_compare_weight(
+        const void* ap,
+        const void* bp) {
+
+    return triangle_point_weight_compare(
+            (const triangle_point_t*)ap, (const triangle_point_t*)bp);
+}
+
+/* Uses as a qsort functor */
+static int
+triangle_point_compare_cell(
+        const void* ap,
+        const void* bp) {
+
+    const triangle_point_t* a = (const triangle_point_t*)ap;
+    const triangle_point_t* b = (const triangle_point_t*)bp;
+
+    if (a->cell < b->cell) {
+        return -1;
+    } else if (a->cell > b->cell) {
+        return 1;
+    }
+    return triangle_point_weight_compare(a, b);
+}
+
+/* Uses as a qsort functor */
+static int
+triangle_point_compare_rank(
+        const void* ap,
+        const void* bp) {
+
+    const triangle_point_t* a = (const triangle_point_t*)ap;
+    const triangle_point_t* b = (const triangle_point_t*)bp;
+
+    if (a->rank < b->rank) {
+        return -1;
+    } else if (a->rank > b->rank) {
+        return 1;
+    } else if (a->cell < b->cell) {
+        return -1;
+    } else if (a->cell > b->cell) {
+        return 1;
+    } else {
+        return 0;
+    }
+}
+
+/* Reverse the lowest nbits bits of i */
+static size_t
+triangles_reverse_bits(
+        size_t i,
+        const size_t nbits) {
+
+    size_t r = 0;
+    size_t b;
+
+    for (b = 0; b < nbits; ++b) {
+        r = (r << 1) | (i & 1);
+        i >>= 1;
+    }
+
+    return r;
+}
+
+/* Put the coordinates in order of preference for building triangles,
+   so that the first n of them are the ones select_triangle_points
+   would choose for any n (for triangles_select_grid, any n up to
+   nselect).  For triangles_select_sample, they are in bit-reversed
+   order of their position in the list, so that the first 2^k of them
+   are evenly spaced through it. */
+static void
+triangles_rank_points(
+        const size_t ncoords,
+        const coord_t* const * const coords,
+        const coord_t* const base,
+        const double* const weights,
+        const triangles_select_e select,
+        const size_t nselect,
+        triangle_point_t* const points) {
+
+    size_t  ngrid, nbits, i;
+    coord_t lo, hi;
+    double  cx, cy;
+
+    for (i = 0; i < ncoords; ++i) {
+        points[i].cell = 0;
+        points[i].rank = 0;
+        points[i].weight = weights ? weights[coords[i] - base] : 0.0;
+        points[i].index = i;
+    }
+
+    if (ncoords == 0) {
+        return;
+    }
+
+    switch (select) {
+    case triangles_select_brightest:
+        qsort(points, ncoords, sizeof(triangle_point_t),
+              &triangle_point_compare_weight);
+        break;
+    case triangles_select_grid:
+        /* Take the best point of every cell, then the second best of
+           every cell, and so on */
+        ngrid = (size_t)ceil(sqrt((double)MAX(1, nselect)));
+
+        lo = hi = *coords[0];
+        for (i = 1; i < ncoords; ++i) {
+            lo.x = MIN(lo.x, coords[i]->x);
+            lo.y = MIN(lo.y, coords[i]->y);
+            hi.x = MAX(hi.x, coords[i]->x);
+            hi.y = MAX(hi.y, coords[i]->y);
+        }
+
+        for (i = 0; i < ncoords; ++i) {
+            cx = (hi.x > lo.x) ?
+                (coords[i]->x - lo.x) / (hi.x - lo.x) * (double)ngrid : 0.0;
+            cy = (hi.y > lo.y) ?
+                (coords[i]->y - lo.y) / (hi.y - lo.y) * (double)ngrid : 0.0;
+            points[i].cell =
+                MIN(ngrid - 1, (size_t)cy) * ngrid +
+                MIN(ngrid - 1, (size_t)cx);
+        }
+
+        qsort(points, ncoords, sizeof(triangle_point_t),
+              &triangle_point_compare_cell);
+        for (i = 1; i < ncoords; ++i) {
+            if (points[i].cell == points[i - 1].cell) {
+                points[i].rank = points[i - 1].rank + 1;
+            }
+        }
+        qsort(points, ncoords, sizeof(triangle_point_t),
+              &triangle_point_compare_rank);
+        break;
+    default:
+        for (nbits = 0; ((size_t)1 << nbits) < ncoords; ++nbits) {
+        }
+        for (i = 0; i < ncoords; ++i) {
+            points[i].rank = triangles_reverse_bits(i, nbits);
+        }
+        qsort(points, ncoords, sizeof(triangle_point_t),
+              &triangle_point_compare_rank);
+        break;
+    }
+}
+
+/* Check the arguments of select_triangle_points */
+static int
+triangles_check_select(
+        const double* const weights,
+        const triangles_select_e select,
+        stimage_error_t* const error) {
+
+    if (select >= triangles_select_LAST || select < 0) {
+        stimage_error_set_message(error, "Invalid point selection method");
+        return 1;
+    }
+
+    if (select == triangles_select_brightest && weights == NULL) {
+        stimage_error_set_message(
+                error, "Selecting the brightest points requires weights");
+        return 1;
+    }
+
+    return 0;
+}
+
+int
+select_triangle_points(
+        const size_t ncoords,
+        const coord_t* const * const coords,
+        const coord_t* const base,
+        const double* const weights,
+        const triangles_select_e select,
+        const size_t nselect,
+        size_t* const nselected,
+        const coord_t** const selected,
+        workspace_t* const workspace,
+        stimage_error_t* const error) {
+
+    triangle_point_t* points = NULL;
+    char*             chosen = NULL;
+    size_t            i, n;
+    int               status = 1;
+
+    assert(coords || ncoords == 0);
+    assert(nselected);
+    assert(selected);
+    assert(error);
+
+    if (triangles_check_select(weights, select, error)) goto exit;
+
+    if (select == triangles_select_sample || ncoords <= nselect) {
+        for (i = 0; i < ncoords; ++i) {
+            selected[i] = coords[i];
+        }
+        *nselected = ncoords;
+        status = 0;
+        goto exit;
+    }
+
+    assert(base);
+
+    points = workspace_alloc(
+            workspace, ncoords * sizeof(triangle_point_t), error);
+    if (points == NULL) goto exit;
+    chosen = workspace_alloc(workspace, ncoords * sizeof(char), error);
+    if (chosen == NULL) goto exit;
+
+    triangles_rank_points(
+            ncoords, coords, base, weights, select, nselect, points);
+
+    for (i = 0; i < ncoords; ++i) {
+        chosen[i] = 0;
+    }
+    for (i = 0; i < nselect; ++i) {
+        chosen[points[i].index] = 1;
+    }
+
+    for (i = 0, n = 0; i < ncoords; ++i) {
+        if (chosen[i]) {
+            selected[n++] = coords[i];
+        }
+    }
+    *nselected = n;
+
+    status = 0;
+
+ exit:
+
+    workspace_release(workspace, points);
+    workspace_release(workspace, chosen);
+
+    return status;
+}
+
+/* Fill in a triangle from three coordinates and the squares of the
+   distances between them.  Returns zero if the triangle is rejected
+   because the ratio of its longest to shortest side is too high. */
+static int
+triangles_make(
+        const coord_t* const ci,
+        const coord_t* const cj,
+        const coord_t* const ck,
+        const double dist_ij,
+        const double dist_jk,
+        const double dist_ki,
+        const double tol2,
+        const double maxratio,
+        triangle_t* const tri) {
+
+    size_t m;
+    double dx[3], dy[3], sides2[3], sides[3];
+    double cosc, cosc2, sinc2;
+    double ratio, loctol;
+
+    /* Order the vertices with the shortest side of the triangle
+       between vertices 1 and 2 and the intermediate side between
+       vertices 2 and 3.
+    */
+    if (dist_ij <= dist_jk) {
+        if (dist_ki <= dist_ij) {
+            tri->vertices[0] = ck;
+            tri->vertices[1] = ci;
+            tri->vertices[2] = cj;
+        } else if (dist_ki >= dist_jk) {
+            tri->vertices[0] = ci;
+            tri->vertices[1] = cj;
+            tri->vertices[2] = ck;
+        } else {
+            tri->vertices[0] = cj;
+            tri->vertices[1] = ci;
+            tri->vertices[2] = ck;
+        }
+    } else {
+        if (dist_ki <= dist_jk) {
+            tri->vertices[0] = ci;
+            tri->vertices[1] = ck;
+            tri->vertices[2] = cj;
+        } else if (dist_ki >= dist_ij) {
+            tri->vertices[0] = ck;
+            tri->vertices[1] = cj;
+            tri->vertices[2] = ci;
+        } else {
+            tri->vertices[0] = cj;
+            tri->vertices[1] = ck;
+            tri->vertices[2] = ci;
+        }
+    }
+
+    /* Compute the lengths of the sides */
+    for (m = 0; m < 3; ++m) {
+        dx[m] = tri->vertices[sides_def[m][0]]->x -
+            tri->vertices[sides_def[m][1]]->x;
+        dy[m] = tri->vertices[sides_def[m][0]]->y -
+            tri->vertices[sides_def[m][1]]->y;
+        sides2[m] = dx[m]*dx[m] + dy[m]*dy[m];
+        assert(sides2[m] >= 0.0);
+        sides[m] = sqrt(sides2[m]);
+    }
+
+    /* If the ratio of long to short is too high, reject
+       this triangle */
+    ratio = sides[2] / sides[1];
+    if (ratio > maxratio) {
+        return 0;
+    }
+
+    /* Compute the cos, cos ** 2 and sin ** 2 of the angle at
+       vertex 1. */
+    cosc = (dx[2]*dx[1] + dy[2]*dy[1]) / (sides[2]*sides[1]);
+    cosc2 = MAX(0.0, MIN(1.0, cosc*cosc));
+    sinc2 = MAX(0.0, MIN(1.0, 1.0 - cosc2));
+
+    /* Determine whether the triangles vertices are
+       arranged clockwise or anti-clockwise */
+    tri->sense = ((dx[1]*dy[0] - dy[1]*dx[0]) > 0.0);
+
+    /* Compute the tolerances */
+    loctol = (1.0/sides2[2] - cosc/(sides[2]*sides[1]) + 1.0/sides2[1]);
+    tri->ratio_tolerance = 2.0*ratio*ratio*tol2*loctol;
+    tri->cosine_tolerance = \
+        2.0*sinc2*tol2*loctol +
+        2.0*cosc2*tol2*tol2*loctol*loctol;
+
+    /* Compute the perimeter */
+    tri->log_perimeter = log(sides[0] + sides[1] + sides[2]);
+    tri->ratio = ratio;
+    tri->cosine_v1 = cosc;
+
+    return 1;
+}
+
 int
 find_triangles(
         const size_t ncoords,
@@ -98,13 +485,9 @@ find_triangles(
     const double tol2 = tolerance * tolerance;
     const size_t nsample = MAX(1, ncoords / maxnpoints);
     const size_t npoints = MIN(ncoords, nsample * maxnpoints);
-    triangle_t* tri = triangles;
-    size_t i, j, k, m;
+    size_t i, j, k;
     size_t ntri = 0;
     double dist_ij, dist_jk, dist_ki;
-    double dx[3], dy[3], sides2[3], sides[3];
-    double cosc, cosc2, sinc2;
-    double ratio, loctol;
 
     assert(coords);
     assert(ntriangles);
@@ -146,84 +529,15 @@ find_triangles(
                     }
                 #endif /* NDEBUG */
 
-                tri = &triangles[ntri];
                 /* DIFF: The original stores the index of the
                    triangle.  Do we need to do that? */
-
-                /* Order the vertices with the shortest side of the triangle
-                   between vertices 1 and 2 and the intermediate side between
-                   vertices 2 and 3.
-                */
-                if (dist_ij <= dist_jk) {
-                    if (dist_ki <= dist_ij) {
-                        tri->vertices[0] = coords[k];
-                        tri->vertices[1] = coords[i];
-                        tri->vertices[2] = coords[j];
-                    } else if (dist_ki >= dist_jk) {
-                        tri->vertices[0] = coords[i];
-                        tri->vertices[1] = coords[j];
-                        tri->vertices[2] = coords[k];
-                    } else {
-                        tri->vertices[0] = coords[j];
-                        tri->vertices[1] = coords[i];
-                        tri->vertices[2] = coords[k];
-                    }
-                } else {
-                    if (dist_ki <= dist_jk) {
-                        tri->vertices[0] = coords[i];
-                        tri->vertices[1] = coords[k];
-                        tri->vertices[2] = coords[j];
-                    } else if (dist_ki >= dist_ij) {
-                        tri->vertices[0] = coords[k];
-                        tri->vertices[1] = coords[j];
-                        tri->vertices[2] = coords[i];
-                    } else {
-                        tri->vertices[0] = coords[j];
-                        tri->vertices[1] = coords[k];
-                        tri->vertices[2] = coords[i];
-                    }
-                }
-
-                /* Compute the lengths of the sides */
-                for (m = 0; m < 3; ++m) {
-                    dx[m] = tri->vertices[sides_def[m][0]]->x -
-                        tri->vertices[sides_def[m][1]]->x;
-                    dy[m] = tri->vertices[sides_def[m][0]]->y -
-                        tri->vertices[sides_def[m][1]]->y;
-                    sides2[m] = dx[m]*dx[m] + dy[m]*dy[m];
-                    assert(sides2[m] >= 0.0);
-                    sides[m] = sqrt(sides2[m]);
-                }
-
-                /* If the ratio of long to short is too high, reject
-                   this triangle */
-                ratio = sides[2] / sides[1];
-                if (ratio > maxratio) {
+                if (!triangles_make(
+                            coords[i], coords[j], coords[k],
+                            dist_ij, dist_jk, dist_ki, tol2, maxratio,
+                            &triangles[ntri])) {
                     continue;
                 }
 
-                /* Compute the cos, cos ** 2 and sin ** 2 of the angle at
-                   vertex 1. */
-                cosc = (dx[2]*dx[1] + dy[2]*dy[1]) / (sides[2]*sides[1]);
-                cosc2 = MAX(0.0, MIN(1.0, cosc*cosc));
-                sinc2 = MAX(0.0, MIN(1.0, 1.0 - cosc2));
-
-                /* Determine whether the triangles vertices are
-                   arranged clockwise or anti-clockwise */
-                tri->sense = ((dx[1]*dy[0] - dy[1]*dx[0]) > 0.0);
-
-                /* Compute the tolerances */
-                loctol = (1.0/sides2[2] - cosc/(sides[2]*sides[1]) + 1.0/sides2[1]);
-                tri->ratio_tolerance = 2.0*ratio*ratio*tol2*loctol;
-                tri->cosine_tolerance = \
-                    2.0*sinc2*tol2*loctol +
-                    2.0*cosc2*tol2*tol2*loctol*loctol;
-
-                /* Compute the perimeter */
-                tri->log_perimeter = log(sides[0] + sides[1] + sides[2]);
-                tri->ratio = ratio;
-                tri->cosine_v1 = cosc;
-
                 ++ntri;
             }
         }
@@ -357,372 +671,2231 @@ merge_triangles(
     return 0;
 }
 
-static int
-reject_triangles_compute_sigma_mode_factor(
-        const size_t nmatches,
-        double* const diffp,
-        const double sum,
-        const double sumsq,
-        const size_t nfalse,
-        const size_t ntrue,
-        double* sigma,
-        double* mode,
-        double* factor) {
+void
+triangle_table_init(
+        triangle_table_t* const table) {
 
-    assert(diffp);
-    assert(sigma);
-    assert(mode);
-    assert(factor);
+    assert(table);
 
-    /* Compute the mean, mode, and sigma of the log-perimeter
-       distribution */
-    if (nmatches == 0) {
-        *sigma = 0.0;
-    } else {
-        *sigma = (sumsq - (sum / (double)(nmatches)) * sum) / ((double)(nmatches) - 1);
-    }
+    memset(table, 0, sizeof(triangle_table_t));
+}
 
-    if (*sigma <= 0.0) {
-        return 1;
-    } else {
-        *sigma = sqrt(*sigma);
-    }
+void
+triangle_table_free(
+        triangle_table_t* const table) {
 
-    /* Sort by the diff of the log-perimeters */
-    sort_doubles(nmatches, diffp);
+    workspace_t* workspace;
 
-    *mode = compute_mode(nmatches, diffp, 10, 1.0, 0.1 * *sigma, 0.01 * *sigma);
+    assert(table);
 
-    if (nfalse > ntrue) {
-        *factor = 1.0;
-    } else if ((0.1 * ntrue) > nfalse) {
-        *factor = 3.0;
-    } else {
-        *factor = 2.0;
+    workspace = table->workspace;
+    workspace_release(workspace, table->vertices);
+    workspace_release(workspace, table->log_perimeter);
+    workspace_release(workspace, table->ratio);
+    workspace_release(workspace, table->cosine_v1);
+    workspace_release(workspace, table->ratio_tolerance);
+    workspace_release(workspace, table->cosine_tolerance);
+    workspace_release(workspace, table->sense);
+    memset(table, 0, sizeof(triangle_table_t));
+    table->workspace = workspace;
+}
+
+/* Grow one of the arrays of a table, which holds used bytes, to size
+   bytes.  Workspace memory cannot be grown in place, so it is copied
+   to a new allocation. */
+static void*
+triangle_table_realloc(
+        workspace_t* const workspace,
+        void* const array,
+        const size_t used,
+        const size_t size,
+        stimage_error_t* const error) {
+
+    void* result = NULL;
+
+    if (workspace != NULL) {
+        result = workspace_alloc(workspace, size, error);
+        if (result != NULL && used > 0) {
+            memcpy(result, array, used);
+        }
+        return result;
     }
 
-    return 0;
+    result = realloc(array, size);
+    if (result == NULL) {
+        stimage_error_format_message(
+            error, "Error allocating %lu bytes", (unsigned long)size);
+    }
+
+    return result;
 }
 
 int
-reject_triangles(
-        size_t* nmatches,
-        triangle_match_t* const matches,
-        const size_t nreject,
-        stimage_error_t* error) {
+triangle_table_reserve(
+        triangle_table_t* const table,
+        const size_t ntriangles,
+        stimage_error_t* const error) {
 
-    size_t            i            = 0;
-    double            sum          = 0.0;
-    double            sumsq        = 0.0;
-    int               nplus        = 0;
-    int               nminus       = 0;
-    double            diff         = 0.0;
-    int               ntrue        = 0;
-    int               nfalse       = 0;
-    double            sigma        = 0.0;
-    double            mode         = 0.0;
-    double            factor       = 0.0;
-    double            locut        = 0.0;
-    double            hicut        = 0.0;
-    size_t            ncount       = 0;
-    size_t            ncurrmatches = *nmatches;
-    size_t            niter        = 0;
-    const triangle_t* r_tri        = NULL;
-    const triangle_t* l_tri        = NULL;
-    double*           diffp        = NULL;
-    int               status       = 1;
+    const size_t n = MAX(1, ntriangles);
+    const size_t m = table->ntriangles;
+    void*        p = NULL;
 
-    assert(nmatches);
-    assert(matches);
+    assert(table);
     assert(error);
 
-    diffp = malloc_with_error(ncurrmatches * sizeof(double), error);
-    if (diffp == NULL) goto exit;
+    if (n <= table->nallocated) {
+        return 0;
+    }
 
-    /* Accumulate the number of same-sense and number of
-       opposite-sense matches as well as the log perimeter
-       statistics. */
-    for (i = 0; i < ncurrmatches; ++i) {
-        r_tri = matches[i].r;
-        l_tri = matches[i].l;
+    p = triangle_table_realloc(
+            table->workspace, table->vertices,
+            3 * m * sizeof(uint16_t), 3 * n * sizeof(uint16_t), error);
+    if (p == NULL) return 1;
+    table->vertices = p;
+    p = triangle_table_realloc(
+            table->workspace, table->log_perimeter,
+            m * sizeof(double), n * sizeof(double), error);
+    if (p == NULL) return 1;
+    table->log_perimeter = p;
+    p = triangle_table_realloc(
+            table->workspace, table->ratio,
+            m * sizeof(double), n * sizeof(double), error);
+    if (p == NULL) return 1;
+    table->ratio = p;
+    p = triangle_table_realloc(
+            table->workspace, table->cosine_v1,
+            m * sizeof(double), n * sizeof(double), error);
+    if (p == NULL) return 1;
+    table->cosine_v1 = p;
+    p = triangle_table_realloc(
+            table->workspace, table->ratio_tolerance,
+            m * sizeof(float), n * sizeof(float), error);
+    if (p == NULL) return 1;
+    table->ratio_tolerance = p;
+    p = triangle_table_realloc(
+            table->workspace, table->cosine_tolerance,
+            m * sizeof(float), n * sizeof(float), error);
+    if (p == NULL) return 1;
+    table->cosine_tolerance = p;
+    p = triangle_table_realloc(
+            table->workspace, table->sense,
+            m * sizeof(unsigned char), n * sizeof(unsigned char), error);
+    if (p == NULL) return 1;
+    table->sense = p;
+
+    table->nallocated = n;
 
-        diff = r_tri->log_perimeter - l_tri->log_perimeter;
-        diffp[i] = diff;
-        sum += diff;
-        sumsq += diff*diff;
-        if (r_tri->sense == l_tri->sense) {
-            ++nplus;
-        }
-    }
-    nminus = (int)ncurrmatches - nplus;
-    ntrue = ABS(nplus - nminus);
-    nfalse = ncurrmatches - ntrue;
+    return 0;
+}
 
-    if (reject_triangles_compute_sigma_mode_factor(
-            ncurrmatches, diffp, sum, sumsq, nfalse, ntrue, &sigma, &mode, &factor)) {
-        status = 0;
-        goto exit;
-    }
+void
+triangle_table_get(
+        const triangle_table_t* const table,
+        const size_t i,
+        const coord_t* const * const coords,
+        triangle_t* const tri) {
 
-    /* Begin the rejection loop */
-    for (niter = 0; niter < nreject; ++niter) {
-        ncount = 0;
-        locut = mode - factor * sigma;
-        hicut = mode + factor * sigma;
+    size_t m;
 
-        for (i = 0; i < ncurrmatches; ++i) {
-            r_tri = matches[i].r;
-            l_tri = matches[i].l;
-            diff = r_tri->log_perimeter - l_tri->log_perimeter;
-            if (diff < locut || diff > hicut) {
-                sum -= diff;
-                sumsq -= diff*diff;
-                if (r_tri->sense == l_tri->sense) {
-                    --nplus;
-                } else {
-                    --nminus;
+    assert(table);
+    assert(i < table->ntriangles);
+    assert(coords);
+    assert(tri);
+
+    for (m = 0; m < 3; ++m) {
+        tri->vertices[m] = coords[table->vertices[3 * i + m]];
+    }
+    tri->log_perimeter = table->log_perimeter[i];
+    tri->ratio = table->ratio[i];
+    tri->cosine_v1 = table->cosine_v1[i];
+    tri->ratio_tolerance = table->ratio_tolerance[i];
+    tri->cosine_tolerance = table->cosine_tolerance[i];
+    tri->sense = table->sense[i];
+}
+
+/* Store a triangle made by triangles_make from coords[i], coords[j]
+   and coords[k] in row n of a table */
+static void
+triangle_table_put(
+        triangle_table_t* const table,
+        const size_t n,
+        const triangle_t* const tri,
+        const coord_t* const * const coords,
+        const size_t i,
+        const size_t j,
+        const size_t k) {
+
+    const coord_t* vertex;
+    size_t         m;
+
+    assert(n < table->nallocated);
+
+    for (m = 0; m < 3; ++m) {
+        vertex = tri->vertices[m];
+        table->vertices[3 * n + m] = (uint16_t)(
+                vertex == coords[i] ? i : (vertex == coords[j] ? j : k));
+    }
+    table->log_perimeter[n] = tri->log_perimeter;
+    table->ratio[n] = tri->ratio;
+    table->cosine_v1[n] = tri->cosine_v1;
+    table->ratio_tolerance[n] = (float)tri->ratio_tolerance;
+    table->cosine_tolerance[n] = (float)tri->cosine_tolerance;
+    table->sense[n] = (unsigned char)tri->sense;
+}
+
+static void
+triangle_table_copy_row(
+        triangle_table_t* const dst,
+        const size_t di,
+        const triangle_table_t* const src,
+        const size_t si) {
+
+    assert(di < dst->nallocated);
+    assert(si < src->nallocated);
+
+    dst->vertices[3 * di] = src->vertices[3 * si];
+    dst->vertices[3 * di + 1] = src->vertices[3 * si + 1];
+    dst->vertices[3 * di + 2] = src->vertices[3 * si + 2];
+    dst->log_perimeter[di] = src->log_perimeter[si];
+    dst->ratio[di] = src->ratio[si];
+    dst->cosine_v1[di] = src->cosine_v1[si];
+    dst->ratio_tolerance[di] = src->ratio_tolerance[si];
+    dst->cosine_tolerance[di] = src->cosine_tolerance[si];
+    dst->sense[di] = src->sense[si];
+}
+
+typedef struct {
+    double ratio;
+    size_t index;
+} triangle_order_t;
+
+/* Orders by ratio, and then by position in the table */
+static int
+triangle_order_compare(
+        const void* ap,
+        const void* bp) {
+
+    const triangle_order_t* a = (const triangle_order_t*)ap;
+    const triangle_order_t* b = (const triangle_order_t*)bp;
+
+    if (a->ratio < b->ratio) {
+        return -1;
+    } else if (a->ratio > b->ratio) {
+        return 1;
+    } else if (a->index < b->index) {
+        return -1;
+    } else if (a->index > b->index) {
+        return 1;
+    } else {
+        return 0;
+    }
+}
+
+/* Copy the triangles from row start onward of a table into sorted, in
+   increasing order of ratio.  sorted must be initialized, and is
+   replaced. */
+static int
+triangle_table_sorted_copy(
+        const triangle_table_t* const table,
+        const size_t start,
+        triangle_table_t* const sorted,
+        stimage_error_t* const error) {
+
+    const size_t      n      = table->ntriangles - start;
+    triangle_order_t* order  = NULL;
+    size_t            i;
+    int               status = 1;
+
+    order = workspace_alloc(
+            sorted->workspace, MAX(1, n) * sizeof(triangle_order_t), error);
+    if (order == NULL) goto exit;
+
+    if (triangle_table_reserve(sorted, n, error)) goto exit;
+
+    for (i = 0; i < n; ++i) {
+        order[i].ratio = table->ratio[start + i];
+        order[i].index = start + i;
+    }
+
+    qsort(order, n, sizeof(triangle_order_t), &triangle_order_compare);
+
+    for (i = 0; i < n; ++i) {
+        triangle_table_copy_row(sorted, i, table, order[i].index);
+    }
+    sorted->ntriangles = n;
+
+    status = 0;
+
+ exit:
+
+    workspace_release(sorted->workspace, order);
+
+    return status;
+}
+
+/* The state shared by the tasks of triangles_build_rows.  Each task
+   builds the triangles whose first vertex is one of the sampled
+   coordinates (or, when extending, whose last vertex is one of the new
+   coordinates) into its own range of rows of the table, which is
+   large enough for all of them, and counts how many it kept. */
+typedef struct {
+    const coord_t* const * coords;
+    size_t                 npoints;
+    size_t                 nsample;
+    size_t                 nold;
+    int                    extend;
+    double                 tol2;
+    double                 maxratio;
+    triangle_table_t*      table;
+    size_t*                start;
+    size_t*                count;
+} triangles_build_state_t;
+
+static int
+triangles_build_task(
+        void* data,
+        const size_t task,
+        stimage_error_t* const error) {
+
+    const triangles_build_state_t* state   = data;
+    const coord_t* const * const   coords  = state->coords;
+    const size_t                   npoints = state->npoints;
+    const size_t                   nsample = state->nsample;
+    const double                   tol2    = state->tol2;
+    size_t                         n       = state->start[task];
+    size_t                         i, j, k;
+    double                         dist_ij, dist_jk, dist_ki;
+    triangle_t                     tri;
+
+    if (state->extend) {
+        k = state->nold + task;
+        for (i = 0; i < k; ++i) {
+            dist_ki = euclid_distance2(coords[k], coords[i]);
+            if (dist_ki <= tol2) {
+                continue;
+            }
+
+            for (j = i + 1; j < k; ++j) {
+                dist_ij = euclid_distance2(coords[i], coords[j]);
+                if (dist_ij <= tol2) {
+                    continue;
                 }
-            } else {
-                /* This starts writing non-rejected matches to the
-                   beginning of the list containing all matches */
-                #ifndef NDEBUG
-                    if (ncount >= *nmatches) {
-                        stimage_error_set_message(
-                            error,
-                            "Rejection created more matches than it started with.");
-                        goto exit;
-                    }
-                #endif
-                diffp[ncount] = diff;
-                matches[ncount].r = r_tri;
-                matches[ncount].l = l_tri;
-                ++ncount;
+
+                dist_jk = euclid_distance2(coords[j], coords[k]);
+                if (dist_jk <= tol2) {
+                    continue;
+                }
+
+                if (triangles_make(
+                            coords[i], coords[j], coords[k],
+                            dist_ij, dist_jk, dist_ki, tol2, state->maxratio,
+                            &tri)) {
+                    triangle_table_put(state->table, n++, &tri, coords, i, j, k);
+                }
+            }
+        }
+    } else {
+        i = task * nsample;
+        for (j = i + nsample; j < npoints - nsample; j += nsample) {
+            dist_ij = euclid_distance2(coords[i], coords[j]);
+            if (dist_ij <= tol2) {
+                continue;
+            }
+
+            for (k = j + nsample; k < npoints; k += nsample) {
+                dist_jk = euclid_distance2(coords[j], coords[k]);
+                if (dist_jk <= tol2) {
+                    continue;
+                }
+
+                dist_ki = euclid_distance2(coords[k], coords[i]);
+                if (dist_ki <= tol2) {
+                    continue;
+                }
+
+                if (triangles_make(
+                            coords[i], coords[j], coords[k],
+                            dist_ij, dist_jk, dist_ki, tol2, state->maxratio,
+                            &tri)) {
+                    triangle_table_put(state->table, n++, &tri, coords, i, j, k);
+                }
+            }
+        }
+    }
+
+    state->count[task] = n - state->start[task];
+
+    return 0;
+}
+
+/* Append the triangles of every nsample'th one of the first npoints
+   coordinates (or, if extend is non-zero, the triangles whose last
+   vertex is one of coords[nold] to coords[npoints - 1]) to a table, on
+   up to nthreads threads.  The rows of each task are moved down to
+   follow those of the previous task, so the triangles are appended in
+   the same order whatever the number of threads. */
+static int
+triangles_build_rows(
+        const size_t npoints,
+        const coord_t* const * const coords,
+        const size_t nsample,
+        const size_t nold,
+        const int extend,
+        const double tolerance,
+        const double maxratio,
+        const size_t nthreads,
+        triangle_table_t* const table,
+        stimage_error_t* const error) {
+
+    const size_t            m      = npoints / nsample;
+    size_t                  ntasks = 0;
+    size_t                  nrows  = 0;
+    size_t                  out    = 0;
+    size_t                  t, r, v;
+    triangles_build_state_t state;
+    int                     status = 1;
+
+    memset(&state, 0, sizeof(triangles_build_state_t));
+
+    if (extend) {
+        ntasks = npoints > nold ? npoints - nold : 0;
+    } else {
+        ntasks = m >= 3 ? m - 2 : 0;
+    }
+    if (ntasks == 0) {
+        return 0;
+    }
+
+    state.coords = coords;
+    state.npoints = npoints;
+    state.nsample = nsample;
+    state.nold = nold;
+    state.extend = extend;
+    state.tol2 = tolerance * tolerance;
+    state.maxratio = maxratio;
+    state.table = table;
+
+    state.start = workspace_alloc(
+            table->workspace, ntasks * sizeof(size_t), error);
+    if (state.start == NULL) goto exit;
+    state.count = workspace_alloc(
+            table->workspace, ntasks * sizeof(size_t), error);
+    if (state.count == NULL) goto exit;
+
+    /* Each task gets room for every pair of the other two vertices */
+    nrows = table->ntriangles;
+    for (t = 0; t < ntasks; ++t) {
+        state.start[t] = nrows;
+        v = extend ? nold + t : m - 1 - t;
+        nrows += v * (v - 1) / 2;
+    }
+
+    if (triangle_table_reserve(table, nrows, error)) goto exit;
+
+    if (parallel_for(
+                nthreads, ntasks, &triangles_build_task, &state,
+                error)) goto exit;
+
+    out = table->ntriangles;
+    for (t = 0; t < ntasks; ++t) {
+        for (r = 0; r < state.count[t]; ++r) {
+            if (out != state.start[t] + r) {
+                triangle_table_copy_row(table, out, table, state.start[t] + r);
+            }
+            ++out;
+        }
+    }
+    table->ntriangles = out;
+
+    status = 0;
+
+ exit:
+
+    workspace_release(table->workspace, state.start);
+    workspace_release(table->workspace, state.count);
+
+    return status;
+}
+
+int
+find_triangle_table(
+        const size_t ncoords,
+        const coord_t* const * const coords,
+        const size_t maxnpoints,
+        const double tolerance,
+        const double maxratio,
+        const size_t nthreads,
+        triangle_table_t* const table,
+        stimage_error_t* const error) {
+
+    const size_t     nsample      = MAX(1, ncoords / MAX(1, maxnpoints));
+    const size_t     npoints      = MIN(ncoords, nsample * maxnpoints);
+    size_t           maxtriangles = 0;
+    triangle_table_t sorted;
+    int              status       = 1;
+
+    assert(coords);
+    assert(table);
+    assert(error);
+
+    triangle_table_init(&sorted);
+    sorted.workspace = table->workspace;
+
+    if (maxratio > 10.0 || maxratio < 5.0) {
+        stimage_error_format_message(
+            error,
+            "maxratio should be in the range 5.0 - 10.0 (%f)", maxratio);
+        goto exit;
+    }
+
+    table->ntriangles = 0;
+    if (npoints < 3 * nsample) {
+        status = 0;
+        goto exit;
+    }
+
+    if (max_num_triangles(ncoords, maxnpoints, &maxtriangles, error) ||
+        triangles_build_rows(
+                npoints, coords, nsample, 0, 0, tolerance, maxratio,
+                nthreads, table, error)) {
+        goto exit;
+    }
+
+    /* Sort the triangles in increasing order of ratio */
+    if (triangle_table_sorted_copy(table, 0, &sorted, error)) goto exit;
+    triangle_table_free(table);
+    *table = sorted;
+    triangle_table_init(&sorted);
+    sorted.workspace = table->workspace;
+
+    status = 0;
+
+ exit:
+
+    triangle_table_free(&sorted);
+
+    return status;
+}
+
+/* The state shared by the tasks of merge_triangle_tables.  Each task
+   merges a contiguous range of the rows of r_table, writing its
+   matches from the position of its first row onward, since each row
+   has at most one match. */
+typedef struct {
+    const triangle_table_t* r_table;
+    const triangle_table_t* l_table;
+    double                  maxtol;
+    size_t                  nrows;
+    triangle_table_match_t* matches;
+    size_t*                 count;
+} triangles_merge_state_t;
+
+static int
+triangles_merge_task(
+        void* data,
+        const size_t task,
+        stimage_error_t* const error) {
+
+    const triangles_merge_state_t* state        = data;
+    const size_t                   nr_triangles = state->r_table->ntriangles;
+    const size_t                   nl_triangles = state->l_table->ntriangles;
+    const double* const            r_ratio      = state->r_table->ratio;
+    const double* const            l_ratio      = state->l_table->ratio;
+    const double* const            r_cosine     = state->r_table->cosine_v1;
+    const double* const            l_cosine     = state->l_table->cosine_v1;
+    const float* const             r_ratio_tol  = state->r_table->ratio_tolerance;
+    const float* const             l_ratio_tol  = state->l_table->ratio_tolerance;
+    const float* const             r_cosine_tol = state->r_table->cosine_tolerance;
+    const float* const             l_cosine_tol = state->l_table->cosine_tolerance;
+    const double                   maxtol       = state->maxtol;
+    const size_t                   rstart       = task * state->nrows;
+    const size_t                   rend         = MIN(nr_triangles, rstart + state->nrows);
+    triangle_table_match_t* const  matches      = state->matches + rstart;
+    size_t                         match_iter   = 0;
+    size_t                         blp, rp, lp, lo, hi;
+    double                         dratio       = 0.0;
+    double                         dratio2, dcosine, dcosine2, dtratio, dtcosine;
+    size_t                         max_lp;
+    double                         max_d2;
+
+    /* Find the first triangle in L that satisfies the ratio tolerance
+       requirement for the first triangle of the range.  This is where
+       a merge of the whole list would have got to. */
+    lo = 0;
+    hi = nl_triangles;
+    while (lo < hi) {
+        blp = lo + (hi - lo) / 2;
+        if (r_ratio[rstart] - l_ratio[blp] <= maxtol) {
+            hi = blp;
+        } else {
+            lo = blp + 1;
+        }
+    }
+    blp = lo;
+
+    /* This is the same search as merge_triangles, but each step only
+       touches the arrays it needs. */
+    for (rp = rstart; rp < rend; ++rp) {
+        for ( ; blp < nl_triangles; ++blp) {
+            dratio = r_ratio[rp] - l_ratio[blp];
+            if (dratio <= maxtol) {
+                break;
+            }
+        }
+
+        if (blp >= nl_triangles) {
+            break;
+        }
+
+        if (dratio < -maxtol) {
+            continue;
+        }
+
+        max_lp = nl_triangles;
+        max_d2 = MAX_DOUBLE;
+
+        for (lp = blp; lp < nl_triangles; ++lp) {
+            dratio = r_ratio[rp] - l_ratio[lp];
+            if (dratio < -maxtol) {
+                break;
+            }
+
+            dratio2 = dratio*dratio;
+            dcosine = r_cosine[rp] - l_cosine[lp];
+            dcosine2 = dcosine*dcosine;
+            dtratio = (double)r_ratio_tol[rp] + (double)l_ratio_tol[lp];
+            dtcosine = (double)r_cosine_tol[rp] + (double)l_cosine_tol[lp];
+
+            if (dratio2 <= dtratio && dcosine2 <= dtcosine &&
+                (dratio2 + dcosine2) < max_d2) {
+                max_lp = lp;
+                max_d2 = dratio2 + dcosine2;
             }
         }
 
-        /* NOTE: At this point matches[0 --- ncount] contains only
-           non-rejected matches.  matches[ncount --- ncurrmatches] is now
-           garbage.  Same is true of diffp.  */
+        if (max_lp < nl_triangles) {
+            matches[match_iter].l = max_lp;
+            matches[match_iter].r = rp;
+            ++match_iter;
+        }
+    }
+
+    state->count[task] = match_iter;
+
+    return 0;
+}
+
+int
+merge_triangle_tables(
+        const triangle_table_t* const r_table,
+        const triangle_table_t* const l_table,
+        const size_t nthreads,
+        size_t* nmatches,
+        triangle_table_match_t* const matches,
+        stimage_error_t* const error) {
+
+    const size_t            nr_triangles = r_table->ntriangles;
+    const size_t            nl_triangles = l_table->ntriangles;
+    size_t                  ntasks       = 1;
+    size_t                  match_iter   = 0;
+    size_t                  i, t;
+    double                  rmaxtol, lmaxtol;
+    triangles_merge_state_t state;
+    int                     status       = 1;
+
+    assert(r_table);
+    assert(l_table);
+    assert(nmatches);
+    assert(matches);
+    assert(error);
+
+    memset(&state, 0, sizeof(triangles_merge_state_t));
+
+    if (nr_triangles == 0 || nl_triangles == 0) {
+        *nmatches = 0;
+        return 0;
+    }
+
+    if (*nmatches < nr_triangles) {
+        stimage_error_format_message(
+            error,
+            "Room for %lu triangle matches is needed",
+            (unsigned long)nr_triangles);
+        return 1;
+    }
+
+    /* Find the maximum tolerance for each list */
+    rmaxtol = r_table->ratio_tolerance[0];
+    for (i = 1; i < nr_triangles; ++i) {
+        rmaxtol = MAX(rmaxtol, r_table->ratio_tolerance[i]);
+    }
+
+    lmaxtol = l_table->ratio_tolerance[0];
+    for (i = 1; i < nl_triangles; ++i) {
+        lmaxtol = MAX(lmaxtol, l_table->ratio_tolerance[i]);
+    }
+
+    /* Split the reference triangles into ranges of ratio, a few per
+       thread so that the dense parts of the lists are shared out */
+    if (nthreads != 1) {
+        ntasks = MIN(nr_triangles, TRIANGLES_MERGE_TASKS);
+    }
+
+    state.r_table = r_table;
+    state.l_table = l_table;
+    state.maxtol = sqrt(rmaxtol + lmaxtol);
+    state.nrows = (nr_triangles + ntasks - 1) / ntasks;
+    ntasks = (nr_triangles + state.nrows - 1) / state.nrows;
+    state.matches = matches;
+    state.count = workspace_alloc(
+            r_table->workspace, ntasks * sizeof(size_t), error);
+    if (state.count == NULL) goto exit;
+
+    if (parallel_for(
+                nthreads, ntasks, &triangles_merge_task, &state,
+                error)) goto exit;
+
+    /* Concatenate the matches of the ranges */
+    for (t = 0; t < ntasks; ++t) {
+        for (i = 0; i < state.count[t]; ++i) {
+            matches[match_iter++] = matches[t * state.nrows + i];
+        }
+    }
+
+    *nmatches = match_iter;
+
+    status = 0;
+
+ exit:
+
+    workspace_release(r_table->workspace, state.count);
+
+    return status;
+}
+
+/* The bytes taken by one row of a triangle table */
+#define TRIANGLE_TABLE_ROW_BYTES \
+    (3 * sizeof(uint16_t) + 3 * sizeof(double) + 2 * sizeof(float) + \
+     sizeof(unsigned char))
+
+int
+estimate_triangles(
+        const size_t nref,
+        const size_t ninput,
+        const size_t nmatch,
+        const double maxratio,
+        triangles_estimate_t* const estimate,
+        stimage_error_t* const error) {
+
+    const size_t nr = MIN(nref, nmatch);
+    const size_t ni = MIN(ninput, nmatch);
+    double       tr, ti, tm, build, fixed, stage, peak;
+
+    assert(estimate);
+    assert(error);
+
+    memset(estimate, 0, sizeof(triangles_estimate_t));
+
+    if (maxratio > 10.0 || maxratio < 5.0) {
+        stimage_error_format_message(
+            error,
+            "maxratio should be in the range 5.0 - 10.0 (%f)", maxratio);
+        return 1;
+    }
+
+    if (nr < 3 || ni < 3) {
+        stimage_error_set_message(
+            error,
+            "Too few coordinates to do triangle matching");
+        return 1;
+    }
+
+    if (max_num_triangles(nr, nr, &estimate->nref_triangles, error) ||
+        max_num_triangles(ni, ni, &estimate->ninput_triangles, error)) {
+        return 1;
+    }
+
+    estimate->nref_points = nr;
+    estimate->ninput_points = ni;
+
+    /* Doubles are used, since the products overflow a 32-bit size_t */
+    tr = (double)estimate->nref_triangles;
+    ti = (double)estimate->ninput_triangles;
+    tm = MIN(tr, ti);
+
+    /* The sorted copies of the lists made by xyxymatch, the copies of
+       the chosen coordinates, and the matched coordinate pairs */
+    fixed = (double)nref * (sizeof(coord_t*) * 2) +
+        (double)ninput * (sizeof(coord_t) + sizeof(coord_t*) * 2) +
+        (double)(nr + ni) * (sizeof(coord_t) + sizeof(coord_t*) * 2) +
+        (double)nmatch * sizeof(coord_t*) * 4;
+
+    /* Building a table takes the table, a sorted copy and the sort
+       order */
+    build = 2.0 * TRIANGLE_TABLE_ROW_BYTES + sizeof(triangle_order_t);
+
+    /* The reference table is kept while the input table is built */
+    peak = tr * build;
+    stage = tr * TRIANGLE_TABLE_ROW_BYTES + ti * build;
+    peak = MAX(peak, stage);
+
+    /* Merging takes the index pairs, then the matched triangles */
+    stage = (tr + ti) * TRIANGLE_TABLE_ROW_BYTES +
+        tm * (sizeof(triangle_table_match_t) + sizeof(triangle_match_t) +
+              2 * sizeof(triangle_t) + sizeof(double));
+    peak = MAX(peak, stage);
+
+    /* Voting takes a matrix of the coordinates of the two lists */
+    stage = (tr + ti) * TRIANGLE_TABLE_ROW_BYTES +
+        tm * (sizeof(triangle_match_t) + 2 * sizeof(triangle_t)) +
+        (double)nr * (double)ni * sizeof(size_t);
+    peak = MAX(peak, stage);
+
+    peak += fixed;
+    estimate->peak_bytes = peak >= (double)((size_t)-1) ?
+        (size_t)-1 : (size_t)peak;
+
+    estimate->cost =
+        tr * (1.0 + log2(MAX(2.0, tr))) +
+        ti * (1.0 + log2(MAX(2.0, ti))) +
+        tm * (1.0 + log2(MAX(2.0, tm)));
+
+    return 0;
+}
+
+int
+limit_triangles_nmatch(
+        const size_t nref,
+        const size_t ninput,
+        const size_t nmatch,
+        const double maxratio,
+        const size_t memory_limit,
+        size_t* const nmatch_limited,
+        stimage_error_t* const error) {
+
+    triangles_estimate_t estimate;
+    size_t               lo, hi, mid;
+
+    assert(nmatch_limited);
+    assert(error);
+
+    *nmatch_limited = nmatch;
+    if (memory_limit == 0) {
+        return 0;
+    }
+
+    /* Leave the error for too few coordinates to match_triangles */
+    if (nmatch < 3 || nref < 3 || ninput < 3) {
+        return 0;
+    }
+
+    /* max_num_triangles does not allow 2346 coordinates or more */
+    hi = MIN(nmatch, MAX(nref, ninput));
+    hi = MIN(hi, 2345);
+
+    if (estimate_triangles(nref, ninput, hi, maxratio, &estimate, error)) {
+        return 1;
+    }
+    if (estimate.peak_bytes <= memory_limit) {
+        *nmatch_limited = (hi == 2345) ? hi : nmatch;
+        return 0;
+    }
+
+    if (estimate_triangles(nref, ninput, 3, maxratio, &estimate, error)) {
+        return 1;
+    }
+    if (estimate.peak_bytes > memory_limit) {
+        stimage_error_format_message(
+            error,
+            "memory_limit of %lu bytes is too small for triangle matching "
+            "(%lu bytes needed)", (unsigned long)memory_limit,
+            (unsigned long)estimate.peak_bytes);
+        return 1;
+    }
+
+    /* peak_bytes grows with nmatch, so bisect for the largest that
+       fits */
+    lo = 3;
+    while (lo < hi) {
+        mid = hi - (hi - lo) / 2;
+        if (estimate_triangles(nref, ninput, mid, maxratio, &estimate, error)) {
+            return 1;
+        }
+        if (estimate.peak_bytes <= memory_limit) {
+            lo = mid;
+        } else {
+            hi = mid - 1;
+        }
+    }
+
+    *nmatch_limited = lo;
+
+    return 0;
+}
+
+static int
+reject_triangles_compute_sigma_mode_factor(
+        const size_t nmatches,
+        const double* const diffp,
+        const double sum,
+        const double sumsq,
+        const size_t nfalse,
+        const size_t ntrue,
+        double* sigma,
+        double* mode,
+        double* factor) {
+
+    assert(diffp);
+    assert(sigma);
+    assert(mode);
+    assert(factor);
+
+    /* Compute the mean, mode, and sigma of the log-perimeter
+       distribution */
+    if (nmatches == 0) {
+        *sigma = 0.0;
+    } else {
+        *sigma = (sumsq - (sum / (double)(nmatches)) * sum) / ((double)(nmatches) - 1);
+    }
+
+    if (*sigma <= 0.0) {
+        return 1;
+    } else {
+        *sigma = sqrt(*sigma);
+    }
+
+    /* diffp is kept sorted by reject_triangles */
+    *mode = compute_mode(nmatches, diffp, 10, 1.0, 0.1 * *sigma, 0.01 * *sigma);
+
+    if (nfalse > ntrue) {
+        *factor = 1.0;
+    } else if ((0.1 * ntrue) > nfalse) {
+        *factor = 3.0;
+    } else {
+        *factor = 2.0;
+    }
+
+    return 0;
+}
+
+int
+reject_triangles(
+        size_t* nmatches,
+        triangle_match_t* const matches,
+        const size_t nreject,
+        workspace_t* const workspace,
+        stimage_error_t* error) {
+
+    size_t            i            = 0;
+    double            sum          = 0.0;
+    double            sumsq        = 0.0;
+    int               nplus        = 0;
+    int               nminus       = 0;
+    double            diff         = 0.0;
+    int               ntrue        = 0;
+    int               nfalse       = 0;
+    double            sigma        = 0.0;
+    double            mode         = 0.0;
+    double            factor       = 0.0;
+    double            locut        = 0.0;
+    double            hicut        = 0.0;
+    size_t            ncount       = 0;
+    size_t            ncurrmatches = *nmatches;
+    size_t            niter        = 0;
+    const triangle_t* r_tri        = NULL;
+    const triangle_t* l_tri        = NULL;
+    double*           diffp        = NULL;
+    size_t            lo           = 0;
+    size_t            end          = 0;
+    int               status       = 1;
+
+    assert(nmatches);
+    assert(matches);
+    assert(error);
+
+    diffp = workspace_alloc(workspace, ncurrmatches * sizeof(double), error);
+    if (diffp == NULL) goto exit;
+
+    /* Accumulate the number of same-sense and number of
+       opposite-sense matches as well as the log perimeter
+       statistics. */
+    for (i = 0; i < ncurrmatches; ++i) {
+        r_tri = matches[i].r;
+        l_tri = matches[i].l;
+
+        diff = r_tri->log_perimeter - l_tri->log_perimeter;
+        diffp[i] = diff;
+        sum += diff;
+        sumsq += diff*diff;
+        if (r_tri->sense == l_tri->sense) {
+            ++nplus;
+        }
+    }
+    nminus = (int)ncurrmatches - nplus;
+    ntrue = ABS(nplus - nminus);
+    nfalse = ncurrmatches - ntrue;
+
+    /* Sort by the diff of the log-perimeters.  This is only done once:
+       each rejection cycle keeps the values within a range, which are
+       a contiguous part of the sorted values, so diffp + lo always
+       holds the remaining ones in order. */
+    sort_doubles(ncurrmatches, diffp);
+
+    if (reject_triangles_compute_sigma_mode_factor(
+            ncurrmatches, diffp, sum, sumsq, nfalse, ntrue, &sigma, &mode, &factor)) {
+        status = 0;
+        goto exit;
+    }
+
+    /* Begin the rejection loop */
+    for (niter = 0; niter < nreject; ++niter) {
+        ncount = 0;
+        locut = mode - factor * sigma;
+        hicut = mode + factor * sigma;
+
+        for (i = 0; i < ncurrmatches; ++i) {
+            r_tri = matches[i].r;
+            l_tri = matches[i].l;
+            diff = r_tri->log_perimeter - l_tri->log_perimeter;
+            if (diff < locut || diff > hicut) {
+                sum -= diff;
+                sumsq -= diff*diff;
+                if (r_tri->sense == l_tri->sense) {
+                    --nplus;
+                } else {
+                    --nminus;
+                }
+            } else {
+                /* This starts writing non-rejected matches to the
+                   beginning of the list containing all matches */
+                #ifndef NDEBUG
+                    if (ncount >= *nmatches) {
+                        stimage_error_set_message(
+                            error,
+                            "Rejection created more matches than it started with.");
+                        goto exit;
+                    }
+                #endif
+                matches[ncount].r = r_tri;
+                matches[ncount].l = l_tri;
+                ++ncount;
+            }
+        }
+
+        /* NOTE: At this point matches[0 --- ncount] contains only
+           non-rejected matches.  matches[ncount --- ncurrmatches] is now
+           garbage.  */
+
+        /* No more triangles were rejected, or all the triangles were rejected */
+        if (ncurrmatches == ncount || ncount == 0) {
+            break;
+        }
+
+        /* Narrow the sorted values to the ones that were kept */
+        end = lo + ncurrmatches;
+        for ( ; lo < end && diffp[lo] < locut; ++lo) {
+            /* empty */
+        }
+        for ( ; end > lo && diffp[end - 1] > hicut; --end) {
+            /* empty */
+        }
+        assert(end - lo == ncount);
+
+        ncurrmatches = ncount;
+
+        /* Recompute sigma, mode and factor based on only non-rejected
+           values */
+        if (reject_triangles_compute_sigma_mode_factor(
+                ncurrmatches, diffp + lo, sum, sumsq, nfalse, ntrue, &sigma, &mode, &factor)) {
+            break;
+        }
+    };
+
+    /* One last time through loop to get rid of opposite sense of matches */
+    if (ncurrmatches > 0) {
+        if (nplus > nminus) {
+            ncount = 0;
+            for (i = 0; i < ncurrmatches; ++i) {
+                r_tri = matches[i].r;
+                l_tri = matches[i].l;
+                if (r_tri->sense == l_tri->sense) {
+                    matches[ncount].r = r_tri;
+                    matches[ncount].l = l_tri;
+                    ++ncount;
+                }
+            }
+            ncurrmatches = ncount;
+        } else {
+            ncount = 0;
+            for (i = 0; i < ncurrmatches; ++i) {
+                r_tri = matches[i].r;
+                l_tri = matches[i].l;
+                if (r_tri->sense != l_tri->sense) {
+                    matches[ncount].r = r_tri;
+                    matches[ncount].l = l_tri;
+                    ++ncount;
+                }
+            }
+            ncurrmatches = ncount;
+        }
+    }
+
+    *nmatches = ncurrmatches;
+
+    status = 0;
+
+ exit:
+
+    workspace_release(workspace, diffp);
+
+    return status;
+}
+
+/* Add the triangles whose last vertex is one of coords[nold] to
+   coords[ncoords - 1] to a table of triangles built by
+   find_triangle_table from the first nold coordinates, keeping it
+   sorted by ratio. */
+static int
+triangles_extend(
+        const size_t ncoords,
+        const coord_t* const * const coords,
+        const size_t nold,
+        triangle_table_t* const table,
+        const double tolerance,
+        const double maxratio,
+        const size_t nthreads,
+        stimage_error_t* const error) {
+
+    const size_t     nstart       = table->ntriangles;
+    size_t           maxtriangles = 0;
+    size_t           ntri;
+    size_t           a, b, out;
+    triangle_table_t added;
+    int              status       = 1;
+
+    triangle_table_init(&added);
+    added.workspace = table->workspace;
+
+    if (max_num_triangles(ncoords, ncoords, &maxtriangles, error) ||
+        triangles_build_rows(
+                ncoords, coords, 1, nold, 1, tolerance, maxratio,
+                nthreads, table, error)) {
+        goto exit;
+    }
+
+    ntri = table->ntriangles;
+    if (ntri == nstart) {
+        status = 0;
+        goto exit;
+    }
+
+    /* Sort the new triangles and merge them into the old ones from the
+       back */
+    if (triangle_table_sorted_copy(table, nstart, &added, error)) goto exit;
+
+    a = nstart;
+    b = added.ntriangles;
+    out = ntri;
+    while (b > 0) {
+        if (a > 0 && table->ratio[a - 1] > added.ratio[b - 1]) {
+            triangle_table_copy_row(table, --out, table, --a);
+        } else {
+            triangle_table_copy_row(table, --out, &added, --b);
+        }
+    }
+
+    status = 0;
+
+ exit:
+
+    triangle_table_free(&added);
+
+    return status;
+}
+
+/* The triangles built from the first npoints of a list of
+   coordinates.  The coordinates are copied into a contiguous array,
+   so that their positions in the list can be recovered from pointers
+   to them, as vote_triangle_matches does, and the set can be grown to
+   more of the coordinates without rebuilding the triangles it already
+   has.  All of its memory comes from table.workspace, unless the table
+   is borrowed from the caller of match_triangles, in which case it is
+   only read. */
+typedef struct {
+    size_t          ncoords;
+    coord_t*        coords;
+    const coord_t** list;
+    const coord_t** original;
+    size_t           npoints;
+    triangle_table_t table;
+    int              borrowed;
+} triangle_set_t;
+
+static void
+triangle_set_free(
+        triangle_set_t* const set) {
+
+    workspace_t* const workspace = set->table.workspace;
+
+    workspace_release(workspace, set->coords);
+    workspace_release(workspace, set->list);
+    workspace_release(workspace, set->original);
+    if (set->borrowed) {
+        triangle_table_init(&set->table);
+        set->table.workspace = workspace;
+        set->borrowed = 0;
+    } else {
+        triangle_table_free(&set->table);
+    }
+}
+
+/* Take the same coordinates from a list that find_triangles would use
+   with the given maxnpoints: every nsample'th one, up to maxnpoints of
+   them.  The set must be freed with triangle_set_free, even if an
+   error occurs. */
+static int
+triangle_set_init(
+        triangle_set_t* const set,
+        const size_t ncoords,
+        const coord_t* const * const coords,
+        const size_t maxnpoints,
+        workspace_t* const workspace,
+        stimage_error_t* const error) {
+
+    const size_t nsample = MAX(1, ncoords / MAX(1, maxnpoints));
+    const size_t npoints = MIN(ncoords, nsample * maxnpoints);
+    size_t       i, n;
+
+    memset(set, 0, sizeof(triangle_set_t));
+    set->table.workspace = workspace;
+
+    n = (npoints + nsample - 1) / nsample;
+    if (n == 0) {
+        return 0;
+    }
+
+    set->coords = workspace_alloc(workspace, n * sizeof(coord_t), error);
+    if (set->coords == NULL) return 1;
+    set->list = workspace_alloc(workspace, n * sizeof(coord_t*), error);
+    if (set->list == NULL) return 1;
+    set->original = workspace_alloc(workspace, n * sizeof(coord_t*), error);
+    if (set->original == NULL) return 1;
+
+    for (i = 0; i < n; ++i) {
+        set->coords[i] = *coords[i * nsample];
+        set->list[i] = &set->coords[i];
+        set->original[i] = coords[i * nsample];
+    }
+    set->ncoords = n;
+
+    return 0;
+}
+
+/* Build the triangles of the first npoints coordinates of the set,
+   reusing those it already has */
+static int
+triangle_set_grow(
+        triangle_set_t* const set,
+        size_t npoints,
+        const double tolerance,
+        const double maxratio,
+        const size_t nthreads,
+        stimage_error_t* const error) {
+
+    npoints = MIN(npoints, set->ncoords);
+    if (npoints < 3 || npoints <= set->npoints) {
+        return 0;
+    }
+
+    if (set->npoints == 0) {
+        if (find_triangle_table(
+                    npoints, set->list, npoints, tolerance, maxratio,
+                    nthreads, &set->table, error)) return 1;
+    } else if (triangles_extend(
+                       npoints, set->list, set->npoints, &set->table,
+                       tolerance, maxratio, nthreads, error)) {
+        return 1;
+    }
+
+    set->npoints = npoints;
+
+    return 0;
+}
+
+/* Use the triangles of a table built by find_reference_triangle_table
+   for a set, after checking that its vertices are in the set */
+static int
+triangle_set_borrow(
+        triangle_set_t* const set,
+        const triangle_table_t* const table,
+        stimage_error_t* const error) {
+
+    workspace_t* workspace;
+    size_t       i;
+
+    for (i = 0; i < 3 * table->ntriangles; ++i) {
+        if (table->vertices[i] >= set->ncoords) {
+            stimage_error_set_message(
+                error,
+                "The reference triangles were not built from these "
+                "reference coordinates");
+            return 1;
+        }
+    }
+
+    workspace = set->table.workspace;
+    set->table = *table;
+    set->table.workspace = workspace;
+    set->npoints = set->ncoords;
+    set->borrowed = 1;
+
+    return 0;
+}
+
+/* Build the sets of triangles for the whole of two lists, subsampled
+   to nmatch coordinates each.  If ref_table is not NULL, the reference
+   triangles are taken from it instead.  The sets must be freed with
+   triangle_set_free, even if an error occurs. */
+static int
+triangles_build_sets(
+        const size_t nref,
+        const coord_t* const * const ref_sorted,
+        const size_t ninput,
+        const coord_t* const * const input_sorted,
+        const size_t nmatch,
+        const double tolerance,
+        const double maxratio,
+        const triangle_table_t* const ref_table,
+        const size_t nthreads,
+        workspace_t* const workspace,
+        triangle_set_t* const ref_set,
+        triangle_set_t* const input_set,
+        stimage_error_t* const error) {
+
+    memset(ref_set, 0, sizeof(triangle_set_t));
+    memset(input_set, 0, sizeof(triangle_set_t));
+
+    if (nref < 3) {
+        stimage_error_set_message(
+            error,
+            "Too few reference coordinates to do triangle matching");
+        return 1;
+    }
+
+    if (ninput < 3) {
+        stimage_error_set_message(
+            error,
+            "Too few input coordinates to do triangle matching");
+        return 1;
+    }
+
+    /* Find all the reference triangles */
+    if (triangle_set_init(
+                ref_set, nref, ref_sorted, nmatch, workspace, error)) {
+        return 1;
+    }
+    if (ref_table != NULL) {
+        if (triangle_set_borrow(ref_set, ref_table, error)) return 1;
+    } else if (triangle_set_grow(
+                       ref_set, ref_set->ncoords, tolerance, maxratio,
+                       nthreads, error)) {
+        return 1;
+    }
+
+    if (ref_set->table.ntriangles == 0) {
+        stimage_error_set_message(
+            error,
+            "No valid reference triangles found.");
+        return 1;
+    }
+
+    /* Find all the input triangles */
+    if (triangle_set_init(
+                input_set, ninput, input_sorted, nmatch, workspace, error) ||
+        triangle_set_grow(
+                input_set, input_set->ncoords, tolerance, maxratio, nthreads,
+                error)) {
+        return 1;
+    }
+
+    if (input_set->table.ntriangles == 0) {
+        stimage_error_set_message(
+            error,
+            "No valid input triangles found.");
+        return 1;
+    }
+
+    return 0;
+}
+
+int
+find_reference_triangle_table(
+        const size_t nref_unique,
+        const coord_t* const * const ref_sorted,
+        const size_t nmatch,
+        const double tolerance,
+        const double maxratio,
+        const size_t nthreads,
+        triangle_table_t* const table,
+        stimage_error_t* const error) {
+
+    triangle_set_t set;
+    int            status = 1;
+
+    assert(ref_sorted || nref_unique == 0);
+    assert(table);
+    assert(error);
+
+    /* select_triangle_points keeps the whole list for
+       triangles_select_sample, so the set is built from ref_sorted as
+       it is */
+    if (triangle_set_init(
+                &set, nref_unique, ref_sorted, nmatch, table->workspace,
+                error) ||
+        triangle_set_grow(
+                &set, set.ncoords, tolerance, maxratio, nthreads,
+                error)) goto exit;
+
+    triangle_table_free(table);
+    *table = set.table;
+    triangle_table_init(&set.table);
+    set.table.workspace = table->workspace;
+
+    status = 0;
+
+ exit:
+
+    triangle_set_free(&set);
+
+    return status;
+}
+
+/* Match the triangles of two sets.  Only the triangles that match are
+   expanded into triangle_t structs, in *triangles, for reject_triangles
+   and vote_triangle_matches.  The caller must release
+   *triangle_matches and *triangles to the workspace of ref_set, even
+   if an error occurs.  The l member of each
+   triangle match is an input triangle if *input_is_left is non-zero,
+   otherwise a reference triangle. */
+static int
+triangles_merge_sets(
+        const triangle_set_t* const ref_set,
+        const triangle_set_t* const input_set,
+        const size_t nthreads,
+        size_t* const ntriangle_matches,
+        triangle_match_t** const triangle_matches,
+        triangle_t** const triangles,
+        int* const input_is_left,
+        stimage_error_t* const error) {
+
+    workspace_t* const      ws     = ref_set->table.workspace;
+    const triangle_set_t*   r_set  = NULL;
+    const triangle_set_t*   l_set  = NULL;
+    triangle_table_match_t* pairs  = NULL;
+    size_t                  i;
+    int                     status = 1;
+
+    *triangle_matches = NULL;
+    *triangles = NULL;
+
+    /* Match the triangles in the larger list to those in the smaller
+       one.  Each triangle of the smaller list matches at most once. */
+    *input_is_left = (ref_set->table.ntriangles <= input_set->table.ntriangles);
+    if (*input_is_left) {
+        r_set = ref_set;
+        l_set = input_set;
+    } else {
+        r_set = input_set;
+        l_set = ref_set;
+    }
+
+    *ntriangle_matches = MAX(1, r_set->table.ntriangles);
+    pairs = workspace_alloc(
+        ws, *ntriangle_matches * sizeof(triangle_table_match_t), error);
+    if (pairs == NULL) goto exit;
+
+    if (merge_triangle_tables(
+                &r_set->table, &l_set->table, nthreads,
+                ntriangle_matches, pairs, error)) goto exit;
+
+    *triangle_matches = workspace_alloc(
+        ws, MAX(1, *ntriangle_matches) * sizeof(triangle_match_t), error);
+    if (*triangle_matches == NULL) goto exit;
+    *triangles = workspace_alloc(
+        ws, MAX(1, 2 * *ntriangle_matches) * sizeof(triangle_t), error);
+    if (*triangles == NULL) goto exit;
+
+    for (i = 0; i < *ntriangle_matches; ++i) {
+        triangle_table_get(
+                &l_set->table, pairs[i].l, l_set->list, &(*triangles)[2 * i]);
+        triangle_table_get(
+                &r_set->table, pairs[i].r, r_set->list, &(*triangles)[2 * i + 1]);
+        (*triangle_matches)[i].l = &(*triangles)[2 * i];
+        (*triangle_matches)[i].r = &(*triangles)[2 * i + 1];
+    }
+
+    status = 0;
+
+ exit:
+
+    workspace_release(ws, pairs);
+
+    return status;
+}
+
+/* Match the coordinates of two sets of triangles by merging the
+   triangles, rejecting false triangle matches and voting.  The
+   coordinate pairs found are stored as the original pointers the sets
+   were built from. */
+static int
+triangles_vote_sets(
+        const triangle_set_t* const ref_set,
+        const triangle_set_t* const input_set,
+        const size_t nreject,
+        const size_t nthreads,
+        size_t* ncoord_matches,
+        const coord_t** refcoord_matches_,
+        const coord_t** inputcoord_matches_,
+        size_t* nkeep,
+        size_t* nmerge,
+        stimage_error_t* const error) {
+
+    const coord_t**   refcoord_matches   = NULL;
+    const coord_t**   inputcoord_matches = NULL;
+    size_t            nleft              = 0;
+    const coord_t*    left               = NULL;
+    size_t            nright             = 0;
+    const coord_t*    right              = NULL;
+    size_t            ntriangle_matches  = 0;
+    triangle_match_t* triangle_matches   = NULL;
+    triangle_t*       triangles          = NULL;
+    int               input_is_left      = 0;
+    size_t            i;
+    int               status             = 1;
+
+    if (triangles_merge_sets(
+                ref_set, input_set, nthreads,
+                &ntriangle_matches, &triangle_matches, &triangles,
+                &input_is_left, error)) goto exit;
+
+    if (input_is_left) {
+        refcoord_matches = inputcoord_matches_;
+        inputcoord_matches = refcoord_matches_;
+        nleft = input_set->npoints;
+        left = input_set->coords;
+        nright = ref_set->npoints;
+        right = ref_set->coords;
+    } else {
+        refcoord_matches = refcoord_matches_;
+        inputcoord_matches = inputcoord_matches_;
+        nleft = ref_set->npoints;
+        left = ref_set->coords;
+        nright = input_set->npoints;
+        right = input_set->coords;
+    }
+
+    *nmerge = ntriangle_matches;
+
+    if (ntriangle_matches == 0) {
+        *ncoord_matches = 0;
+        status = 0;
+        goto exit;
+    }
+
+    /* Reject triangles */
+    if (reject_triangles(&ntriangle_matches, triangle_matches,
+                         nreject, ref_set->table.workspace,
+                         error)) {
+        goto exit;
+    }
+
+    *nkeep = ntriangle_matches;
+
+    if (ntriangle_matches == 0) {
+        *ncoord_matches = 0;
+        status = 0;
+        goto exit;
+    }
+
+    /* Match the coordinates */
+    if (vote_triangle_matches(
+                nleft, left, nright, right,
+                ntriangle_matches, triangle_matches,
+                ncoord_matches, refcoord_matches, inputcoord_matches,
+                error)) {
+        goto exit;
+    }
+
+    /* Map the copies back to the original coordinates */
+    for (i = 0; i < *ncoord_matches; ++i) {
+        refcoord_matches_[i] =
+            ref_set->original[refcoord_matches_[i] - ref_set->coords];
+        inputcoord_matches_[i] =
+            input_set->original[inputcoord_matches_[i] - input_set->coords];
+    }
+
+    status = 0;
+
+ exit:
+
+    workspace_release(ref_set->table.workspace, triangle_matches);
+    workspace_release(ref_set->table.workspace, triangles);
+
+    return status;
+}
+
+/* The coordinate pairs found are stored in refcoord_matches_ and
+   inputcoord_matches_ as pointers into the same arrays that ref_sorted
+   and input_sorted point into.  They may be the same arrays as
+   ref_sorted and input_sorted. */
+static int
+_match_triangles(
+        const size_t nref,
+        const coord_t* const * const ref_sorted, /*[nref]*/
+        const size_t ninput,
+        const coord_t* const * const input_sorted,
+        size_t* ncoord_matches,
+        const coord_t** refcoord_matches_,
+        const coord_t** inputcoord_matches_,
+        const size_t nmatch,
+        const double tolerance,
+        const double maxratio,
+        const size_t nreject,
+        const triangle_table_t* const ref_table,
+        const size_t nthreads,
+        workspace_t* const workspace,
+        size_t* nkeep,
+        size_t* nmerge,
+        stimage_error_t* const error) {
+
+    workspace_mark_t mark   = workspace_mark(workspace);
+    triangle_set_t   ref_set;
+    triangle_set_t   input_set;
+    int              status = 1;
+
+    assert(ref_sorted);
+    assert(input_sorted);
+    assert(ncoord_matches);
+    assert(refcoord_matches_);
+    assert(inputcoord_matches_);
+    assert(nkeep);
+    assert(nmerge);
+    assert(error);
+
+    if (triangles_build_sets(
+                nref, ref_sorted, ninput, input_sorted,
+                nmatch, tolerance, maxratio, ref_table, nthreads, workspace,
+                &ref_set, &input_set, error)) goto exit;
+
+    if (triangles_vote_sets(
+                &ref_set, &input_set, nreject, nthreads,
+                ncoord_matches, refcoord_matches_, inputcoord_matches_,
+                nkeep, nmerge, error)) goto exit;
+
+    status = 0;
+
+ exit:
+
+    triangle_set_free(&ref_set);
+    triangle_set_free(&input_set);
+    workspace_rewind(workspace, mark);
+
+    return status;
+}
+
+/* Decide whether the coordinate pairs voted for are true matches, as
+   Groth does.  If they are not, *ncoord_matches is set to zero.
+   npoints is the number of coordinates the triangles were built
+   from. */
+static int
+triangles_confirm(
+        const size_t npoints,
+        size_t* const ncoord_matches,
+        const coord_t** const refcoord_matches,
+        const coord_t** const inputcoord_matches,
+        const size_t nkeep,
+        const size_t nmerge,
+        const double tolerance,
+        const double maxratio,
+        const size_t nreject,
+        const size_t nthreads,
+        workspace_t* const workspace,
+        stimage_error_t* const error) {
+
+    size_t ncheck       = 0;
+    size_t check_nkeep  = 0;
+    size_t check_nmerge = 0;
+
+    if (*ncoord_matches == 0 || (*ncoord_matches <= 3 && nkeep < nmerge)) {
+        *ncoord_matches = 0;
+        return 0;
+    }
+
+    /* If all the coordinates were not matched then make another pass
+       through the triangles matching algorithm. If the number of
+       matches decreases as a result of this then all the matches were
+       not true matches and declare the list unmatched. */
+    if (*ncoord_matches < npoints && *ncoord_matches > 2) {
+        ncheck = *ncoord_matches;
+        if (_match_triangles(
+                ncheck, refcoord_matches,
+                ncheck, inputcoord_matches,
+                ncoord_matches, refcoord_matches, inputcoord_matches,
+                npoints, tolerance, maxratio, nreject, NULL, nthreads,
+                workspace, &check_nkeep, &check_nmerge, error)) return 1;
+
+        if (*ncoord_matches < ncheck) {
+            *ncoord_matches = 0;
+        }
+    }
+
+    return 0;
+}
+
+/* Draw the triangle matches in a fixed pseudo-random order, and
+   return the first similarity transformation that passes
+   verification.  The order visits every match once: it steps through
+   them with a stride that is coprime to their number. */
+static int
+triangles_ransac(
+        const verify_index_t* const index,
+        const size_t ninput,
+        const coord_t* const * const input_sorted,
+        const size_t ntriangle_matches,
+        const triangle_match_t* const triangle_matches,
+        const int input_is_left,
+        const double tolerance,
+        similarity_t* const solution) {
+
+    const size_t          nhypotheses = MIN(
+            ntriangle_matches, TRIANGLES_MAX_HYPOTHESES);
+    size_t                stride;
+    size_t                a, b, tmp;
+    size_t                i, k;
+    const triangle_t*     in_tri;
+    const triangle_t*     ref_tri;
+    similarity_t          t;
+
+    /* Start near the golden ratio, which spreads the draws evenly */
+    stride = (size_t)(0.6180339887 * (double)ntriangle_matches) + 1;
+    for (;; ++stride) {
+        a = stride;
+        b = ntriangle_matches;
+        while (b != 0) {
+            tmp = a % b;
+            a = b;
+            b = tmp;
+        }
+        if (a == 1) {
+            break;
+        }
+    }
+
+    for (i = 0, k = 0; i < nhypotheses; ++i) {
+        if (input_is_left) {
+            in_tri = triangle_matches[k].l;
+            ref_tri = triangle_matches[k].r;
+        } else {
+            in_tri = triangle_matches[k].r;
+            ref_tri = triangle_matches[k].l;
+        }
+        k = (k + stride) % ntriangle_matches;
+
+        /* Vertices 1 and 3 are the ends of the longest side */
+        if (!similarity_from_pairs(
+                    in_tri->vertices[0], in_tri->vertices[2],
+                    ref_tri->vertices[0], ref_tri->vertices[2],
+                    (in_tri->sense == ref_tri->sense) ? 1.0 : -1.0,
+                    &t)) {
+            continue;
+        }
+
+        if (verify_similarity(index, ninput, input_sorted, &t, tolerance)) {
+            *solution = t;
+            return 1;
+        }
+    }
+
+    return 0;
+}
+
+/* Look for a similarity transformation among the triangle matches of
+   two sets.  *found is set to non-zero if one was accepted. */
+static int
+triangles_ransac_sets(
+        const verify_index_t* const index,
+        const size_t ninput,
+        const coord_t* const * const input_sorted,
+        const triangle_set_t* const ref_set,
+        const triangle_set_t* const input_set,
+        const double tolerance,
+        const size_t nthreads,
+        similarity_t* const solution,
+        int* const found,
+        stimage_error_t* const error) {
+
+    size_t            ntriangle_matches = 0;
+    triangle_match_t* triangle_matches  = NULL;
+    triangle_t*       triangles         = NULL;
+    int               input_is_left     = 0;
+    int               status            = 1;
+
+    *found = 0;
+
+    if (triangles_merge_sets(
+                ref_set, input_set, nthreads,
+                &ntriangle_matches, &triangle_matches, &triangles,
+                &input_is_left, error)) goto exit;
+
+    *found = (ntriangle_matches > 0 &&
+              triangles_ransac(
+                      index, ninput, input_sorted,
+                      ntriangle_matches, triangle_matches, input_is_left,
+                      tolerance, solution));
+
+    status = 0;
+
+ exit:
+
+    workspace_release(ref_set->table.workspace, triangle_matches);
+    workspace_release(ref_set->table.workspace, triangles);
+
+    return status;
+}
+
+/* Refine a similarity transformation found by RANSAC with all of the
+   matches it gives, and use it to match the whole lists */
+static int
+triangles_match_similarity(
+        const verify_index_t* const index,
+        const coord_t* const ref,
+        const size_t ninput,
+        const coord_t* const input,
+        const coord_t* const * const input_sorted,
+        similarity_t solution,
+        const double tolerance,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error) {
+
+    coord_match_t* pairs  = NULL;
+    coord_t*       moved  = NULL;
+    size_t         npairs, i;
+    int            status = 1;
 
-        /* No more triangles were rejected, or all the triangles were rejected */
-        if (ncurrmatches == ncount || ncount == 0) {
-            break;
-        }
+    pairs = malloc_with_error(ninput * sizeof(coord_match_t), error);
+    if (pairs == NULL) goto exit;
 
-        ncurrmatches = ncount;
+    for (i = 0; i < 2; ++i) {
+        npairs = verify_count_matches(
+                index, ninput, input_sorted, 1, &solution, tolerance, pairs);
+        similarity_fit(npairs, pairs, &solution);
+    }
 
-        /* Recompute sigma, mode and factor based on only non-rejected
-           values */
-        if (reject_triangles_compute_sigma_mode_factor(
-                ncurrmatches, diffp, sum, sumsq, nfalse, ntrue, &sigma, &mode, &factor)) {
-            break;
-        }
-    };
+    moved = malloc_with_error(ninput * sizeof(coord_t), error);
+    if (moved == NULL) goto exit;
 
-    /* One last time through loop to get rid of opposite sense of matches */
-    if (ncurrmatches > 0) {
-        if (nplus > nminus) {
-            ncount = 0;
-            for (i = 0; i < ncurrmatches; ++i) {
-                r_tri = matches[i].r;
-                l_tri = matches[i].l;
-                if (r_tri->sense == l_tri->sense) {
-                    matches[ncount].r = r_tri;
-                    matches[ncount].l = l_tri;
-                    ++ncount;
-                }
-            }
-            ncurrmatches = ncount;
-        } else {
-            ncount = 0;
-            for (i = 0; i < ncurrmatches; ++i) {
-                r_tri = matches[i].r;
-                l_tri = matches[i].l;
-                if (r_tri->sense != l_tri->sense) {
-                    matches[ncount].r = r_tri;
-                    matches[ncount].l = l_tri;
-                    ++ncount;
-                }
-            }
-            ncurrmatches = ncount;
-        }
+    for (i = 0; i < ninput; ++i) {
+        similarity_apply(&solution, input_sorted[i], &moved[i]);
     }
 
-    *nmatches = ncurrmatches;
+    if (match_tolerance_moved(
+                index->ncoords, ref, index->coords,
+                ninput, input, input_sorted, moved,
+                tolerance,
+                callback, callback_data,
+                error)) goto exit;
 
     status = 0;
 
  exit:
 
-    free(diffp);
+    free(pairs);
+    free(moved);
 
     return status;
 }
 
+/* The triangles are built from ref_select and input_select, but
+   transformations are verified against, and used to match, the whole
+   of ref_sorted and input_sorted */
 static int
-_match_triangles(
+match_triangles_ransac(
         const size_t nref,
         const coord_t* const ref,
-        const coord_t* const * const ref_sorted, /*[nref]*/
+        const coord_t* const * const ref_sorted,
         const size_t ninput,
-        const coord_t* const input, /*[ninput]*/
+        const coord_t* const input,
         const coord_t* const * const input_sorted,
-        size_t* ncoord_matches,
-        const coord_t** refcoord_matches_,
-        const coord_t** inputcoord_matches_,
+        const size_t nref_select,
+        const coord_t* const * const ref_select,
+        const size_t ninput_select,
+        const coord_t* const * const input_select,
         const size_t nmatch,
         const double tolerance,
         const double maxratio,
-        const size_t nreject,
-        size_t* nkeep,
-        size_t* nmerge,
+        const triangle_table_t* const ref_table,
+        const size_t nthreads,
+        workspace_t* const workspace,
+        coord_match_callback_t* callback,
+        void* callback_data,
         stimage_error_t* const error) {
 
-    const coord_t**   refcoord_matches   = NULL;
-    const coord_t**   inputcoord_matches = NULL;
-    size_t            nleft              = 0;
-    const coord_t*    left               = NULL;
-    size_t            nright             = 0;
-    const coord_t*    right              = NULL;
-    size_t            nref_triangles     = 0;
-    triangle_t*       ref_triangles      = NULL;
-    size_t            ninput_triangles   = 0;
-    triangle_t*       input_triangles    = NULL;
-    size_t            ntriangle_matches  = 0;
-    triangle_match_t* triangle_matches   = NULL;
-    int               status             = 1;
+    triangle_set_t ref_set;
+    triangle_set_t input_set;
+    verify_index_t index;
+    similarity_t   solution;
+    int            found  = 0;
+    int            status = 1;
 
-    assert(ref);
-    assert(ref_sorted);
-    assert(input);
-    assert(input_sorted);
-    assert(ncoord_matches);
-    assert(refcoord_matches_);
-    assert(inputcoord_matches_);
-    assert(nkeep);
-    assert(nmerge);
-    assert(error);
+    if (triangles_build_sets(
+                nref_select, ref_select, ninput_select, input_select,
+                nmatch, tolerance, maxratio, ref_table, nthreads, workspace,
+                &ref_set, &input_set, error)) goto exit;
 
-    if (nref < 3) {
-        stimage_error_set_message(
-            error,
-            "Too few reference coordinates to do triangle matching");
-        goto exit;
+    verify_index_init(&index, nref, ref_sorted, tolerance);
+
+    if (triangles_ransac_sets(
+                &index, ninput, input_sorted, &ref_set, &input_set,
+                tolerance, nthreads, &solution, &found, error)) goto exit;
+
+    if (found &&
+        triangles_match_similarity(
+                &index, ref, ninput, input, input_sorted, solution,
+                tolerance, callback, callback_data, error)) goto exit;
+
+    status = 0;
+
+ exit:
+
+    triangle_set_free(&ref_set);
+    triangle_set_free(&input_set);
+
+    return status;
+}
+
+/* Is every pair in (ref0, input0) also in (ref1, input1)? */
+static int
+triangles_pairs_contained(
+        const size_t n0,
+        const coord_t* const * const ref0,
+        const coord_t* const * const input0,
+        const size_t n1,
+        const coord_t* const * const ref1,
+        const coord_t* const * const input1) {
+
+    size_t i, j;
+
+    for (i = 0; i < n0; ++i) {
+        for (j = 0; j < n1; ++j) {
+            if (ref0[i] == ref1[j] && input0[i] == input1[j]) {
+                break;
+            }
+        }
+        if (j == n1) {
+            return 0;
+        }
     }
 
-    if (ninput < 3) {
-        stimage_error_set_message(
-            error,
-            "Too few input coordinates to do triangle matching");
-        goto exit;
+    return 1;
+}
+
+/* Build a triangle set from the nmatch best coordinates of a list, in
+   order of preference */
+static int
+triangles_ranked_set(
+        const size_t ncoords,
+        const coord_t* const * const coords,
+        const coord_t* const base,
+        const double* const weights,
+        const triangles_select_e select,
+        const size_t nmatch,
+        triangle_set_t* const set,
+        stimage_error_t* const error) {
+
+    triangle_point_t* points = NULL;
+    const coord_t**   ranked = NULL;
+    const size_t      n      = MIN(ncoords, nmatch);
+    size_t            i;
+    int               status = 1;
+
+    memset(set, 0, sizeof(triangle_set_t));
+
+    points = malloc_with_error(
+            MAX(1, ncoords) * sizeof(triangle_point_t), error);
+    if (points == NULL) goto exit;
+    ranked = malloc_with_error(MAX(1, n) * sizeof(coord_t*), error);
+    if (ranked == NULL) goto exit;
+
+    triangles_rank_points(
+            ncoords, coords, base, weights, select, nmatch, points);
+    for (i = 0; i < n; ++i) {
+        ranked[i] = coords[points[i].index];
     }
 
-    /* Find all the reference triangles */
-    if (max_num_triangles(nref, nmatch, &nref_triangles, error)) goto exit;
+    if (triangle_set_init(set, n, ranked, n, NULL, error)) goto exit;
 
-    ref_triangles = malloc_with_error(
-            nref_triangles * sizeof(triangle_t), error);
-    if (ref_triangles == NULL) goto exit;
+    status = 0;
 
-    if (find_triangles(nref, ref_sorted, &nref_triangles, ref_triangles,
-                       nmatch, tolerance, maxratio, error)) goto exit;
+ exit:
 
-    if (nref_triangles == 0) {
-        stimage_error_set_message(
-            error,
-            "No valid reference triangles found.");
-        goto exit;
+    free(points);
+    free(ranked);
+
+    return status;
+}
+
+/* Fit a similarity transformation to the pairs found by voting.  The
+   vote does not tell whether the input is flipped, so both parities
+   are fit, and the one that matches more coordinates is kept. */
+static int
+triangles_fit_pairs(
+        const verify_index_t* const index,
+        const size_t ninput,
+        const coord_t* const * const input_sorted,
+        const size_t npairs,
+        const coord_t* const * const ref_matches,
+        const coord_t* const * const input_matches,
+        const double tolerance,
+        similarity_t* const solution,
+        size_t* const nmatched,
+        stimage_error_t* const error) {
+
+    coord_match_t* pairs   = NULL;
+    similarity_t   flipped;
+    size_t         nflipped;
+    size_t         i;
+    int            status  = 1;
+
+    pairs = malloc_with_error(MAX(1, npairs) * sizeof(coord_match_t), error);
+    if (pairs == NULL) goto exit;
+
+    for (i = 0; i < npairs; ++i) {
+        pairs[i].l = ref_matches[i];
+        pairs[i].r = input_matches[i];
     }
 
-    /* Find all the input triangles */
-    if (max_num_triangles(ninput, nmatch, &ninput_triangles, error)) goto exit;
+    memset(solution, 0, sizeof(similarity_t));
+    memset(&flipped, 0, sizeof(similarity_t));
+    solution->parity = 1.0;
+    flipped.parity = -1.0;
+    similarity_fit(npairs, pairs, solution);
+    similarity_fit(npairs, pairs, &flipped);
+
+    *nmatched = verify_count_matches(
+            index, ninput, input_sorted, 1, solution, tolerance, NULL);
+    nflipped = verify_count_matches(
+            index, ninput, input_sorted, 1, &flipped, tolerance, NULL);
+    if (nflipped > *nmatched) {
+        *solution = flipped;
+        *nmatched = nflipped;
+    }
+
+    status = 0;
+
+ exit:
+
+    free(pairs);
+
+    return status;
+}
+
+/* Start from a few coordinates of each list and double the number
+   until a match is found and confirmed, or nmatch is reached.  The
+   triangles of the smaller lists are kept, and only the triangles
+   involving the new coordinates are built at each step.  A match
+   found by voting before nmatch is reached only pairs up the few
+   coordinates it was found with, so the whole lists are then matched
+   with the transformation it implies. */
+static int
+match_triangles_adaptive(
+        const size_t nref,
+        const coord_t* const ref,
+        const coord_t* const * const ref_sorted,
+        const size_t ninput,
+        const coord_t* const input,
+        const coord_t* const * const input_sorted,
+        const size_t nmatch,
+        const double tolerance,
+        const double maxratio,
+        const size_t nreject,
+        const triangles_verify_e verify,
+        const triangles_select_e select,
+        const double* const ref_weights,
+        const double* const input_weights,
+        const size_t nthreads,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error) {
+
+    triangle_set_t  ref_set;
+    triangle_set_t  input_set;
+    verify_index_t  index;
+    similarity_t    solution;
+    int             found              = 0;
+    int             stable             = 0;
+    size_t          nstable            = 0;
+    size_t          nmatched           = 0;
+    size_t          nmax               = 0;
+    size_t          npoints            = 0;
+    size_t          ncoord_matches     = 0;
+    const coord_t** refcoord_matches   = NULL;
+    const coord_t** inputcoord_matches = NULL;
+    size_t          nprev              = 0;
+    const coord_t** ref_prev           = NULL;
+    const coord_t** input_prev         = NULL;
+    size_t          nkeep              = 0;
+    size_t          nmerge             = 0;
+    size_t          i;
+    int             status             = 1;
 
-    input_triangles = malloc_with_error(
-            ninput_triangles * sizeof(triangle_t), error);
-    if (input_triangles == NULL) goto exit;
+    memset(&input_set, 0, sizeof(triangle_set_t));
 
-    if (find_triangles(ninput, input_sorted, &ninput_triangles,
-                       input_triangles, nmatch, tolerance, maxratio,
-                       error)) goto exit;
+    if (triangles_ranked_set(
+                nref, ref_sorted, ref, ref_weights, select, nmatch,
+                &ref_set, error) ||
+        triangles_ranked_set(
+                ninput, input_sorted, input, input_weights, select, nmatch,
+                &input_set, error)) goto exit;
 
-    if (ninput_triangles == 0) {
+    if (ref_set.ncoords < 3) {
         stimage_error_set_message(
             error,
-            "No valid input triangles found.");
+            "Too few reference coordinates to do triangle matching");
         goto exit;
     }
 
-    ntriangle_matches = MAX(nref_triangles, ninput_triangles);
-    triangle_matches = malloc_with_error(
-        ntriangle_matches * sizeof(triangle_match_t), error);
-    if (triangle_matches == NULL) goto exit;
+    if (input_set.ncoords < 3) {
+        stimage_error_set_message(
+            error,
+            "Too few input coordinates to do triangle matching");
+        goto exit;
+    }
 
-    /* Match the triangles in the input list to those in the reference
-       list */
-    if (nref_triangles <= ninput_triangles) {
-        refcoord_matches = inputcoord_matches_;
-        inputcoord_matches = refcoord_matches_;
-        nleft = ninput;
-        left = input;
-        nright = nref;
-        right = ref;
-        if (merge_triangles(
-                nref_triangles, ref_triangles,
-                ninput_triangles, input_triangles,
-                &ntriangle_matches, triangle_matches,
-                error)) goto exit;
-    } else {
-        refcoord_matches = refcoord_matches_;
-        inputcoord_matches = inputcoord_matches_;
-        nleft = nref;
-        left = ref;
-        nright = ninput;
-        right = input;
-        if (merge_triangles(
-                ninput_triangles, input_triangles,
-                nref_triangles, ref_triangles,
-                &ntriangle_matches, triangle_matches,
-                error)) goto exit;
+    verify_index_init(&index, nref, ref_sorted, tolerance);
+
+    if (verify != triangles_verify_ransac) {
+        refcoord_matches = malloc_with_error(nmatch * sizeof(coord_t*), error);
+        if (refcoord_matches == NULL) goto exit;
+        inputcoord_matches = malloc_with_error(nmatch * sizeof(coord_t*), error);
+        if (inputcoord_matches == NULL) goto exit;
+        ref_prev = malloc_with_error(nmatch * sizeof(coord_t*), error);
+        if (ref_prev == NULL) goto exit;
+        input_prev = malloc_with_error(nmatch * sizeof(coord_t*), error);
+        if (input_prev == NULL) goto exit;
     }
 
-    *nmerge = ntriangle_matches;
+    nmax = MAX(ref_set.ncoords, input_set.ncoords);
+    for (npoints = MIN(TRIANGLES_ADAPTIVE_START, nmax); ;
+         npoints = MIN(2 * npoints, nmax)) {
+        if (triangle_set_grow(
+                    &ref_set, npoints, tolerance, maxratio, nthreads,
+                    error) ||
+            triangle_set_grow(
+                    &input_set, npoints, tolerance, maxratio, nthreads,
+                    error)) {
+            goto exit;
+        }
 
-    if (ntriangle_matches == 0) {
-        status = 0;
-        goto exit;
-    }
+        if (ref_set.table.ntriangles > 0 && input_set.table.ntriangles > 0) {
+            if (verify == triangles_verify_ransac) {
+                if (triangles_ransac_sets(
+                            &index, ninput, input_sorted,
+                            &ref_set, &input_set, tolerance, nthreads,
+                            &solution, &found, error)) goto exit;
+                if (found) {
+                    break;
+                }
+            } else {
+                ncoord_matches = nmatch;
+                if (triangles_vote_sets(
+                            &ref_set, &input_set, nreject, nthreads,
+                            &ncoord_matches, refcoord_matches,
+                            inputcoord_matches, &nkeep, &nmerge,
+                            error) ||
+                    triangles_confirm(
+                            MIN(ref_set.npoints, input_set.npoints),
+                            &ncoord_matches, refcoord_matches,
+                            inputcoord_matches, nkeep, nmerge,
+                            tolerance, maxratio, nreject, nthreads, NULL,
+                            error)) goto exit;
+
+                /* The match is stable once it has kept all the pairs
+                   found with fewer coordinates over several steps in
+                   a row */
+                if (ncoord_matches >= TRIANGLES_ADAPTIVE_MIN_MATCHES &&
+                    nprev > 0 &&
+                    triangles_pairs_contained(
+                            nprev, ref_prev, input_prev,
+                            ncoord_matches, refcoord_matches,
+                            inputcoord_matches)) {
+                    ++nstable;
+                } else {
+                    nstable = 0;
+                }
 
-    /* Reject triangles */
-    if (reject_triangles(&ntriangle_matches, triangle_matches,
-                         nreject,
-                         error)) {
-        goto exit;
-    }
+                if (nstable >= TRIANGLES_ADAPTIVE_STABLE_STEPS) {
+                    stable = 1;
+                    break;
+                }
 
-    *nkeep = ntriangle_matches;
+                nprev = ncoord_matches;
+                for (i = 0; i < nprev; ++i) {
+                    ref_prev[i] = refcoord_matches[i];
+                    input_prev[i] = inputcoord_matches[i];
+                }
+            }
+        }
 
-    if (ntriangle_matches == 0) {
-        *ncoord_matches = 0;
-        status = 0;
-        goto exit;
+        if (npoints >= nmax) {
+            break;
+        }
     }
 
-    /* Match the coordinates */
-    if (vote_triangle_matches(
-                nleft, left, nright, right,
-                ntriangle_matches, triangle_matches,
-                ncoord_matches, refcoord_matches, inputcoord_matches,
-                error)) {
-        goto exit;
+    if (verify == triangles_verify_ransac) {
+        if (found &&
+            triangles_match_similarity(
+                    &index, ref, ninput, input, input_sorted, solution,
+                    tolerance, callback, callback_data, error)) goto exit;
+    } else {
+        /* Match the whole lists with the full tolerance, unless the
+           transformation does not even explain the pairs of the vote,
+           e.g. because the lists are not related by a similarity */
+        if (stable) {
+            if (triangles_fit_pairs(
+                        &index, ninput, input_sorted, ncoord_matches,
+                        refcoord_matches, inputcoord_matches, tolerance,
+                        &solution, &nmatched, error)) goto exit;
+            if (nmatched >= ncoord_matches) {
+                if (triangles_match_similarity(
+                            &index, ref, ninput, input, input_sorted,
+                            solution, tolerance, callback, callback_data,
+                            error)) goto exit;
+                status = 0;
+                goto exit;
+            }
+        }
+
+        /* Call the callback with all of the matches */
+        for (i = 0; i < ncoord_matches; ++i) {
+            if (callback(callback_data,
+                         refcoord_matches[i] - ref,
+                         inputcoord_matches[i] - input,
+                         error)) goto exit;
+        }
     }
 
     status = 0;
 
  exit:
 
-    free(ref_triangles);
-    free(input_triangles);
-    free(triangle_matches);
+    triangle_set_free(&ref_set);
+    triangle_set_free(&input_set);
+    free(refcoord_matches);
+    free(inputcoord_matches);
+    free(ref_prev);
+    free(input_prev);
+
     return status;
 }
 
@@ -740,6 +2913,14 @@ match_triangles(
         const double tolerance,
         const double maxratio,
         const size_t nreject,
+        const triangles_verify_e verify,
+        const triangles_select_e select,
+        const double* const ref_weights,
+        const double* const input_weights,
+        const int adaptive,
+        const triangle_table_t* ref_table,
+        const size_t nthreads,
+        workspace_t* const workspace,
         coord_match_callback_t* callback,
         void* callback_data,
         stimage_error_t* const error) {
@@ -747,52 +2928,100 @@ match_triangles(
     size_t          ncoord_matches     = nmatch;
     const coord_t** refcoord_matches   = NULL;
     const coord_t** inputcoord_matches = NULL;
+    size_t          nref_select        = 0;
+    const coord_t** ref_select         = NULL;
+    size_t          ninput_select      = 0;
+    const coord_t** input_select       = NULL;
     size_t          nkeep              = 0;
     size_t          nmerge             = 0;
-    size_t          ncheck             = 0;
     size_t          ref_idx            = 0;
     size_t          input_idx          = 0;
     size_t          i                  = 0;
     int             status             = 1;
 
-    refcoord_matches = malloc_with_error(
-            ncoord_matches * sizeof(coord_t*), error);
+    if (verify >= triangles_verify_LAST || verify < 0) {
+        stimage_error_set_message(error, "Invalid verification method");
+        return 1;
+    }
+
+    if (verify == triangles_verify_ransac && !(tolerance > 0.0)) {
+        stimage_error_set_message(
+                error, "tolerance must be > 0 for RANSAC verification");
+        return 1;
+    }
+
+    if (triangles_check_select(
+                ref_weights, select, error) ||
+        triangles_check_select(
+                input_weights, select, error)) {
+        return 1;
+    }
+
+    if (adaptive) {
+        return match_triangles_adaptive(
+                nref_unique, ref, ref_sorted,
+                ninput_unique, input, input_sorted,
+                nmatch, tolerance, maxratio, nreject, verify,
+                select, ref_weights, input_weights, nthreads,
+                callback, callback_data, error);
+    }
+
+    /* The triangles of a reference table built beforehand are those of
+       every n'th coordinate */
+    if (select != triangles_select_sample) {
+        ref_table = NULL;
+    }
+
+    /* Choose the coordinates to build triangles from */
+    ref_select = workspace_alloc(
+            workspace, nref_unique * sizeof(coord_t*), error);
+    if (ref_select == NULL) goto exit;
+
+    input_select = workspace_alloc(
+            workspace, ninput_unique * sizeof(coord_t*), error);
+    if (input_select == NULL) goto exit;
+
+    if (select_triangle_points(
+                nref_unique, ref_sorted, ref, ref_weights, select, nmatch,
+                &nref_select, ref_select, workspace, error) ||
+        select_triangle_points(
+                ninput_unique, input_sorted, input, input_weights, select,
+                nmatch, &ninput_select, input_select, workspace,
+                error)) goto exit;
+
+    if (verify == triangles_verify_ransac) {
+        ncoord_matches = 0;
+        if (match_triangles_ransac(
+                    nref_unique, ref, ref_sorted,
+                    ninput_unique, input, input_sorted,
+                    nref_select, ref_select, ninput_select, input_select,
+                    nmatch, tolerance, maxratio, ref_table, nthreads,
+                    workspace, callback, callback_data, error)) goto exit;
+        status = 0;
+        goto exit;
+    }
+
+    refcoord_matches = workspace_alloc(
+            workspace, ncoord_matches * sizeof(coord_t*), error);
     if (refcoord_matches == NULL) goto exit;
 
-    inputcoord_matches = malloc_with_error(
-            ncoord_matches * sizeof(coord_t*), error);
+    inputcoord_matches = workspace_alloc(
+            workspace, ncoord_matches * sizeof(coord_t*), error);
     if (inputcoord_matches == NULL) goto exit;
 
     if (_match_triangles(
-        nref_unique, ref, ref_sorted,
-        ninput_unique, input, input_sorted,
+        nref_select, ref_select,
+        ninput_select, input_select,
         &ncoord_matches, refcoord_matches, inputcoord_matches,
-        nmatch, tolerance, maxratio, nreject,
+        nmatch, tolerance, maxratio, nreject, ref_table, nthreads, workspace,
         &nkeep, &nmerge,
         error)) goto exit;
 
-    if (ncoord_matches == 0 || (ncoord_matches <= 3 && nkeep < nmerge)) {
-        status = 0;
-        goto exit;
-    }
-
-    /* If all the coordinates were not matched then make another pass
-       through the triangles matching algorithm. If the number of
-       matches decreases as a result of this then all the matches were
-       not true matches and declare the list unmatched. */
-    if (ncoord_matches < nmatch && ncoord_matches > 2) {
-        ncheck = ncoord_matches;
-        if (_match_triangles(
-                ncoord_matches, ref, refcoord_matches,
-                ncoord_matches, input, inputcoord_matches,
-                &ncoord_matches, refcoord_matches, inputcoord_matches,
-                nmatch, tolerance, maxratio, nreject,
-                &nkeep, &nmerge, error)) goto exit;
-
-        if (ncoord_matches < ncheck) {
-            ncoord_matches = 0;
-        }
-    }
+    if (triangles_confirm(
+                nmatch, &ncoord_matches,
+                refcoord_matches, inputcoord_matches, nkeep, nmerge,
+                tolerance, maxratio, nreject, nthreads, workspace,
+                error)) goto exit;
 
     status = 0;
 
@@ -814,8 +3043,10 @@ match_triangles(
         }
     }
 
-    free(refcoord_matches);
-    free(inputcoord_matches);
+    workspace_release(workspace, refcoord_matches);
+    workspace_release(workspace, inputcoord_matches);
+    workspace_release(workspace, ref_select);
+    workspace_release(workspace, input_select);
 
     return status;
 }
@@ -0,0 +1,276 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <assert.h>
+#define _USE_MATH_DEFINES       /* needed for MS Windows to define M_PI */
+#include <math.h>
+
+#include "immatch/lib/verify.h"
+
+/* The number of input coordinates checked before the whole list is
+   checked */
+#define VERIFY_NSAMPLE 200
+
+/* The number of matches beyond those expected by chance needed to
+   accept a transformation, in standard deviations and absolute
+   terms */
+#define VERIFY_NSIGMA 5.0
+#define VERIFY_MIN_EXCESS 5.0
+
+int
+similarity_from_pairs(
+        const coord_t* const input0,
+        const coord_t* const input1,
+        const coord_t* const ref0,
+        const coord_t* const ref1,
+        const double parity,
+        similarity_t* const t) {
+
+    const double ux = input1->x - input0->x;
+    const double uy = parity * (input1->y - input0->y);
+    const double vx = ref1->x - ref0->x;
+    const double vy = ref1->y - ref0->y;
+    const double norm = ux * ux + uy * uy;
+
+    if (!(norm > 0.0)) {
+        return 0;
+    }
+
+    /* (vx + i vy) / (ux + i uy) */
+    t->parity = parity;
+    t->a = (vx * ux + vy * uy) / norm;
+    t->b = (vy * ux - vx * uy) / norm;
+    t->tx = ref0->x - (t->a * input0->x - t->b * parity * input0->y);
+    t->ty = ref0->y - (t->b * input0->x + t->a * parity * input0->y);
+
+    return 1;
+}
+
+void
+similarity_fit(
+        const size_t npairs,
+        const coord_match_t* const pairs,
+        similarity_t* const t) {
+
+    coord_t mean_ref   = {0.0, 0.0};
+    coord_t mean_input = {0.0, 0.0};
+    double  sxx        = 0.0;
+    double  sa         = 0.0;
+    double  sb         = 0.0;
+    double  x, y, u, v;
+    size_t  i;
+
+    assert(pairs || npairs == 0);
+    assert(t);
+
+    if (npairs < 2) {
+        return;
+    }
+
+    for (i = 0; i < npairs; ++i) {
+        mean_ref.x += pairs[i].l->x;
+        mean_ref.y += pairs[i].l->y;
+        mean_input.x += pairs[i].r->x;
+        mean_input.y += t->parity * pairs[i].r->y;
+    }
+    mean_ref.x /= (double)npairs;
+    mean_ref.y /= (double)npairs;
+    mean_input.x /= (double)npairs;
+    mean_input.y /= (double)npairs;
+
+    for (i = 0; i < npairs; ++i) {
+        x = pairs[i].r->x - mean_input.x;
+        y = t->parity * pairs[i].r->y - mean_input.y;
+        u = pairs[i].l->x - mean_ref.x;
+        v = pairs[i].l->y - mean_ref.y;
+        /* (u + iv) * conj(x + iy) */
+        sa += u * x + v * y;
+        sb += v * x - u * y;
+        sxx += x * x + y * y;
+    }
+
+    if (!(sxx > 0.0)) {
+        return;
+    }
+
+    t->a = sa / sxx;
+    t->b = sb / sxx;
+    t->tx = mean_ref.x - (t->a * mean_input.x - t->b * mean_input.y);
+    t->ty = mean_ref.y - (t->b * mean_input.x + t->a * mean_input.y);
+}
+
+void
+verify_index_init(
+        verify_index_t* const index,
+        const size_t ncoords,
+        const coord_t* const * const coords,
+        const double tolerance) {
+
+    coord_t lo, hi;
+    size_t  i;
+
+    assert(index);
+    assert(coords || ncoords == 0);
+
+    index->ncoords = ncoords;
+    index->coords = coords;
+    index->density = 0.0;
+
+    if (ncoords == 0) {
+        return;
+    }
+
+    lo = hi = *coords[0];
+    for (i = 1; i < ncoords; ++i) {
+        lo.x = MIN(lo.x, coords[i]->x);
+        lo.y = MIN(lo.y, coords[i]->y);
+        hi.x = MAX(hi.x, coords[i]->x);
+        hi.y = MAX(hi.y, coords[i]->y);
+    }
+
+    index->density = (double)ncoords /
+        MAX((hi.x - lo.x) * (hi.y - lo.y), tolerance * tolerance);
+}
+
+/* Find the reference coordinate nearest to c within tolerance, or
+   NULL if there is none.  The reference coordinates are sorted in y,
+   so they are found with a binary search. */
+static const coord_t*
+verify_nearest(
+        const verify_index_t* const index,
+        const coord_t* const c,
+        const double tolerance) {
+
+    size_t         lo      = 0;
+    size_t         hi      = index->ncoords;
+    size_t         mid;
+    double         d2;
+    double         best    = tolerance * tolerance;
+    const coord_t* nearest = NULL;
+
+    while (lo < hi) {
+        mid = lo + (hi - lo) / 2;
+        if (index->coords[mid]->y < c->y - tolerance) {
+            lo = mid + 1;
+        } else {
+            hi = mid;
+        }
+    }
+
+    for (; lo < index->ncoords && index->coords[lo]->y <= c->y + tolerance;
+         ++lo) {
+        d2 = euclid_distance2(index->coords[lo], c);
+        if (d2 <= best) {
+            best = d2;
+            nearest = index->coords[lo];
+        }
+    }
+
+    return nearest;
+}
+
+size_t
+verify_count_matches(
+        const verify_index_t* const index,
+        const size_t ninput,
+        const coord_t* const * const input,
+        const size_t stride,
+        const similarity_t* const t,
+        const double tolerance,
+        coord_match_t* const pairs) {
+
+    size_t         nmatches = 0;
+    size_t         i;
+    coord_t        moved;
+    const coord_t* nearest;
+
+    assert(index);
+    assert(input || ninput == 0);
+    assert(stride > 0);
+    assert(t);
+
+    for (i = 0; i < ninput; i += stride) {
+        similarity_apply(t, input[i], &moved);
+        nearest = verify_nearest(index, &moved, tolerance);
+        if (nearest != NULL) {
+            if (pairs != NULL) {
+                pairs[nmatches].l = nearest;
+                pairs[nmatches].r = input[i];
+            }
+            ++nmatches;
+        }
+    }
+
+    return nmatches;
+}
+
+static int
+verify_is_significant(
+        const verify_index_t* const index,
+        const size_t ncheck,
+        const size_t nmatches,
+        const double tolerance) {
+
+    const double p = MIN(1.0, M_PI * tolerance * tolerance * index->density);
+    const double expected = (double)ncheck * p;
+
+    return ((double)nmatches >=
+            expected + VERIFY_NSIGMA * sqrt(expected) + VERIFY_MIN_EXCESS);
+}
+
+int
+verify_similarity(
+        const verify_index_t* const index,
+        const size_t ninput,
+        const coord_t* const * const input,
+        const similarity_t* const t,
+        const double tolerance) {
+
+    const size_t stride = MAX(1, ninput / VERIFY_NSAMPLE);
+    size_t       nmatches;
+
+    nmatches = verify_count_matches(
+            index, ninput, input, stride, t, tolerance, NULL);
+    if (!verify_is_significant(
+                index, (ninput + stride - 1) / stride, nmatches, tolerance)) {
+        return 0;
+    }
+
+    if (stride > 1) {
+        nmatches = verify_count_matches(
+                index, ninput, input, 1, t, tolerance, NULL);
+        if (!verify_is_significant(index, ninput, nmatches, tolerance)) {
+            return 0;
+        }
+    }
+
+    return 1;
+}
@@ -35,11 +35,14 @@ DAMAGE.
 */
 
 #include <assert.h>
+#include <math.h>
 
 #include "immatch/xyxymatch.h"
 #include "lib/lintransform.h"
 #include "lib/xycoincide.h"
 #include "lib/xysort.h"
+#include "immatch/lib/offsets.h"
+#include "immatch/lib/quads.h"
 #include "immatch/lib/triangles.h"
 #include "immatch/lib/tolerance.h"
 
@@ -81,6 +84,125 @@ xyxymatch_callback(
     return 0;
 }
 
+/* Removes coincident coordinates from an xysort-ed list, using the
+   hash grid only for lists crowded enough for it to pay off.  The
+   number of coordinates per row of height separation is estimated
+   from the range of y of the sorted list; a range that is not finite
+   leaves the estimate NaN, and the sliding window is used. */
+static int
+remove_coincident(
+        const size_t ncoords,
+        const coord_t** const sorted /*[ncoords]*/,
+        const double separation,
+        size_t* const nunique,
+        stimage_error_t* const error) {
+
+    double nrow = 0.0;
+
+    if (ncoords > 1) {
+        nrow = (double)ncoords * fabs(separation) /
+            (sorted[ncoords - 1]->y - sorted[0]->y);
+    }
+
+    if (!(nrow >= XYCOINCIDE_GRID_MIN_ROW)) {
+        *nunique = xycoincide(ncoords, sorted, sorted, separation);
+        return 0;
+    }
+
+    return xycoincide_grid(
+            ncoords, sorted, sorted, separation, nunique, error);
+}
+
+int
+xyxymatch_prepare_ref(
+        const size_t nref, const coord_t* const ref /*[nref]*/,
+        const double separation,
+        size_t* const nunique,
+        size_t* const index /*[nref]*/,
+        stimage_error_t* const error) {
+
+    const coord_t** ref_sorted = NULL;
+    size_t          i;
+    int             status     = 1;
+
+    assert(ref || nref == 0);
+    assert(nunique);
+    assert(index);
+    assert(error);
+
+    *nunique = 0;
+    if (nref == 0) {
+        return 0;
+    }
+
+    ref_sorted = malloc_with_error(nref * sizeof(coord_t*), error);
+    if (ref_sorted == NULL) goto exit;
+
+    xysort(nref, ref, ref_sorted);
+    if (remove_coincident(
+                nref, ref_sorted, separation, nunique, error)) goto exit;
+
+    for (i = 0; i < *nunique; ++i) {
+        index[i] = (size_t)(ref_sorted[i] - ref);
+    }
+
+    status = 0;
+
+ exit:
+
+    free(ref_sorted);
+
+    return status;
+}
+
+int
+xyxymatch_ref_triangles(
+        const size_t nref, const coord_t* const ref /*[nref]*/,
+        const xyxymatch_ref_t* const prepared,
+        const size_t nmatch,
+        const double tolerance,
+        const double maxratio,
+        const size_t nthreads,
+        triangle_table_t* const table,
+        stimage_error_t* const error) {
+
+    const coord_t** ref_sorted = NULL;
+    size_t          i;
+    int             status     = 1;
+
+    assert(ref || nref == 0);
+    assert(prepared);
+    assert(table);
+    assert(error);
+
+    ref_sorted = malloc_with_error(
+            MAX(1, prepared->nunique) * sizeof(coord_t*), error);
+    if (ref_sorted == NULL) goto exit;
+
+    for (i = 0; i < prepared->nunique; ++i) {
+        if (prepared->index[i] >= nref) {
+            stimage_error_set_message(
+                error,
+                "The prepared reference list does not match the "
+                "reference coordinates");
+            goto exit;
+        }
+        ref_sorted[i] = ref + prepared->index[i];
+    }
+
+    if (find_reference_triangle_table(
+                prepared->nunique, ref_sorted, nmatch, tolerance, maxratio,
+                nthreads, table, error)) goto exit;
+
+    status = 0;
+
+ exit:
+
+    free(ref_sorted);
+
+    return status;
+}
+
 /** DIFF
 
 The original takes lists of input, reference and output files.  This
@@ -112,6 +234,19 @@ xyxymatch(
         const size_t nmatch,
         const double maxratio,
         const size_t nreject,
+        const double tile_size,
+        const size_t nthreads,
+        const double search_radius,
+        const double max_rotation,
+        const double max_scale,
+        const triangles_verify_e verify,
+        const triangles_select_e select,
+        const double* const input_weights,
+        const double* const ref_weights,
+        const int adaptive,
+        const size_t memory_limit,
+        const xyxymatch_ref_t* const prepared,
+        workspace_t* const workspace,
         stimage_error_t* const error) {
 
     static const coord_t      DEFAULT_ORIGIN     = {0.0, 0.0};
@@ -123,8 +258,12 @@ xyxymatch(
     size_t                    ninput_unique      = ninput;
     const coord_t**           ref_sorted         = NULL;
     size_t                    nref_unique        = nref;
+    size_t                    nmatch_limited     = nmatch;
+    const triangle_table_t*   ref_triangles      = NULL;
+    size_t                    i;
     lintransform_t            lintransform;
     xyxymatch_callback_data_t state;
+    workspace_mark_t          mark               = workspace_mark(workspace);
     int                       status             = 1;
 
     /****************************************
@@ -170,11 +309,41 @@ xyxymatch(
     /****************************************
      PREPARE REFERENCE COORDINATES
     */
-    ref_sorted = malloc_with_error(nref * sizeof(coord_t*), error);
+    ref_sorted = workspace_alloc(workspace, nref * sizeof(coord_t*), error);
     if (ref_sorted == NULL) goto exit;
 
-    xysort(nref, ref, ref_sorted);
-    nref_unique = xycoincide(nref, ref_sorted, ref_sorted, separation);
+    if (prepared != NULL) {
+        if (prepared->separation != separation) {
+            stimage_error_set_message(
+                error,
+                "The reference coordinates were prepared with a different "
+                "separation");
+            goto exit;
+        }
+        if (prepared->nunique > nref) {
+            stimage_error_set_message(
+                error,
+                "The prepared reference list is longer than the reference "
+                "coordinate list");
+            goto exit;
+        }
+        for (i = 0; i < prepared->nunique; ++i) {
+            if (prepared->index[i] >= nref) {
+                stimage_error_set_message(
+                    error,
+                    "The prepared reference list does not match the "
+                    "reference coordinates");
+                goto exit;
+            }
+            ref_sorted[i] = ref + prepared->index[i];
+        }
+        nref_unique = prepared->nunique;
+    } else {
+        xysort(nref, ref, ref_sorted);
+        if (remove_coincident(
+                    nref, ref_sorted, separation, &nref_unique,
+                    error)) goto exit;
+    }
 
     /****************************************
      DETERMINE INITIAL TRANSFORM
@@ -184,15 +353,18 @@ xyxymatch(
     /****************************************
      PREPARE INPUT COORDINATES
     */
-    input_trans = malloc_with_error(ninput * sizeof(coord_t), error);
+    input_trans = workspace_alloc(workspace, ninput * sizeof(coord_t), error);
     if (input_trans == NULL) goto exit;
 
-    input_trans_sorted = malloc_with_error(ninput * sizeof(coord_t*), error);
+    input_trans_sorted = workspace_alloc(
+            workspace, ninput * sizeof(coord_t*), error);
     if (input_trans_sorted == NULL) goto exit;
 
     apply_lintransform(&lintransform, ninput, input, input_trans);
     xysort(ninput, input_trans, input_trans_sorted);
-    ninput_unique = xycoincide(ninput, input_trans_sorted, input_trans_sorted, separation);
+    if (remove_coincident(
+                ninput, input_trans_sorted, separation, &ninput_unique,
+                error)) goto exit;
 
     /****************************************
      RUN THE DESIRED ALGORITHM
@@ -205,7 +377,14 @@ xyxymatch(
 
     switch (algorithm) {
     case xyxymatch_algo_tolerance:
-        if (match_tolerance(
+        if (nthreads != 1 || tile_size > 0.0) {
+            if (match_tolerance_tiled(
+                    nref_unique, ref, ref_sorted,
+                    ninput_unique, input_trans, input_trans_sorted,
+                    tolerance, tile_size, nthreads,
+                    xyxymatch_callback, &state,
+                    error)) goto exit;
+        } else if (match_tolerance(
                 nref_unique, ref, ref_sorted,
                 ninput_unique, input_trans, input_trans_sorted,
                 tolerance,
@@ -214,10 +393,38 @@ xyxymatch(
         *noutput = state.outputp;
         break;
     case xyxymatch_algo_triangles:
+        if (limit_triangles_nmatch(
+                nref_unique, ninput_unique, nmatch, maxratio, memory_limit,
+                &nmatch_limited, error)) goto exit;
+        if (prepared != NULL &&
+            prepared->nmatch == nmatch_limited &&
+            prepared->tolerance == tolerance &&
+            prepared->maxratio == maxratio) {
+            ref_triangles = prepared->triangles;
+        }
         if (match_triangles(
                 nref, nref_unique, ref, ref_sorted,
                 ninput, ninput_unique, input_trans, input_trans_sorted,
-                nmatch, tolerance, maxratio, nreject,
+                nmatch_limited, tolerance, maxratio, nreject, verify,
+                select, ref_weights, input_weights, adaptive, ref_triangles,
+                nthreads, workspace, &xyxymatch_callback, &state,
+                error)) goto exit;
+        *noutput = state.outputp;
+        break;
+    case xyxymatch_algo_offsets:
+        if (match_offsets(
+                nref, nref_unique, ref, ref_sorted,
+                ninput, ninput_unique, input_trans, input_trans_sorted,
+                tolerance, search_radius, max_rotation, max_scale,
+                &xyxymatch_callback, &state,
+                error)) goto exit;
+        *noutput = state.outputp;
+        break;
+    case xyxymatch_algo_quads:
+        if (match_quads(
+                nref, nref_unique, ref, ref_sorted,
+                ninput, ninput_unique, input_trans, input_trans_sorted,
+                tolerance,
                 &xyxymatch_callback, &state,
                 error)) goto exit;
         *noutput = state.outputp;
@@ -232,9 +439,10 @@ xyxymatch(
 
 exit:
 
-    free(ref_sorted);
-    free(input_trans_sorted);
-    free(input_trans);
+    workspace_release(workspace, ref_sorted);
+    workspace_release(workspace, input_trans_sorted);
+    workspace_release(workspace, input_trans);
+    workspace_rewind(workspace, mark);
     return status;
 }
 
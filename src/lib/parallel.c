@@ -0,0 +1,187 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <assert.h>
+#include <string.h>
+
+#if !defined(_WIN32)
+  #define STIMAGE_HAVE_PTHREAD
+  #include <pthread.h>
+  #include <unistd.h>
+#endif
+
+#include "lib/parallel.h"
+
+size_t
+parallel_default_nthreads(void) {
+#if defined(STIMAGE_HAVE_PTHREAD) && defined(_SC_NPROCESSORS_ONLN)
+    long n = sysconf(_SC_NPROCESSORS_ONLN);
+
+    if (n > 0) {
+        return (size_t)n;
+    }
+#endif
+
+    return 1;
+}
+
+static int
+parallel_for_serial(
+        const size_t ntasks,
+        parallel_task_t task,
+        void* data,
+        stimage_error_t* const error) {
+
+    size_t i;
+
+    for (i = 0; i < ntasks; ++i) {
+        if (task(data, i, error)) {
+            return 1;
+        }
+    }
+
+    return 0;
+}
+
+#if defined(STIMAGE_HAVE_PTHREAD)
+
+typedef struct {
+    pthread_mutex_t  lock;
+    parallel_task_t  task;
+    void*            data;
+    size_t           ntasks;
+    size_t           next;
+    size_t           failed_task;
+    stimage_error_t* error;
+} parallel_state_t;
+
+static void*
+parallel_worker(
+        void* arg) {
+
+    parallel_state_t* state = (parallel_state_t*)arg;
+    stimage_error_t   error;
+    size_t            i;
+
+    stimage_error_init(&error);
+
+    for (;;) {
+        pthread_mutex_lock(&state->lock);
+        i = state->next++;
+        pthread_mutex_unlock(&state->lock);
+
+        if (i >= state->ntasks) {
+            break;
+        }
+
+        if (state->task(state->data, i, &error)) {
+            pthread_mutex_lock(&state->lock);
+            if (i < state->failed_task) {
+                state->failed_task = i;
+                memcpy(state->error, &error, sizeof(stimage_error_t));
+            }
+            /* Don't start any more tasks */
+            state->next = state->ntasks;
+            pthread_mutex_unlock(&state->lock);
+            break;
+        }
+    }
+
+    return NULL;
+}
+
+#endif
+
+int
+parallel_for(
+        size_t nthreads,
+        const size_t ntasks,
+        parallel_task_t task,
+        void* data,
+        stimage_error_t* const error) {
+
+#if defined(STIMAGE_HAVE_PTHREAD)
+    parallel_state_t state;
+    pthread_t*       threads  = NULL;
+    size_t           nstarted = 0;
+    size_t           i;
+    int              status   = 1;
+#endif
+
+    assert(task);
+    assert(error);
+
+    if (nthreads == 0) {
+        nthreads = parallel_default_nthreads();
+    }
+    nthreads = MIN(nthreads, ntasks);
+
+#if defined(STIMAGE_HAVE_PTHREAD)
+    if (nthreads <= 1) {
+        return parallel_for_serial(ntasks, task, data, error);
+    }
+
+    threads = malloc_with_error(nthreads * sizeof(pthread_t), error);
+    if (threads == NULL) return 1;
+
+    if (pthread_mutex_init(&state.lock, NULL)) {
+        stimage_error_set_message(error, "Could not create mutex");
+        free(threads);
+        return 1;
+    }
+    state.task = task;
+    state.data = data;
+    state.ntasks = ntasks;
+    state.next = 0;
+    state.failed_task = ntasks;
+    state.error = error;
+
+    /* The calling thread does its share of the work too */
+    for (i = 1; i < nthreads; ++i) {
+        if (pthread_create(&threads[i], NULL, parallel_worker, &state)) {
+            break;
+        }
+        ++nstarted;
+    }
+    parallel_worker(&state);
+    for (i = 1; i <= nstarted; ++i) {
+        pthread_join(threads[i], NULL);
+    }
+
+    pthread_mutex_destroy(&state.lock);
+    free(threads);
+
+    status = (state.failed_task < ntasks);
+    return status;
+#else
+    return parallel_for_serial(ntasks, task, data, error);
+#endif
+}
@@ -486,31 +486,6 @@ eval_poly_generic(
         return 0;
     }
 
-    /* Fit first order in x and y */
-    if (xorder == 2 && yorder == 1) {
-        for (i = 0; i < ncoord; ++i) {
-            zfit[i] += ref[i].x * coeff[1];
-        }
-
-        return 0;
-    }
-
-    if (yorder == 2 && xorder == 1) {
-        for (i = 0; i < ncoord; ++i) {
-            zfit[i] += ref[i].y * coeff[1];
-        }
-
-        return 0;
-    }
-
-    if (yorder == 2 && xorder == 2 && xterms == xterms_none) {
-        for (i = 0; i < ncoord; ++i) {
-            zfit[i] += ref[i].x * coeff[1] + ref[i].y * coeff[2];
-        }
-
-        return 0;
-    }
-
     xb = malloc_with_error(xorder * ncoord * sizeof(double), error);
     if (xb == NULL) goto exit;
     yb = malloc_with_error(yorder * ncoord * sizeof(double), error);
@@ -539,20 +514,20 @@ eval_poly_generic(
                 for (i = 0; i < ncoord; ++i) {
                     accum[i] += xbp[i] * coeff[cp+k];
                 }
+                xbp += ncoord;
             }
-            xbp += ncoord;
-        }
 
-        for (i = 0; i < ncoord; ++i) {
-            zfit[i] += accum[i] * ybp[i];
-        }
+            for (i = 0; i < ncoord; ++i) {
+                zfit[i] += accum[i] * ybp[i];
+            }
 
-        cp += xincr;
-        ybp += ncoord;
+            cp += xincr;
+            ybp += ncoord;
 
-        if (xterms == xterms_half) {
-            if ((j + xorder + 1) > maxorder) {
-                xincr -= 1;
+            if (xterms == xterms_half) {
+                if ((j + 1 + xorder + 1) > maxorder) {
+                    xincr -= 1;
+                }
             }
         }
     } else { /* xterms == surface_xterms_none */
@@ -0,0 +1,332 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <assert.h>
+
+#define _USE_MATH_DEFINES       /* needed for MS Windows to define M_PI */
+#include <math.h>
+
+#include "lib/projection.h"
+
+/* All of the supported projections are zenithal, with the native
+   pole at the reference point.  Rather than going through the
+   native spherical coordinates (phi, theta) explicitly, we work with
+   the direction cosines (l, m, n) of each point relative to the
+   reference point, where n = sin(theta) and hypot(l, m) = cos(theta).
+   The projection plane coordinates are then just (l, m) scaled by
+   R(theta) / cos(theta). */
+
+int
+projection_is_supported(
+        const geomap_proj_e projection) {
+
+    switch (projection) {
+    case geomap_proj_none:
+    case geomap_proj_lin:
+    case geomap_proj_tan:
+    case geomap_proj_sin:
+    case geomap_proj_stg:
+    case geomap_proj_arc:
+    case geomap_proj_zea:
+        return 1;
+    default:
+        return 0;
+    }
+}
+
+int
+projection_is_celestial(
+        const geomap_proj_e projection) {
+
+    return (projection != geomap_proj_none &&
+            projection != geomap_proj_lin);
+}
+
+void
+compute_sky_refpt(
+        const size_t ncoords,
+        const coord_t* const sky,
+        coord_t* const refpt) {
+
+    double sx = 0.0;
+    double sy = 0.0;
+    double sz = 0.0;
+    double ra, dec, cosdec;
+    size_t i;
+
+    assert(sky);
+    assert(refpt);
+
+    for (i = 0; i < ncoords; ++i) {
+        ra = DEGTORAD(sky[i].x);
+        dec = DEGTORAD(sky[i].y);
+        cosdec = cos(dec);
+        sx += cosdec * cos(ra);
+        sy += cosdec * sin(ra);
+        sz += sin(dec);
+    }
+
+    refpt->x = RADTODEG(atan2(sy, sx));
+    if (refpt->x < 0.0) {
+        refpt->x += 360.0;
+    }
+    refpt->y = RADTODEG(atan2(sz, sqrt(sx*sx + sy*sy)));
+}
+
+static int
+projection_check(
+        const geomap_proj_e projection,
+        const coord_t* const refpt,
+        stimage_error_t* const error) {
+
+    if (projection >= geomap_proj_LAST || projection < 0 ||
+        !projection_is_supported(projection)) {
+        stimage_error_set_message(error, "Unsupported projection");
+        return 1;
+    }
+
+    if (projection_is_celestial(projection) &&
+        (!coord_is_finite(refpt) || refpt->y < -90.0 || refpt->y > 90.0)) {
+        stimage_error_set_message(error, "Invalid projection reference point");
+        return 1;
+    }
+
+    return 0;
+}
+
+int
+project_coords(
+        const geomap_proj_e projection,
+        const coord_t* const refpt,
+        const size_t ncoords,
+        const coord_t* const sky,
+        coord_t* const plane,
+        stimage_error_t* const error) {
+
+    double sin_dec0, cos_dec0;
+    double dra, sin_dec, cos_dec, cos_dra;
+    double l, m, n, rho, r;
+    size_t i;
+
+    assert(refpt);
+    assert(sky);
+    assert(plane);
+    assert(error);
+
+    if (projection_check(projection, refpt, error)) {
+        return 1;
+    }
+
+    if (!projection_is_celestial(projection)) {
+        if (plane != sky) {
+            for (i = 0; i < ncoords; ++i) {
+                plane[i] = sky[i];
+            }
+        }
+        return 0;
+    }
+
+    sin_dec0 = sin(DEGTORAD(refpt->y));
+    cos_dec0 = cos(DEGTORAD(refpt->y));
+
+    for (i = 0; i < ncoords; ++i) {
+        dra = DEGTORAD((sky[i].x - refpt->x));
+        sin_dec = sin(DEGTORAD(sky[i].y));
+        cos_dec = cos(DEGTORAD(sky[i].y));
+        cos_dra = cos(dra);
+
+        l = cos_dec * sin(dra);
+        m = sin_dec * cos_dec0 - cos_dec * sin_dec0 * cos_dra;
+        n = sin_dec * sin_dec0 + cos_dec * cos_dec0 * cos_dra;
+        rho = sqrt(l*l + m*m);
+
+        /* r is R(theta) / cos(theta), in radians */
+        switch (projection) {
+        case geomap_proj_tan:
+            if (n <= 0.0) {
+                goto out_of_domain;
+            }
+            r = 1.0 / n;
+            break;
+        case geomap_proj_sin:
+            if (n < 0.0) {
+                goto out_of_domain;
+            }
+            r = 1.0;
+            break;
+        case geomap_proj_stg:
+            if (n <= -1.0) {
+                goto out_of_domain;
+            }
+            r = 2.0 / (1.0 + n);
+            break;
+        case geomap_proj_arc:
+            if (rho == 0.0) {
+                r = 1.0;
+            } else {
+                r = atan2(rho, n) / rho;
+            }
+            break;
+        case geomap_proj_zea:
+            /* R = sqrt(2 (1 - n)), rewritten using rho^2 = (1 - n)(1 + n)
+               to avoid cancellation near the reference point */
+            if (n <= -1.0) {
+                goto out_of_domain;
+            }
+            r = sqrt(2.0 / (1.0 + n));
+            break;
+        default:
+            stimage_error_set_message(error, "Unsupported projection");
+            return 1;
+        }
+
+        plane[i].x = RADTODEG(l * r);
+        plane[i].y = RADTODEG(m * r);
+    }
+
+    return 0;
+
+ out_of_domain:
+
+    stimage_error_format_message(
+            error,
+            "Coordinate (%f, %f) is outside of the domain of the projection",
+            sky[i].x, sky[i].y);
+    return 1;
+}
+
+int
+deproject_coords(
+        const geomap_proj_e projection,
+        const coord_t* const refpt,
+        const size_t ncoords,
+        const coord_t* const plane,
+        coord_t* const sky,
+        stimage_error_t* const error) {
+
+    double sin_dec0, cos_dec0;
+    double x, y, rr, cos_theta, sin_theta;
+    double l, m, n, t;
+    size_t i;
+
+    assert(refpt);
+    assert(plane);
+    assert(sky);
+    assert(error);
+
+    if (projection_check(projection, refpt, error)) {
+        return 1;
+    }
+
+    if (!projection_is_celestial(projection)) {
+        if (plane != sky) {
+            for (i = 0; i < ncoords; ++i) {
+                sky[i] = plane[i];
+            }
+        }
+        return 0;
+    }
+
+    sin_dec0 = sin(DEGTORAD(refpt->y));
+    cos_dec0 = cos(DEGTORAD(refpt->y));
+
+    for (i = 0; i < ncoords; ++i) {
+        x = DEGTORAD(plane[i].x);
+        y = DEGTORAD(plane[i].y);
+        rr = sqrt(x*x + y*y);
+
+        switch (projection) {
+        case geomap_proj_tan:
+            t = sqrt(1.0 + rr*rr);
+            sin_theta = 1.0 / t;
+            cos_theta = rr / t;
+            break;
+        case geomap_proj_sin:
+            if (rr > 1.0) {
+                goto out_of_domain;
+            }
+            cos_theta = rr;
+            sin_theta = sqrt(1.0 - rr*rr);
+            break;
+        case geomap_proj_stg:
+            t = 0.25 * rr * rr;
+            sin_theta = (1.0 - t) / (1.0 + t);
+            cos_theta = rr / (1.0 + t);
+            break;
+        case geomap_proj_arc:
+            if (rr > M_PI) {
+                goto out_of_domain;
+            }
+            sin_theta = cos(rr);
+            cos_theta = sin(rr);
+            break;
+        case geomap_proj_zea:
+            if (rr > 2.0) {
+                goto out_of_domain;
+            }
+            sin_theta = 1.0 - 0.5 * rr * rr;
+            cos_theta = rr * sqrt(1.0 - 0.25 * rr * rr);
+            break;
+        default:
+            stimage_error_set_message(error, "Unsupported projection");
+            return 1;
+        }
+
+        if (rr == 0.0) {
+            l = 0.0;
+            m = 0.0;
+        } else {
+            l = cos_theta * x / rr;
+            m = cos_theta * y / rr;
+        }
+        n = sin_theta;
+
+        /* Rotate from native back to celestial coordinates */
+        t = n * cos_dec0 - m * sin_dec0;
+        sky[i].x = refpt->x + RADTODEG(atan2(l, t));
+        sky[i].y = RADTODEG(atan2(n * sin_dec0 + m * cos_dec0, sqrt(l*l + t*t)));
+        if (sky[i].x < 0.0) {
+            sky[i].x += 360.0;
+        } else if (sky[i].x >= 360.0) {
+            sky[i].x -= 360.0;
+        }
+    }
+
+    return 0;
+
+ out_of_domain:
+
+    stimage_error_format_message(
+            error,
+            "Coordinate (%f, %f) is outside of the domain of the projection",
+            plane[i].x, plane[i].y);
+    return 1;
+}
@@ -35,6 +35,7 @@ DAMAGE.
 */
 
 #include <assert.h>
+#include <math.h>
 #include <stdlib.h>
 
 #include "lib/util.h"
@@ -104,7 +105,7 @@ combinatorial(
     size_t gfac;
     size_t i;
 
-    assert(n > ngroup);
+    assert(n >= ngroup);
     assert(ngroup > 0);
     assert(n < 2346);
 
@@ -231,7 +232,7 @@ compute_mode(
         const double step) {
 
     int x1, x2, x3, nmax;
-    double y1, y2, mode;
+    double y1, y2, base, s, mode = 0.0;
 
     assert(a);
 
@@ -259,11 +260,25 @@ compute_mode(
 
     /* Compute the bin and step size.  The bin size is based on the
        data range over a fraction of the pixels around the median and
-       a bin step which may be smaller than the bin size. */
+       a bin step which may be smaller than the bin size.
+
+       The number of points in the bin only goes up at a step where a
+       new point enters it, so only those steps are visited.  This
+       finds the same bin as trying every step, but takes time
+       proportional to the number of points rather than to the data
+       range over the step size. */
     nmax = 0;
     x2 = x1;
-    for (y1 = a[x1]; x2 < x3; y1 += step) {
-        for (; a[x1] < y1; ++x1) {
+    base = a[x1];
+    s = 0.0;
+    while (x2 < x3) {
+        /* The first step at which a[x2] is inside the bin */
+        s = MAX(s, floor((a[x2] - base - bin) / step) + 1.0);
+        while (base + s * step + bin <= a[x2]) {
+            s += 1.0;
+        }
+        y1 = base + s * step;
+        for (; x1 < x2 && a[x1] < y1; ++x1) {
             /* empty */
         }
         y2 = y1 + bin;
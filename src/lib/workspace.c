@@ -0,0 +1,225 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <assert.h>
+#include <stdlib.h>
+
+#include "lib/workspace.h"
+
+/* Every allocation is rounded up to this many bytes, so that each one
+   stays aligned for any type */
+#define WORKSPACE_ALIGN 16
+
+/* The smallest block the workspace allocates from the system */
+#define WORKSPACE_MIN_BLOCK 65536
+
+#define WORKSPACE_ROUND(n) \
+    (((n) + WORKSPACE_ALIGN - 1) / WORKSPACE_ALIGN * WORKSPACE_ALIGN)
+
+struct workspace_block_t {
+    workspace_block_t* next;
+    size_t             size;
+};
+
+/* The memory of a block follows its header, rounded up so it is
+   aligned */
+#define WORKSPACE_HEADER WORKSPACE_ROUND(sizeof(workspace_block_t))
+
+static workspace_block_t*
+workspace_block_new(
+        workspace_t* const workspace,
+        const size_t size,
+        stimage_error_t* const error) {
+
+    workspace_block_t* block = NULL;
+
+    block = malloc_with_error(WORKSPACE_HEADER + size, error);
+    if (block == NULL) return NULL;
+
+    block->next = NULL;
+    block->size = size;
+    ++workspace->nsystem_allocs;
+
+    return block;
+}
+
+static void
+workspace_block_free_all(
+        workspace_block_t* block) {
+
+    workspace_block_t* next = NULL;
+
+    while (block != NULL) {
+        next = block->next;
+        free(block);
+        block = next;
+    }
+}
+
+void
+workspace_init(
+        workspace_t* const workspace) {
+
+    assert(workspace);
+
+    workspace->first = NULL;
+    workspace->current = NULL;
+    workspace->used = 0;
+    workspace->nsystem_allocs = 0;
+}
+
+void
+workspace_free(
+        workspace_t* const workspace) {
+
+    assert(workspace);
+
+    workspace_block_free_all(workspace->first);
+    workspace->first = NULL;
+    workspace->current = NULL;
+    workspace->used = 0;
+}
+
+void*
+workspace_alloc(
+        workspace_t* const workspace,
+        const size_t size,
+        stimage_error_t* const error) {
+
+    const size_t       n     = WORKSPACE_ROUND(MAX(1, size));
+    workspace_block_t* block = NULL;
+    workspace_block_t* last  = NULL;
+    size_t             grow  = WORKSPACE_MIN_BLOCK;
+    void*              p     = NULL;
+
+    assert(error);
+
+    if (workspace == NULL) {
+        return malloc_with_error(size, error);
+    }
+
+    if (workspace->current == NULL) {
+        workspace->current = workspace->first;
+        workspace->used = 0;
+    }
+
+    /* Use the first block, from the current one on, with enough room
+       left.  Skipped space is only reclaimed by workspace_rewind. */
+    block = workspace->current;
+    while (block != NULL && workspace->used + n > block->size) {
+        last = block;
+        block = block->next;
+        workspace->used = 0;
+    }
+
+    if (block == NULL) {
+        if (last != NULL) {
+            grow = MAX(grow, 2 * last->size);
+        }
+        block = workspace_block_new(workspace, MAX(n, grow), error);
+        if (block == NULL) return NULL;
+        if (last == NULL) {
+            workspace->first = block;
+        } else {
+            last->next = block;
+        }
+        workspace->used = 0;
+    }
+
+    workspace->current = block;
+    p = (char*)block + WORKSPACE_HEADER + workspace->used;
+    workspace->used += n;
+
+    return p;
+}
+
+void
+workspace_release(
+        workspace_t* const workspace,
+        void* const p) {
+
+    if (workspace == NULL) {
+        free(p);
+    }
+}
+
+workspace_mark_t
+workspace_mark(
+        const workspace_t* const workspace) {
+
+    workspace_mark_t mark = {NULL, 0};
+
+    if (workspace != NULL) {
+        mark.block = workspace->current;
+        mark.used = workspace->used;
+    }
+
+    return mark;
+}
+
+void
+workspace_rewind(
+        workspace_t* const workspace,
+        const workspace_mark_t mark) {
+
+    workspace_block_t* block = NULL;
+    size_t             size  = 0;
+    stimage_error_t    error;
+
+    if (workspace == NULL) {
+        return;
+    }
+
+    if (mark.block != NULL &&
+        (mark.block != workspace->first || mark.used != 0)) {
+        workspace->current = mark.block;
+        workspace->used = mark.used;
+        return;
+    }
+
+    /* Rewound to the beginning: merge the blocks into one that holds
+       everything the call needed.  If that fails, just keep the
+       blocks as they are. */
+    if (workspace->first != NULL && workspace->first->next != NULL) {
+        for (block = workspace->first; block != NULL; block = block->next) {
+            size += block->size;
+        }
+        stimage_error_init(&error);
+        block = workspace_block_new(workspace, size, &error);
+        if (block != NULL) {
+            workspace_block_free_all(workspace->first);
+            workspace->first = block;
+        }
+    }
+
+    workspace->current = workspace->first;
+    workspace->used = 0;
+}
@@ -105,3 +105,174 @@ xycoincide(
 
     return nunique;
 }
+
+/* Hash grid used by xycoincide_grid.  Each occupied cell holds the
+   head of a linked list (through next) of the kept coordinates that
+   fall in that cell. */
+typedef struct {
+    STIMAGE_Int64 cx;
+    STIMAGE_Int64 cy;
+    size_t        head;
+} grid_cell_t;
+
+#define GRID_EMPTY ((size_t)-1)
+
+/* Cells further out than this can not be represented as integers, so
+   the coordinate is treated like a non-finite one */
+#define GRID_MAX_CELL 4.0e18
+
+static inline size_t
+grid_hash(
+        const STIMAGE_Int64 cx,
+        const STIMAGE_Int64 cy,
+        const size_t mask) {
+
+    unsigned long long h;
+
+    h = (unsigned long long)cx * 0x9E3779B97F4A7C15ULL;
+    h ^= (unsigned long long)cy * 0xC2B2AE3D27D4EB4FULL;
+    h ^= h >> 29;
+
+    return (size_t)h & mask;
+}
+
+static inline grid_cell_t*
+grid_lookup(
+        grid_cell_t* const table,
+        const size_t mask,
+        const STIMAGE_Int64 cx,
+        const STIMAGE_Int64 cy) {
+
+    size_t i = grid_hash(cx, cy, mask);
+
+    /* Linear probing: the table is never more than half full */
+    while (table[i].head != GRID_EMPTY) {
+        if (table[i].cx == cx && table[i].cy == cy) {
+            break;
+        }
+        i = (i + 1) & mask;
+    }
+
+    return &table[i];
+}
+
+int
+xycoincide_grid(
+    const size_t ncoords,
+    const coord_t* const * const input /*[ncoords]*/,
+    const coord_t** const output /*[ncoords]*/,
+    const double tolerance,
+    size_t* const nunique,
+    stimage_error_t* const error) {
+
+    double         tolerance2 = tolerance * tolerance;
+    double         cellsize   = 1.0;
+    double         fx         = 0.0;
+    double         fy         = 0.0;
+    double         distance   = 0.0;
+    double         r2         = 0.0;
+    grid_cell_t*   table      = NULL;
+    grid_cell_t*   cell       = NULL;
+    size_t*        next       = NULL;
+    size_t         tablesize  = 16;
+    size_t         mask       = 0;
+    size_t         nout       = 0;
+    size_t         i          = 0;
+    size_t         j          = 0;
+    STIMAGE_Int64  cx         = 0;
+    STIMAGE_Int64  cy         = 0;
+    STIMAGE_Int64  dx         = 0;
+    STIMAGE_Int64  dy         = 0;
+    const coord_t* c          = NULL;
+    int            deleted    = 0;
+    int            status     = 1;
+
+    assert(input);
+    assert(output);
+    assert(nunique);
+    assert(error);
+
+    /* A cell slightly larger than the tolerance guarantees that all
+       neighbors within tolerance are in the adjacent cells, in spite
+       of rounding.  Any positive size works for a zero tolerance,
+       since only exact duplicates are removed. */
+    if (fabs(tolerance) > 0.0) {
+        cellsize = fabs(tolerance) * (1.0 + 1e-6);
+    }
+
+    while (tablesize < ncoords * 2) {
+        tablesize <<= 1;
+    }
+    mask = tablesize - 1;
+
+    table = malloc_with_error(tablesize * sizeof(grid_cell_t), error);
+    if (table == NULL) goto exit;
+    next = malloc_with_error((ncoords ? ncoords : 1) * sizeof(size_t), error);
+    if (next == NULL) goto exit;
+
+    for (i = 0; i < tablesize; ++i) {
+        table[i].head = GRID_EMPTY;
+    }
+
+    /* The output may be the same buffer as the input, but it is only
+       ever written at or before the element being read, and kept
+       coordinates are always read back through output. */
+    for (i = 0; i < ncoords; ++i) {
+        c = input[i];
+
+        fx = floor(c->x / cellsize);
+        fy = floor(c->y / cellsize);
+        if (!coord_is_finite(c) ||
+            fabs(fx) > GRID_MAX_CELL || fabs(fy) > GRID_MAX_CELL) {
+            output[nout++] = c;
+            continue;
+        }
+
+        cx = (STIMAGE_Int64)fx;
+        cy = (STIMAGE_Int64)fy;
+
+        deleted = 0;
+        for (dy = -1; dy <= 1 && !deleted; ++dy) {
+            for (dx = -1; dx <= 1 && !deleted; ++dx) {
+                cell = grid_lookup(table, mask, cx + dx, cy + dy);
+                for (j = cell->head; j != GRID_EMPTY; j = next[j]) {
+                    /* Same operation order as xycoincide, so the
+                       results are bitwise identical */
+                    distance = c->y - output[j]->y;
+                    r2 = distance * distance;
+                    distance = c->x - output[j]->x;
+                    r2 += distance * distance;
+                    if (r2 <= tolerance2) {
+                        deleted = 1;
+                        break;
+                    }
+                }
+            }
+        }
+
+        if (deleted) {
+            continue;
+        }
+
+        cell = grid_lookup(table, mask, cx, cy);
+        if (cell->head == GRID_EMPTY) {
+            cell->cx = cx;
+            cell->cy = cy;
+            next[nout] = GRID_EMPTY;
+        } else {
+            next[nout] = cell->head;
+        }
+        cell->head = nout;
+        output[nout++] = c;
+    }
+
+    *nunique = nout;
+    status = 0;
+
+ exit:
+
+    free(table);
+    free(next);
+
+    return status;
+}
@@ -36,7 +36,9 @@ DAMAGE.
 
 #include <assert.h>
 #include <stdlib.h>
+#include <string.h>
 
+#include "lib/parallel.h"
 #include "lib/xysort.h"
 
 /* DIFF: The documentation of the original function (part of rg_sort)
@@ -73,17 +75,277 @@ xysort_compare(const void* ap, const void* bp) {
     }
 }
 
+/* Radix sort
+
+   The coordinates are sorted with an LSD radix sort on the IEEE bit
+   patterns of the doubles, first on x and then (stably) on y.  Each
+   double is mapped to an unsigned integer with the same ordering by
+   flipping the sign bit of positive numbers and all the bits of
+   negative numbers.  Since each pass is stable, ties on (y, x) are
+   left in index order.
+
+   Each pass is split into chunks that can be run on separate
+   threads: every chunk counts its digits, the counts are combined
+   into per-chunk output offsets, then every chunk scatters its items.
+   Passes where all items have the same digit (as is common for the
+   exponent bits) are skipped.
+*/
+
+typedef unsigned long long xysort_key_t;
+
+typedef struct {
+    xysort_key_t key;
+    size_t       index;
+} xysort_item_t;
+
+#define XYSORT_RADIX_BITS 11
+#define XYSORT_RADIX_SIZE (1 << XYSORT_RADIX_BITS)
+#define XYSORT_RADIX_MASK (XYSORT_RADIX_SIZE - 1)
+#define XYSORT_NPASSES ((64 + XYSORT_RADIX_BITS - 1) / XYSORT_RADIX_BITS)
+
+/* Below this number of coordinates, xysort uses qsort.  The
+   XYSORT_NPASSES passes over the 2^XYSORT_RADIX_BITS counts cost more
+   than qsort does on short lists: on uniform coordinates, qsort takes
+   11 us against 75 us at 256, and 83 us against 109 us at 1000, while
+   the radix sort wins from about 2000 (172 us against 222 us). */
+#define XYSORT_RADIX_MIN 2048
+
+/* The minimum number of coordinates handled by each thread */
+#define XYSORT_CHUNK_MIN 65536
+
+static inline xysort_key_t
+xysort_key(
+        double d) {
+
+    xysort_key_t u;
+
+    /* -0.0 compares equal to 0.0, so give it the same key */
+    if (d == 0.0) {
+        d = 0.0;
+    }
+
+    memcpy(&u, &d, sizeof(xysort_key_t));
+    if (u & 0x8000000000000000ULL) {
+        return ~u;
+    }
+    return u | 0x8000000000000000ULL;
+}
+
+typedef struct {
+    size_t               nitems;
+    size_t               nchunks;
+    const xysort_item_t* src;
+    xysort_item_t*       dst;
+    size_t*              counts; /* [nchunks][XYSORT_RADIX_SIZE] */
+    int                  shift;
+} xysort_pass_t;
+
+static inline void
+xysort_chunk_range(
+        const xysort_pass_t* const pass,
+        const size_t chunk,
+        size_t* const start,
+        size_t* const end) {
+
+    *start = (pass->nitems * chunk) / pass->nchunks;
+    *end = (pass->nitems * (chunk + 1)) / pass->nchunks;
+}
+
+static int
+xysort_count_task(
+        void* data,
+        const size_t chunk,
+        stimage_error_t* const error) {
+
+    xysort_pass_t* pass   = (xysort_pass_t*)data;
+    size_t*        counts = pass->counts + chunk * XYSORT_RADIX_SIZE;
+    size_t         start, end, i;
+
+    xysort_chunk_range(pass, chunk, &start, &end);
+
+    memset(counts, 0, XYSORT_RADIX_SIZE * sizeof(size_t));
+    for (i = start; i < end; ++i) {
+        ++counts[(pass->src[i].key >> pass->shift) & XYSORT_RADIX_MASK];
+    }
+
+    return 0;
+}
+
+static int
+xysort_scatter_task(
+        void* data,
+        const size_t chunk,
+        stimage_error_t* const error) {
+
+    xysort_pass_t* pass    = (xysort_pass_t*)data;
+    size_t*        offsets = pass->counts + chunk * XYSORT_RADIX_SIZE;
+    size_t         start, end, i;
+
+    xysort_chunk_range(pass, chunk, &start, &end);
+
+    for (i = start; i < end; ++i) {
+        pass->dst[offsets[(pass->src[i].key >> pass->shift) &
+                          XYSORT_RADIX_MASK]++] = pass->src[i];
+    }
+
+    return 0;
+}
+
+/* Sort items on their keys.  The result may end up in either buffer,
+   and *items is updated to point to it. */
+static int
+xysort_radix(
+        xysort_pass_t* const pass,
+        const size_t nthreads,
+        xysort_item_t** const items,
+        xysort_item_t** const tmp,
+        stimage_error_t* const error) {
+
+    xysort_item_t* swap;
+    size_t         total, count, b, c;
+    int            p, skip;
+
+    for (p = 0; p < XYSORT_NPASSES; ++p) {
+        pass->src = *items;
+        pass->dst = *tmp;
+        pass->shift = p * XYSORT_RADIX_BITS;
+
+        if (parallel_for(
+                    nthreads, pass->nchunks, &xysort_count_task, pass,
+                    error)) return 1;
+
+        /* If every item has the same digit, the pass is a no-op */
+        skip = 0;
+        for (b = 0; b < XYSORT_RADIX_SIZE && !skip; ++b) {
+            count = 0;
+            for (c = 0; c < pass->nchunks; ++c) {
+                count += pass->counts[c * XYSORT_RADIX_SIZE + b];
+            }
+            skip = (count == pass->nitems);
+        }
+        if (skip) {
+            continue;
+        }
+
+        /* Convert the counts into output offsets for each chunk */
+        total = 0;
+        for (b = 0; b < XYSORT_RADIX_SIZE; ++b) {
+            for (c = 0; c < pass->nchunks; ++c) {
+                count = pass->counts[c * XYSORT_RADIX_SIZE + b];
+                pass->counts[c * XYSORT_RADIX_SIZE + b] = total;
+                total += count;
+            }
+        }
+        assert(total == pass->nitems);
+
+        if (parallel_for(
+                    nthreads, pass->nchunks, &xysort_scatter_task, pass,
+                    error)) return 1;
+
+        swap = *items;
+        *items = *tmp;
+        *tmp = swap;
+    }
+
+    return 0;
+}
+
+int
+xysort_index(
+    const size_t ncoords,
+    const coord_t* const coords /* [ncoords] */,
+    size_t* const index /* [ncoords] */,
+    size_t nthreads,
+    stimage_error_t* const error) {
+
+    xysort_item_t* buf0   = NULL;
+    xysort_item_t* buf1   = NULL;
+    xysort_item_t* items  = NULL;
+    xysort_item_t* tmp    = NULL;
+    xysort_pass_t  pass;
+    size_t         i;
+    int            status = 1;
+
+    assert(coords);
+    assert(index);
+    assert(error);
+
+    pass.counts = NULL;
+
+    if (nthreads == 0) {
+        nthreads = parallel_default_nthreads();
+    }
+
+    pass.nitems = ncoords;
+    pass.nchunks = MAX(1, MIN(nthreads, ncoords / XYSORT_CHUNK_MIN));
+
+    buf0 = malloc_with_error(MAX(1, ncoords) * sizeof(xysort_item_t), error);
+    if (buf0 == NULL) goto exit;
+    buf1 = malloc_with_error(MAX(1, ncoords) * sizeof(xysort_item_t), error);
+    if (buf1 == NULL) goto exit;
+    pass.counts = malloc_with_error(
+            pass.nchunks * XYSORT_RADIX_SIZE * sizeof(size_t), error);
+    if (pass.counts == NULL) goto exit;
+
+    items = buf0;
+    tmp = buf1;
+
+    /* Secondary key */
+    for (i = 0; i < ncoords; ++i) {
+        items[i].key = xysort_key(coords[i].x);
+        items[i].index = i;
+    }
+    if (xysort_radix(&pass, nthreads, &items, &tmp, error)) goto exit;
+
+    /* Primary key */
+    for (i = 0; i < ncoords; ++i) {
+        items[i].key = xysort_key(coords[items[i].index].y);
+    }
+    if (xysort_radix(&pass, nthreads, &items, &tmp, error)) goto exit;
+
+    for (i = 0; i < ncoords; ++i) {
+        index[i] = items[i].index;
+    }
+
+    status = 0;
+
+ exit:
+
+    free(buf0);
+    free(buf1);
+    free(pass.counts);
+
+    return status;
+}
+
 void
 xysort(
     const size_t ncoords,
     const coord_t* const coords /* [ncoords] */,
     const coord_t** const coords_ptr /* [ncoords] */) {
 
-    size_t i;
+    size_t*         index = NULL;
+    stimage_error_t error;
+    size_t          i;
 
     assert(coords);
     assert(coords_ptr);
 
+    if (ncoords >= XYSORT_RADIX_MIN) {
+        stimage_error_init(&error);
+        index = malloc(ncoords * sizeof(size_t));
+        if (index != NULL &&
+            xysort_index(ncoords, coords, index, 1, &error) == 0) {
+            for (i = 0; i < ncoords; ++i) {
+                coords_ptr[i] = coords + index[i];
+            }
+            free(index);
+            return;
+        }
+        /* If memory is short, fall back to the in-place qsort */
+        free(index);
+    }
+
     /* Fill the pointer array */
     for (i = 0; i < ncoords; ++i) {
         coords_ptr[i] = (coord_t*)coords + i;
@@ -46,14 +46,14 @@ cholesky_factorization(
     #define MATRIX(j, i) (matrix[(i)*nbands+(j)])
     #define MATFAC(j, i) (matfac[(i)*nbands+(j)])
 
-    size_t i, n, j;
-    int imax, jmax;
+    size_t i, n, j, imax, jmax;
     double ratio;
 
     assert(matrix);
     assert(matfac);
     assert(error_type);
     assert(error);
+    assert(nbands >= 1);
 
     if (nrows == 1) {
         if (MATRIX(0, 0) > 0.0) {
@@ -65,7 +65,6 @@ cholesky_factorization(
     /* Copy matrix into matfac */
     for (n = 0; n < nrows; ++n) {
         for (j = 0; j < nbands; ++j) {
-            assert(n < nbands && j < nrows);
             MATFAC(j, n) = MATRIX(j, n);
         }
     }
@@ -75,31 +74,27 @@ cholesky_factorization(
         if (((MATFAC(0, n) + MATRIX(0, n)) - MATRIX(0, n)) <=
             1000.0 / MAX_DOUBLE) {
             for (j = 0; j < nbands; ++j) {
-                assert(n < nbands && j < nrows);
                 MATFAC(j, n) = 0.0;
             }
             *error_type = surface_fit_error_singular;
             continue;
         }
 
-        assert(MATFAC(0, n) != 0.0);
         MATFAC(0, n) = 1.0 / MATFAC(0, n);
-        imax = MIN(nbands - 1, nrows - n);
-        if (imax < 0) {
+        imax = MIN(nbands - 1, nrows - 1 - n);
+        if (imax < 1) {
             continue;
         }
 
         jmax = imax;
-        for (i = 0; i < (size_t)imax; ++i) {
-            assert(n < nbands && i+1 < nrows);
-            ratio = MATFAC(i+1, n) * MATFAC(0, n);
-            for (j = 0; j < (size_t)jmax; ++j) {
-                assert(n+i < nbands && j < nrows && j+i < nrows);
-                MATFAC(j, n+i) = MATFAC(j, n+i) - MATFAC(j+i, n) * ratio;
+        for (i = 1; i <= imax; ++i) {
+            ratio = MATFAC(i, n) * MATFAC(0, n);
+            for (j = 0; j < jmax; ++j) {
+                assert(j + i < nbands && n + i < nrows);
+                MATFAC(j, n+i) -= MATFAC(j+i, n) * ratio;
             }
             --jmax;
-            assert(n < nbands && i+1 < nrows);
-            MATFAC(i+1, n) = ratio;
+            MATFAC(i, n) = ratio;
         }
     }
 
@@ -121,7 +116,7 @@ cholesky_solve(
 
     #define MATFAC(j, i) (matfac[(i)*nbands+(j)])
 
-    size_t i, j, jmax, nbands_m1;
+    size_t i, j, jmax;
     int n;
 
     assert(matfac);
@@ -142,24 +137,19 @@ cholesky_solve(
     }
 
     /* Forward substitution */
-    nbands_m1 = nbands - 1;
     for (n = 0; n < (int)nrows; ++n) {
-        jmax = MIN(nbands_m1, nrows - n);
-        if (jmax >= 1) {
-            for (j = 0; j < jmax; ++j) {
-                coeff[j+n] -= MATFAC(j+1, n) * coeff[n];
-            }
+        jmax = MIN(nbands - 1, nrows - 1 - (size_t)n);
+        for (j = 1; j <= jmax; ++j) {
+            coeff[n+j] -= MATFAC(j, n) * coeff[n];
         }
     }
 
     /* Back substitution */
     for (n = (int)nrows - 1; n >= 0; --n) {
         coeff[n] *= MATFAC(0, n);
-        jmax = MIN(nbands_m1, nrows - n);
-        if (jmax >= 1) {
-            for (j = 0; j < jmax; ++j) {
-                coeff[n] -= MATFAC(j+1, n) * coeff[j+n];
-            }
+        jmax = MIN(nbands - 1, nrows - 1 - (size_t)n);
+        for (j = 1; j <= jmax; ++j) {
+            coeff[n] -= MATFAC(j, n) * coeff[n+j];
         }
     }
 
@@ -30,6 +30,7 @@ DAMAGE.
 */
 
 #include <assert.h>
+#include <math.h>
 #include <stdio.h>
 
 #include "surface/cholesky.h"
@@ -52,48 +53,16 @@ vector_dot_product(
     return sum;
 }
 
-/* was dgsacpts */
-static int
-surface_fit_add_points(
-        surface_t* const s,
+/* Calculate the weights of the points */
+static void
+surface_fit_weights(
         const size_t ncoord,
         const coord_t* const coord,
-        const double* const z,
         double* const w,
-        const surface_fit_weight_e weight_type,
-        stimage_error_t* const error) {
-
-    size_t i, j, k, l, ii, jj, ll;
-    double* byw = NULL;
-    double* bw = NULL;
-    double* xbasis = NULL;
-    double* ybasis = NULL;
-    double* vzp;
-    double* mzp;
-    double* bxp;
-    double* byp;
-    double* vindex;
-    double* mindex;
-    double* bbyp;
-    double* bbxp;
-    int xorder;
-    int xxorder;
-    int maxorder;
-    size_t ntimes;
-    int status = 1;
-
-    assert(s);
-    assert(coord);
-    assert(z);
-    assert(w);
-    assert(error);
-    assert(s->vector);
-    assert(s->matrix);
+        const surface_fit_weight_e weight_type) {
 
-    /* Increment the number of points */
-    s->npoints += ncoord;
+    size_t i;
 
-    /* Calculate weights */
     switch (weight_type) {
     case surface_fit_weight_spacing:
         if (ncoord == 1) {
@@ -121,10 +90,76 @@ surface_fit_add_points(
         }
         break;
     }
+}
+
+/* List the x and y powers of the basis function of each coefficient
+   of a surface, in the order surface_fit_add_points computes them */
+static size_t
+surface_fit_terms(
+        const size_t xorder,
+        const size_t yorder,
+        const xterms_e xterms,
+        /* Output */
+        size_t* const kx,
+        size_t* const ly) {
+
+    size_t k, l;
+    size_t n        = 0;
+    size_t nx       = xorder;
+    size_t maxorder = MAX(xorder + 1, yorder + 1);
+
+    for (l = 0; l < yorder; ++l) {
+        for (k = 0; k < nx; ++k) {
+            kx[n] = k;
+            ly[n] = l;
+            ++n;
+        }
 
-    xbasis = malloc_with_error(ncoord * s->xorder * sizeof(double), error);
+        switch (xterms) {
+        case xterms_none:
+            nx = 1;
+            break;
+        case xterms_half:
+            if (l + 1 + xorder + 1 > maxorder) {
+                --nx;
+            }
+            break;
+        default:
+            break;
+        }
+    }
+
+    return n;
+}
+
+int
+surface_fit_basis(
+        const surface_t* const s,
+        const size_t ncoord,
+        const coord_t* const coord,
+        workspace_t* const workspace,
+        /* Output */
+        double* const basis,
+        stimage_error_t* const error) {
+
+    size_t i, k, l;
+    double* xbasis = NULL;
+    double* ybasis = NULL;
+    double* tbp;
+    int xorder;
+    int maxorder;
+    int status = 1;
+
+    assert(s);
+    assert(coord);
+    assert(basis);
+    assert(error);
+
+    xbasis = workspace_alloc(
+            workspace, ncoord * s->xorder * sizeof(double), error);
     if (xbasis == NULL) goto exit;
-    ybasis = malloc_with_error(ncoord * s->yorder * sizeof(double), error);
+    ybasis = workspace_alloc(
+            workspace, ncoord * s->yorder * sizeof(double), error);
     if (ybasis == NULL) goto exit;
 
     /* Calculate the non-zero basis functions */
@@ -158,104 +193,110 @@ surface_fit_add_points(
         goto exit;
     }
 
-    /* Allocate temporary space for matrix accumulation */
-    byw = malloc_with_error(ncoord * sizeof(double), error);
-    if (byw == NULL) goto exit;
-    bw = malloc_with_error(ncoord * sizeof(double), error);
-    if (bw == NULL) goto exit;
-
-    vzp = s->vector - 1;
-    mzp = s->matrix;
-    bxp = xbasis;
-    byp = ybasis;
-
+    /* Compute the basis function for each coefficient.  The
+       coefficients are ordered with x varying fastest, and the number
+       of x terms in each row of y depends on the cross terms. */
     maxorder = MAX(s->xorder + 1, s->yorder + 1);
     xorder = s->xorder;
-    ntimes = 0;
-    for (l = 1; l <= s->yorder; ++l) {
-        for (i = 0; i < ncoord; ++i) {
-            byw[i] = w[i] * byp[i];
-        }
-
-        bxp = xbasis;
-
-        for (k = 1; k <= s->xorder; ++k) {
+    tbp = basis;
+    for (l = 0; l < (size_t)s->yorder; ++l) {
+        for (k = 0; k < (size_t)xorder; ++k) {
+            assert((size_t)(tbp - basis) < s->ncoeff * ncoord);
             for (i = 0; i < ncoord; ++i) {
-                bw[i] = byw[i] * bxp[i];
-            }
-
-            vindex = vzp + k;
-            assert(vindex - s->vector < s->ncoeff);
-            *vindex += vector_dot_product(ncoord, bw, z);
-            bbyp = byp;
-            bbxp = bxp;
-            xxorder = xorder;
-            jj = k;
-            ll = l;
-            ii = 0;
-            for (j = k + ntimes; j <= s->ncoeff; ++j) {
-                mindex = mzp + ii;
-                assert(mindex - s->matrix < s->ncoeff * s->ncoeff);
-                assert((bbxp - xbasis) + ncoord - 1 < ncoord * s->xorder);
-                assert((bbyp - ybasis) + ncoord - 1 < ncoord * s->yorder);
-                for (i = 0; i < ncoord; ++i) {
-                    *mindex += bw[i] * bbxp[i] * bbyp[i];
-                }
-                if (jj % xxorder == 0) {
-                    jj = 1;
-                    ++ll;
-                    bbxp = xbasis;
-                    bbyp += ncoord;
-                    switch (s->xterms) {
-                    case xterms_none:
-                        xxorder = 1;
-                        break;
-                    case xterms_half:
-                        if ((ll + s->xorder) > maxorder) {
-                            --xxorder;
-                        }
-                        break;
-                    default:
-                        break;
-                    }
-                } else {
-                    ++jj;
-                    bbxp += ncoord;
-                }
-                ++ii;
+                tbp[i] = xbasis[k*ncoord + i] * ybasis[l*ncoord + i];
             }
-            mzp += s->ncoeff;
-            bxp += ncoord;
+            tbp += ncoord;
         }
 
-        vzp += xorder;
-        ntimes += xorder;
-
         switch (s->xterms) {
         case xterms_none:
             xorder = 1;
             break;
         case xterms_half:
-            if ((l + s->xorder + 1) > maxorder) {
+            if ((int)(l + 1 + s->xorder + 1) > maxorder) {
                 --xorder;
             }
             break;
         default:
             break;
         }
-        byp += ncoord;
     }
+    assert((size_t)(tbp - basis) == s->ncoeff * ncoord);
 
     status = 0;
 
-    surface_print(s);
+ exit:
+
+    workspace_release(workspace, xbasis);
+    workspace_release(workspace, ybasis);
+
+    return status;
+}
+
+/* was dgsacpts */
+static int
+surface_fit_add_points(
+        surface_t* const s,
+        const size_t ncoord,
+        const coord_t* const coord,
+        const double* const z,
+        double* const w,
+        const surface_fit_weight_e weight_type,
+        workspace_t* const workspace,
+        stimage_error_t* const error) {
+
+    size_t i, k, m;
+    double* bw = NULL;
+    double* tbasis = NULL;
+    double* mzp;
+    int status = 1;
+
+    assert(s);
+    assert(coord);
+    assert(z);
+    assert(w);
+    assert(error);
+    assert(s->vector);
+    assert(s->matrix);
+
+    /* Increment the number of points */
+    s->npoints += ncoord;
+
+    surface_fit_weights(ncoord, coord, w, weight_type);
+
+    /* Allocate temporary space for matrix accumulation */
+    bw = workspace_alloc(
+            workspace, ncoord * sizeof(double), error);
+    if (bw == NULL) goto exit;
+    tbasis = workspace_alloc(
+            workspace, ncoord * s->ncoeff * sizeof(double), error);
+    if (tbasis == NULL) goto exit;
+
+    if (surface_fit_basis(
+                s, ncoord, coord, workspace, tbasis, error)) goto exit;
+
+    /* Accumulate the normal equations.  Only the upper triangle of
+       the matrix is stored, in banded form, so that element (k, m) is
+       at matrix[k * ncoeff + (m - k)]. */
+    for (k = 0; k < s->ncoeff; ++k) {
+        for (i = 0; i < ncoord; ++i) {
+            bw[i] = w[i] * tbasis[k*ncoord + i];
+        }
+
+        s->vector[k] += vector_dot_product(ncoord, bw, z);
+
+        mzp = s->matrix + k * s->ncoeff;
+        for (m = k; m < s->ncoeff; ++m) {
+            mzp[m - k] += vector_dot_product(ncoord, bw, tbasis + m*ncoord);
+        }
+    }
+
+    status = 0;
 
  exit:
 
-    free(byw);
-    free(bw);
-    free(xbasis);
-    free(ybasis);
+    workspace_release(workspace, bw);
+    workspace_release(workspace, tbasis);
 
     return status;
 }
@@ -302,8 +343,6 @@ surface_fit_solve(
         return 1;
     }
 
-    surface_print(s);
-
     return 0;
 }
 
@@ -315,6 +354,7 @@ surface_fit(
         const double* const z,
         double* const w,
         const surface_fit_weight_e weight_type,
+        workspace_t* const workspace,
         /* Output */
         surface_fit_error_e* const error_type,
         stimage_error_t* const error) {
@@ -326,10 +366,433 @@ surface_fit(
     assert(error);
 
     if (surface_zero(s, error) ||
-        surface_fit_add_points(s, ncoord, coord, z, w, weight_type, error) ||
+        surface_fit_add_points(
+                s, ncoord, coord, z, w, weight_type, workspace, error) ||
         surface_fit_solve(s, error_type, error)) {
         return 1;
     }
 
     return 0;
 }
+
+/* Find the index among the n terms kx, ly of each of the m terms skx,
+   sly.  Returns non-zero if one of them is missing. */
+static int
+surface_fit_match_terms(
+        const size_t n,
+        const size_t* const kx,
+        const size_t* const ly,
+        const size_t m,
+        const size_t* const skx,
+        const size_t* const sly,
+        /* Output */
+        size_t* const idx) {
+
+    size_t a, i;
+
+    for (a = 0; a < m; ++a) {
+        for (i = 0; i < n; ++i) {
+            if (kx[i] == skx[a] && ly[i] == sly[a]) {
+                break;
+            }
+        }
+        if (i == n) {
+            return 1;
+        }
+        idx[a] = i;
+    }
+
+    return 0;
+}
+
+int
+surface_fit_covariance(
+        const surface_t* const s,
+        /* Output */
+        double* const covariance,
+        stimage_error_t* const error) {
+
+    const size_t n = s->ncoeff;
+    size_t       i, k;
+
+    assert(s);
+    assert(s->cholesky_fact);
+    assert(covariance);
+    assert(error);
+
+    if (s->npoints == 0) {
+        stimage_error_set_message(error, "The surface has not been fit");
+        return 1;
+    }
+
+    /* Column k of the inverse of the normal matrix is the solution
+       for the k-th unit vector.  cholesky_solve copies its right side
+       before solving, so it can solve in place. */
+    for (k = 0; k < n; ++k) {
+        for (i = 0; i < n; ++i) {
+            covariance[k * n + i] = (i == k) ? 1.0 : 0.0;
+        }
+        if (cholesky_solve(
+                    n, n, s->cholesky_fact, covariance + k * n,
+                    covariance + k * n, error)) return 1;
+    }
+
+    return 0;
+}
+
+/* Copy the principal sub-block of the banded normal equations of an
+   n-coefficient surface selected by idx, less those of sub_matrix if
+   it is not NULL, into the m-coefficient banded matrix and vector */
+static void
+surface_fit_sub_block(
+        const size_t n,
+        const double* const matrix,
+        const double* const vector,
+        const double* const sub_matrix,
+        const double* const sub_vector,
+        const size_t m,
+        const size_t* const idx,
+        /* Output */
+        double* const block_matrix,
+        double* const block_vector) {
+
+    size_t a, b, ab;
+
+    for (a = 0; a < m; ++a) {
+        block_vector[a] = vector[idx[a]];
+        if (sub_vector != NULL) {
+            block_vector[a] -= sub_vector[idx[a]];
+        }
+        for (b = a; b < m; ++b) {
+            ab = idx[a] * n + (idx[b] - idx[a]);
+            block_matrix[a * m + (b - a)] = matrix[ab];
+            if (sub_matrix != NULL) {
+                block_matrix[a * m + (b - a)] -= sub_matrix[ab];
+            }
+        }
+        for (b = m - a; b < m; ++b) {
+            block_matrix[a * m + b] = 0.0;
+        }
+    }
+}
+
+/* The weighted sum of squared residuals of the coefficients c, given
+   the normal equations of the points (selected by idx from the
+   n-coefficient banded matrix and vector) and their weighted sum of
+   squares zwz */
+static double
+surface_fit_chisq(
+        const size_t n,
+        const double* const matrix,
+        const double* const vector,
+        const double zwz,
+        const size_t m,
+        const size_t* const idx,
+        const double* const c) {
+
+    size_t a, b;
+    double cmc = 0.0;
+    double cv  = 0.0;
+
+    for (a = 0; a < m; ++a) {
+        cv += c[a] * vector[idx[a]];
+        cmc += c[a] * c[a] * matrix[idx[a] * n];
+        for (b = a + 1; b < m; ++b) {
+            cmc += 2.0 * c[a] * c[b] * matrix[idx[a] * n + (idx[b] - idx[a])];
+        }
+    }
+
+    return zwz - 2.0 * cv + cmc;
+}
+
+int
+surface_fit_nested(
+        surface_t* const s,
+        const size_t ncoord,
+        const coord_t* const coord,
+        const double* const z,
+        double* const w,
+        const surface_fit_weight_e weight_type,
+        const size_t nsurfaces,
+        const size_t* const xorders,
+        const size_t* const yorders,
+        const size_t nfolds,
+        workspace_t* const workspace,
+        /* Output */
+        surface_fit_score_t* const scores,
+        stimage_error_t* const error) {
+
+    const size_t        n           = s->ncoeff;
+    const size_t        nf          = nfolds >= 2 ? nfolds : 1;
+    size_t*             kx          = NULL;
+    size_t*             ly          = NULL;
+    size_t*             skx         = NULL;
+    size_t*             sly         = NULL;
+    size_t*             idx         = NULL;
+    double*             fold_matrix = NULL;
+    double*             fold_vector = NULL;
+    double*             fold_zwz    = NULL;
+    size_t*             fold_npoints = NULL;
+    double*             block       = NULL;
+    double*             block_vector = NULL;
+    double*             fact        = NULL;
+    double*             c           = NULL;
+    coord_t*            fold_coord  = NULL;
+    double*             fold_z      = NULL;
+    double*             fold_w      = NULL;
+    double              zwz         = 0.0;
+    double              cv          = 0.0;
+    double              my_nan      = fmod(1.0, 0.0);
+    surface_fit_error_e error_type;
+    size_t              i, j, f, m, nfold;
+    int                 status      = 1;
+
+    assert(s);
+    assert(s->matrix);
+    assert(s->vector);
+    assert(coord);
+    assert(z);
+    assert(w);
+    assert(xorders);
+    assert(yorders);
+    assert(scores);
+    assert(error);
+
+    #define ALLOC(p, count, type) \
+        p = workspace_alloc(workspace, (count) * sizeof(type), error); \
+        if (p == NULL) goto exit;
+
+    ALLOC(kx, n, size_t);
+    ALLOC(ly, n, size_t);
+    ALLOC(skx, n, size_t);
+    ALLOC(sly, n, size_t);
+    ALLOC(idx, n, size_t);
+    ALLOC(fold_matrix, nf * n * n, double);
+    ALLOC(fold_vector, nf * n, double);
+    ALLOC(fold_zwz, nf, double);
+    ALLOC(fold_npoints, nf, size_t);
+    ALLOC(block, n * n, double);
+    ALLOC(block_vector, n, double);
+    ALLOC(fact, n * n, double);
+    ALLOC(c, n, double);
+    if (nf > 1) {
+        ALLOC(fold_coord, ncoord / nf + 1, coord_t);
+        ALLOC(fold_z, ncoord / nf + 1, double);
+        ALLOC(fold_w, ncoord / nf + 1, double);
+    }
+
+    #undef ALLOC
+
+    surface_fit_weights(ncoord, coord, w, weight_type);
+
+    /* Accumulate the normal equations of each fold */
+    for (f = 0; f < nf; ++f) {
+        if (nf > 1) {
+            nfold = 0;
+            for (i = f; i < ncoord; i += nf, ++nfold) {
+                fold_coord[nfold] = coord[i];
+                fold_z[nfold] = z[i];
+                fold_w[nfold] = w[i];
+            }
+        } else {
+            nfold = ncoord;
+        }
+
+        if (surface_zero(s, error)) goto exit;
+        s->npoints = 0;
+        if (nfold > 0 && surface_fit_add_points(
+                    s, nfold, nf > 1 ? fold_coord : coord,
+                    nf > 1 ? fold_z : z, nf > 1 ? fold_w : w,
+                    surface_fit_weight_user, workspace, error)) goto exit;
+
+        for (i = 0; i < n * n; ++i) {
+            fold_matrix[f * n * n + i] = s->matrix[i];
+        }
+        for (i = 0; i < n; ++i) {
+            fold_vector[f * n + i] = s->vector[i];
+        }
+        fold_zwz[f] = 0.0;
+        for (i = 0; i < nfold; ++i) {
+            if (nf > 1) {
+                fold_zwz[f] += fold_w[i] * fold_z[i] * fold_z[i];
+            } else {
+                fold_zwz[f] += w[i] * z[i] * z[i];
+            }
+        }
+        fold_npoints[f] = nfold;
+    }
+
+    /* The normal equations of all of the points are the sum of those
+       of the folds */
+    if (nf > 1) {
+        for (i = 0; i < n * n; ++i) {
+            s->matrix[i] = 0.0;
+            for (f = 0; f < nf; ++f) {
+                s->matrix[i] += fold_matrix[f * n * n + i];
+            }
+        }
+        for (i = 0; i < n; ++i) {
+            s->vector[i] = 0.0;
+            for (f = 0; f < nf; ++f) {
+                s->vector[i] += fold_vector[f * n + i];
+            }
+        }
+    }
+    for (f = 0; f < nf; ++f) {
+        zwz += fold_zwz[f];
+    }
+    s->npoints = ncoord;
+
+    surface_fit_terms(s->xorder, s->yorder, s->xterms, kx, ly);
+
+    for (j = 0; j < nsurfaces; ++j) {
+        if (xorders[j] < 1 || yorders[j] < 1 ||
+            xorders[j] > s->xorder || yorders[j] > s->yorder) {
+            stimage_error_set_message(
+                    error, "Nested surface is larger than the surface");
+            goto exit;
+        }
+
+        /* Find the coefficients of the nested surface among those of
+           the largest one */
+        m = surface_fit_terms(
+                xorders[j], yorders[j], s->xterms, skx, sly);
+        if (surface_fit_match_terms(n, kx, ly, m, skx, sly, idx)) {
+            stimage_error_set_message(
+                    error, "Surface terms are not nested");
+            goto exit;
+        }
+
+        scores[j].ncoeff = m;
+        scores[j].chisq = my_nan;
+        scores[j].cv = my_nan;
+        scores[j].error_type = surface_fit_error_ok;
+
+        if (s->npoints < m) {
+            scores[j].error_type = surface_fit_error_no_degrees_of_freedom;
+            continue;
+        }
+
+        surface_fit_sub_block(
+                n, s->matrix, s->vector, NULL, NULL, m, idx,
+                block, block_vector);
+        if (cholesky_factorization(
+                    m, m, block, fact, &scores[j].error_type, error) ||
+            cholesky_solve(m, m, fact, block_vector, c, error)) goto exit;
+
+        scores[j].chisq = MAX(0.0, surface_fit_chisq(
+                n, s->matrix, s->vector, zwz, m, idx, c));
+
+        if (nf < 2) {
+            continue;
+        }
+
+        /* Fit the points outside each fold, and score the fit on the
+           points of the fold */
+        cv = 0.0;
+        for (f = 0; f < nf; ++f) {
+            error_type = surface_fit_error_ok;
+            if (s->npoints - fold_npoints[f] < m) {
+                break;
+            }
+            surface_fit_sub_block(
+                    n, s->matrix, s->vector, fold_matrix + f * n * n,
+                    fold_vector + f * n, m, idx, block, block_vector);
+            if (cholesky_factorization(
+                        m, m, block, fact, &error_type, error) ||
+                cholesky_solve(m, m, fact, block_vector, c, error)) goto exit;
+            if (error_type != surface_fit_error_ok) {
+                break;
+            }
+            cv += MAX(0.0, surface_fit_chisq(
+                    n, fold_matrix + f * n * n, fold_vector + f * n,
+                    fold_zwz[f], m, idx, c));
+        }
+        if (f == nf) {
+            scores[j].cv = cv;
+        }
+    }
+
+    /* Leave the fit of all of the points in the largest surface */
+    if (surface_fit_solve(s, &error_type, error)) goto exit;
+
+    status = 0;
+
+ exit:
+
+    workspace_release(workspace, kx);
+    workspace_release(workspace, ly);
+    workspace_release(workspace, skx);
+    workspace_release(workspace, sly);
+    workspace_release(workspace, idx);
+    workspace_release(workspace, fold_matrix);
+    workspace_release(workspace, fold_vector);
+    workspace_release(workspace, fold_zwz);
+    workspace_release(workspace, fold_npoints);
+    workspace_release(workspace, block);
+    workspace_release(workspace, block_vector);
+    workspace_release(workspace, fact);
+    workspace_release(workspace, c);
+    workspace_release(workspace, fold_coord);
+    workspace_release(workspace, fold_z);
+    workspace_release(workspace, fold_w);
+
+    return status;
+}
+
+int
+surface_fit_nested_index(
+        const surface_t* const s,
+        const surface_t* const sub,
+        workspace_t* const workspace,
+        /* Output */
+        size_t* const idx,
+        int* const nested,
+        stimage_error_t* const error) {
+
+    size_t* kx     = NULL;
+    size_t* ly     = NULL;
+    size_t* skx    = NULL;
+    size_t* sly    = NULL;
+    int     status = 1;
+
+    assert(s);
+    assert(sub);
+    assert(idx);
+    assert(nested);
+    assert(error);
+
+    *nested = 0;
+
+    kx = workspace_alloc(workspace, s->ncoeff * sizeof(size_t), error);
+    if (kx == NULL) goto exit;
+    ly = workspace_alloc(workspace, s->ncoeff * sizeof(size_t), error);
+    if (ly == NULL) goto exit;
+    skx = workspace_alloc(
+            workspace, MAX(1, sub->ncoeff) * sizeof(size_t), error);
+    if (skx == NULL) goto exit;
+    sly = workspace_alloc(
+            workspace, MAX(1, sub->ncoeff) * sizeof(size_t), error);
+    if (sly == NULL) goto exit;
+
+    /* The basis functions only match if they are normalized alike */
+    if (s->type == sub->type &&
+        s->xrange == sub->xrange && s->xmaxmin == sub->xmaxmin &&
+        s->yrange == sub->yrange && s->ymaxmin == sub->ymaxmin) {
+        surface_fit_terms(s->xorder, s->yorder, s->xterms, kx, ly);
+        surface_fit_terms(sub->xorder, sub->yorder, sub->xterms, skx, sly);
+        *nested = !surface_fit_match_terms(
+                s->ncoeff, kx, ly, sub->ncoeff, skx, sly, idx);
+    }
+
+    status = 0;
+
+ exit:
+
+    workspace_release(workspace, kx);
+    workspace_release(workspace, ly);
+    workspace_release(workspace, skx);
+    workspace_release(workspace, sly);
+
+    return status;
+}
@@ -0,0 +1,205 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#define NO_IMPORT_ARRAY
+
+#include <Python.h>
+#include "wrap_util.h"
+
+#include "immatch/crossmatch.h"
+
+/* Get the coord_t for the given epoch from an optional sequence of
+   per-epoch pairs.  c is left untouched if the sequence or the entry
+   is None. */
+static int
+to_epoch_coord_t(
+        const char* const name,
+        PyObject* seq,
+        const Py_ssize_t nepochs,
+        const Py_ssize_t epoch,
+        coord_t* const c) {
+
+    PyObject* item   = NULL;
+    int       status = -1;
+
+    if (seq == NULL || seq == Py_None) {
+        return 0;
+    }
+
+    if (PySequence_Size(seq) != nepochs) {
+        PyErr_Format(
+                PyExc_ValueError,
+                "%s must have one entry per catalog",
+                name);
+        return -1;
+    }
+
+    item = PySequence_GetItem(seq, epoch);
+    if (item == NULL) {
+        return -1;
+    }
+
+    status = to_coord_t(name, item, c);
+    Py_DECREF(item);
+
+    return status;
+}
+
+PyObject*
+py_crossmatch_epochs(PyObject* self, PyObject* args, PyObject* kwds) {
+    PyObject* catalogs_obj    = NULL;
+    double    tolerance       = 1.0;
+    PyObject* origins_obj     = NULL;
+    PyObject* mags_obj        = NULL;
+    PyObject* rotations_obj   = NULL;
+    PyObject* ref_origins_obj = NULL;
+
+    PyObject*        catalogs   = NULL;
+    PyObject**       arrays     = NULL;
+    size_t*          ncoords    = NULL;
+    const coord_t**  coords     = NULL;
+    lintransform_t*  transforms = NULL;
+    size_t*          ids        = NULL;
+    size_t           ntotal     = 0;
+    size_t           nsources   = 0;
+    Py_ssize_t       nepochs    = 0;
+    Py_ssize_t       i;
+    coord_t          origin, mag, rotation, ref_origin;
+    PyObject*        result     = NULL;
+    PyObject*        epoch_ids  = NULL;
+    npy_intp         dims;
+    stimage_error_t  error;
+
+    const char*    keywords[]    = {
+        "catalogs", "tolerance", "origins", "mags", "rotations",
+        "ref_origins", NULL
+    };
+
+    stimage_error_init(&error);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "O|dOOOO:crossmatch_epochs",
+                (char **)keywords,
+                &catalogs_obj, &tolerance, &origins_obj, &mags_obj,
+                &rotations_obj, &ref_origins_obj)) {
+        return NULL;
+    }
+
+    catalogs = PySequence_Fast(catalogs_obj, "catalogs must be a sequence");
+    if (catalogs == NULL) {
+        return NULL;
+    }
+    nepochs = PySequence_Fast_GET_SIZE(catalogs);
+
+    arrays = calloc(nepochs + 1, sizeof(PyObject*));
+    ncoords = malloc((nepochs + 1) * sizeof(size_t));
+    coords = malloc((nepochs + 1) * sizeof(coord_t*));
+    transforms = malloc((nepochs + 1) * sizeof(lintransform_t));
+    if (arrays == NULL || ncoords == NULL || coords == NULL ||
+        transforms == NULL) {
+        PyErr_NoMemory();
+        goto exit;
+    }
+
+    for (i = 0; i < nepochs; ++i) {
+        arrays[i] = (PyObject*)PyArray_ContiguousFromAny(
+                PySequence_Fast_GET_ITEM(catalogs, i), NPY_DOUBLE, 2, 2);
+        if (arrays[i] == NULL) {
+            goto exit;
+        }
+        if (PyArray_DIM(arrays[i], 1) != 2) {
+            PyErr_SetString(PyExc_TypeError, "catalogs must be Nx2 arrays");
+            goto exit;
+        }
+        ncoords[i] = PyArray_DIM(arrays[i], 0);
+        coords[i] = (coord_t*)PyArray_DATA(arrays[i]);
+        ntotal += ncoords[i];
+
+        origin.x = origin.y = 0.0;
+        mag.x = mag.y = 1.0;
+        rotation.x = rotation.y = 0.0;
+        ref_origin.x = ref_origin.y = 0.0;
+        if (to_epoch_coord_t("origins", origins_obj, nepochs, i, &origin) ||
+            to_epoch_coord_t("mags", mags_obj, nepochs, i, &mag) ||
+            to_epoch_coord_t("rotations", rotations_obj, nepochs, i, &rotation) ||
+            to_epoch_coord_t("ref_origins", ref_origins_obj, nepochs, i,
+                             &ref_origin)) {
+            goto exit;
+        }
+        compute_lintransform(origin, mag, rotation, ref_origin, &transforms[i]);
+    }
+
+    ids = malloc((ntotal + 1) * sizeof(size_t));
+    if (ids == NULL) {
+        PyErr_NoMemory();
+        goto exit;
+    }
+
+    if (crossmatch_epochs(
+                nepochs, ncoords, coords, transforms, tolerance,
+                ids, &nsources, &error)) {
+        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    result = PyList_New(nepochs);
+    if (result == NULL) {
+        goto exit;
+    }
+
+    for (i = 0, ntotal = 0; i < nepochs; ntotal += ncoords[i], ++i) {
+        dims = (npy_intp)ncoords[i];
+        epoch_ids = PyArray_SimpleNew(1, &dims, NPY_UINTP);
+        if (epoch_ids == NULL) {
+            Py_CLEAR(result);
+            goto exit;
+        }
+        memcpy(PyArray_DATA(epoch_ids), ids + ntotal,
+               ncoords[i] * sizeof(size_t));
+        PyList_SET_ITEM(result, i, epoch_ids);
+    }
+
+ exit:
+
+    if (arrays != NULL) {
+        for (i = 0; i < nepochs; ++i) {
+            Py_XDECREF(arrays[i]);
+        }
+    }
+    Py_DECREF(catalogs);
+    free(arrays);
+    free(ncoords);
+    free(coords);
+    free(transforms);
+    free(ids);
+
+    return result;
+}
@@ -38,6 +38,7 @@ DAMAGE.
 
 #include <Python.h>
 #include <structmember.h>
+#include <string.h>
 
 #include "wrap_util.h"
 #include "immatch/geomap.h"
@@ -46,6 +47,8 @@ typedef struct {
     PyObject_HEAD
     PyObject *fit_geometry;
     PyObject *function;
+    PyObject *projection;
+    PyObject *refpt;
     PyObject *rms;
     PyObject *mean_ref;
     PyObject *mean_input;
@@ -56,6 +59,16 @@ typedef struct {
     PyObject *ycoeff;
     PyObject *x2coeff;
     PyObject *y2coeff;
+    PyObject *surfaces;
+    PyObject *orders;
+    PyObject *scores;
+    PyObject *xcov;
+    PyObject *ycov;
+    PyObject *x2cov;
+    PyObject *y2cov;
+    PyObject *resamples;
+    PyObject *niter;
+    PyObject *weights;
 } geomap_object;
 
 static PyObject *
@@ -80,16 +93,227 @@ geomap_array_init() {
     return o;
 }
 
+/* The number of surfaces of a fit (x, y, x2 and y2), and the number
+   of values stored for each: xorder, yorder, xterms, xrange, xmaxmin,
+   yrange and ymaxmin */
+#define GEOMAP_NSURFACES 4
+#define GEOMAP_SURFACE_SIZE 7
+
+static PyObject *
+geomap_surfaces_init() {
+    npy_intp dims[2] = {GEOMAP_NSURFACES, GEOMAP_SURFACE_SIZE};
+
+    return PyArray_ZEROS(2, dims, NPY_DOUBLE, 0);
+}
+
+/* The dtype of the scores of the orders tried, built on first use */
+static PyArray_Descr*
+geomap_scores_dtype(void) {
+    static PyArray_Descr* dtype      = NULL;
+    PyObject*             dtype_list = NULL;
+
+    if (dtype == NULL) {
+        dtype_list = Py_BuildValue(
+                "[(ss)(ss)(ss)(ss)(ss)(ss)(ss)(ss)(ss)(ss)(ss)]",
+                "order", "i8",
+                "nxcoeff", "i8",
+                "nycoeff", "i8",
+                "chisq_x", "f8",
+                "chisq_y", "f8",
+                "aic_x", "f8",
+                "aic_y", "f8",
+                "bic_x", "f8",
+                "bic_y", "f8",
+                "cv_x", "f8",
+                "cv_y", "f8");
+        if (dtype_list == NULL) {
+            return NULL;
+        }
+        if (!PyArray_DescrConverter(dtype_list, &dtype)) {
+            dtype = NULL;
+        }
+        Py_DECREF(dtype_list);
+        if (dtype == NULL) {
+            return NULL;
+        }
+    }
+
+    Py_INCREF(dtype);
+    return dtype;
+}
+
+/* A record of the scores array, which has the same layout */
+typedef struct {
+    npy_int64 order;
+    npy_int64 nxcoeff;
+    npy_int64 nycoeff;
+    double    chisq_x;
+    double    chisq_y;
+    double    aic_x;
+    double    aic_y;
+    double    bic_x;
+    double    bic_y;
+    double    cv_x;
+    double    cv_y;
+} geomap_score_record_t;
+
+/* Store the scores of the orders tried in a new array */
+static int
+from_geomap_scores(
+        const geomap_result_t* const result,
+        PyObject** o) {
+
+    PyArray_Descr*               dtype;
+    geomap_score_record_t*       record;
+    const geomap_order_score_t*  score;
+    npy_intp                     dims = (npy_intp)result->nscores;
+    size_t                       i;
+
+    dtype = geomap_scores_dtype();
+    if (dtype == NULL) {
+        return -1;
+    }
+    *o = PyArray_Zeros(1, &dims, dtype, 0);
+    if (*o == NULL) {
+        return -1;
+    }
+
+    for (i = 0; i < result->nscores; ++i) {
+        score = &result->scores[i];
+        record = (geomap_score_record_t*)PyArray_GETPTR1(*o, i);
+        record->order = (npy_int64)score->order;
+        record->nxcoeff = (npy_int64)score->nxcoeff;
+        record->nycoeff = (npy_int64)score->nycoeff;
+        record->chisq_x = score->chisq.x;
+        record->chisq_y = score->chisq.y;
+        record->aic_x = score->aic.x;
+        record->aic_y = score->aic.y;
+        record->bic_x = score->bic.x;
+        record->bic_y = score->bic.y;
+        record->cv_x = score->cv.x;
+        record->cv_y = score->cv.y;
+    }
+
+    return 0;
+}
+
+/* Store the orders of the fit, (xxorder, xyorder, yxorder, yyorder),
+   in a new array */
+static int
+from_geomap_orders(
+        const geomap_result_t* const result,
+        PyObject** o) {
+
+    npy_intp   dims = 4;
+    npy_int64* data;
+
+    *o = PyArray_ZEROS(1, &dims, NPY_INT64, 0);
+    if (*o == NULL) {
+        return -1;
+    }
+
+    data = (npy_int64*)PyArray_DATA(*o);
+    data[0] = (npy_int64)result->xxorder;
+    data[1] = (npy_int64)result->xyorder;
+    data[2] = (npy_int64)result->yxorder;
+    data[3] = (npy_int64)result->yyorder;
+
+    return 0;
+}
+
+/* Store a covariance matrix of n coefficients in a new n x n array,
+   which is empty if none was estimated */
+static int
+from_geomap_covariance(
+        const size_t n,
+        const double* const covariance,
+        PyObject** o) {
+
+    npy_intp dims[2];
+    size_t   i;
+
+    dims[0] = dims[1] = (covariance != NULL) ? (npy_intp)n : 0;
+    *o = PyArray_ZEROS(2, dims, NPY_DOUBLE, 0);
+    if (*o == NULL) {
+        return -1;
+    }
+
+    for (i = 0; i < (size_t)(dims[0] * dims[1]); ++i) {
+        ((double*)PyArray_DATA(*o))[i] = covariance[i];
+    }
+
+    return 0;
+}
+
+/* Store the coefficients fit to the resamples in a new nresamples x
+   ncoeff array */
+static int
+from_geomap_resamples(
+        const geomap_result_t* const result,
+        PyObject** o) {
+
+    npy_intp dims[2];
+    size_t   i;
+
+    dims[0] = (npy_intp)result->nresamples;
+    dims[1] = (npy_intp)(result->nxcoeff + result->nycoeff +
+                         result->nx2coeff + result->ny2coeff);
+    if (result->resamples == NULL) {
+        dims[0] = 0;
+    }
+    *o = PyArray_ZEROS(2, dims, NPY_DOUBLE, 0);
+    if (*o == NULL) {
+        return -1;
+    }
+
+    for (i = 0; i < (size_t)(dims[0] * dims[1]); ++i) {
+        ((double*)PyArray_DATA(*o))[i] = result->resamples[i];
+    }
+
+    return 0;
+}
+
+/* Store the weights of the points in the fit in a new array */
+static int
+from_geomap_weights(
+        const geomap_result_t* const result,
+        PyObject** o) {
+
+    npy_intp dims = (npy_intp)result->nweights;
+    size_t   i;
+
+    if (result->weights == NULL) {
+        dims = 0;
+    }
+    *o = PyArray_ZEROS(1, &dims, NPY_DOUBLE, 0);
+    if (*o == NULL) {
+        return -1;
+    }
+
+    for (i = 0; i < (size_t)dims; ++i) {
+        ((double*)PyArray_DATA(*o))[i] = result->weights[i];
+    }
+
+    return 0;
+}
+
 static int
 geomap_init(geomap_object *self, PyObject *args, PyObject *kwds)
 {
+    geomap_result_t empty;
+
 #if PY_MAJOR_VERSION >= 3
     self->fit_geometry = PyUnicode_FromString("");
     self->function = PyUnicode_FromString("");
+    self->projection = PyUnicode_FromString("");
 #else
     self->fit_geometry = PyString_FromString("");
     self->function = PyString_FromString("");
+    self->projection = PyString_FromString("");
 #endif
+
+    self->refpt = geomap_array_init();
+    if (self->refpt == NULL) return -1;
     
     self->rms = geomap_array_init();
     if (self->rms == NULL) return -1;
@@ -121,6 +345,22 @@ geomap_init(geomap_object *self, PyObject *args, PyObject *kwds)
     self->y2coeff = geomap_array_init();
     if (self->y2coeff == NULL) return -1;
 
+    self->surfaces = geomap_surfaces_init();
+    if (self->surfaces == NULL) return -1;
+
+    geomap_result_init(&empty);
+    if (from_geomap_orders(&empty, &self->orders)) return -1;
+    if (from_geomap_scores(&empty, &self->scores)) return -1;
+    if (from_geomap_covariance(0, NULL, &self->xcov)) return -1;
+    if (from_geomap_covariance(0, NULL, &self->ycov)) return -1;
+    if (from_geomap_covariance(0, NULL, &self->x2cov)) return -1;
+    if (from_geomap_covariance(0, NULL, &self->y2cov)) return -1;
+    if (from_geomap_resamples(&empty, &self->resamples)) return -1;
+    if (from_geomap_weights(&empty, &self->weights)) return -1;
+
+    self->niter = PyLong_FromSize_t(0);
+    if (self->niter == NULL) return -1;
+
     return 0;
 }
 
@@ -129,6 +369,8 @@ geomap_dealloc(geomap_object *self)
 {    
     Py_XDECREF(self->fit_geometry);
     Py_XDECREF(self->function);
+    Py_XDECREF(self->projection);
+    Py_XDECREF(self->refpt);
     Py_XDECREF(self->rms);
     Py_XDECREF(self->mean_ref);
     Py_XDECREF(self->mean_input);
@@ -139,16 +381,24 @@ geomap_dealloc(geomap_object *self)
     Py_XDECREF(self->ycoeff);
     Py_XDECREF(self->x2coeff);
     Py_XDECREF(self->y2coeff);
+    Py_XDECREF(self->surfaces);
+    Py_XDECREF(self->orders);
+    Py_XDECREF(self->scores);
+    Py_XDECREF(self->xcov);
+    Py_XDECREF(self->ycov);
+    Py_XDECREF(self->x2cov);
+    Py_XDECREF(self->y2cov);
+    Py_XDECREF(self->resamples);
+    Py_XDECREF(self->niter);
+    Py_XDECREF(self->weights);
     Py_TYPE(self)->tp_free((PyObject*)self);
 }
 
-static PyMethodDef geomap_methods[] = {
-    {NULL}  /* Sentinel */
-};
-
 static PyMemberDef geomap_members[] = {
     {"fit_geometry", T_OBJECT_EX, offsetof(geomap_object, fit_geometry), 0, "fit_geometry"},
     {"function", T_OBJECT_EX, offsetof(geomap_object, function), 0, "function"},
+    {"projection", T_OBJECT_EX, offsetof(geomap_object, projection), 0, "projection"},
+    {"refpt", T_OBJECT_EX, offsetof(geomap_object, refpt), 0, "refpt"},
     {"rms", T_OBJECT_EX, offsetof(geomap_object, rms), 0, "rms"},
     {"mean_ref", T_OBJECT_EX, offsetof(geomap_object, mean_ref), 0, "mean_ref"},
     {"mean_input", T_OBJECT_EX, offsetof(geomap_object, mean_input), 0, "mean_input"},
@@ -159,12 +409,290 @@ static PyMemberDef geomap_members[] = {
     {"ycoeff", T_OBJECT_EX, offsetof(geomap_object, ycoeff), 0, "ycoeff"},
     {"x2coeff", T_OBJECT_EX, offsetof(geomap_object, x2coeff), 0, "x2coeff"},
     {"y2coeff", T_OBJECT_EX, offsetof(geomap_object, y2coeff), 0, "y2coeff"},
+    {"surfaces", T_OBJECT_EX, offsetof(geomap_object, surfaces), 0, "surfaces"},
+    {"orders", T_OBJECT_EX, offsetof(geomap_object, orders), 0, "orders"},
+    {"scores", T_OBJECT_EX, offsetof(geomap_object, scores), 0, "scores"},
+    {"xcov", T_OBJECT_EX, offsetof(geomap_object, xcov), 0, "xcov"},
+    {"ycov", T_OBJECT_EX, offsetof(geomap_object, ycov), 0, "ycov"},
+    {"x2cov", T_OBJECT_EX, offsetof(geomap_object, x2cov), 0, "x2cov"},
+    {"y2cov", T_OBJECT_EX, offsetof(geomap_object, y2cov), 0, "y2cov"},
+    {"resamples", T_OBJECT_EX, offsetof(geomap_object, resamples), 0, "resamples"},
+    {"niter", T_OBJECT_EX, offsetof(geomap_object, niter), 0, "niter"},
+    {"weights", T_OBJECT_EX, offsetof(geomap_object, weights), 0, "weights"},
     {NULL}  /* Sentinel */
 };
 
-static PyTypeObject geomap_class = {
+/* Store the surfaces of a fit in a new GEOMAP_NSURFACES x
+   GEOMAP_SURFACE_SIZE array */
+static int
+from_geomap_surfaces(
+        const geomap_result_t* const result,
+        PyObject** o) {
+
+    const geomap_surface_t* surfaces[GEOMAP_NSURFACES];
+    double*                 row;
+    size_t                  i;
+
+    surfaces[0] = &result->xsurface;
+    surfaces[1] = &result->ysurface;
+    surfaces[2] = &result->x2surface;
+    surfaces[3] = &result->y2surface;
+
+    *o = geomap_surfaces_init();
+    if (*o == NULL) {
+        return -1;
+    }
+
+    for (i = 0; i < GEOMAP_NSURFACES; ++i) {
+        row = (double*)PyArray_GETPTR2(*o, i, 0);
+        row[0] = (double)surfaces[i]->xorder;
+        row[1] = (double)surfaces[i]->yorder;
+        row[2] = (double)surfaces[i]->xterms;
+        row[3] = surfaces[i]->xrange;
+        row[4] = surfaces[i]->xmaxmin;
+        row[5] = surfaces[i]->yrange;
+        row[6] = surfaces[i]->ymaxmin;
+    }
+
+    return 0;
+}
+
+/* The inverse of from_geomap_surfaces */
+static int
+to_geomap_surfaces(
+        PyObject* o,
+        geomap_result_t* const result) {
+
+    geomap_surface_t* surfaces[GEOMAP_NSURFACES];
+    PyObject*         array = NULL;
+    const double*     row;
+    size_t            i;
+    int               status = -1;
+
+    surfaces[0] = &result->xsurface;
+    surfaces[1] = &result->ysurface;
+    surfaces[2] = &result->x2surface;
+    surfaces[3] = &result->y2surface;
+
+    array = (PyObject*)PyArray_ContiguousFromAny(o, NPY_DOUBLE, 2, 2);
+    if (array == NULL) {
+        return -1;
+    }
+    if (PyArray_DIM(array, 0) != GEOMAP_NSURFACES ||
+        PyArray_DIM(array, 1) != GEOMAP_SURFACE_SIZE) {
+        PyErr_Format(
+                PyExc_ValueError, "surfaces must be a %dx%d array",
+                GEOMAP_NSURFACES, GEOMAP_SURFACE_SIZE);
+        goto exit;
+    }
+
+    for (i = 0; i < GEOMAP_NSURFACES; ++i) {
+        row = (const double*)PyArray_GETPTR2(array, i, 0);
+        if (!(row[0] >= 0.0) || !(row[1] >= 0.0) || row[0] > 1e6 ||
+            row[1] > 1e6 || !(row[2] >= 0.0) || row[2] >= xterms_LAST) {
+            PyErr_SetString(PyExc_ValueError, "Invalid surface in surfaces");
+            goto exit;
+        }
+        surfaces[i]->xorder = (size_t)row[0];
+        surfaces[i]->yorder = (size_t)row[1];
+        surfaces[i]->xterms = (xterms_e)row[2];
+        surfaces[i]->xrange = row[3];
+        surfaces[i]->xmaxmin = row[4];
+        surfaces[i]->yrange = row[5];
+        surfaces[i]->ymaxmin = row[6];
+    }
+
+    status = 0;
+
+ exit:
+    Py_DECREF(array);
+    return status;
+}
+
+/* Get the UTF-8 contents of a string attribute */
+static const char*
+geomap_string(
+        PyObject* o) {
+
+#if PY_MAJOR_VERSION >= 3
+    return PyUnicode_AsUTF8(o);
+#else
+    return PyString_AsString(o);
+#endif
+}
+
+/* Convert a GeomapResults object back to a geomap_result_t.  The
+   coefficients are not copied: result points into the arrays stored
+   in coeffs, which the caller must release. */
+static int
+geomap_object_to_result(
+        geomap_object* self,
+        geomap_result_t* const result,
+        PyObject** const coeffs) {
+
+    PyObject* members[4];
+    size_t*   counts[4];
+    double**  values[4];
+    size_t    i;
+
+    members[0] = self->xcoeff;
+    members[1] = self->ycoeff;
+    members[2] = self->x2coeff;
+    members[3] = self->y2coeff;
+    counts[0] = &result->nxcoeff;
+    counts[1] = &result->nycoeff;
+    counts[2] = &result->nx2coeff;
+    counts[3] = &result->ny2coeff;
+    values[0] = &result->xcoeff;
+    values[1] = &result->ycoeff;
+    values[2] = &result->x2coeff;
+    values[3] = &result->y2coeff;
+
+    if (to_geomap_fit_e(
+                "fit_geometry", geomap_string(self->fit_geometry),
+                &result->fit_geometry) ||
+        PyErr_Occurred() ||
+        to_surface_type_e(
+                "function", geomap_string(self->function),
+                &result->function) ||
+        PyErr_Occurred() ||
+        to_geomap_proj_e(
+                "projection", geomap_string(self->projection),
+                &result->projection) ||
+        PyErr_Occurred() ||
+        to_coord_t("refpt", self->refpt, &result->refpt) ||
+        to_geomap_surfaces(self->surfaces, result)) {
+        return -1;
+    }
+
+    for (i = 0; i < 4; ++i) {
+        coeffs[i] = (PyObject*)PyArray_ContiguousFromAny(
+                members[i], NPY_DOUBLE, 1, 1);
+        if (coeffs[i] == NULL) {
+            return -1;
+        }
+        *counts[i] = (size_t)PyArray_DIM(coeffs[i], 0);
+        *values[i] = (double*)PyArray_DATA(coeffs[i]);
+    }
+
+    /* The second order surfaces are only used if they were fit */
+    if (result->x2surface.xorder == 0) {
+        result->nx2coeff = 0;
+    }
+    if (result->y2surface.xorder == 0) {
+        result->ny2coeff = 0;
+    }
+
+    return 0;
+}
+
+static PyObject*
+geomap_evaluate(geomap_object* self, PyObject* args, PyObject* kwds) {
+    PyObject*       ref_obj   = NULL;
+    PyObject*       ref_array = NULL;
+    PyObject*       fit_array = NULL;
+    PyObject*       coeffs[4] = {NULL, NULL, NULL, NULL};
+    geomap_result_t result;
+    npy_intp        dims[2];
+    stimage_error_t error;
+    size_t          i;
+    int             status;
+
+    const char*    keywords[]    = {"ref", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "O:evaluate", (char **)keywords, &ref_obj)) {
+        return NULL;
+    }
+
+    geomap_result_init(&result);
+    stimage_error_init(&error);
+
+    if (geomap_object_to_result(self, &result, coeffs)) {
+        goto exit;
+    }
+
+    ref_array = (PyObject*)PyArray_ContiguousFromAny(
+            ref_obj, NPY_DOUBLE, 2, 2);
+    if (ref_array == NULL) {
+        goto exit;
+    }
+    if (PyArray_DIM(ref_array, 1) != 2) {
+        PyErr_SetString(PyExc_TypeError, "ref array must be an Nx2 array");
+        goto exit;
+    }
+
+    dims[0] = PyArray_DIM(ref_array, 0);
+    dims[1] = 2;
+    fit_array = PyArray_SimpleNew(2, dims, NPY_DOUBLE);
+    if (fit_array == NULL) {
+        goto exit;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    status = geomap_result_eval(
+            &result, (size_t)dims[0], (coord_t*)PyArray_DATA(ref_array),
+            (coord_t*)PyArray_DATA(fit_array), &error);
+    Py_END_ALLOW_THREADS
+    if (status) {
+        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
+        Py_CLEAR(fit_array);
+    }
+
+ exit:
+
+    Py_XDECREF(ref_array);
+    for (i = 0; i < 4; ++i) {
+        Py_XDECREF(coeffs[i]);
+    }
+
+    return fit_array;
+}
+
+/* Pickle as the type and its attributes, which are set again one by
+   one when unpickling.  The arrays are pickled by numpy, so with
+   protocol 5 they may be passed out-of-band. */
+static PyObject*
+geomap_reduce(geomap_object* self, PyObject* unused) {
+    PyObject*          state  = NULL;
+    PyObject*          value;
+    const PyMemberDef* member;
+
+    state = PyDict_New();
+    if (state == NULL) {
+        return NULL;
+    }
+
+    for (member = geomap_members; member->name != NULL; ++member) {
+        value = *(PyObject**)((char*)self + member->offset);
+        if (value != NULL &&
+            PyDict_SetItemString(state, member->name, value)) {
+            Py_DECREF(state);
+            return NULL;
+        }
+    }
+
+    return Py_BuildValue("(O()(ON))", Py_TYPE(self), Py_None, state);
+}
+
+#define GEOMAP_EVALUATE_DOC \
+"evaluate(ref)\n" \
+"\n" \
+"Evaluate the fit at the reference coordinates *ref*, an Nx2 array,\n" \
+"without fitting again.  Returns the Nx2 array of fitted input\n" \
+"coordinates, the same as the ``fit_x`` and ``fit_y`` columns that\n" \
+"`geomap` returns for the coordinates it was given.\n"
+
+static PyMethodDef geomap_methods[] = {
+    {"evaluate", (PyCFunction)geomap_evaluate, METH_VARARGS | METH_KEYWORDS,
+     GEOMAP_EVALUATE_DOC},
+    {"__reduce__", (PyCFunction)geomap_reduce, METH_NOARGS, NULL},
+    {NULL}  /* Sentinel */
+};
+
+PyTypeObject geomap_class = {
     PyVarObject_HEAD_INIT(NULL, 0)
-    "py_geomap.GeomapResults", /* tp_name */
+    "stsci.stimage.GeomapResults", /* tp_name */
     sizeof(geomap_object),     /* tp_basicsize */
     0,                         /* tp_itemsize */
     (destructor)geomap_dealloc,/* tp_dealloc */
@@ -203,64 +731,185 @@ static PyTypeObject geomap_class = {
     geomap_new,                /* tp_new */
 };
 
-PyObject*
-py_geomap(PyObject* self, PyObject* args, PyObject* kwds) {
-    PyObject* input_obj        = NULL;
-    PyObject* ref_obj          = NULL;
-    PyObject* bbox_obj         = NULL;
-    PyObject* fit_obj          = NULL;
-    char*     fit_geometry_str = NULL;
-    char*     surface_type_str = NULL;
-    size_t    xxorder          = 2;
-    size_t    xyorder          = 2;
-    size_t    yxorder          = 2;
-    size_t    yyorder          = 2;
-    char*     xxterms_str      = NULL;
-    char*     yxterms_str      = NULL;
-    size_t    maxiter          = 0;
-    double    reject           = 0.0;
-
-    size_t         ninput       = 0;
-    PyObject*      input_array  = NULL;
-    size_t         nref         = 0;
-    PyObject*      ref_array    = NULL;
+/* The parameters of a fit, other than the coordinates, once converted
+   from Python */
+typedef struct {
     bbox_t         bbox;
-    geomap_fit_e   fit_geometry = geomap_fit_general;
-    surface_type_e surface_type = surface_type_polynomial;
-    xterms_e       xxterms      = xterms_half;
-    xterms_e       yxterms      = xterms_half;
+    geomap_proj_e  projection;
+    coord_t        refpt;
+    int            has_refpt;
+    geomap_fit_e   fit_geometry;
+    surface_type_e surface_type;
+    size_t         xxorder;
+    size_t         xyorder;
+    size_t         yxorder;
+    size_t         yyorder;
+    xterms_e       xxterms;
+    xterms_e       yxterms;
+    size_t         maxiter;
+    double         reject;
+    geomap_options_t options;
+} geomap_params_t;
 
+static void
+geomap_params_init(
+        geomap_params_t* const params) {
+
+    bbox_init(&params->bbox);
+    params->projection = geomap_proj_none;
+    params->refpt.x = params->refpt.y = 0.0;
+    params->has_refpt = 0;
+    params->fit_geometry = geomap_fit_general;
+    params->surface_type = surface_type_polynomial;
+    params->xxorder = 2;
+    params->xyorder = 2;
+    params->yxorder = 2;
+    params->yyorder = 2;
+    params->xxterms = xterms_half;
+    params->yxterms = xterms_half;
+    params->maxiter = 0;
+    params->reject = 0.0;
+    geomap_options_init(&params->options);
+}
+
+/* Convert the parameters that are given as Python objects or
+   strings */
+static int
+geomap_params_convert(
+        geomap_params_t* const params,
+        PyObject* bbox_obj,
+        const char* fit_geometry_str,
+        const char* surface_type_str,
+        const char* xxterms_str,
+        const char* yxterms_str,
+        const char* projection_str,
+        PyObject* refpt_obj,
+        const char* order_str,
+        const char* criterion_str,
+        const char* uncertainty_str,
+        const char* robust_str) {
+
+    geomap_order_e criterion = geomap_order_bic;
+
+    if (to_bbox_t("bbox", bbox_obj, &params->bbox) ||
+        to_geomap_fit_e(
+                "fit_geometry", fit_geometry_str, &params->fit_geometry) ||
+        to_surface_type_e(
+                "surface_type", surface_type_str, &params->surface_type) ||
+        to_xterms_e("xxterms", xxterms_str, &params->xxterms) ||
+        to_xterms_e("yxterms", yxterms_str, &params->yxterms) ||
+        to_geomap_proj_e("projection", projection_str, &params->projection)) {
+        return -1;
+    }
+
+    if (refpt_obj != NULL && refpt_obj != Py_None) {
+        if (to_coord_t("refpt", refpt_obj, &params->refpt)) {
+            return -1;
+        }
+        params->has_refpt = 1;
+    }
+
+    if (order_str != NULL) {
+        if (strcmp(order_str, "auto") != 0) {
+            PyErr_SetString(PyExc_ValueError, "order must be None or 'auto'");
+            return -1;
+        }
+        if (to_geomap_order_e("criterion", criterion_str, &criterion)) {
+            return -1;
+        }
+        if (params->options.max_order < 2) {
+            PyErr_SetString(PyExc_ValueError, "max_order must be at least 2");
+            return -1;
+        }
+        if (criterion == geomap_order_cv && params->options.nfolds < 2) {
+            PyErr_SetString(PyExc_ValueError, "nfolds must be at least 2");
+            return -1;
+        }
+        params->options.order_select = criterion;
+    }
+
+    if (to_geomap_uncertainty_e(
+                "uncertainty", uncertainty_str,
+                &params->options.uncertainty) ||
+        to_geomap_robust_e("robust", robust_str, &params->options.robust)) {
+        return -1;
+    }
+
+    /* 0 jackknife groups means one per point */
+    if ((params->options.uncertainty == geomap_uncertainty_bootstrap &&
+         params->options.nresamples < 2) ||
+        (params->options.uncertainty == geomap_uncertainty_jackknife &&
+         params->options.nresamples == 1)) {
+        PyErr_SetString(
+                PyExc_ValueError, "nresamples must be at least 2");
+        return -1;
+    }
+
+    return 0;
+}
+
+/* The dtype of the output array, built on first use */
+static PyArray_Descr*
+geomap_output_dtype(void) {
+    static PyArray_Descr* dtype      = NULL;
+    PyObject*             dtype_list = NULL;
+
+    if (dtype == NULL) {
+        dtype_list = Py_BuildValue(
+                "[(ss)(ss)(ss)(ss)(ss)(ss)(ss)(ss)]",
+                "input_x", "f8",
+                "input_y", "f8",
+                "ref_x", "f8",
+                "ref_y", "f8",
+                "fit_x", "f8",
+                "fit_y", "f8",
+                "resid_x", "f8",
+                "resid_y", "f8");
+        if (dtype_list == NULL) {
+            return NULL;
+        }
+        if (!PyArray_DescrConverter(dtype_list, &dtype)) {
+            dtype = NULL;
+        }
+        Py_DECREF(dtype_list);
+        if (dtype == NULL) {
+            return NULL;
+        }
+    }
+
+    Py_INCREF(dtype);
+    return dtype;
+}
+
+/* Fit two coordinate lists with the given parameters.  workspace may
+   be NULL. */
+static PyObject*
+geomap_run(
+        const geomap_params_t* const params,
+        PyObject* input_obj,
+        PyObject* ref_obj,
+        workspace_t* const workspace) {
+
+    size_t           ninput       = 0;
+    PyObject*        input_array  = NULL;
+    size_t           nref         = 0;
+    PyObject*        ref_array    = NULL;
+    PyObject*        fit_obj      = NULL;
     geomap_result_t  fit;
     PyObject*        tmp          = NULL;
     npy_intp         dims         = 0;
     size_t           i            = 0;
     size_t           noutput      = 0;
     geomap_output_t* output       = NULL;
-    PyObject*        dtype_list   = NULL;
     PyArray_Descr*   dtype        = NULL;
     PyObject*        result       = NULL;
     PyObject*        output_array = NULL;
     stimage_error_t  error;
+    int              status;
 
-    const char*    keywords[]    = {
-        "input", "ref", "bbox", "fit_geometry", "function",
-        "xxorder", "xyorder", "yxorder", "yyorder", "xxterms",
-        "yxterms", "maxiter", "reject", NULL
-    };
-
-    bbox_init(&bbox);
     geomap_result_init(&fit);
     stimage_error_init(&error);
 
-    if (!PyArg_ParseTupleAndKeywords(
-                args, kwds, "OO|Ossnnnnssnd:geomap",
-                (char **)keywords,
-                &input_obj, &ref_obj, &bbox_obj, &fit_geometry_str,
-                &surface_type_str, &xxorder, &xyorder, &yxorder, &yyorder,
-                &xxterms_str, &yxterms_str, &maxiter, &reject)) {
-        return NULL;
-    }
-
     input_array = (PyObject*)PyArray_ContiguousFromAny(
             input_obj, NPY_DOUBLE, 2, 2);
     if (input_array == NULL) {
@@ -281,14 +930,6 @@ py_geomap(PyObject* self, PyObject* args, PyObject* kwds) {
         goto exit;
     }
 
-    if (to_bbox_t("bbox", bbox_obj, &bbox) ||
-        to_geomap_fit_e("fit_geometry", fit_geometry_str, &fit_geometry) ||
-        to_surface_type_e("surface_type", surface_type_str, &surface_type) ||
-        to_xterms_e("xxterms", xxterms_str, &xxterms) ||
-        to_xterms_e("yxterms", yxterms_str, &yxterms)) {
-        goto exit;
-    }
-
     ninput = PyArray_DIM(input_array, 0);
     nref = PyArray_DIM(ref_array, 0);
     noutput = MAX(ninput, nref);
@@ -298,46 +939,51 @@ py_geomap(PyObject* self, PyObject* args, PyObject* kwds) {
         goto exit;
     }
 
-    if (geomap(
+    /* The arrays are private copies or are kept alive by the
+       references held here, so the fit can run without the GIL */
+    Py_BEGIN_ALLOW_THREADS
+    status = geomap(
                 ninput, (coord_t*)PyArray_DATA(input_array),
                 nref, (coord_t*)PyArray_DATA(ref_array),
-                &bbox, fit_geometry, surface_type,
-                xxorder, xyorder, yxorder, yyorder,
-                xxterms, yxterms,
-                maxiter, reject,
+                &params->bbox, params->projection,
+                params->has_refpt ? &params->refpt : NULL,
+                params->fit_geometry, params->surface_type,
+                params->xxorder, params->xyorder,
+                params->yxorder, params->yyorder,
+                params->xxterms, params->yxterms,
+                params->maxiter, params->reject, &params->options,
+                workspace,
                 &noutput, output, &fit,
-                &error)) {
+                &error);
+    Py_END_ALLOW_THREADS
+    if (status) {
         PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
         goto exit;
     }
 
-    dtype_list = Py_BuildValue(
-            "[(ss)(ss)(ss)(ss)(ss)(ss)(ss)(ss)]",
-            "input_x", "f8",
-            "input_y", "f8",
-            "ref_x", "f8",
-            "ref_y", "f8",
-            "fit_x", "f8",
-            "fit_y", "f8",
-            "resid_x", "f8",
-            "resid_y", "f8");
-    if (dtype_list == NULL) {
-        goto exit;
-    }
-    if (!PyArray_DescrConverter(dtype_list, &dtype)) {
+    dtype = geomap_output_dtype();
+    if (dtype == NULL) {
         goto exit;
     }
-    Py_DECREF(dtype_list);
     dims = (npy_intp)noutput;
     output_array = PyArray_NewFromDescr(
             &PyArray_Type, dtype, 1, &dims, NULL, output,
             NPY_OWNDATA, NULL);
+    dtype = NULL;
     if (output_array == NULL) {
         goto exit;
     }
+    PyArray_ENABLEFLAGS((PyArrayObject*)output_array, NPY_OWNDATA);
+
+    if (PyType_Ready(&geomap_class) < 0) {
+        goto exit;
+    }
 
     fit_obj = geomap_new(&geomap_class, NULL, NULL);
-    
+    if (fit_obj == NULL) {
+        goto exit;
+    }
+
     #define ADD_ATTR(func, member, name) \
         if ((func)((member), &tmp)) goto exit;      \
         PyObject_SetAttrString(fit_obj, (name), tmp);       \
@@ -353,6 +999,8 @@ py_geomap(PyObject* self, PyObject* args, PyObject* kwds) {
 
     ADD_ATTR(from_geomap_fit_e, fit.fit_geometry, "fit_geometry");
     ADD_ATTR(from_surface_type_e, fit.function, "function");
+    ADD_ATTR(from_geomap_proj_e, fit.projection, "projection");
+    ADD_ATTR(from_coord_t, &fit.refpt, "refpt");
     ADD_ATTR(from_coord_t, &fit.rms, "rms");
     ADD_ATTR(from_coord_t, &fit.mean_ref, "mean_ref");
     ADD_ATTR(from_coord_t, &fit.mean_input, "mean_input");
@@ -363,23 +1011,334 @@ py_geomap(PyObject* self, PyObject* args, PyObject* kwds) {
     ADD_ARRAY(fit.nycoeff, fit.ycoeff, "ycoeff");
     ADD_ARRAY(fit.nx2coeff, fit.x2coeff, "x2coeff");
     ADD_ARRAY(fit.ny2coeff, fit.y2coeff, "y2coeff");
+    ADD_ATTR(from_geomap_surfaces, &fit, "surfaces");
+    ADD_ATTR(from_geomap_orders, &fit, "orders");
+    ADD_ATTR(from_geomap_scores, &fit, "scores");
+    ADD_ATTR(from_geomap_resamples, &fit, "resamples");
+    ADD_ATTR(from_geomap_weights, &fit, "weights");
+
+    tmp = PyLong_FromSize_t(fit.niter);
+    if (tmp == NULL) goto exit;
+    PyObject_SetAttrString(fit_obj, "niter", tmp);
+    Py_DECREF(tmp);
+
+    #define ADD_COV(size, member, name) \
+        if (from_geomap_covariance((size), (member), &tmp)) goto exit; \
+        PyObject_SetAttrString(fit_obj, (name), tmp); \
+        Py_DECREF(tmp);
+
+    ADD_COV(fit.nxcoeff, fit.xcov, "xcov");
+    ADD_COV(fit.nycoeff, fit.ycov, "ycov");
+    ADD_COV(fit.nx2coeff, fit.x2cov, "x2cov");
+    ADD_COV(fit.ny2coeff, fit.y2cov, "y2cov");
+
+    #undef ADD_ATTR
+    #undef ADD_ARRAY
+    #undef ADD_COV
 
     result = Py_BuildValue("OO", fit_obj, output_array);
 
  exit:
 
-    Py_DECREF(input_array);
-    Py_DECREF(ref_array);
+    Py_XDECREF(input_array);
+    Py_XDECREF(ref_array);
     geomap_result_free(&fit);
-    if (result == NULL) {
-        Py_XDECREF(output_array);
+    if (output_array == NULL) {
+        Py_XDECREF(dtype);
         free(output);
-        Py_XDECREF(fit_obj);
     }
+    Py_XDECREF(output_array);
+    Py_XDECREF(fit_obj);
 
     return result;
 }
 
+PyObject*
+py_geomap(PyObject* self, PyObject* args, PyObject* kwds) {
+    PyObject*       input_obj        = NULL;
+    PyObject*       ref_obj          = NULL;
+    PyObject*       bbox_obj         = NULL;
+    char*           projection_str   = NULL;
+    PyObject*       refpt_obj        = NULL;
+    char*           fit_geometry_str = NULL;
+    char*           surface_type_str = NULL;
+    char*           xxterms_str      = NULL;
+    char*           yxterms_str      = NULL;
+    char*           order_str        = NULL;
+    char*           criterion_str    = NULL;
+    char*           uncertainty_str  = NULL;
+    char*           robust_str       = NULL;
+    geomap_params_t params;
+
+    const char*    keywords[]    = {
+        "input", "ref", "bbox", "fit_geometry", "function",
+        "xxorder", "xyorder", "yxorder", "yyorder", "xxterms",
+        "yxterms", "maxiter", "reject", "projection", "refpt", "order",
+        "max_order", "criterion", "nfolds", "uncertainty", "nresamples",
+        "seed", "nthreads", "robust", "robust_tuning", "robust_maxiter",
+        "robust_tol", NULL
+    };
+
+    geomap_params_init(&params);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "OO|OssnnnnssndzOznsnznnnzdnd:geomap",
+                (char **)keywords,
+                &input_obj, &ref_obj, &bbox_obj, &fit_geometry_str,
+                &surface_type_str, &params.xxorder, &params.xyorder,
+                &params.yxorder, &params.yyorder, &xxterms_str, &yxterms_str,
+                &params.maxiter, &params.reject, &projection_str,
+                &refpt_obj, &order_str, &params.options.max_order,
+                &criterion_str, &params.options.nfolds, &uncertainty_str,
+                &params.options.nresamples, &params.options.seed,
+                &params.options.nthreads, &robust_str,
+                &params.options.robust_tuning,
+                &params.options.robust_maxiter,
+                &params.options.robust_tol)) {
+        return NULL;
+    }
+
+    if (geomap_params_convert(
+                &params, bbox_obj, fit_geometry_str, surface_type_str,
+                xxterms_str, yxterms_str, projection_str, refpt_obj,
+                order_str, criterion_str, uncertainty_str,
+                robust_str)) {
+        return NULL;
+    }
+
+    return geomap_run(&params, input_obj, ref_obj, NULL);
+}
+
+#define FITTER_DOC \
+"Fitter(**params)\n" \
+"\n" \
+"A preconfigured `geomap`.\n" \
+"\n" \
+"The parameters are the keyword arguments of `geomap`, with the same\n" \
+"defaults.  They are checked and converted once, when the Fitter is\n" \
+"created, and the scratch memory of each fit is kept for the next\n" \
+"one, so a Fitter is much cheaper than `geomap` for many small fits\n" \
+"with the same parameters.\n" \
+"\n" \
+"The fit runs without holding the GIL, so a Fitter may be called\n" \
+"from several threads at once.  A call made while another is\n" \
+"running uses temporary memory instead of the shared workspace.\n" \
+"\n" \
+"Calling it as ``fitter(input, ref)`` returns the same\n" \
+"``(GeomapResults, array)`` tuple as `geomap`.\n"
+
+/* A Fitter holds the converted parameters of geomap, and a workspace
+   that its calls reuse */
+typedef struct {
+    PyObject_HEAD
+    geomap_params_t params;
+    workspace_t     workspace;
+    int             busy;
+#ifdef STIMAGE_HAVE_VECTORCALL
+    vectorcallfunc  vectorcall;
+#endif
+} fitter_object;
+
+/* Run a Fitter call.  As with a Matcher, the parameters are copied and
+   only one call at a time uses the workspace, since the GIL is
+   released during the fit. */
+static PyObject*
+fitter_run(
+        fitter_object* fitter,
+        PyObject* input_obj,
+        PyObject* ref_obj) {
+
+    geomap_params_t params    = fitter->params;
+    workspace_t*    workspace = NULL;
+    PyObject*       result;
+
+    if (!fitter->busy) {
+        fitter->busy = 1;
+        workspace = &fitter->workspace;
+    }
+
+    result = geomap_run(&params, input_obj, ref_obj, workspace);
+
+    if (workspace != NULL) {
+        fitter->busy = 0;
+    }
+
+    return result;
+}
+
+#ifdef STIMAGE_HAVE_VECTORCALL
+static PyObject*
+fitter_vectorcall(
+        PyObject* self, PyObject* const* args, size_t nargsf,
+        PyObject* kwnames) {
+    fitter_object* fitter    = (fitter_object*)self;
+    PyObject*      values[2];
+
+    static const char* const keywords[] = {"input", "ref"};
+
+    if (unpack_call_args(
+                "Fitter", args, PyVectorcall_NARGS(nargsf), kwnames,
+                keywords, 2, 2, values)) {
+        return NULL;
+    }
+
+    return fitter_run(fitter, values[0], values[1]);
+}
+#else
+static PyObject*
+fitter_call(PyObject* self, PyObject* args, PyObject* kwds) {
+    fitter_object* fitter    = (fitter_object*)self;
+    PyObject*      input_obj = NULL;
+    PyObject*      ref_obj   = NULL;
+
+    const char*    keywords[]    = {"input", "ref", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "OO:Fitter", (char **)keywords,
+                &input_obj, &ref_obj)) {
+        return NULL;
+    }
+
+    return fitter_run(fitter, input_obj, ref_obj);
+}
+#endif
+
+static PyObject*
+fitter_new(PyTypeObject* type, PyObject* args, PyObject* kwds) {
+    fitter_object* self;
+
+    self = (fitter_object*)type->tp_alloc(type, 0);
+    if (self == NULL) {
+        return NULL;
+    }
+
+    geomap_params_init(&self->params);
+    workspace_init(&self->workspace);
+    self->busy = 0;
+#ifdef STIMAGE_HAVE_VECTORCALL
+    self->vectorcall = fitter_vectorcall;
+#endif
+
+    return (PyObject*)self;
+}
+
+static int
+fitter_init(fitter_object* self, PyObject* args, PyObject* kwds) {
+    PyObject*       bbox_obj         = NULL;
+    char*           projection_str   = NULL;
+    PyObject*       refpt_obj        = NULL;
+    char*           fit_geometry_str = NULL;
+    char*           surface_type_str = NULL;
+    char*           xxterms_str      = NULL;
+    char*           yxterms_str      = NULL;
+    char*           order_str        = NULL;
+    char*           criterion_str    = NULL;
+    char*           uncertainty_str  = NULL;
+    char*           robust_str       = NULL;
+    geomap_params_t params;
+
+    const char*    keywords[]    = {
+        "bbox", "fit_geometry", "function",
+        "xxorder", "xyorder", "yxorder", "yyorder", "xxterms",
+        "yxterms", "maxiter", "reject", "projection", "refpt", "order",
+        "max_order", "criterion", "nfolds", "uncertainty", "nresamples",
+        "seed", "nthreads", "robust", "robust_tuning", "robust_maxiter",
+        "robust_tol", NULL
+    };
+
+    geomap_params_init(&params);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "|OssnnnnssndzOznsnznnnzdnd:Fitter",
+                (char **)keywords,
+                &bbox_obj, &fit_geometry_str, &surface_type_str,
+                &params.xxorder, &params.xyorder, &params.yxorder,
+                &params.yyorder, &xxterms_str, &yxterms_str,
+                &params.maxiter, &params.reject, &projection_str,
+                &refpt_obj, &order_str, &params.options.max_order,
+                &criterion_str, &params.options.nfolds, &uncertainty_str,
+                &params.options.nresamples, &params.options.seed,
+                &params.options.nthreads, &robust_str,
+                &params.options.robust_tuning,
+                &params.options.robust_maxiter,
+                &params.options.robust_tol)) {
+        return -1;
+    }
+
+    if (geomap_params_convert(
+                &params, bbox_obj, fit_geometry_str, surface_type_str,
+                xxterms_str, yxterms_str, projection_str, refpt_obj,
+                order_str, criterion_str, uncertainty_str,
+                robust_str)) {
+        return -1;
+    }
+
+    self->params = params;
+
+    return 0;
+}
+
+static void
+fitter_dealloc(fitter_object* self) {
+    workspace_free(&self->workspace);
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+#ifdef STIMAGE_HAVE_VECTORCALL
+#define FITTER_FLAGS (Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_VECTORCALL)
+#else
+#define FITTER_FLAGS Py_TPFLAGS_DEFAULT
+#endif
+
+PyTypeObject fitter_type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "stsci.stimage.Fitter",    /* tp_name */
+    sizeof(fitter_object),     /* tp_basicsize */
+    0,                         /* tp_itemsize */
+    (destructor)fitter_dealloc, /* tp_dealloc */
+#ifdef STIMAGE_HAVE_VECTORCALL
+    offsetof(fitter_object, vectorcall), /* tp_vectorcall_offset */
+#else
+    0,                         /* tp_print */
+#endif
+    0,                         /* tp_getattr */
+    0,                         /* tp_setattr */
+    0,                         /* tp_reserved */
+    0,                         /* tp_repr */
+    0,                         /* tp_as_number */
+    0,                         /* tp_as_sequence */
+    0,                         /* tp_as_mapping */
+    0,                         /* tp_hash */
+#ifdef STIMAGE_HAVE_VECTORCALL
+    PyVectorcall_Call,         /* tp_call */
+#else
+    fitter_call,               /* tp_call */
+#endif
+    0,                         /* tp_str */
+    0,                         /* tp_getattro */
+    0,                         /* tp_setattro */
+    0,                         /* tp_as_buffer */
+    FITTER_FLAGS,              /* tp_flags */
+    FITTER_DOC,                /* tp_doc */
+    0,                         /* tp_traverse */
+    0,                         /* tp_clear */
+    0,                         /* tp_richcompare */
+    0,                         /* tp_weaklistoffset */
+    0,                         /* tp_iter */
+    0,                         /* tp_iternext */
+    0,                         /* tp_methods */
+    0,                         /* tp_members */
+    0,                         /* tp_getset */
+    0,                         /* tp_base */
+    0,                         /* tp_dict */
+    0,                         /* tp_descr_get */
+    0,                         /* tp_descr_set */
+    0,                         /* tp_dictoffset */
+    (initproc)fitter_init,     /* tp_init */
+    0,                         /* tp_alloc */
+    fitter_new,                /* tp_new */
+};
+
 #if PY_MAJOR_VERSION >= 3
 
 static PyModuleDef geomap_module = {
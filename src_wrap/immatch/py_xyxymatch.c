@@ -37,57 +37,292 @@ DAMAGE.
 #define NO_IMPORT_ARRAY
 
 #include <Python.h>
+#include <stddef.h>
+#include <string.h>
+
 #include "wrap_util.h"
 
 #include "immatch/xyxymatch.h"
 
-PyObject*
-py_xyxymatch(PyObject* self, PyObject* args, PyObject* kwds) {
-    PyObject* input_obj      = NULL;
-    PyObject* ref_obj        = NULL;
-    PyObject* origin_obj     = NULL;
-    PyObject* mag_obj        = NULL;
-    PyObject* rotation_obj   = NULL;
-    PyObject* ref_origin_obj = NULL;
-    char*     algorithm_str  = NULL;
-    double    tolerance      = 1.0;
-    double    separation     = 9.0;
-    size_t    nmatch         = 30;
-    double    maxratio       = 10.0;
-    size_t    nreject        = 10;
-
-    PyObject*        input_array = NULL;
-    PyObject*        ref_array   = NULL;
-    coord_t          origin      = {0.0, 0.0};
-    coord_t          mag         = {1.0, 1.0};
-    coord_t          rotation    = {0.0, 0.0};
-    coord_t          ref_origin  = {0.0, 0.0};
-    xyxymatch_algo_e algorithm   = xyxymatch_algo_tolerance;
-
-    PyObject*           result     = NULL;
-    size_t              noutput    = 0;
-    xyxymatch_output_t* output     = NULL;
-    PyObject*           dtype_list = NULL;
-    PyArray_Descr*      dtype      = NULL;
-    npy_intp            dims;
-    stimage_error_t     error;
+/* The parameters of a match, other than the coordinates and their
+   weights, once converted from Python */
+typedef struct {
+    coord_t            origin;
+    coord_t            mag;
+    coord_t            rotation;
+    coord_t            ref_origin;
+    xyxymatch_algo_e   algorithm;
+    double             tolerance;
+    double             separation;
+    size_t             nmatch;
+    double             maxratio;
+    size_t             nreject;
+    double             tile_size;
+    size_t             nthreads;
+    double             search_radius;
+    double             max_rotation;
+    double             max_scale;
+    triangles_verify_e verify;
+    triangles_select_e select;
+    int                adaptive;
+    size_t             memory_limit;
+} xyxymatch_params_t;
 
-    const char*    keywords[]    = {
-        "input", "ref", "origin", "mag", "rotation", "ref_origin", "algorithm",
-        "tolerance", "separation", "nmatch", "maxratio", "nreject", NULL
-    };
+static void
+xyxymatch_params_init(
+        xyxymatch_params_t* const params) {
 
-    stimage_error_init(&error);
+    params->origin.x = params->origin.y = 0.0;
+    params->mag.x = params->mag.y = 1.0;
+    params->rotation.x = params->rotation.y = 0.0;
+    params->ref_origin.x = params->ref_origin.y = 0.0;
+    params->algorithm = xyxymatch_algo_tolerance;
+    params->tolerance = 1.0;
+    params->separation = 9.0;
+    params->nmatch = 30;
+    params->maxratio = 10.0;
+    params->nreject = 10;
+    params->tile_size = 0.0;
+    params->nthreads = 1;
+    params->search_radius = 0.0;
+    params->max_rotation = 0.0;
+    params->max_scale = 0.0;
+    params->verify = triangles_verify_reject;
+    params->select = triangles_select_sample;
+    params->adaptive = 0;
+    params->memory_limit = 0;
+}
 
-    if (!PyArg_ParseTupleAndKeywords(
-                args, kwds, "OO|OOOOsddndn:xyxymatch",
-                (char **)keywords,
-                &input_obj, &ref_obj, &origin_obj, &mag_obj, &rotation_obj,
-                &ref_origin_obj, &algorithm_str, &tolerance, &separation,
-                &nmatch, &maxratio, &nreject)) {
+/* Convert the parameters that are given as Python objects or
+   strings */
+static int
+xyxymatch_params_convert(
+        xyxymatch_params_t* const params,
+        PyObject* origin_obj,
+        PyObject* mag_obj,
+        PyObject* rotation_obj,
+        PyObject* ref_origin_obj,
+        const char* algorithm_str,
+        const char* verify_str,
+        const char* select_str) {
+
+    if (to_coord_t("origin", origin_obj, &params->origin) ||
+        to_coord_t("mag", mag_obj, &params->mag) ||
+        to_coord_t("rotation", rotation_obj, &params->rotation) ||
+        to_coord_t("ref_origin", ref_origin_obj, &params->ref_origin) ||
+        to_xyxymatch_algo_e("algorithm", algorithm_str, &params->algorithm) ||
+        to_triangles_verify_e("verify", verify_str, &params->verify) ||
+        to_triangles_select_e("select", select_str, &params->select)) {
+        return -1;
+    }
+
+    return 0;
+}
+
+/* The dtype of the output array, built on first use */
+static PyArray_Descr*
+xyxymatch_output_dtype(void) {
+    static PyArray_Descr* dtype      = NULL;
+    PyObject*             dtype_list = NULL;
+
+    if (dtype == NULL) {
+        dtype_list = Py_BuildValue(
+                "[(ss)(ss)(ss)(ss)(ss)(ss)]",
+                "input_x", "f8",
+                "input_y", "f8",
+                "input_idx", SIZE_T_D,
+                "ref_x", "f8",
+                "ref_y", "f8",
+                "ref_idx", SIZE_T_D);
+        if (dtype_list == NULL) {
+            return NULL;
+        }
+        if (!PyArray_DescrConverter(dtype_list, &dtype)) {
+            dtype = NULL;
+        }
+        Py_DECREF(dtype_list);
+        if (dtype == NULL) {
+            return NULL;
+        }
+    }
+
+    Py_INCREF(dtype);
+    return dtype;
+}
+
+/* A prepared reference list converted from the tuple made by
+   stsci.stimage.PreparedReference:
+
+       (separation, index, triangles)
+
+   where triangles is None or
+
+       (nmatch, tolerance, maxratio, vertices, log_perimeter, ratio,
+        cosine_v1, ratio_tolerance, cosine_tolerance, sense)
+
+   Arrays of the right type are used in place, so a list kept in shared
+   memory is not copied.  The references to them are held in arrays. */
+#define PREPARED_NARRAYS 8
+
+typedef struct {
+    xyxymatch_ref_t  ref;
+    triangle_table_t triangles;
+    PyObject*        arrays[PREPARED_NARRAYS];
+} prepared_ref_t;
+
+static void
+prepared_ref_init(
+        prepared_ref_t* const prepared) {
+
+    size_t i;
+
+    memset(&prepared->ref, 0, sizeof(xyxymatch_ref_t));
+    triangle_table_init(&prepared->triangles);
+    for (i = 0; i < PREPARED_NARRAYS; ++i) {
+        prepared->arrays[i] = NULL;
+    }
+}
+
+static void
+prepared_ref_free(
+        prepared_ref_t* const prepared) {
+
+    size_t i;
+
+    for (i = 0; i < PREPARED_NARRAYS; ++i) {
+        Py_XDECREF(prepared->arrays[i]);
+        prepared->arrays[i] = NULL;
+    }
+}
+
+/* Convert one of the arrays of a prepared reference list into
+   prepared->arrays[i], returning its data.  If n >= 0, it must have n
+   entries. */
+static void*
+prepared_ref_array(
+        prepared_ref_t* const prepared,
+        const size_t i,
+        const char* const name,
+        PyObject* obj,
+        const int type,
+        const npy_intp n) {
+
+    PyObject* array;
+
+    array = (PyObject*)PyArray_FROMANY(obj, type, 1, 1, NPY_ARRAY_IN_ARRAY);
+    if (array == NULL) {
+        return NULL;
+    }
+    prepared->arrays[i] = array;
+
+    if (n >= 0 && PyArray_DIM(array, 0) != n) {
+        PyErr_Format(
+                PyExc_ValueError,
+                "prepared reference %s must have %zd entries",
+                name, (Py_ssize_t)n);
         return NULL;
     }
 
+    return PyArray_DATA(array);
+}
+
+static int
+to_prepared_ref(
+        PyObject* obj,
+        prepared_ref_t* const prepared) {
+
+    PyObject*         index_obj     = NULL;
+    PyObject*         triangles_obj = NULL;
+    PyObject*         columns[7];
+    triangle_table_t* table         = &prepared->triangles;
+    npy_intp          n;
+
+    if (!PyArg_ParseTuple(
+                obj, "dOO:prepared", &prepared->ref.separation, &index_obj,
+                &triangles_obj)) {
+        return -1;
+    }
+
+    prepared->ref.index = prepared_ref_array(
+            prepared, 0, "index", index_obj, NPY_UINTP, -1);
+    if (prepared->ref.index == NULL) {
+        return -1;
+    }
+    prepared->ref.nunique = PyArray_DIM(prepared->arrays[0], 0);
+
+    if (triangles_obj == Py_None) {
+        return 0;
+    }
+
+    if (!PyArg_ParseTuple(
+                triangles_obj, "nddOOOOOOO:prepared triangles",
+                &prepared->ref.nmatch, &prepared->ref.tolerance,
+                &prepared->ref.maxratio, &columns[0], &columns[1],
+                &columns[2], &columns[3], &columns[4], &columns[5],
+                &columns[6])) {
+        return -1;
+    }
+
+    table->ratio = prepared_ref_array(
+            prepared, 1, "ratio", columns[2], NPY_DOUBLE, -1);
+    if (table->ratio == NULL) {
+        return -1;
+    }
+    n = PyArray_DIM(prepared->arrays[1], 0);
+
+    if ((table->vertices = prepared_ref_array(
+                 prepared, 2, "vertices", columns[0], NPY_UINT16,
+                 3 * n)) == NULL ||
+        (table->log_perimeter = prepared_ref_array(
+                 prepared, 3, "log_perimeter", columns[1], NPY_DOUBLE,
+                 n)) == NULL ||
+        (table->cosine_v1 = prepared_ref_array(
+                 prepared, 4, "cosine_v1", columns[3], NPY_DOUBLE,
+                 n)) == NULL ||
+        (table->ratio_tolerance = prepared_ref_array(
+                 prepared, 5, "ratio_tolerance", columns[4], NPY_FLOAT,
+                 n)) == NULL ||
+        (table->cosine_tolerance = prepared_ref_array(
+                 prepared, 6, "cosine_tolerance", columns[5], NPY_FLOAT,
+                 n)) == NULL ||
+        (table->sense = prepared_ref_array(
+                 prepared, 7, "sense", columns[6], NPY_UBYTE,
+                 n)) == NULL) {
+        return -1;
+    }
+
+    table->ntriangles = table->nallocated = (size_t)n;
+    prepared->ref.triangles = table;
+
+    return 0;
+}
+
+/* Match two coordinate lists with the given parameters.  prepared and
+   workspace may be NULL. */
+static PyObject*
+xyxymatch_run(
+        const xyxymatch_params_t* const params,
+        PyObject* input_obj,
+        PyObject* ref_obj,
+        PyObject* input_weights_obj,
+        PyObject* ref_weights_obj,
+        const xyxymatch_ref_t* const prepared,
+        workspace_t* const workspace) {
+
+    PyObject*           input_array         = NULL;
+    PyObject*           ref_array           = NULL;
+    PyObject*           input_weights_array = NULL;
+    PyObject*           ref_weights_array   = NULL;
+    PyObject*           result              = NULL;
+    size_t              noutput             = 0;
+    xyxymatch_output_t* output              = NULL;
+    PyArray_Descr*      dtype               = NULL;
+    int                 status;
+    npy_intp            dims;
+    stimage_error_t     error;
+
+    stimage_error_init(&error);
+
     input_array = (PyObject*)PyArray_ContiguousFromAny(
             input_obj, NPY_DOUBLE, 2, 2);
     if (input_array == NULL) {
@@ -108,57 +343,588 @@ py_xyxymatch(PyObject* self, PyObject* args, PyObject* kwds) {
         goto exit;
     }
 
-    if (to_coord_t("origin", origin_obj, &origin) ||
-        to_coord_t("mag", mag_obj, &mag) ||
-        to_coord_t("rotation", rotation_obj, &rotation) ||
-        to_coord_t("ref_origin", ref_origin_obj, &ref_origin) ||
-        to_xyxymatch_algo_e("algorithm", algorithm_str, &algorithm)) {
+    if (input_weights_obj != NULL && input_weights_obj != Py_None) {
+        input_weights_array = (PyObject*)PyArray_ContiguousFromAny(
+                input_weights_obj, NPY_DOUBLE, 1, 1);
+        if (input_weights_array == NULL) {
+            goto exit;
+        }
+        if (PyArray_DIM(input_weights_array, 0) !=
+            PyArray_DIM(input_array, 0)) {
+            PyErr_SetString(
+                    PyExc_ValueError,
+                    "input_weights must have one entry per input coordinate");
+            goto exit;
+        }
+    }
+
+    if (ref_weights_obj != NULL && ref_weights_obj != Py_None) {
+        ref_weights_array = (PyObject*)PyArray_ContiguousFromAny(
+                ref_weights_obj, NPY_DOUBLE, 1, 1);
+        if (ref_weights_array == NULL) {
+            goto exit;
+        }
+        if (PyArray_DIM(ref_weights_array, 0) != PyArray_DIM(ref_array, 0)) {
+            PyErr_SetString(
+                    PyExc_ValueError,
+                    "ref_weights must have one entry per reference coordinate");
+            goto exit;
+        }
+    }
+
+    dtype = xyxymatch_output_dtype();
+    if (dtype == NULL) {
         goto exit;
     }
 
-    noutput = PyArray_DIM(input_array, 0);
+    noutput = MAX(PyArray_DIM(input_array, 0), PyArray_DIM(ref_array, 0));
     output = malloc(noutput * sizeof(xyxymatch_output_t));
     if (output == NULL) {
         result = PyErr_NoMemory();
         goto exit;
     }
-    if (xyxymatch(
+    /* The arrays are private copies or are kept alive by the
+       references held here, so the matching can run without the GIL */
+    Py_BEGIN_ALLOW_THREADS
+    status = xyxymatch(
                 PyArray_DIM(input_array, 0), (coord_t*)PyArray_DATA(input_array),
                 PyArray_DIM(ref_array, 0), (coord_t*)PyArray_DATA(ref_array),
                 &noutput, output,
-                &origin, &mag, &rotation, &ref_origin,
-                algorithm, tolerance, separation, nmatch, maxratio, nreject,
-                &error)) {
+                &params->origin, &params->mag, &params->rotation,
+                &params->ref_origin,
+                params->algorithm, params->tolerance, params->separation,
+                params->nmatch, params->maxratio, params->nreject,
+                params->tile_size, params->nthreads, params->search_radius,
+                params->max_rotation, params->max_scale,
+                params->verify, params->select,
+                input_weights_array ?
+                    (double*)PyArray_DATA(input_weights_array) : NULL,
+                ref_weights_array ?
+                    (double*)PyArray_DATA(ref_weights_array) : NULL,
+                params->adaptive, params->memory_limit, prepared, workspace,
+                &error);
+    Py_END_ALLOW_THREADS
+    if (status) {
         PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
         goto exit;
     }
 
-    dtype_list = Py_BuildValue(
-            "[(ss)(ss)(ss)(ss)(ss)(ss)]",
-            "input_x", "f8",
-            "input_y", "f8",
-            "input_idx", SIZE_T_D,
-            "ref_x", "f8",
-            "ref_y", "f8",
-            "ref_idx", SIZE_T_D);
-    if (dtype_list == NULL) {
-        goto exit;
-    }
-    if (!PyArray_DescrConverter(dtype_list, &dtype)) {
-        goto exit;
-    }
-    Py_DECREF(dtype_list);
     dims = (npy_intp)noutput;
     result = PyArray_NewFromDescr(
             &PyArray_Type, dtype, 1, &dims, NULL, output, NPY_OWNDATA, NULL);
+    dtype = NULL;
+    /* The flags given to PyArray_NewFromDescr do not make the array
+       own memory passed to it, so it has to be set afterward */
+    if (result != NULL) {
+        PyArray_ENABLEFLAGS((PyArrayObject*)result, NPY_OWNDATA);
+    }
 
  exit:
 
-    Py_DECREF(input_array);
-    Py_DECREF(ref_array);
+    Py_XDECREF(input_array);
+    Py_XDECREF(ref_array);
+    Py_XDECREF(input_weights_array);
+    Py_XDECREF(ref_weights_array);
+    Py_XDECREF(dtype);
     if (result == NULL) {
         free(output);
     }
 
     return result;
 }
+
+PyObject*
+py_xyxymatch(PyObject* self, PyObject* args, PyObject* kwds) {
+    PyObject*          input_obj         = NULL;
+    PyObject*          ref_obj           = NULL;
+    PyObject*          origin_obj        = NULL;
+    PyObject*          mag_obj           = NULL;
+    PyObject*          rotation_obj      = NULL;
+    PyObject*          ref_origin_obj    = NULL;
+    char*              algorithm_str     = NULL;
+    char*              verify_str        = NULL;
+    char*              select_str        = NULL;
+    PyObject*          input_weights_obj = NULL;
+    PyObject*          ref_weights_obj   = NULL;
+    PyObject*          prepared_obj      = NULL;
+    PyObject*          result            = NULL;
+    xyxymatch_params_t params;
+    prepared_ref_t     prepared;
+
+    const char*    keywords[]    = {
+        "input", "ref", "origin", "mag", "rotation", "ref_origin", "algorithm",
+        "tolerance", "separation", "nmatch", "maxratio", "nreject",
+        "tile_size", "nthreads", "search_radius", "max_rotation",
+        "max_scale", "verify", "select", "input_weights", "ref_weights",
+        "adaptive", "memory_limit", "prepared", NULL
+    };
+
+    xyxymatch_params_init(&params);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "OO|OOOOsddndndndddssOOinO:xyxymatch",
+                (char **)keywords,
+                &input_obj, &ref_obj, &origin_obj, &mag_obj, &rotation_obj,
+                &ref_origin_obj, &algorithm_str, &params.tolerance,
+                &params.separation, &params.nmatch, &params.maxratio,
+                &params.nreject, &params.tile_size, &params.nthreads,
+                &params.search_radius, &params.max_rotation,
+                &params.max_scale, &verify_str, &select_str,
+                &input_weights_obj, &ref_weights_obj,
+                &params.adaptive, &params.memory_limit, &prepared_obj)) {
+        return NULL;
+    }
+
+    if (xyxymatch_params_convert(
+                &params, origin_obj, mag_obj, rotation_obj, ref_origin_obj,
+                algorithm_str, verify_str, select_str)) {
+        return NULL;
+    }
+
+    prepared_ref_init(&prepared);
+
+    if (prepared_obj == NULL || prepared_obj == Py_None) {
+        result = xyxymatch_run(
+                &params, input_obj, ref_obj, input_weights_obj,
+                ref_weights_obj, NULL, NULL);
+    } else if (to_prepared_ref(prepared_obj, &prepared) == 0) {
+        result = xyxymatch_run(
+                &params, input_obj, ref_obj, input_weights_obj,
+                ref_weights_obj, &prepared.ref, NULL);
+    }
+
+    prepared_ref_free(&prepared);
+
+    return result;
+}
+
+PyObject*
+py_prepare_reference(PyObject* self, PyObject* args, PyObject* kwds) {
+    PyObject*       ref_obj     = NULL;
+    PyObject*       ref_array   = NULL;
+    PyObject*       index_array = NULL;
+    PyObject*       result      = NULL;
+    double          separation  = 9.0;
+    size_t          nunique     = 0;
+    npy_intp        dims;
+    int             status;
+    stimage_error_t error;
+
+    const char*    keywords[]    = {
+        "ref", "separation", NULL
+    };
+
+    stimage_error_init(&error);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "O|d:prepare_reference", (char **)keywords,
+                &ref_obj, &separation)) {
+        return NULL;
+    }
+
+    ref_array = (PyObject*)PyArray_ContiguousFromAny(
+            ref_obj, NPY_DOUBLE, 2, 2);
+    if (ref_array == NULL) {
+        goto exit;
+    }
+    if (PyArray_DIM(ref_array, 1) != 2) {
+        PyErr_SetString(PyExc_TypeError, "ref array must be an Nx2 array");
+        goto exit;
+    }
+
+    dims = PyArray_DIM(ref_array, 0);
+    index_array = PyArray_SimpleNew(1, &dims, NPY_UINTP);
+    if (index_array == NULL) {
+        goto exit;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    status = xyxymatch_prepare_ref(
+            PyArray_DIM(ref_array, 0), (coord_t*)PyArray_DATA(ref_array),
+            separation, &nunique, (size_t*)PyArray_DATA(index_array),
+            &error);
+    Py_END_ALLOW_THREADS
+    if (status) {
+        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    dims = (npy_intp)nunique;
+    result = PyArray_SimpleNew(1, &dims, NPY_UINTP);
+    if (result != NULL) {
+        memcpy(PyArray_DATA((PyArrayObject*)result),
+               PyArray_DATA((PyArrayObject*)index_array),
+               nunique * sizeof(size_t));
+    }
+
+ exit:
+
+    Py_XDECREF(ref_array);
+    Py_XDECREF(index_array);
+
+    return result;
+}
+
+/* Copy one column of a triangle table into a new array */
+static PyObject*
+triangle_column(
+        const void* const data,
+        const npy_intp n,
+        const int type) {
+
+    PyObject* array;
+
+    array = PyArray_SimpleNew(1, &n, type);
+    if (array != NULL && n > 0) {
+        memcpy(PyArray_DATA((PyArrayObject*)array), data,
+               n * PyArray_ITEMSIZE((PyArrayObject*)array));
+    }
+
+    return array;
+}
+
+PyObject*
+py_reference_triangles(PyObject* self, PyObject* args, PyObject* kwds) {
+    PyObject*        ref_obj     = NULL;
+    PyObject*        index_obj   = NULL;
+    PyObject*        ref_array   = NULL;
+    PyObject*        result      = NULL;
+    size_t           nmatch      = 30;
+    double           tolerance   = 1.0;
+    double           maxratio    = 10.0;
+    size_t           nthreads    = 1;
+    prepared_ref_t   prepared;
+    triangle_table_t table;
+    npy_intp         n;
+    int              status;
+    stimage_error_t  error;
+
+    const char*    keywords[]    = {
+        "ref", "index", "nmatch", "tolerance", "maxratio", "nthreads", NULL
+    };
+
+    stimage_error_init(&error);
+    prepared_ref_init(&prepared);
+    triangle_table_init(&table);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "OO|nddn:reference_triangles", (char **)keywords,
+                &ref_obj, &index_obj, &nmatch, &tolerance, &maxratio,
+                &nthreads)) {
+        return NULL;
+    }
+
+    ref_array = (PyObject*)PyArray_ContiguousFromAny(
+            ref_obj, NPY_DOUBLE, 2, 2);
+    if (ref_array == NULL) {
+        goto exit;
+    }
+    if (PyArray_DIM(ref_array, 1) != 2) {
+        PyErr_SetString(PyExc_TypeError, "ref array must be an Nx2 array");
+        goto exit;
+    }
+
+    prepared.ref.index = prepared_ref_array(
+            &prepared, 0, "index", index_obj, NPY_UINTP, -1);
+    if (prepared.ref.index == NULL) {
+        goto exit;
+    }
+    prepared.ref.nunique = PyArray_DIM(prepared.arrays[0], 0);
+
+    Py_BEGIN_ALLOW_THREADS
+    status = xyxymatch_ref_triangles(
+            PyArray_DIM(ref_array, 0), (coord_t*)PyArray_DATA(ref_array),
+            &prepared.ref, nmatch, tolerance, maxratio, nthreads, &table,
+            &error);
+    Py_END_ALLOW_THREADS
+    if (status) {
+        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    n = (npy_intp)table.ntriangles;
+    result = Py_BuildValue(
+            "(NNNNNNN)",
+            triangle_column(table.vertices, 3 * n, NPY_UINT16),
+            triangle_column(table.log_perimeter, n, NPY_DOUBLE),
+            triangle_column(table.ratio, n, NPY_DOUBLE),
+            triangle_column(table.cosine_v1, n, NPY_DOUBLE),
+            triangle_column(table.ratio_tolerance, n, NPY_FLOAT),
+            triangle_column(table.cosine_tolerance, n, NPY_FLOAT),
+            triangle_column(table.sense, n, NPY_UBYTE));
+
+ exit:
+
+    Py_XDECREF(ref_array);
+    prepared_ref_free(&prepared);
+    triangle_table_free(&table);
+
+    return result;
+}
+
+#define MATCHER_DOC \
+"Matcher(**params)\n" \
+"\n" \
+"A preconfigured `xyxymatch`.\n" \
+"\n" \
+"The parameters are the keyword arguments of `xyxymatch`, other than\n" \
+"*input_weights* and *ref_weights*, with the same defaults.  They are\n" \
+"checked and converted once, when the Matcher is created, and the\n" \
+"scratch memory of each match is kept for the next one, so a Matcher\n" \
+"is much cheaper than `xyxymatch` for many small calls with the same\n" \
+"parameters.\n" \
+"\n" \
+"The matching runs without holding the GIL, so a Matcher may be\n" \
+"called from several threads at once.  A call made while another\n" \
+"is running uses temporary memory instead of the shared workspace.\n" \
+"\n" \
+"Calling it as ``matcher(input, ref, input_weights=None,\n" \
+"ref_weights=None)`` returns the same structured array as `xyxymatch`.\n"
+
+/* A Matcher holds the converted parameters of xyxymatch, and a
+   workspace that its calls reuse */
+typedef struct {
+    PyObject_HEAD
+    xyxymatch_params_t params;
+    workspace_t        workspace;
+    int                busy;
+#ifdef STIMAGE_HAVE_VECTORCALL
+    vectorcallfunc     vectorcall;
+#endif
+} matcher_object;
+
+/* Run a Matcher call.  The GIL is released during the matching, so
+   the parameters are copied in case __init__ is called again from
+   another thread, and only one call at a time uses the workspace.
+   Since busy is only touched with the GIL held, it needs no lock. */
+static PyObject*
+matcher_run(
+        matcher_object* matcher,
+        PyObject* input_obj,
+        PyObject* ref_obj,
+        PyObject* input_weights_obj,
+        PyObject* ref_weights_obj) {
+
+    xyxymatch_params_t params    = matcher->params;
+    workspace_t*       workspace = NULL;
+    PyObject*          result;
+
+    if (!matcher->busy) {
+        matcher->busy = 1;
+        workspace = &matcher->workspace;
+    }
+
+    result = xyxymatch_run(
+            &params, input_obj, ref_obj, input_weights_obj, ref_weights_obj,
+            NULL, workspace);
+
+    if (workspace != NULL) {
+        matcher->busy = 0;
+    }
+
+    return result;
+}
+
+#ifdef STIMAGE_HAVE_VECTORCALL
+static PyObject*
+matcher_vectorcall(
+        PyObject* self, PyObject* const* args, size_t nargsf,
+        PyObject* kwnames) {
+    matcher_object* matcher   = (matcher_object*)self;
+    PyObject*       values[4];
+
+    static const char* const keywords[] = {
+        "input", "ref", "input_weights", "ref_weights"
+    };
+
+    if (unpack_call_args(
+                "Matcher", args, PyVectorcall_NARGS(nargsf), kwnames,
+                keywords, 4, 2, values)) {
+        return NULL;
+    }
+
+    return matcher_run(matcher, values[0], values[1], values[2], values[3]);
+}
+#else
+static PyObject*
+matcher_call(PyObject* self, PyObject* args, PyObject* kwds) {
+    matcher_object* matcher           = (matcher_object*)self;
+    PyObject*       input_obj         = NULL;
+    PyObject*       ref_obj           = NULL;
+    PyObject*       input_weights_obj = NULL;
+    PyObject*       ref_weights_obj   = NULL;
+
+    const char*    keywords[]    = {
+        "input", "ref", "input_weights", "ref_weights", NULL
+    };
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "OO|OO:Matcher", (char **)keywords,
+                &input_obj, &ref_obj, &input_weights_obj, &ref_weights_obj)) {
+        return NULL;
+    }
+
+    return matcher_run(
+            matcher, input_obj, ref_obj, input_weights_obj, ref_weights_obj);
+}
+#endif
+
+static PyObject*
+matcher_new(PyTypeObject* type, PyObject* args, PyObject* kwds) {
+    matcher_object* self;
+
+    self = (matcher_object*)type->tp_alloc(type, 0);
+    if (self == NULL) {
+        return NULL;
+    }
+
+    xyxymatch_params_init(&self->params);
+    workspace_init(&self->workspace);
+    self->busy = 0;
+#ifdef STIMAGE_HAVE_VECTORCALL
+    self->vectorcall = matcher_vectorcall;
+#endif
+
+    return (PyObject*)self;
+}
+
+static int
+matcher_init(matcher_object* self, PyObject* args, PyObject* kwds) {
+    PyObject*          origin_obj     = NULL;
+    PyObject*          mag_obj        = NULL;
+    PyObject*          rotation_obj   = NULL;
+    PyObject*          ref_origin_obj = NULL;
+    char*              algorithm_str  = NULL;
+    char*              verify_str     = NULL;
+    char*              select_str     = NULL;
+    xyxymatch_params_t params;
+
+    const char*    keywords[]    = {
+        "origin", "mag", "rotation", "ref_origin", "algorithm",
+        "tolerance", "separation", "nmatch", "maxratio", "nreject",
+        "tile_size", "nthreads", "search_radius", "max_rotation",
+        "max_scale", "verify", "select", "adaptive", "memory_limit", NULL
+    };
+
+    xyxymatch_params_init(&params);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "|OOOOsddndndndddssin:Matcher",
+                (char **)keywords,
+                &origin_obj, &mag_obj, &rotation_obj, &ref_origin_obj,
+                &algorithm_str, &params.tolerance, &params.separation,
+                &params.nmatch, &params.maxratio, &params.nreject,
+                &params.tile_size, &params.nthreads, &params.search_radius,
+                &params.max_rotation, &params.max_scale, &verify_str,
+                &select_str, &params.adaptive, &params.memory_limit)) {
+        return -1;
+    }
+
+    if (xyxymatch_params_convert(
+                &params, origin_obj, mag_obj, rotation_obj, ref_origin_obj,
+                algorithm_str, verify_str, select_str)) {
+        return -1;
+    }
+
+    self->params = params;
+
+    return 0;
+}
+
+static void
+matcher_dealloc(matcher_object* self) {
+    workspace_free(&self->workspace);
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+#ifdef STIMAGE_HAVE_VECTORCALL
+#define MATCHER_FLAGS (Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_VECTORCALL)
+#else
+#define MATCHER_FLAGS Py_TPFLAGS_DEFAULT
+#endif
+
+PyTypeObject matcher_type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "stsci.stimage.Matcher",   /* tp_name */
+    sizeof(matcher_object),    /* tp_basicsize */
+    0,                         /* tp_itemsize */
+    (destructor)matcher_dealloc, /* tp_dealloc */
+#ifdef STIMAGE_HAVE_VECTORCALL
+    offsetof(matcher_object, vectorcall), /* tp_vectorcall_offset */
+#else
+    0,                         /* tp_print */
+#endif
+    0,                         /* tp_getattr */
+    0,                         /* tp_setattr */
+    0,                         /* tp_reserved */
+    0,                         /* tp_repr */
+    0,                         /* tp_as_number */
+    0,                         /* tp_as_sequence */
+    0,                         /* tp_as_mapping */
+    0,                         /* tp_hash */
+#ifdef STIMAGE_HAVE_VECTORCALL
+    PyVectorcall_Call,         /* tp_call */
+#else
+    matcher_call,              /* tp_call */
+#endif
+    0,                         /* tp_str */
+    0,                         /* tp_getattro */
+    0,                         /* tp_setattro */
+    0,                         /* tp_as_buffer */
+    MATCHER_FLAGS,             /* tp_flags */
+    MATCHER_DOC,               /* tp_doc */
+    0,                         /* tp_traverse */
+    0,                         /* tp_clear */
+    0,                         /* tp_richcompare */
+    0,                         /* tp_weaklistoffset */
+    0,                         /* tp_iter */
+    0,                         /* tp_iternext */
+    0,                         /* tp_methods */
+    0,                         /* tp_members */
+    0,                         /* tp_getset */
+    0,                         /* tp_base */
+    0,                         /* tp_dict */
+    0,                         /* tp_descr_get */
+    0,                         /* tp_descr_set */
+    0,                         /* tp_dictoffset */
+    (initproc)matcher_init,    /* tp_init */
+    0,                         /* tp_alloc */
+    matcher_new,               /* tp_new */
+};
+
+PyObject*
+py_estimate_triangles(PyObject* self, PyObject* args, PyObject* kwds) {
+    size_t               ninput   = 0;
+    size_t               nref     = 0;
+    size_t               nmatch   = 30;
+    double               maxratio = 10.0;
+    triangles_estimate_t estimate;
+    stimage_error_t      error;
+
+    const char*    keywords[]    = {
+        "ninput", "nref", "nmatch", "maxratio", NULL
+    };
+
+    stimage_error_init(&error);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "nn|nd:estimate_triangles",
+                (char **)keywords,
+                &ninput, &nref, &nmatch, &maxratio)) {
+        return NULL;
+    }
+
+    if (estimate_triangles(nref, ninput, nmatch, maxratio, &estimate, &error)) {
+        PyErr_SetString(PyExc_ValueError, stimage_error_get_message(&error));
+        return NULL;
+    }
+
+    return Py_BuildValue(
+            "{snsnsnsnsnsd}",
+            "ninput_points", (Py_ssize_t)estimate.ninput_points,
+            "nref_points", (Py_ssize_t)estimate.nref_points,
+            "ninput_triangles", (Py_ssize_t)estimate.ninput_triangles,
+            "nref_triangles", (Py_ssize_t)estimate.nref_triangles,
+            "peak_bytes", (Py_ssize_t)estimate.peak_bytes,
+            "cost", estimate.cost);
+}
@@ -0,0 +1,126 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#define NO_IMPORT_ARRAY
+
+#include <Python.h>
+#include "wrap_util.h"
+
+#include "lib/projection.h"
+
+static PyObject*
+py_project_generic(
+        PyObject* args,
+        PyObject* kwds,
+        const char* const format,
+        const int forward) {
+
+    PyObject*       coords_obj     = NULL;
+    PyObject*       refpt_obj      = NULL;
+    char*           projection_str = NULL;
+
+    PyObject*       coords_array   = NULL;
+    PyObject*       result         = NULL;
+    coord_t         refpt          = {0.0, 0.0};
+    geomap_proj_e   projection     = geomap_proj_tan;
+    npy_intp        dims[2];
+    int             status         = 1;
+    stimage_error_t error;
+
+    const char*    keywords[]    = {
+        "coords", "refpt", "projection", NULL
+    };
+
+    stimage_error_init(&error);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, format,
+                (char **)keywords,
+                &coords_obj, &refpt_obj, &projection_str)) {
+        return NULL;
+    }
+
+    coords_array = (PyObject*)PyArray_ContiguousFromAny(
+            coords_obj, NPY_DOUBLE, 2, 2);
+    if (coords_array == NULL) {
+        goto exit;
+    }
+    if (PyArray_DIM(coords_array, 1) != 2) {
+        PyErr_SetString(PyExc_TypeError, "coords array must be an Nx2 array");
+        goto exit;
+    }
+
+    if (to_coord_t("refpt", refpt_obj, &refpt) ||
+        to_geomap_proj_e("projection", projection_str, &projection)) {
+        goto exit;
+    }
+
+    dims[0] = PyArray_DIM(coords_array, 0);
+    dims[1] = 2;
+    result = PyArray_SimpleNew(2, dims, NPY_DOUBLE);
+    if (result == NULL) {
+        goto exit;
+    }
+
+    if (forward) {
+        status = project_coords(
+                projection, &refpt, (size_t)dims[0],
+                (coord_t*)PyArray_DATA(coords_array),
+                (coord_t*)PyArray_DATA(result), &error);
+    } else {
+        status = deproject_coords(
+                projection, &refpt, (size_t)dims[0],
+                (coord_t*)PyArray_DATA(coords_array),
+                (coord_t*)PyArray_DATA(result), &error);
+    }
+
+    if (status) {
+        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
+        Py_DECREF(result);
+        result = NULL;
+    }
+
+ exit:
+
+    Py_XDECREF(coords_array);
+
+    return result;
+}
+
+PyObject*
+py_project(PyObject* self, PyObject* args, PyObject* kwds) {
+    return py_project_generic(args, kwds, "OO|s:project", 1);
+}
+
+PyObject*
+py_deproject(PyObject* self, PyObject* args, PyObject* kwds) {
+    return py_project_generic(args, kwds, "OO|s:deproject", 0);
+}
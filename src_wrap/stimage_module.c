@@ -37,11 +37,27 @@ DAMAGE.
 #include "wrap_util.h"
 
 PyObject* py_xyxymatch(PyObject*, PyObject*, PyObject*);
+PyObject* py_estimate_triangles(PyObject*, PyObject*, PyObject*);
+PyObject* py_prepare_reference(PyObject*, PyObject*, PyObject*);
+PyObject* py_reference_triangles(PyObject*, PyObject*, PyObject*);
 PyObject* py_geomap(PyObject*, PyObject*, PyObject*);
+PyObject* py_project(PyObject*, PyObject*, PyObject*);
+PyObject* py_deproject(PyObject*, PyObject*, PyObject*);
+PyObject* py_crossmatch_epochs(PyObject*, PyObject*, PyObject*);
+
+extern PyTypeObject matcher_type;
+extern PyTypeObject fitter_type;
+extern PyTypeObject geomap_class;
 
 static PyMethodDef module_methods[] = {
     {"xyxymatch", (PyCFunction)py_xyxymatch, METH_VARARGS | METH_KEYWORDS, NULL},
+    {"estimate_triangles", (PyCFunction)py_estimate_triangles, METH_VARARGS | METH_KEYWORDS, NULL},
+    {"prepare_reference", (PyCFunction)py_prepare_reference, METH_VARARGS | METH_KEYWORDS, NULL},
+    {"reference_triangles", (PyCFunction)py_reference_triangles, METH_VARARGS | METH_KEYWORDS, NULL},
     {"geomap", (PyCFunction)py_geomap, METH_VARARGS | METH_KEYWORDS, NULL},
+    {"project", (PyCFunction)py_project, METH_VARARGS | METH_KEYWORDS, NULL},
+    {"deproject", (PyCFunction)py_deproject, METH_VARARGS | METH_KEYWORDS, NULL},
+    {"crossmatch_epochs", (PyCFunction)py_crossmatch_epochs, METH_VARARGS | METH_KEYWORDS, NULL},
     {NULL}  /* Sentinel */
 };
 
@@ -74,10 +90,31 @@ init_stimage(void)
 
 #if PY_MAJOR_VERSION >= 3
     m = PyModule_Create(&moduledef);
-	return m;
 #else
     m = Py_InitModule3("_stimage", module_methods,
                        "Example module that creates an extension type.");
+#endif
+
+    if (m != NULL &&
+        (PyType_Ready(&matcher_type) < 0 ||
+         PyType_Ready(&fitter_type) < 0 ||
+         PyType_Ready(&geomap_class) < 0)) {
+        Py_DECREF(m);
+        m = NULL;
+    }
+
+    if (m != NULL) {
+        Py_INCREF(&matcher_type);
+        PyModule_AddObject(m, "Matcher", (PyObject*)&matcher_type);
+        Py_INCREF(&fitter_type);
+        PyModule_AddObject(m, "Fitter", (PyObject*)&fitter_type);
+        Py_INCREF(&geomap_class);
+        PyModule_AddObject(m, "GeomapResults", (PyObject*)&geomap_class);
+    }
+
+#if PY_MAJOR_VERSION >= 3
+	return m;
+#else
 	return;
 #endif
 }
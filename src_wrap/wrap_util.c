@@ -40,6 +40,72 @@ DAMAGE.
 
 char* SIZE_T_D;
 
+#ifdef STIMAGE_HAVE_VECTORCALL
+int
+unpack_call_args(
+        const char* const name,
+        PyObject* const* args,
+        const Py_ssize_t nargs,
+        PyObject* const kwnames,
+        const char* const* const keywords,
+        const Py_ssize_t nkeywords,
+        const Py_ssize_t nrequired,
+        PyObject** const values) {
+
+    Py_ssize_t nkwargs = kwnames == NULL ? 0 : PyTuple_GET_SIZE(kwnames);
+    Py_ssize_t i, j;
+    PyObject*  key;
+
+    if (nargs > nkeywords) {
+        PyErr_Format(
+                PyExc_TypeError,
+                "%s() takes at most %zd positional arguments (%zd given)",
+                name, nkeywords, nargs);
+        return -1;
+    }
+
+    for (i = 0; i < nkeywords; ++i) {
+        values[i] = i < nargs ? args[i] : NULL;
+    }
+
+    for (i = 0; i < nkwargs; ++i) {
+        key = PyTuple_GET_ITEM(kwnames, i);
+        for (j = 0; j < nkeywords; ++j) {
+            if (PyUnicode_CompareWithASCIIString(key, keywords[j]) == 0) {
+                break;
+            }
+        }
+        if (j == nkeywords) {
+            PyErr_Format(
+                    PyExc_TypeError,
+                    "%s() got an unexpected keyword argument '%U'",
+                    name, key);
+            return -1;
+        }
+        if (values[j] != NULL) {
+            PyErr_Format(
+                    PyExc_TypeError,
+                    "%s() got multiple values for argument '%s'",
+                    name, keywords[j]);
+            return -1;
+        }
+        values[j] = args[nargs + i];
+    }
+
+    for (i = 0; i < nrequired; ++i) {
+        if (values[i] == NULL) {
+            PyErr_Format(
+                    PyExc_TypeError,
+                    "%s() missing required argument '%s'",
+                    name, keywords[i]);
+            return -1;
+        }
+    }
+
+    return 0;
+}
+#endif
+
 int
 to_coord_t(
         const char* const name,
@@ -147,10 +213,66 @@ to_xyxymatch_algo_e(
         *e = xyxymatch_algo_tolerance;
     } else if (strcmp(s, "triangles") == 0) {
         *e = xyxymatch_algo_triangles;
+    } else if (strcmp(s, "offsets") == 0) {
+        *e = xyxymatch_algo_offsets;
+    } else if (strcmp(s, "quads") == 0) {
+        *e = xyxymatch_algo_quads;
+    } else {
+        PyErr_Format(
+                PyExc_ValueError,
+                "%s must be 'tolerance', 'triangles', 'offsets' or 'quads'",
+                name);
+        return -1;
+    }
+
+    return 0;
+}
+
+int
+to_triangles_verify_e(
+        const char* const name,
+        const char* const s,
+        triangles_verify_e* const e) {
+
+    if (s == NULL) {
+        return 0;
+    }
+
+    if (strcmp(s, "reject") == 0) {
+        *e = triangles_verify_reject;
+    } else if (strcmp(s, "ransac") == 0) {
+        *e = triangles_verify_ransac;
+    } else {
+        PyErr_Format(
+                PyExc_ValueError,
+                "%s must be 'reject' or 'ransac'",
+                name);
+        return -1;
+    }
+
+    return 0;
+}
+
+int
+to_triangles_select_e(
+        const char* const name,
+        const char* const s,
+        triangles_select_e* const e) {
+
+    if (s == NULL) {
+        return 0;
+    }
+
+    if (strcmp(s, "sample") == 0) {
+        *e = triangles_select_sample;
+    } else if (strcmp(s, "brightest") == 0) {
+        *e = triangles_select_brightest;
+    } else if (strcmp(s, "grid") == 0) {
+        *e = triangles_select_grid;
     } else {
         PyErr_Format(
                 PyExc_ValueError,
-                "%s must be 'tolerance' or 'triangles'",
+                "%s must be 'sample', 'brightest' or 'grid'",
                 name);
         return -1;
     }
@@ -369,3 +491,172 @@ from_xterms_e(
 
     return 0;
 }
+
+int
+to_geomap_proj_e(
+        const char* const name,
+        const char* const s,
+        geomap_proj_e* const e) {
+
+    if (s == NULL) {
+        return 0;
+    }
+
+    if (strcmp(s, "none") == 0) {
+        *e = geomap_proj_none;
+        return 0;
+    } else if (strcmp(s, "lin") == 0) {
+        *e = geomap_proj_lin;
+        return 0;
+    } else if (strcmp(s, "tan") == 0) {
+        *e = geomap_proj_tan;
+        return 0;
+    } else if (strcmp(s, "sin") == 0) {
+        *e = geomap_proj_sin;
+        return 0;
+    } else if (strcmp(s, "stg") == 0) {
+        *e = geomap_proj_stg;
+        return 0;
+    } else if (strcmp(s, "arc") == 0) {
+        *e = geomap_proj_arc;
+        return 0;
+    } else if (strcmp(s, "zea") == 0) {
+        *e = geomap_proj_zea;
+        return 0;
+    }
+
+    PyErr_Format(
+            PyExc_ValueError,
+            "%s must be 'none', 'lin', 'tan', 'sin', 'stg', 'arc' or 'zea'",
+            name);
+    return -1;
+}
+
+int
+from_geomap_proj_e(
+        const geomap_proj_e e,
+        PyObject** o) {
+
+    const char* c;
+
+    switch (e) {
+    case geomap_proj_none:
+        c = "none";
+        break;
+    case geomap_proj_lin:
+        c = "lin";
+        break;
+    case geomap_proj_tan:
+        c = "tan";
+        break;
+    case geomap_proj_sin:
+        c = "sin";
+        break;
+    case geomap_proj_stg:
+        c = "stg";
+        break;
+    case geomap_proj_arc:
+        c = "arc";
+        break;
+    case geomap_proj_zea:
+        c = "zea";
+        break;
+    default:
+        PyErr_SetString(
+                PyExc_ValueError,
+                "Unknown geomap_proj_e value");
+        return -1;
+    }
+
+#if PY_MAJOR_VERSION >= 3
+    *o = PyUnicode_FromString(c);
+#else
+    *o = PyString_FromString(c);
+#endif
+    if (*o == NULL) {
+        return -1;
+    }
+
+    return 0;
+}
+
+int
+to_geomap_order_e(
+        const char* const name,
+        const char* const s,
+        geomap_order_e* const e) {
+
+    if (s == NULL) {
+        return 0;
+    }
+
+    if (strcmp(s, "aic") == 0) {
+        *e = geomap_order_aic;
+        return 0;
+    } else if (strcmp(s, "bic") == 0) {
+        *e = geomap_order_bic;
+        return 0;
+    } else if (strcmp(s, "cv") == 0) {
+        *e = geomap_order_cv;
+        return 0;
+    }
+
+    PyErr_Format(
+            PyExc_ValueError,
+            "%s must be 'aic', 'bic' or 'cv'",
+            name);
+    return -1;
+}
+
+int
+to_geomap_uncertainty_e(
+        const char* const name,
+        const char* const s,
+        geomap_uncertainty_e* const e) {
+
+    if (s == NULL) {
+        return 0;
+    }
+
+    if (strcmp(s, "analytic") == 0) {
+        *e = geomap_uncertainty_analytic;
+        return 0;
+    } else if (strcmp(s, "bootstrap") == 0) {
+        *e = geomap_uncertainty_bootstrap;
+        return 0;
+    } else if (strcmp(s, "jackknife") == 0) {
+        *e = geomap_uncertainty_jackknife;
+        return 0;
+    }
+
+    PyErr_Format(
+            PyExc_ValueError,
+            "%s must be 'analytic', 'bootstrap' or 'jackknife'",
+            name);
+    return -1;
+}
+
+int
+to_geomap_robust_e(
+        const char* const name,
+        const char* const s,
+        geomap_robust_e* const e) {
+
+    if (s == NULL) {
+        return 0;
+    }
+
+    if (strcmp(s, "huber") == 0) {
+        *e = geomap_robust_huber;
+        return 0;
+    } else if (strcmp(s, "tukey") == 0) {
+        *e = geomap_robust_tukey;
+        return 0;
+    }
+
+    PyErr_Format(
+            PyExc_ValueError,
+            "%s must be 'huber' or 'tukey'",
+            name);
+    return -1;
+}
@@ -49,6 +49,28 @@ DAMAGE.
 
 extern char* SIZE_T_D;
 
+/* The Matcher and Fitter objects use the vectorcall protocol where it
+   is available */
+#if PY_VERSION_HEX >= 0x03090000
+#define STIMAGE_HAVE_VECTORCALL
+#endif
+
+#ifdef STIMAGE_HAVE_VECTORCALL
+/* Unpack the arguments of a vectorcall into values, in the order of
+   keywords, leaving NULL the ones that are not given.  The first
+   nrequired are required. */
+int
+unpack_call_args(
+        const char* const name,
+        PyObject* const* args,
+        const Py_ssize_t nargs,
+        PyObject* const kwnames,
+        const char* const* const keywords,
+        const Py_ssize_t nkeywords,
+        const Py_ssize_t nrequired,
+        PyObject** const values);
+#endif
+
 int
 to_coord_t(
         const char* const name,
@@ -72,6 +94,18 @@ to_xyxymatch_algo_e(
         const char* const s,
         xyxymatch_algo_e* const e);
 
+int
+to_triangles_verify_e(
+        const char* const name,
+        const char* const s,
+        triangles_verify_e* const e);
+
+int
+to_triangles_select_e(
+        const char* const name,
+        const char* const s,
+        triangles_select_e* const e);
+
 int
 to_geomap_fit_e(
         const char* const name,
@@ -105,4 +139,33 @@ from_xterms_e(
         const xterms_e e,
         PyObject** o);
 
+int
+to_geomap_proj_e(
+        const char* const name,
+        const char* const s,
+        geomap_proj_e* const e);
+
+int
+from_geomap_proj_e(
+        const geomap_proj_e e,
+        PyObject** o);
+
+int
+to_geomap_order_e(
+        const char* const name,
+        const char* const s,
+        geomap_order_e* const e);
+
+int
+to_geomap_uncertainty_e(
+        const char* const name,
+        const char* const s,
+        geomap_uncertainty_e* const e);
+
+int
+to_geomap_robust_e(
+        const char* const name,
+        const char* const s,
+        geomap_robust_e* const e);
+
 #endif
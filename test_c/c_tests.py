@@ -4,13 +4,21 @@ import sys
 
 TESTS = [
     'cholesky',
+    'crossmatch',
     'geomap',
+    'geomap_eval',
     'lintransform',
+    'projection',
     'surface',
+    'surface_nested',
     'triangles',
+    'workspace',
     'xycoincide',
     'xysort',
     'xyxymatch',
+    'xyxymatch_offsets',
+    'xyxymatch_prepared',
+    'xyxymatch_quads',
     'xyxymatch_triangles'
     ]
 
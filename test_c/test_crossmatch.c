@@ -0,0 +1,123 @@
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "immatch/crossmatch.h"
+
+int main(int argv, char** argc) {
+    #define nstars 200
+    #define nepochs 3
+    #define nrandom 1000
+    coord_t epochs[nepochs][nstars];
+    const coord_t* coords[nepochs];
+    size_t ncoords[nepochs];
+    lintransform_t transforms[nepochs];
+    size_t ids[nepochs * nstars];
+    coord_t random[nrandom];
+    const coord_t* random_coords = random;
+    size_t nrandom_coords = nrandom;
+    size_t random_ids[nrandom];
+    size_t label[nrandom];
+    coord_t origin = {0.0, 0.0};
+    coord_t mag = {1.0, 1.0};
+    coord_t rot = {0.0, 0.0};
+    coord_t shift;
+    const double tolerance = 0.5;
+    size_t nsources = 0;
+    size_t nlabels = 0;
+    stimage_error_t error;
+    size_t i, j, e;
+    int changed;
+    double dx, dy;
+
+    stimage_error_init(&error);
+    srand48(0);
+
+    /* A jittered grid of stars observed in several epochs, each
+       shifted with respect to the common frame */
+    for (e = 0; e < nepochs; ++e) {
+        shift.x = 5.0 * e;
+        shift.y = -3.0 * e;
+        compute_lintransform(origin, mag, rot, shift, &transforms[e]);
+        for (i = 0; i < nstars; ++i) {
+            epochs[e][i].x = 10.0 * (i % 20) + (drand48() - 0.5) * 0.1 - shift.x;
+            epochs[e][i].y = 10.0 * (i / 20) + (drand48() - 0.5) * 0.1 - shift.y;
+        }
+        coords[e] = epochs[e];
+        ncoords[e] = nstars;
+    }
+
+    if (crossmatch_epochs(
+                nepochs, ncoords, coords, transforms, tolerance,
+                ids, &nsources, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+
+    if (nsources != nstars) {
+        return 1;
+    }
+
+    for (e = 0; e < nepochs; ++e) {
+        for (i = 0; i < nstars; ++i) {
+            if (ids[e * nstars + i] != i) {
+                return 1;
+            }
+        }
+    }
+
+    /* Dense random points chain together; compare against a brute
+       force friends-of-friends */
+    for (i = 0; i < nrandom; ++i) {
+        random[i].x = drand48() * 20.0;
+        random[i].y = drand48() * 20.0;
+        label[i] = i;
+    }
+    random[7].x = NAN;
+
+    if (crossmatch_epochs(
+                1, &nrandom_coords, &random_coords, NULL, tolerance,
+                random_ids, &nsources, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+
+    do {
+        changed = 0;
+        for (i = 0; i < nrandom; ++i) {
+            for (j = i + 1; j < nrandom; ++j) {
+                dx = random[i].x - random[j].x;
+                dy = random[i].y - random[j].y;
+                if (dx*dx + dy*dy <= tolerance*tolerance &&
+                    label[i] != label[j]) {
+                    label[i] = label[j] = label[i] < label[j] ? label[i] : label[j];
+                    changed = 1;
+                }
+            }
+        }
+    } while (changed);
+
+    for (i = 0; i < nrandom; ++i) {
+        if (label[i] == i) {
+            ++nlabels;
+        }
+        for (j = i + 1; j < nrandom; ++j) {
+            if ((label[i] == label[j]) != (random_ids[i] == random_ids[j])) {
+                return 1;
+            }
+        }
+    }
+
+    if (nlabels != nsources) {
+        return 1;
+    }
+
+    /* The linking length must be positive */
+    if (!crossmatch_epochs(
+                1, &nrandom_coords, &random_coords, NULL, 0.0,
+                random_ids, &nsources, &error)) {
+        return 1;
+    }
+
+    return 0;
+}
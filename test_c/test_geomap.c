@@ -34,11 +34,12 @@ main(int argc, char** argv) {
             ncoords, input,
             ncoords, ref,
             &bbox,
+            geomap_proj_none, NULL,
             geomap_fit_general,
             surface_type_polynomial,
             2, 2, 2, 2,
             xterms_half, xterms_half,
-            0, 0,
+            0, 0, NULL, NULL,
             &noutput, output,
             &result,
             &error);
@@ -59,11 +60,12 @@ main(int argc, char** argv) {
             ncoords, input,
             ncoords, ref,
             &bbox,
+            geomap_proj_none, NULL,
             geomap_fit_shift,
             surface_type_polynomial,
             2, 2, 2, 2,
             xterms_none, xterms_none,
-            0, 0,
+            0, 0, NULL, NULL,
             &noutput, output,
             &result,
             &error);
@@ -84,11 +86,12 @@ main(int argc, char** argv) {
     /*         ncoords, input, */
     /*         ncoords, ref, */
     /*         &bbox, */
+    /*         geomap_proj_none, NULL, */
     /*         geomap_fit_xyscale, */
     /*         surface_type_polynomial, */
     /*         2, 2, 2, 2, */
     /*         xterms_none, xterms_none, */
-    /*         0, 0, */
+    /*         0, 0, NULL, NULL, */
     /*         &noutput, output, */
     /*         &result, */
     /*         &error); */
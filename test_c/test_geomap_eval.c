@@ -0,0 +1,115 @@
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "immatch/geomap.h"
+
+/* Fit, then evaluate the result at the reference coordinates, and
+   check that it matches the fit geomap returned */
+int fit_and_eval(const size_t ncoords,
+                 const coord_t* const input,
+                 const coord_t* const ref,
+                 const geomap_fit_e fit_geometry,
+                 const surface_type_e function,
+                 const size_t order) {
+    geomap_output_t* output  = NULL;
+    coord_t*         fit     = NULL;
+    size_t           noutput = ncoords;
+    geomap_result_t  result;
+    stimage_error_t  error;
+    size_t           i;
+    int              status  = 1;
+
+    stimage_error_init(&error);
+    geomap_result_init(&result);
+
+    output = malloc(ncoords * sizeof(geomap_output_t));
+    fit = malloc(ncoords * sizeof(coord_t));
+    if (output == NULL || fit == NULL) {
+        printf("Out of memory\n");
+        goto exit;
+    }
+
+    if (geomap(
+                ncoords, input, ncoords, ref, NULL, geomap_proj_none, NULL,
+                fit_geometry, function, order, order, order, order,
+                xterms_half, xterms_half, 0, 0.0, NULL, NULL,
+                &noutput, output, &result, &error) ||
+        geomap_result_eval(&result, noutput, ref, fit, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    for (i = 0; i < noutput; ++i) {
+        if (fabs(fit[i].x - output[i].fit.x) > 1e-9 ||
+            fabs(fit[i].y - output[i].fit.y) > 1e-9) {
+            printf("Coordinate %lu: (%f, %f) != (%f, %f)\n",
+                   (unsigned long)i, fit[i].x, fit[i].y,
+                   output[i].fit.x, output[i].fit.y);
+            goto exit;
+        }
+    }
+
+    status = 0;
+
+ exit:
+    geomap_result_free(&result);
+    free(output);
+    free(fit);
+
+    return status;
+}
+
+int main(int argc, char** argv) {
+    #define ncoords 200
+    coord_t         ref[ncoords];
+    coord_t         input[ncoords];
+    geomap_result_t result;
+    coord_t         fit;
+    stimage_error_t error;
+    size_t          i;
+
+    srand48(0);
+    stimage_error_init(&error);
+
+    for (i = 0; i < ncoords; ++i) {
+        ref[i].x = drand48() * 2048.0;
+        ref[i].y = drand48() * 2048.0;
+        input[i].x = 10.0 + 1.001 * ref[i].x - 0.002 * ref[i].y +
+            1e-7 * ref[i].x * ref[i].x;
+        input[i].y = -5.0 + 0.003 * ref[i].x + 0.999 * ref[i].y +
+            2e-7 * ref[i].x * ref[i].y;
+    }
+
+    printf("General\n");
+    if (fit_and_eval(ncoords, input, ref, geomap_fit_general,
+                     surface_type_polynomial, 3) ||
+        fit_and_eval(ncoords, input, ref, geomap_fit_general,
+                     surface_type_legendre, 4) ||
+        fit_and_eval(ncoords, input, ref, geomap_fit_general,
+                     surface_type_chebyshev, 3)) {
+        return 1;
+    }
+
+    printf("Shift\n");
+    if (fit_and_eval(ncoords, input, ref, geomap_fit_shift,
+                     surface_type_legendre, 2)) {
+        return 1;
+    }
+
+    printf("Rscale\n");
+    if (fit_and_eval(ncoords, input, ref, geomap_fit_rscale,
+                     surface_type_chebyshev, 2)) {
+        return 1;
+    }
+
+    printf("Invalid\n");
+    geomap_result_init(&result);
+    result.function = surface_type_legendre;
+    if (geomap_result_eval(&result, 1, ref, &fit, &error) == 0) {
+        printf("A result without surfaces was evaluated\n");
+        return 1;
+    }
+
+    return 0;
+}
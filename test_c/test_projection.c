@@ -0,0 +1,79 @@
+#include <assert.h>
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "lib/projection.h"
+
+int main(int argv, char** argc) {
+    #define ncoords 256
+    coord_t sky[ncoords];
+    coord_t plane[ncoords];
+    coord_t back[ncoords];
+    coord_t refpt = {359.5, 45.0};
+    coord_t mean;
+    geomap_proj_e projections[] = {
+        geomap_proj_tan, geomap_proj_sin, geomap_proj_stg,
+        geomap_proj_arc, geomap_proj_zea };
+    stimage_error_t error;
+    size_t i = 0;
+    size_t j = 0;
+    double dra = 0.0;
+
+    stimage_error_init(&error);
+    srand48(0);
+
+    /* Straddle RA = 0 */
+    for (i = 0; i < ncoords; ++i) {
+        sky[i].x = refpt.x + (drand48() - 0.5) * 2.0;
+        if (sky[i].x >= 360.0) {
+            sky[i].x -= 360.0;
+        }
+        sky[i].y = refpt.y + (drand48() - 0.5) * 2.0;
+    }
+
+    compute_sky_refpt(ncoords, sky, &mean);
+    if (fabs(mean.x - refpt.x) > 0.1 || fabs(mean.y - refpt.y) > 0.1) {
+        return 1;
+    }
+
+    for (j = 0; j < sizeof(projections) / sizeof(geomap_proj_e); ++j) {
+        if (project_coords(
+                    projections[j], &refpt, ncoords, sky, plane, &error) ||
+            deproject_coords(
+                    projections[j], &refpt, ncoords, plane, back, &error)) {
+            printf("%s\n", stimage_error_get_message(&error));
+            return 1;
+        }
+
+        for (i = 0; i < ncoords; ++i) {
+            dra = fabs(back[i].x - sky[i].x);
+            if (dra > 180.0) {
+                dra = 360.0 - dra;
+            }
+            if (dra > 1e-9 || fabs(back[i].y - sky[i].y) > 1e-9) {
+                return 1;
+            }
+            /* All of the projections agree with the small-angle
+               approximation near the reference point */
+            if (fabs(plane[i].y - (sky[i].y - refpt.y)) > 0.05) {
+                return 1;
+            }
+        }
+    }
+
+    /* The tangent point maps to the origin */
+    if (project_coords(geomap_proj_tan, &refpt, 1, &refpt, plane, &error) ||
+        fabs(plane[0].x) > 1e-12 || fabs(plane[0].y) > 1e-12) {
+        return 1;
+    }
+
+    /* Points on the opposite hemisphere can not be projected */
+    sky[0].x = refpt.x - 180.0;
+    sky[0].y = -refpt.y;
+    if (!project_coords(geomap_proj_tan, &refpt, 1, sky, plane, &error)) {
+        return 1;
+    }
+
+    return 0;
+}
@@ -0,0 +1,152 @@
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "surface/fit.h"
+#include "surface/vector.h"
+
+/* Fit a surface of the given order on its own, and return its
+   weighted sum of squared residuals */
+int fit_alone(const surface_type_e function,
+              const size_t order,
+              const xterms_e xterms,
+              const bbox_t* const bbox,
+              const size_t ncoords,
+              const coord_t* const coords,
+              const double* const z,
+              double* const w,
+              double* const chisq,
+              stimage_error_t* const error) {
+    surface_t           s;
+    surface_fit_error_e fit_error;
+    double*             zfit = malloc(ncoords * sizeof(double));
+    size_t              i;
+    int                 status = 1;
+
+    surface_new(&s);
+    if (zfit == NULL ||
+        surface_init(&s, function, order, order, xterms, bbox, error) ||
+        surface_fit(&s, ncoords, coords, z, w, surface_fit_weight_user,
+                    NULL, &fit_error, error) ||
+        surface_vector(&s, ncoords, coords, zfit, error)) goto exit;
+
+    *chisq = 0.0;
+    for (i = 0; i < ncoords; ++i) {
+        *chisq += w[i] * (z[i] - zfit[i]) * (z[i] - zfit[i]);
+    }
+
+    status = 0;
+
+ exit:
+    surface_free(&s);
+    free(zfit);
+    return status;
+}
+
+int check(const surface_type_e function,
+          const xterms_e xterms,
+          const size_t ncoords,
+          const coord_t* const coords,
+          const double* const z,
+          double* const w) {
+    #define norders 4
+    surface_t           s;
+    surface_fit_score_t scores[norders];
+    surface_fit_score_t cv_scores[norders];
+    size_t              orders[norders] = {2, 3, 4, 5};
+    bbox_t              bbox;
+    double              chisq;
+    stimage_error_t     error;
+    size_t              j;
+    int                 status = 1;
+
+    stimage_error_init(&error);
+    surface_new(&s);
+    bbox.min.x = bbox.min.y = 0.0;
+    bbox.max.x = bbox.max.y = 1.0;
+
+    if (surface_init(&s, function, 5, 5, xterms, &bbox, &error) ||
+        surface_fit_nested(
+                &s, ncoords, coords, z, w, surface_fit_weight_user,
+                norders, orders, orders, 0, NULL, scores, &error) ||
+        surface_fit_nested(
+                &s, ncoords, coords, z, w, surface_fit_weight_user,
+                norders, orders, orders, 5, NULL, cv_scores, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    for (j = 0; j < norders; ++j) {
+        if (fit_alone(function, orders[j], xterms, &bbox, ncoords, coords,
+                      z, w, &chisq, &error)) {
+            printf("%s\n", stimage_error_get_message(&error));
+            goto exit;
+        }
+
+        if (fabs(scores[j].chisq - chisq) > 1e-8 * (1.0 + chisq) ||
+            fabs(cv_scores[j].chisq - chisq) > 1e-8 * (1.0 + chisq)) {
+            printf("Order %lu: chisq %g, %g != %g\n",
+                   (unsigned long)orders[j], scores[j].chisq,
+                   cv_scores[j].chisq, chisq);
+            goto exit;
+        }
+
+        /* The held-out residuals are worse than the fitted ones */
+        if (!isfinite(cv_scores[j].cv) || !(cv_scores[j].cv >= chisq) ||
+            isfinite(scores[j].cv)) {
+            printf("Order %lu: bad cross-validation %g\n",
+                   (unsigned long)orders[j], cv_scores[j].cv);
+            goto exit;
+        }
+    }
+
+    /* A fit of too low an order cross-validates worse than the order
+       of the data */
+    if (!(cv_scores[0].cv > cv_scores[1].cv)) {
+        printf("Order 2 cross-validates as well as 3\n");
+        goto exit;
+    }
+
+    status = 0;
+
+ exit:
+    surface_free(&s);
+    return status;
+}
+
+int main(int argc, char** argv) {
+    #define ncoords 300
+    coord_t coords[ncoords];
+    double  z[ncoords];
+    double  w[ncoords];
+    size_t  i;
+
+    srand48(0);
+
+    for (i = 0; i < ncoords; ++i) {
+        coords[i].x = drand48();
+        coords[i].y = drand48();
+        z[i] = 1.0 + 2.0 * coords[i].x - coords[i].y +
+            0.5 * coords[i].x * coords[i].x +
+            0.25 * coords[i].x * coords[i].y + (drand48() - 0.5) * 0.01;
+        w[i] = 1.0;
+    }
+    w[7] = 0.0;
+
+    printf("Legendre\n");
+    if (check(surface_type_legendre, xterms_half, ncoords, coords, z, w)) {
+        return 1;
+    }
+
+    printf("Polynomial\n");
+    if (check(surface_type_polynomial, xterms_full, ncoords, coords, z, w)) {
+        return 1;
+    }
+
+    printf("Chebyshev\n");
+    if (check(surface_type_chebyshev, xterms_none, ncoords, coords, z, w)) {
+        return 1;
+    }
+
+    return 0;
+}
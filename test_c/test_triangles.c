@@ -22,6 +22,11 @@ int main(int argc, char** argv) {
     size_t ntriangle_matches;
     triangle_match_t* triangle_matches = NULL;
     size_t nunique;
+    triangle_table_t table1;
+    triangle_table_t table2;
+    size_t ntable_matches;
+    triangle_table_match_t* table_matches = NULL;
+    triangle_t table_tri;
     const double tolerance = 0.0001;
     const double max_ratio = 10.0;
     const size_t max_points = 30;
@@ -36,6 +41,8 @@ int main(int argc, char** argv) {
     size_t j = 0;
 
     stimage_error_init(&error);
+    triangle_table_init(&table1);
+    triangle_table_init(&table2);
 
     srand48(0);
 
@@ -127,6 +134,85 @@ int main(int argc, char** argv) {
         }
     }
 
+    /* The triangle table should hold the same triangles, whatever the
+       number of threads */
+    if (find_triangle_table(
+            nunique, ptr1, max_points, tolerance, max_ratio, 1,
+            &table1, &error) ||
+        find_triangle_table(
+            nunique, ptr2, max_points, tolerance, max_ratio, 4,
+            &table2, &error)) {
+        goto exit;
+    }
+
+    if (table2.ntriangles != table1.ntriangles) {
+        printf("Found %lu triangles with 4 threads instead of %lu\n",
+               (unsigned long)table2.ntriangles,
+               (unsigned long)table1.ntriangles);
+        goto exit;
+    }
+
+    for (i = 0; i < table1.ntriangles; ++i) {
+        for (j = 0; j < 3; ++j) {
+            if (ptr1[table1.vertices[3*i+j]] - data1 !=
+                ptr2[table2.vertices[3*i+j]] - data2) {
+                printf("Threaded triangle table differs at %lu\n",
+                       (unsigned long)i);
+                goto exit;
+            }
+        }
+    }
+
+    if (table1.ntriangles != ntriangles1) {
+        printf("Found %lu triangles in the table instead of %lu\n",
+               (unsigned long)table1.ntriangles, (unsigned long)ntriangles1);
+        goto exit;
+    }
+
+    for (i = 0; i < ntriangles1; ++i) {
+        triangle_table_get(&table1, i, ptr1, &table_tri);
+        if (table_tri.ratio != triangles1[i].ratio ||
+            table_tri.log_perimeter != triangles1[i].log_perimeter) {
+            printf("Triangle table differs at %lu\n", (unsigned long)i);
+            goto exit;
+        }
+
+        for (j = 0; j < 3; ++j) {
+            dist[j] = euclid_distance2(
+                table_tri.vertices[j], table_tri.vertices[(j+1)%3]);
+        }
+        if (dist[0] > dist[1] || dist[1] > dist[2]) {
+            printf("Table distances in the wrong order\n");
+            goto exit;
+        }
+    }
+
+    ntable_matches = table1.ntriangles;
+    table_matches = malloc(sizeof(triangle_table_match_t) * ntable_matches);
+    if (table_matches == NULL) {
+        goto exit;
+    }
+
+    if (merge_triangle_tables(
+            &table1, &table2, 4, &ntable_matches, table_matches, &error)) {
+        goto exit;
+    }
+
+    if (ntable_matches != ntriangles1) {
+        printf("Found %lu table matches instead of %lu when self-matching\n",
+               (unsigned long)ntable_matches, (unsigned long)ntriangles1);
+        goto exit;
+    }
+
+    for (i = 0; i < ntable_matches; ++i) {
+        if (table_matches[i].r != i ||
+            table1.ratio[table_matches[i].r] !=
+            table2.ratio[table_matches[i].l]) {
+            printf("Mismatched table match %lu\n", (unsigned long)i);
+            goto exit;
+        }
+    }
+
     /* Merging triangles with the same set should result in all exact matches */
     ntriangle_matches = ntriangles1;
     printf("Allocating room for %lu matches\n", (unsigned long)ntriangle_matches);
@@ -148,7 +234,7 @@ int main(int argc, char** argv) {
     }
 
     if (reject_triangles(
-            &ntriangle_matches, triangle_matches, nreject, &error)) {
+            &ntriangle_matches, triangle_matches, nreject, NULL, &error)) {
         goto exit;
     }
 
@@ -196,6 +282,9 @@ int main(int argc, char** argv) {
     free(triangles2);
     free(triangle_matches);
     free(trans_triangles);
+    free(table_matches);
+    triangle_table_free(&table1);
+    triangle_table_free(&table2);
 
     if (status) {
         if (error.message[0]) {
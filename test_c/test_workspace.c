@@ -0,0 +1,171 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "immatch/geomap.h"
+#include "immatch/xyxymatch.h"
+#include "lib/workspace.h"
+
+/* Match a rotated and shifted copy of 150 stars, as a real-time
+   pipeline would, with the given workspace */
+int match(const size_t ncoords,
+          const coord_t* const ref,
+          const coord_t* const input,
+          workspace_t* const workspace,
+          size_t* noutput,
+          xyxymatch_output_t* const output) {
+    stimage_error_t error;
+
+    stimage_error_init(&error);
+    *noutput = ncoords;
+
+    if (xyxymatch(ncoords, input, ncoords, ref, noutput, output,
+                  NULL, NULL, NULL, NULL, xyxymatch_algo_triangles,
+                  0.01, 0.0, 30, 10.0, 10, 0.0, 1, 0.0, 0.0, 0.0,
+                  triangles_verify_reject, triangles_select_sample,
+                  NULL, NULL, 0, 0, NULL, workspace, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+
+    return 0;
+}
+
+int fit(const size_t ncoords,
+        const coord_t* const ref,
+        const coord_t* const input,
+        workspace_t* const workspace,
+        geomap_output_t* const output,
+        geomap_result_t* const result) {
+    size_t          noutput = ncoords;
+    stimage_error_t error;
+
+    stimage_error_init(&error);
+    geomap_result_init(result);
+
+    if (geomap(ncoords, input, ncoords, ref, NULL,
+               geomap_proj_none, NULL, geomap_fit_general,
+               surface_type_polynomial, 3, 3, 3, 3,
+               xterms_half, xterms_half, 3, 3.0, NULL, workspace,
+               &noutput, output, result, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+
+    return 0;
+}
+
+int main(int argc, char** argv) {
+    #define ncoords 150
+    coord_t ref[ncoords];
+    coord_t input[ncoords];
+    xyxymatch_output_t match_heap[ncoords];
+    xyxymatch_output_t match_ws[ncoords];
+    geomap_output_t fit_heap[ncoords];
+    geomap_output_t fit_ws[ncoords];
+    geomap_result_t result_heap;
+    geomap_result_t result_ws;
+    size_t nheap, nws, nallocs;
+    workspace_t workspace;
+    workspace_mark_t mark;
+    stimage_error_t error;
+    double* a;
+    double* b;
+    size_t i = 0;
+    int status = 1;
+
+    srand48(0);
+    stimage_error_init(&error);
+    workspace_init(&workspace);
+
+    /* Allocations are aligned, and those after a mark are reclaimed
+       by rewinding to it */
+    printf("Arena\n");
+    a = workspace_alloc(&workspace, 3, &error);
+    mark = workspace_mark(&workspace);
+    b = workspace_alloc(&workspace, 100000, &error);
+    if (a == NULL || b == NULL || ((size_t)b & 15) != 0) {
+        printf("Bad allocation\n");
+        goto exit;
+    }
+    workspace_rewind(&workspace, mark);
+    if (workspace_alloc(&workspace, 100000, &error) != b) {
+        printf("Rewinding did not reclaim the memory\n");
+        goto exit;
+    }
+    workspace_rewind(&workspace, workspace_mark(NULL));
+    nallocs = workspace.nsystem_allocs;
+    workspace_alloc(&workspace, 8, &error);
+    workspace_alloc(&workspace, 100000, &error);
+    if (workspace.nsystem_allocs != nallocs) {
+        printf("The blocks were not merged when rewound\n");
+        goto exit;
+    }
+    workspace_free(&workspace);
+
+    for (i = 0; i < ncoords; ++i) {
+        ref[i].x = drand48() * 1000.0;
+        ref[i].y = drand48() * 1000.0;
+        input[i].x = ref[i].x * 0.999 - ref[i].y * 0.02 + 12.0;
+        input[i].y = ref[i].x * 0.02 + ref[i].y * 0.999 - 7.0;
+    }
+
+    /* The matches are the same as without a workspace, and once the
+       workspace has grown, later calls take nothing from the system */
+    printf("xyxymatch\n");
+    if (match(ncoords, ref, input, NULL, &nheap, match_heap) ||
+        match(ncoords, ref, input, &workspace, &nws, match_ws)) {
+        goto exit;
+    }
+    nallocs = workspace.nsystem_allocs;
+    for (i = 0; i < 3; ++i) {
+        if (match(ncoords, ref, input, &workspace, &nws, match_ws)) {
+            goto exit;
+        }
+    }
+    if (nheap == 0 || nws != nheap ||
+        memcmp(match_ws, match_heap, nws * sizeof(xyxymatch_output_t))) {
+        printf("Different matches with a workspace\n");
+        goto exit;
+    }
+    if (workspace.nsystem_allocs != nallocs) {
+        printf("Repeated matches allocated %lu blocks\n",
+               (unsigned long)(workspace.nsystem_allocs - nallocs));
+        goto exit;
+    }
+
+    printf("geomap\n");
+    if (fit(ncoords, ref, input, NULL, fit_heap, &result_heap) ||
+        fit(ncoords, ref, input, &workspace, fit_ws, &result_ws)) {
+        goto exit;
+    }
+    nallocs = workspace.nsystem_allocs;
+    geomap_result_free(&result_ws);
+    if (fit(ncoords, ref, input, &workspace, fit_ws, &result_ws)) {
+        goto exit;
+    }
+    if (memcmp(fit_ws, fit_heap, ncoords * sizeof(geomap_output_t)) ||
+        result_ws.rms.x != result_heap.rms.x ||
+        result_ws.rms.y != result_heap.rms.y ||
+        result_ws.nxcoeff != result_heap.nxcoeff ||
+        memcmp(result_ws.xcoeff, result_heap.xcoeff,
+               result_ws.nxcoeff * sizeof(double))) {
+        printf("Different fit with a workspace\n");
+        goto exit;
+    }
+    if (workspace.nsystem_allocs != nallocs) {
+        printf("Repeated fits allocated %lu blocks\n",
+               (unsigned long)(workspace.nsystem_allocs - nallocs));
+        goto exit;
+    }
+    geomap_result_free(&result_heap);
+    geomap_result_free(&result_ws);
+
+    status = 0;
+
+ exit:
+
+    workspace_free(&workspace);
+
+    return status;
+}
@@ -2,6 +2,7 @@
 #include <stdio.h>
 #include <stdlib.h>
 
+#include "immatch/xyxymatch.h"
 #include "lib/xysort.h"
 #include "lib/xycoincide.h"
 
@@ -9,6 +10,10 @@ int main(int argv, char** argc) {
     #define ncoords 512
     coord_t data[ncoords];
     const coord_t* ptr[ncoords];
+    const coord_t* grid[ncoords];
+    const coord_t* unsorted[ncoords];
+    size_t ngrid = 0;
+    stimage_error_t error;
     size_t i = 0;
     size_t j = 0;
     size_t nunique = 0;
@@ -25,10 +30,51 @@ int main(int argv, char** argc) {
         data[i].y = drand48();
     }
 
+    stimage_error_init(&error);
+
+    /* Duplicate some points exactly */
+    for (i = 0; i < ncoords; i += 7) {
+        data[i] = data[ncoords - 1 - i];
+    }
+
     xysort(ncoords, data, ptr);
 
+    /* The grid version must give identical results on sorted input */
+    if (xycoincide_grid(ncoords, ptr, grid, tolerance, &ngrid, &error)) {
+        return 1;
+    }
+
     nunique = xycoincide(ncoords, ptr, ptr, tolerance);
 
+    if (ngrid != nunique) {
+        printf("Grid found %lu unique, expected %lu\n",
+               (unsigned long)ngrid, (unsigned long)nunique);
+        return 1;
+    }
+    for (i = 0; i < nunique; ++i) {
+        if (grid[i] != ptr[i]) {
+            return 1;
+        }
+    }
+
+    /* Unsorted, in place */
+    for (i = 0; i < ncoords; ++i) {
+        unsorted[i] = &data[i];
+    }
+    if (xycoincide_grid(
+                ncoords, unsorted, unsorted, tolerance, &ngrid, &error)) {
+        return 1;
+    }
+    for (i = 0; i < ngrid; ++i) {
+        for (j = i + 1; j < ngrid; ++j) {
+            dx = unsorted[i]->x - unsorted[j]->x;
+            dy = unsorted[i]->y - unsorted[j]->y;
+            if (dx*dx + dy*dy <= tolerance2) {
+                return 1;
+            }
+        }
+    }
+
     for (i = 0; i < nunique; ++i) {
         for (j = 0; j < nunique; ++j) {
             if (i == j) continue;
@@ -48,5 +94,42 @@ int main(int argv, char** argc) {
         }
     }
 
+    /* A field crowded enough at a separation of 9 for xyxymatch to
+       cull it with the grid gives the same list as the sliding window */
+    {
+        #define ncrowded 4000
+        static coord_t        crowded[ncrowded];
+        static const coord_t* sorted[ncrowded];
+        static size_t         index[ncrowded];
+
+        for (i = 0; i < ncrowded; ++i) {
+            crowded[i].x = drand48() * 200.0;
+            crowded[i].y = drand48() * 200.0;
+        }
+        if ((double)ncrowded * 9.0 / 200.0 < XYCOINCIDE_GRID_MIN_ROW) {
+            printf("The crowded field is not culled with the grid\n");
+            return 1;
+        }
+
+        xysort(ncrowded, crowded, sorted);
+        nunique = xycoincide(ncrowded, sorted, sorted, 9.0);
+
+        if (xyxymatch_prepare_ref(
+                    ncrowded, crowded, 9.0, &ngrid, index, &error)) {
+            printf("%s\n", stimage_error_get_message(&error));
+            return 1;
+        }
+        if (ngrid != nunique) {
+            printf("Crowded field: %lu unique, expected %lu\n",
+                   (unsigned long)ngrid, (unsigned long)nunique);
+            return 1;
+        }
+        for (i = 0; i < nunique; ++i) {
+            if (&crowded[index[i]] != sorted[i]) {
+                return 1;
+            }
+        }
+    }
+
     return 0;
 }
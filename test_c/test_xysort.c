@@ -4,10 +4,40 @@
 
 #include "lib/xysort.h"
 
+static int
+check_sorted(
+        const size_t ncoords,
+        const coord_t* const data,
+        const size_t* const index) {
+
+    size_t i;
+    const coord_t* a;
+    const coord_t* b;
+
+    for (i = 1; i < ncoords; ++i) {
+        a = &data[index[i-1]];
+        b = &data[index[i]];
+        if (b->y < a->y || (b->y == a->y && b->x < a->x)) {
+            return 1;
+        }
+        /* Ties are left in index order */
+        if (b->y == a->y && b->x == a->x && index[i] < index[i-1]) {
+            return 1;
+        }
+    }
+
+    return 0;
+}
+
 int main(int argv, char** argc) {
     #define ncoords 512
+    #define nbig 300000
     coord_t data[ncoords];
     const coord_t* ptr[ncoords];
+    coord_t* big = NULL;
+    size_t* index1 = NULL;
+    size_t* index4 = NULL;
+    stimage_error_t error;
     size_t i = 0;
     double lastx = 0.0;
     double lasty = 0.0;
@@ -15,6 +45,7 @@ int main(int argv, char** argc) {
     double y = 0.0;
 
     srand48(0);
+    stimage_error_init(&error);
 
     for (i = 0; i < ncoords; ++i) {
         data[i].x = drand48();
@@ -37,5 +68,43 @@ int main(int argv, char** argc) {
         lasty = y;
     }
 
+    /* Large array with negative values, signed zeros and many ties */
+    big = malloc(nbig * sizeof(coord_t));
+    index1 = malloc(nbig * sizeof(size_t));
+    index4 = malloc(nbig * sizeof(size_t));
+    if (big == NULL || index1 == NULL || index4 == NULL) {
+        return 1;
+    }
+
+    for (i = 0; i < nbig; ++i) {
+        big[i].x = (double)(lrand48() % 64) - 32.0;
+        big[i].y = (drand48() - 0.5) * 1e6;
+        if (i % 3 == 0) {
+            big[i].y = (double)(lrand48() % 16) - 8.0;
+        }
+    }
+    big[0].y = -0.0;
+    big[1].y = 0.0;
+
+    if (xysort_index(nbig, big, index1, 1, &error) ||
+        xysort_index(nbig, big, index4, 4, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+
+    if (check_sorted(nbig, big, index1)) {
+        return 1;
+    }
+
+    for (i = 0; i < nbig; ++i) {
+        if (index1[i] != index4[i]) {
+            return 1;
+        }
+    }
+
+    free(big);
+    free(index1);
+    free(index4);
+
     return 0;
 }
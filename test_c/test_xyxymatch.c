@@ -8,7 +8,9 @@ int main(int argc, char** argv) {
     coord_t ref[ncoords];
     coord_t input[ncoords];
     xyxymatch_output_t output[ncoords];
+    xyxymatch_output_t tiled_output[ncoords];
     size_t noutput = ncoords;
+    size_t ntiled_output = ncoords;
     coord_t origin = {0.0, 0.0};
     coord_t mag = {1.0, 1.0};
     coord_t rot = {0.0, 0.0};
@@ -36,7 +38,9 @@ int main(int argc, char** argv) {
                        &noutput, output,
                        &origin, &mag, &rot, &ref_origin,
                        xyxymatch_algo_tolerance,
-                       tolerance, 0.0, 0, 0.0, 0,
+                       tolerance, 0.0, 0, 0.0, 0, 0.0, 1, 0.0, 0.0, 0.0,
+                       triangles_verify_reject,
+                       triangles_select_sample, NULL, NULL, 0, 0, NULL, NULL,
                        &error);
 
     if (status) {
@@ -81,7 +85,9 @@ int main(int argc, char** argv) {
                        &noutput, output,
                        &origin, &mag, &rot, &ref_origin,
                        xyxymatch_algo_tolerance,
-                       tolerance, 0.0, 0, 0.0, 0,
+                       tolerance, 0.0, 0, 0.0, 0, 0.0, 1, 0.0, 0.0, 0.0,
+                       triangles_verify_reject,
+                       triangles_select_sample, NULL, NULL, 0, 0, NULL, NULL,
                        &error);
 
     if (status) {
@@ -111,5 +117,35 @@ int main(int argc, char** argv) {
         }
     }
 
+    /* Matching in tiles, in parallel, should give the same results */
+
+    status = xyxymatch(ncoords, input,
+                       ncoords, ref,
+                       &ntiled_output, tiled_output,
+                       &origin, &mag, &rot, &ref_origin,
+                       xyxymatch_algo_tolerance,
+                       tolerance, 0.0, 0, 0.0, 0, 0.05, 3, 0.0, 0.0, 0.0,
+                       triangles_verify_reject,
+                       triangles_select_sample, NULL, NULL, 0, 0, NULL, NULL,
+                       &error);
+
+    if (status) {
+        printf(stimage_error_get_message(&error));
+        return status;
+    }
+
+    if (ntiled_output != noutput) {
+        printf("Tiled matching found a different number of matches\n");
+        return 1;
+    }
+
+    for (i = 0; i < noutput; ++i) {
+        if (tiled_output[i].coord_idx != output[i].coord_idx ||
+            tiled_output[i].ref_idx != output[i].ref_idx) {
+            printf("Tiled matching found different matches\n");
+            return 1;
+        }
+    }
+
     return status;
 }
@@ -0,0 +1,67 @@
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "immatch/xyxymatch.h"
+
+int main(int argc, char** argv) {
+    #define ncoords 2000
+    coord_t ref[ncoords];
+    coord_t input[ncoords];
+    xyxymatch_output_t output[ncoords];
+    const coord_t shift = {37.25, -12.5};
+    const double angle = DEGTORAD(0.8);
+    const double tolerance = 0.5;
+    size_t noutput = ncoords;
+    stimage_error_t error;
+    double x, y;
+    int status;
+    size_t i = 0;
+
+    stimage_error_init(&error);
+    srand48(0);
+
+    /* The input is the reference, rotated slightly about the center
+       of the field and shifted, with a little noise */
+    for (i = 0; i < ncoords; ++i) {
+        ref[i].x = drand48() * 2048.0;
+        ref[i].y = drand48() * 2048.0;
+        x = ref[i].x - 1024.0;
+        y = ref[i].y - 1024.0;
+        input[i].x = 1024.0 + cos(angle) * x - sin(angle) * y - shift.x +
+            (drand48() - 0.5) * 0.1;
+        input[i].y = 1024.0 + sin(angle) * x + cos(angle) * y - shift.y +
+            (drand48() - 0.5) * 0.1;
+    }
+
+    status = xyxymatch(
+            ncoords, input,
+            ncoords, ref,
+            &noutput, output,
+            NULL, NULL, NULL, NULL,
+            xyxymatch_algo_offsets,
+            tolerance, 0.0, 0, 0.0, 0, 0.0, 1, 100.0, 2.0, 0.0,
+            triangles_verify_reject,
+            triangles_select_sample, NULL, NULL, 0, 0, NULL, NULL,
+            &error);
+
+    if (status) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return status;
+    }
+
+    /* Nearly all of the stars should be matched to themselves */
+    if (noutput < ncoords * 0.95) {
+        printf("Only %d matches\n", (int)noutput);
+        return 1;
+    }
+
+    for (i = 0; i < noutput; ++i) {
+        if (output[i].coord_idx != output[i].ref_idx) {
+            printf("Mismatch\n");
+            return 1;
+        }
+    }
+
+    return 0;
+}
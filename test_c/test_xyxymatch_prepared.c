@@ -0,0 +1,195 @@
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "immatch/xyxymatch.h"
+
+/* Match with or without a prepared reference list, and check that the
+   results are the same */
+int match(const size_t ncoords,
+          const coord_t* const ref,
+          const coord_t* const input,
+          const xyxymatch_algo_e algorithm,
+          const triangles_verify_e verify,
+          const xyxymatch_ref_t* const prepared,
+          size_t* noutput,
+          xyxymatch_output_t* const output,
+          stimage_error_t* const error) {
+
+    *noutput = ncoords;
+    return xyxymatch(
+            ncoords, input, ncoords, ref, noutput, output,
+            NULL, NULL, NULL, NULL, algorithm,
+            0.01, 9.0, 30, 10.0, 10, 0.0, 1, 0.0, 0.0, 0.0,
+            verify, triangles_select_sample, NULL, NULL, 0, 0, prepared,
+            NULL, error);
+}
+
+int compare(const size_t ncoords,
+            const coord_t* const ref,
+            const coord_t* const input,
+            const xyxymatch_algo_e algorithm,
+            const triangles_verify_e verify,
+            const xyxymatch_ref_t* const prepared,
+            xyxymatch_output_t* const expected,
+            xyxymatch_output_t* const output) {
+    stimage_error_t error;
+    size_t          nexpected, noutput, i;
+
+    stimage_error_init(&error);
+
+    if (match(ncoords, ref, input, algorithm, verify, NULL,
+              &nexpected, expected, &error) ||
+        match(ncoords, ref, input, algorithm, verify, prepared,
+              &noutput, output, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+
+    if (nexpected == 0 || noutput != nexpected) {
+        printf("Expected %lu pairs, got %lu\n",
+               (unsigned long)nexpected, (unsigned long)noutput);
+        return 1;
+    }
+
+    for (i = 0; i < noutput; ++i) {
+        if (output[i].coord_idx != expected[i].coord_idx ||
+            output[i].ref_idx != expected[i].ref_idx) {
+            printf("Pair %lu differs\n", (unsigned long)i);
+            return 1;
+        }
+    }
+
+    return 0;
+}
+
+int main(int argc, char** argv) {
+    #define ncoords 500
+    coord_t            ref[ncoords];
+    coord_t            input[ncoords];
+    xyxymatch_output_t expected[ncoords];
+    xyxymatch_output_t output[ncoords];
+    size_t             index[ncoords];
+    xyxymatch_ref_t    prepared;
+    triangle_table_t   triangles;
+    size_t             noutput;
+    uint16_t           vertex;
+    stimage_error_t    error;
+    size_t             i;
+    int                status = 1;
+
+    srand48(0);
+    stimage_error_init(&error);
+    triangle_table_init(&triangles);
+
+    for (i = 0; i < ncoords; ++i) {
+        ref[i].x = drand48() * 2048.0;
+        ref[i].y = drand48() * 2048.0;
+    }
+    /* A close pair, which is culled */
+    ref[1].x = ref[0].x + 1.0;
+    ref[1].y = ref[0].y;
+
+    prepared.separation = 9.0;
+    prepared.index = index;
+    prepared.triangles = NULL;
+    if (xyxymatch_prepare_ref(
+                ncoords, ref, prepared.separation, &prepared.nunique, index,
+                &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    if (prepared.nunique >= ncoords - 1) {
+        printf("The close pair was not culled\n");
+        goto exit;
+    }
+
+    printf("Tolerance\n");
+    for (i = 0; i < ncoords; ++i) {
+        input[i] = ref[i];
+    }
+    if (compare(ncoords, ref, input, xyxymatch_algo_tolerance,
+                triangles_verify_reject, &prepared, expected, output)) {
+        goto exit;
+    }
+
+    for (i = 0; i < ncoords; ++i) {
+        input[i].x = ref[i].x * 1.5 + 24.0;
+        input[i].y = ref[i].y * 1.5 + 42.0;
+    }
+
+    /* Triangles, reusing the prepared reference triangles */
+    if (xyxymatch_ref_triangles(
+                ncoords, ref, &prepared, 30, 0.01, 10.0, 1, &triangles,
+                &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        goto exit;
+    }
+    prepared.triangles = &triangles;
+    prepared.nmatch = 30;
+    prepared.tolerance = 0.01;
+    prepared.maxratio = 10.0;
+
+    if (triangles.ntriangles == 0) {
+        printf("No reference triangles were built\n");
+        goto exit;
+    }
+
+    printf("Triangles\n");
+    if (compare(ncoords, ref, input, xyxymatch_algo_triangles,
+                triangles_verify_reject, &prepared, expected, output)) {
+        goto exit;
+    }
+
+    printf("RANSAC\n");
+    if (compare(ncoords, ref, input, xyxymatch_algo_triangles,
+                triangles_verify_ransac, &prepared, expected, output)) {
+        goto exit;
+    }
+
+    /* The triangles are checked against the coordinates, unless they
+       were built for a different nmatch and are not used */
+    printf("Wrong triangles\n");
+    vertex = triangles.vertices[0];
+    triangles.vertices[0] = 60000;
+    if (match(ncoords, ref, input, xyxymatch_algo_triangles,
+              triangles_verify_reject, &prepared, &noutput, output,
+              &error) == 0) {
+        printf("Triangles of other coordinates were accepted\n");
+        goto exit;
+    }
+
+    prepared.nmatch = 20;
+    if (compare(ncoords, ref, input, xyxymatch_algo_triangles,
+                triangles_verify_reject, &prepared, expected, output)) {
+        goto exit;
+    }
+    prepared.nmatch = 30;
+    triangles.vertices[0] = vertex;
+
+    printf("Wrong separation\n");
+    prepared.separation = 5.0;
+    if (match(ncoords, ref, input, xyxymatch_algo_tolerance,
+              triangles_verify_reject, &prepared, &noutput, output,
+              &error) == 0) {
+        printf("A different separation was accepted\n");
+        goto exit;
+    }
+    prepared.separation = 9.0;
+
+    printf("Wrong list\n");
+    if (match(ncoords / 2, ref, input, xyxymatch_algo_tolerance,
+              triangles_verify_reject, &prepared, &noutput, output,
+              &error) == 0) {
+        printf("A prepared list longer than the reference was accepted\n");
+        goto exit;
+    }
+
+    status = 0;
+
+ exit:
+
+    triangle_table_free(&triangles);
+
+    return status;
+}
@@ -0,0 +1,80 @@
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "immatch/xyxymatch.h"
+
+int main(int argc, char** argv) {
+    #define ncoords 3000
+    coord_t ref[ncoords];
+    coord_t input[ncoords];
+    xyxymatch_output_t output[ncoords];
+    const double angle = DEGTORAD(137.0);
+    const double scale = 0.62;
+    const double tolerance = 0.5;
+    size_t noutput;
+    size_t nmatched;
+    stimage_error_t error;
+    double x, y;
+    int status;
+    int flip;
+    size_t i = 0;
+
+    stimage_error_init(&error);
+    srand48(0);
+
+    for (flip = 0; flip < 2; ++flip) {
+        /* The input is the reference, rotated, scaled, shifted and
+           possibly flipped, with a little noise.  Only 2/3 of the
+           stars are in common. */
+        for (i = 0; i < ncoords; ++i) {
+            ref[i].x = drand48() * 2048.0;
+            ref[i].y = drand48() * 2048.0;
+            x = ref[i].x;
+            y = flip ? -ref[i].y : ref[i].y;
+            input[i].x = scale * (cos(angle) * x - sin(angle) * y) + 300.0 +
+                (drand48() - 0.5) * 0.1;
+            input[i].y = scale * (sin(angle) * x + cos(angle) * y) - 700.0 +
+                (drand48() - 0.5) * 0.1;
+            if (i % 3 == 0) {
+                ref[i].x = drand48() * 2048.0;
+                ref[i].y = drand48() * 2048.0;
+            }
+        }
+
+        noutput = ncoords;
+        status = xyxymatch(
+                ncoords, input,
+                ncoords, ref,
+                &noutput, output,
+                NULL, NULL, NULL, NULL,
+                xyxymatch_algo_quads,
+                tolerance, 0.0, 0, 0.0, 0, 0.0, 1, 0.0, 0.0, 0.0,
+                triangles_verify_reject,
+                triangles_select_sample, NULL, NULL, 0, 0, NULL, NULL,
+                &error);
+
+        if (status) {
+            printf("%s\n", stimage_error_get_message(&error));
+            return status;
+        }
+
+        nmatched = 0;
+        for (i = 0; i < noutput; ++i) {
+            if (output[i].coord_idx == output[i].ref_idx) {
+                ++nmatched;
+            }
+        }
+
+        /* Nearly all of the stars in common should be matched to
+           themselves */
+        if (nmatched < (ncoords * 2) / 3 * 0.95 ||
+            nmatched < noutput * 0.95) {
+            printf("Only %d of %d correct matches\n",
+                   (int)nmatched, (int)noutput);
+            return 1;
+        }
+    }
+
+    return 0;
+}
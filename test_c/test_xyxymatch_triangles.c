@@ -29,7 +29,9 @@ int compare(const size_t ncoords,
             &noutput, output,
             &origin, &mag, &rot, &ref_origin,
             xyxymatch_algo_triangles,
-            tolerance, 0.0, max_points, max_ratio, nreject,
+            tolerance, 0.0, max_points, max_ratio, nreject, 0.0, 1, 0.0, 0.0, 0.0,
+            triangles_verify_reject,
+            triangles_select_sample, NULL, NULL, 0, 0, NULL, NULL,
             &error);
 
     if (status) {
@@ -52,20 +54,78 @@ int compare(const size_t ncoords,
     return 0;
 }
 
+/* Match with the given verification and selection strategies, and
+   check that exactly nexpected correct pairs are found */
+int compare_select(const size_t ncoords,
+                   const size_t nexpected,
+                   const coord_t* const ref,
+                   const coord_t* const input,
+                   const double* const weights,
+                   const triangles_verify_e verify,
+                   const triangles_select_e select,
+                   const int adaptive,
+                   const size_t memory_limit,
+                   xyxymatch_output_t* output) {
+    int status;
+    const double tolerance = 0.0001;
+    size_t noutput = ncoords;
+    stimage_error_t error;
+    size_t i = 0;
+
+    stimage_error_init(&error);
+
+    status = xyxymatch(
+            ncoords, input,
+            ncoords, ref,
+            &noutput, output,
+            NULL, NULL, NULL, NULL,
+            xyxymatch_algo_triangles,
+            tolerance, 0.0, 40, 10.0, 10, 0.0, 1, 0.0, 0.0, 0.0,
+            verify,
+            select, weights, weights, adaptive, memory_limit, NULL, NULL,
+            &error);
+
+    if (status) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return status;
+    }
+
+    if (noutput != nexpected) {
+        printf("Expected %lu pairs, got %lu\n",
+               (unsigned long)nexpected,
+               (unsigned long)noutput);
+        return 1;
+    }
+
+    for (i = 0; i < noutput; ++i) {
+        if (output[i].coord_idx != output[i].ref_idx) {
+            printf("Mismatched indicies\n");
+            return 1;
+        }
+    }
+
+    return 0;
+}
+
 int main(int argc, char** argv) {
     #define ncoords 4098
     coord_t ref[ncoords];
     coord_t input[ncoords];
     xyxymatch_output_t output[ncoords];
+    double flux[ncoords];
     lintransform_t trans;
     coord_t in = {0.0, 0.0};
     coord_t mag = {1.002, 1.003};
     coord_t rot = {2.0, 2.0};
     coord_t out = {1.0, 3.0};
+    triangles_estimate_t estimate;
+    size_t nmatch_limited;
+    stimage_error_t error;
 
     size_t i = 0;
 
     srand48(0);
+    stimage_error_init(&error);
 
     for (i = 0; i < ncoords; ++i) {
         ref[i].x = drand48() - 0.5;
@@ -118,5 +178,93 @@ int main(int argc, char** argv) {
         return 1;
     }
 
+    /* RANSAC verification: rotation, scale and flip, with a quarter
+       of the input coordinates not in the reference list.  The list
+       is no longer than nmatch, since otherwise the subsets used to
+       build triangles would not overlap. */
+    printf("RANSAC\n");
+
+    for (i = 0; i < 40; ++i) {
+        input[i].x = (ref[i].x * 0.8 - ref[i].y * 0.6) * 1.5 + 24;
+        input[i].y = -(ref[i].x * 0.6 + ref[i].y * 0.8) * 1.5 + 42;
+        if (i % 4 == 0) {
+            input[i].x = drand48() * 2.0 + 23;
+            input[i].y = drand48() * 2.0 + 41;
+        }
+    }
+
+    if (compare_select(40, 30, ref, input, NULL,
+                       triangles_verify_ransac, triangles_select_sample, 0, 0,
+                       output)) {
+        return 1;
+    }
+
+    /* Choosing the brightest points, or spreading them over the
+       field, finds common stars in the whole list even though the
+       first points in sorted order differ */
+    for (i = 0; i < ncoords; ++i) {
+        input[i].x = (ref[i].x * 0.8 - ref[i].y * 0.6) * 1.5 + 24;
+        input[i].y = (ref[i].x * 0.6 + ref[i].y * 0.8) * 1.5 + 42;
+        flux[i] = drand48();
+    }
+
+    printf("Brightest\n");
+    if (compare_select(ncoords, 40, ref, input, flux,
+                       triangles_verify_reject, triangles_select_brightest, 0, 0,
+                       output)) {
+        return 1;
+    }
+
+    printf("Grid\n");
+    if (compare_select(ncoords, ncoords, ref, input, flux,
+                       triangles_verify_ransac, triangles_select_grid, 0, 0,
+                       output)) {
+        return 1;
+    }
+
+    /* The adaptive mode stops once the pairs of the brightest points
+       are stable, and matches the whole lists with the transformation
+       they give */
+    printf("Adaptive\n");
+    if (compare_select(ncoords, ncoords, ref, input, flux,
+                       triangles_verify_reject, triangles_select_brightest, 1, 0,
+                       output)) {
+        return 1;
+    }
+
+    if (compare_select(ncoords, ncoords, ref, input, flux,
+                       triangles_verify_ransac, triangles_select_grid, 1, 0,
+                       output)) {
+        return 1;
+    }
+
+    /* A memory limit lowers nmatch: with the budget of 20 points, 20
+       of the brightest points are matched instead of 40 */
+    printf("Memory limit\n");
+    if (estimate_triangles(ncoords, ncoords, 40, 10.0, &estimate, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+    if (estimate.nref_triangles != 9880 || estimate.ninput_points != 40) {
+        printf("Wrong estimate\n");
+        return 1;
+    }
+
+    if (estimate_triangles(ncoords, ncoords, 20, 10.0, &estimate, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+    if (compare_select(ncoords, 20, ref, input, flux,
+                       triangles_verify_reject, triangles_select_brightest, 0,
+                       estimate.peak_bytes, output)) {
+        return 1;
+    }
+
+    if (limit_triangles_nmatch(
+                ncoords, ncoords, 40, 10.0, 100, &nmatch_limited, &error) == 0) {
+        printf("A tiny memory limit was accepted\n");
+        return 1;
+    }
+
     return 0;
 }